@@ -1,13 +1,13 @@
 import os
 from logging.handlers import RotatingFileHandler
 
-import cv2  # OpenCV库用于读取视频文件
 import shutil  # 用于复制文件
 from tqdm import tqdm  # 用于显示进度条
 from concurrent.futures import ThreadPoolExecutor, as_completed  # 用于并行处理
 from typing import List, Optional, Dict
 import logging
 import time  # 用于添加延迟
+from probe_engine import get_probe_engine  # 批量读取视频文件头
 
 # 设置日志
 log_dir = "./logs"
@@ -37,12 +37,13 @@ logger.addHandler(stream_handler)
 GLOBAL_DELAY = 0  # 秒，可以根据需要调整
 
 
-def get_video_duration(video_path: str, cache: Dict[str, Optional[float]]) -> Optional[float]:
+def get_video_duration(video_path: str, cache: Dict[str, Optional[float]], info: Optional[dict] = None) -> Optional[float]:
     """
     获取视频文件的时长（秒）。使用缓存避免重复读取视频时长。
 
     :param video_path: 视频文件的路径
     :param cache: 用于缓存视频时长的字典
+    :param info: 探测引擎已读取的视频信息，为None时单独探测
     :return: 视频时长，单位为秒；如果无法读取时长，返回None
     """
     if video_path in cache:
@@ -50,11 +51,11 @@ def get_video_duration(video_path: str, cache: Dict[str, Optional[float]]) -> Op
         return cache[video_path]  # 如果视频时长已缓存，直接返回
 
     try:
-        cap = cv2.VideoCapture(video_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
-        duration = frame_count / fps if fps > 0 else 0
-        cap.release()
+        if info is None:
+            info = get_probe_engine().probe(video_path)
+        if not info:
+            raise ValueError("无法读取视频信息")
+        duration = info.get('duration', 0)
         cache[video_path] = duration  # 缓存视频时长
         logger.debug(f"计算视频时长: {video_path}, 时长: {duration}")
         return duration
@@ -77,18 +78,22 @@ def find_videos_within_duration(directory: str, min_duration: float, max_duratio
     video_cache: Dict[str, Optional[float]] = {}  # Cache video durations
     logger.info(f"开始在目录 {directory} 中查找时长在 {min_duration}-{max_duration} 秒之间的视频")  # Log start
 
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.flv')):
-                video_path = os.path.join(root, file)
-                logger.debug(f"正在检查文件: {video_path}")
-                duration = get_video_duration(video_path, video_cache)
-                if duration is not None and min_duration <= duration <= max_duration:
-                    videos.append(video_path)
-                    logger.info(f"找到符合条件的视频: {video_path}, 时长: {duration}")
-                else:
-                    logger.debug(
-                        f"视频 {video_path} 时长不符合条件 (时长: {duration if duration is not None else '未知'})")
+    def iter_video_paths():
+        for root, dirs, files in os.walk(directory):
+            for file in files:
+                if file.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.flv')):
+                    yield os.path.join(root, file)
+
+    # 边扫描边交给探测引擎批量读取时长
+    for video_path, info in get_probe_engine().probe_many(iter_video_paths()):
+        logger.debug(f"正在检查文件: {video_path}")
+        duration = get_video_duration(video_path, video_cache, info)
+        if duration is not None and min_duration <= duration <= max_duration:
+            videos.append(video_path)
+            logger.info(f"找到符合条件的视频: {video_path}, 时长: {duration}")
+        else:
+            logger.debug(
+                f"视频 {video_path} 时长不符合条件 (时长: {duration if duration is not None else '未知'})")
     logger.info(f"在目录 {directory} 中找到 {len(videos)} 个符合条件的视频")  # Log end
     return videos
 
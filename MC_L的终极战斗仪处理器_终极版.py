@@ -42,6 +42,14 @@ ENABLE_CROPPING = True        # 启用裁剪功能
 # --- 切头尾时间配置 ---
 HEAD_CUT_TIME = 42    # 片头时间（秒）
 TAIL_CUT_TIME = 42    # 片尾时间（秒）
+# 只切头尾不裁剪（ENABLE_CROPPING = False）时，中间完整的 GOP 直接流复制，只重新编码两端不完整的 GOP
+ENABLE_SMART_CUT = True
+
+# --- 长视频分段并行编码配置 ---
+# 启用后长视频按关键帧切成若干段并行编码再无损拼接（仅硬件编码器，软件编码单任务已占满CPU）
+ENABLE_CHUNKED_ENCODE = True
+CHUNKED_ENCODE_MIN_DURATION = 1800  # 有效时长超过这个值（秒）才分段
+CHUNK_SECONDS = 300                 # 每段目标时长（秒），分段点对齐到之后最近的关键帧
 
 # --- 裁剪配置 ---
 TARGET_RESOLUTION = (1920, 1080)  # 目标分辨率 (必须是16:9比例)
@@ -104,7 +112,6 @@ import os
 import subprocess
 import logging
 import json
-import re
 import concurrent.futures
 import threading
 import psutil
@@ -131,6 +138,17 @@ import signal
 import atexit
 import shutil
 from threading import Lock, Event, Thread, RLock, Condition
+from video_meta_cache import cached_probe, get_meta_cache
+from keyframe_sampler import sample_frames
+from mp4_header import is_mp4_file, read_mp4_info
+from file_index import iter_video_files
+from progress_store import ProgressStore
+from smart_cut import smart_cut
+from chunked_encode import ChunkedEncoder, plan_chunks
+from ffmpeg_progress import run_ffmpeg
+
+# 程序退出时输出元数据缓存命中率
+atexit.register(get_meta_cache().log_stats)
 
 # ==================== 编码配置 ====================
 os.environ['PYTHONIOENCODING'] = 'utf-8'
@@ -3985,7 +4003,12 @@ class ROISelector:
     def extract_preview_frame(self, video_path: str) -> Optional[np.ndarray]:
         """提取视频预览帧"""
         try:
-            # 获取视频时长
+            # 只解码中间位置之前最近的一个关键帧，不再 ffprobe + ffmpeg 写临时图片
+            frames = sample_frames(video_path, (0.5,), ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
+            if frames is not None:
+                return frames[0]
+            
+            # 关键帧采样失败时回退：获取视频时长
             probe_cmd = [FFPROBE_PATH, '-v', 'error', '-show_entries', 'format=duration', 
                         '-of', 'default=noprint_wrappers=1:nokey=1', video_path]
             result = subprocess.run(probe_cmd, capture_output=True, text=True, encoding='utf-8', timeout=15)
@@ -4605,7 +4628,7 @@ class ProgressManager:
         self.crash_recovery_file = os.path.join(self.progress_folder, "crash_recovery.json")
         
         os.makedirs(self.progress_folder, exist_ok=True)
-        self.progress_data = self.load_progress()
+        self.store = self.load_progress()
 
     def calculate_file_sha256(self, file_path: str) -> str:
         """计算文件SHA256哈希值"""
@@ -4721,33 +4744,19 @@ class ProgressManager:
             
         return partial_files
 
-    def load_progress(self) -> Dict[str, Any]:
-        """加载进度数据"""
-        try:
-            if os.path.exists(self.progress_file):
-                with open(self.progress_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    logging.info(f"加载进度记录: {len(data.get('completed', []))} 个已完成")
-                    return data
-        except Exception as e:
-            logging.warning(f"加载进度文件失败: {e}")
-        
-        return {
-            'completed': [], 'processing': [], 'failed': [],
+    def load_progress(self) -> ProgressStore:
+        """加载进度数据（JSON 快照 + 追加日志，按文件名和签名建索引）"""
+        store = ProgressStore(self.progress_file, defaults={
             'start_time': None, 'roi_settings': None,
-            'video_signatures': {},  # SHA256签名映射
             'config': {'enable_head_tail_cut': ENABLE_HEAD_TAIL_CUT, 'enable_cropping': ENABLE_CROPPING}
-        }
+        }, logger=logging.getLogger())
+        logging.info(f"加载进度记录: {store.counts()['completed']} 个已完成")
+        return store
 
     def save_progress(self):
-        """保存进度数据"""
+        """把还没写入的进度日志立即写盘（平时由后台线程每秒成组写入）"""
         try:
-            with open(self.temp_file, 'w', encoding='utf-8') as f:
-                json.dump(self.progress_data, f, ensure_ascii=False, indent=2)
-            
-            if os.path.exists(self.progress_file):
-                os.remove(self.progress_file)
-            os.rename(self.temp_file, self.progress_file)
+            self.store.flush()
         except Exception as e:
             logging.error(f"保存进度文件失败: {e}")
 
@@ -4766,19 +4775,14 @@ class ProgressManager:
             
             # 2. 检查本地签名记录（使用快速签名）
             video_signature = self.get_video_signature(video_path)
-            signatures = self.progress_data.get('video_signatures', {})
-            if video_signature in signatures:
+            if self.store.get_signature(video_signature) is not None:
                 logger.debug(f"✅ 本地签名命中: {video_name}")
                 return True
             
             # 3. 检查旧版本记录（基于文件名）
-            for record in self.progress_data.get('completed', []):
-                if isinstance(record, dict) and record.get('name') == video_name:
-                    logger.debug(f"✅ 旧记录命中: {video_name}")
-                    return True
-                elif record == video_name:
-                    logger.debug(f"✅ 旧记录命中: {video_name}")
-                    return True
+            if self.store.is_completed(video_name):
+                logger.debug(f"✅ 旧记录命中: {video_name}")
+                return True
             
             return False
         
@@ -4794,34 +4798,17 @@ class ProgressManager:
         video_signature = self.get_video_signature(video_path)
         
         # 检查SHA256签名映射
-        signatures = self.progress_data.get('video_signatures', {})
-        if video_signature in signatures:
+        if self.store.get_signature(video_signature) is not None:
             return True
             
-        # 兼容旧版本记录（基于文件名）
-        for record in self.progress_data.get('completed', []):
-            if isinstance(record, dict):
-                if record.get('name') == video_name:
-                    # 迁移到新的签名系统
-                    signatures[video_signature] = {
-                        'name': video_name,
-                        'path': video_path,
-                        'migrated_from_old': True
-                    }
-                    self.progress_data['video_signatures'] = signatures
-                    self.save_progress()
-                    return True
-            else:
-                if record == video_name:
-                    # 迁移到新系统
-                    signatures[video_signature] = {
-                        'name': video_name,
-                        'path': video_path,
-                        'migrated_from_old': True
-                    }
-                    self.progress_data['video_signatures'] = signatures
-                    self.save_progress()
-                    return True
+        # 兼容旧版本记录（基于文件名），命中后迁移到新的签名系统
+        if self.store.is_completed(video_name):
+            self.store.set_signature(video_signature, {
+                'name': video_name,
+                'path': video_path,
+                'migrated_from_old': True
+            })
+            return True
         return False
 
     def mark_completed(self, video_path: str, output_path: str = None, processing_time: float = 0.0):
@@ -4834,13 +4821,6 @@ class ProgressManager:
             self.video_record_manager.complete_processing(video_path, output_path, processing_time)
         
         # 继续维护本地记录（兼容性）
-        # 移除旧记录（兼容性处理）
-        self.progress_data['completed'] = [
-            record for record in self.progress_data['completed']
-            if not (isinstance(record, dict) and record.get('name') == video_name) and record != video_name
-        ]
-        
-        # 添加新记录到传统列表（兼容性）
         completed_record = {
             'name': video_name,
             'path': video_path,
@@ -4857,32 +4837,18 @@ class ProgressManager:
             }
         }
         
-        self.progress_data['completed'].append(completed_record)
+        # 替换同名旧记录，同时从处理中和失败列表移除
+        self.store.mark_completed(video_name, completed_record)
         
         # 添加到新的签名映射系统
-        if 'video_signatures' not in self.progress_data:
-            self.progress_data['video_signatures'] = {}
-        
-        self.progress_data['video_signatures'][video_signature] = {
+        self.store.set_signature(video_signature, {
             'name': video_name,
             'path': video_path,
             'output_path': output_path,
             'processing_time': processing_time,
-            'completed_time': datetime.now().isoformat(),
+            'completed_time': completed_record['completed_time'],
             'config': completed_record['config'].copy()
-        }
-        
-        # 从处理中移除
-        if video_name in self.progress_data['processing']:
-            self.progress_data['processing'].remove(video_name)
-        
-        # 从失败列表移除
-        self.progress_data['failed'] = [
-            record for record in self.progress_data['failed']
-            if not (isinstance(record, dict) and record.get('name') == video_name)
-        ]
-        
-        self.save_progress()
+        })
 
     def mark_processing(self, video_path: str, video_info: Dict = None):
         """标记视频为处理中（数据库+本地记录）"""
@@ -4893,9 +4859,7 @@ class ProgressManager:
             self.video_record_manager.start_processing(video_path, video_info=video_info)
         
         # 继续维护本地记录（兼容性）
-        if video_name not in self.progress_data['processing']:
-            self.progress_data['processing'].append(video_name)
-        self.save_progress()
+        self.store.mark_processing(video_name)
 
     def mark_failed(self, video_path: str, error_msg: str = ""):
         """标记视频为失败（数据库+本地记录）"""
@@ -4908,21 +4872,12 @@ class ProgressManager:
         if self.video_record_manager and self.video_record_manager.db_manager.is_available():
             self.video_record_manager.fail_processing(video_path, clean_error)
         
-        # 继续维护本地记录（兼容性）
-        # 检查是否已在失败列表中
-        failed_names = [f.get('name') if isinstance(f, dict) else f for f in self.progress_data['failed']]
-        if video_name not in failed_names:
-            self.progress_data['failed'].append({
-                'name': video_name,
-                'error': clean_error,
-                'time': datetime.now().isoformat()
-            })
-        
-        # 从处理中移除
-        if video_name in self.progress_data['processing']:
-            self.progress_data['processing'].remove(video_name)
-        
-        self.save_progress()
+        # 继续维护本地记录（兼容性）：已在失败列表中的保留第一次的错误信息，同时从处理中移除
+        self.store.mark_failed(video_name, {
+            'name': video_name,
+            'error': clean_error,
+            'time': datetime.now().isoformat()
+        }, replace=False)
 
     def clean_error_message(self, error_msg: str) -> str:
         """清理错误消息"""
@@ -4944,14 +4899,30 @@ class ProgressManager:
 
     def get_statistics(self) -> Dict[str, int]:
         """获取统计信息"""
-        return {
-            'completed': len(self.progress_data['completed']),
-            'processing': len(self.progress_data['processing']),
-            'failed': len(self.progress_data['failed'])
-        }
+        return self.store.counts()
+
+    def get_failed_records(self) -> List[Any]:
+        """获取失败记录列表"""
+        return self.store.failed_records()
+
+    def get_roi_settings(self):
+        """获取保存的ROI设置"""
+        return self.store.get('roi_settings')
 
+    def set_roi_settings(self, roi_settings):
+        """保存ROI设置"""
+        self.store.set('roi_settings', roi_settings)
+        self.save_progress()
+
+@cached_probe('mcl_video_info')
 def get_video_info(video_path: str) -> Dict[str, Any]:
-    """获取视频信息"""
+    """获取视频信息（结果按 路径+大小+修改时间 持久缓存，同一文件只探测一次）"""
+    # MP4/MOV 直接解析文件头，不启动 ffprobe
+    if is_mp4_file(video_path):
+        info = read_mp4_info(video_path)
+        if info:
+            return info
+    
     try:
         cmd = [FFPROBE_PATH, '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', video_path]
         result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', timeout=30)
@@ -5064,8 +5035,12 @@ def should_skip_low_resolution(video_path: str) -> Tuple[bool, Optional[Tuple[in
 
 def build_unified_ffmpeg_command(input_file: str, output_file: str, 
                                 roi: Optional[Tuple[int, int, int, int, int, int]] = None,
-                                hardware_info: Dict[str, Any] = None) -> List[str]:
-    """构建统一的FFmpeg命令，支持切头尾+裁剪"""
+                                hardware_info: Dict[str, Any] = None,
+                                time_range: Optional[Tuple[float, float]] = None) -> List[str]:
+    """构建统一的FFmpeg命令，支持切头尾+裁剪
+
+    time_range=(开始秒, 时长) 时只处理源视频中的这一段（分段编码用），不再按切头尾计算
+    """
     # 确保路径使用正确的分隔符并处理特殊字符
     input_file = os.path.normpath(input_file)
     output_file = os.path.normpath(output_file)
@@ -5092,14 +5067,19 @@ def build_unified_ffmpeg_command(input_file: str, output_file: str,
     cmd.extend(['-analyzeduration', hardware_info.get('probe_size', '50M')])
     
     # 切头尾时间设置
-    if ENABLE_HEAD_TAIL_CUT and HEAD_CUT_TIME > 0:
+    if time_range:
+        if time_range[0] > 0:
+            cmd.extend(['-ss', f'{time_range[0]:.6f}'])
+    elif ENABLE_HEAD_TAIL_CUT and HEAD_CUT_TIME > 0:
         cmd.extend(['-ss', str(HEAD_CUT_TIME)])
     
     # 使用引号包围输入文件路径以处理特殊字符
     cmd.extend(['-i', input_file])
     
     # 计算有效时长（如果启用了切头尾）
-    if ENABLE_HEAD_TAIL_CUT:
+    if time_range:
+        cmd.extend(['-t', f'{time_range[1]:.6f}'])
+    elif ENABLE_HEAD_TAIL_CUT:
         video_info = get_video_info(input_file)
         total_duration = video_info.get('duration', 0)
         effective_duration = max(0, total_duration - HEAD_CUT_TIME - TAIL_CUT_TIME)
@@ -5179,45 +5159,94 @@ def build_unified_ffmpeg_command(input_file: str, output_file: str,
     
     return cmd
 
-def parse_progress(line: str) -> Dict[str, Any]:
-    """解析FFmpeg进度信息"""
-    info = {}
-    patterns = {
-        'frame': r'frame=\s*(\d+)',
-        'fps': r'fps=\s*([\d\.]+)',
-        'time': r'time=\s*(\d+):(\d+):([\d\.]+)',
-        'speed': r'speed=\s*([\d\.]+)x',
-        'size': r'size=\s*(\d+)kB'
-    }
+def try_smart_cut(input_file: str, output_file: str, pbar=None) -> bool:
+    """只切头尾不裁剪时尝试关键帧对齐切割，不适用或失败返回 False（由调用方整段编码）"""
+    if not (ENABLE_SMART_CUT and ENABLE_HEAD_TAIL_CUT and not ENABLE_CROPPING):
+        return False
+    duration = get_video_info(input_file).get('duration', 0)
+    if duration - HEAD_CUT_TIME - TAIL_CUT_TIME <= 0:
+        return False
     
-    for key, pattern in patterns.items():
-        match = re.search(pattern, line)
-        if match:
-            if key == 'time':
-                info[key] = float(match.group(1)) * 3600 + float(match.group(2)) * 60 + float(match.group(3))
-            elif key in ['fps', 'speed']:
-                info[key] = float(match.group(1))
-            else:
-                info[key] = int(match.group(1))
+    def on_progress(fraction: float, stage: str):
+        if pbar is None:
+            return
+        target = 10 + fraction * 85
+        if target > pbar.n:
+            pbar.update(target - pbar.n)
+        pbar.set_postfix_str(f"✂️ {stage}")
     
-    return info
+    return smart_cut(input_file, output_file, HEAD_CUT_TIME, duration - TAIL_CUT_TIME,
+                     ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH, progress=on_progress)
+
+def concat_mp4_files(file_list: List[str], output_path: str):
+    """使用 concat demuxer 无损拼接多个 mp4 片段"""
+    list_file = f"{output_path}.concat_list.txt"
+    with open(list_file, 'w', encoding='utf-8') as f:
+        for p in file_list:
+            safe_path = os.path.abspath(p).replace('\\', '/').replace("'", "'\\''")
+            f.write(f"file '{safe_path}'\n")
+    try:
+        cmd = [FFMPEG_PATH, '-y', '-nostdin', '-f', 'concat', '-safe', '0', '-i', list_file,
+               '-c', 'copy', '-movflags', '+faststart', output_path]
+        proc = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+        if proc.returncode != 0:
+            raise Exception(f"拼接失败: {proc.stderr[-1000:]}")
+    finally:
+        try:
+            os.remove(list_file)
+        except OSError:
+            pass
+
+# 分段编码共享线程池：所有视频的分段都提交到这里，批量末尾只剩一个长视频时也能占满编码器
+_chunk_executor = None
+_chunk_executor_lock = threading.Lock()
+
+def get_chunk_executor(hardware_info: Dict[str, Any]) -> concurrent.futures.ThreadPoolExecutor:
+    """获取分段编码共享线程池（首次调用时按硬件并行数创建）"""
+    global _chunk_executor
+    with _chunk_executor_lock:
+        if _chunk_executor is None:
+            max_workers = max(1, min(hardware_info.get('max_parallel', 4), 8))
+            _chunk_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chunk')
+        return _chunk_executor
+
+def should_use_chunked_encode(output_file: str, effective_duration: float, hardware_info: Dict[str, Any]) -> bool:
+    """已有分段检查点时继续分段，否则只对长视频 + 硬件编码器启用"""
+    if os.path.exists(ChunkedEncoder.manifest_path(output_file)):
+        return True
+    return (ENABLE_CHUNKED_ENCODE and hardware_info.get('encoder_type') != 'software'
+            and effective_duration >= CHUNKED_ENCODE_MIN_DURATION)
+
+def run_chunked_encode(input_file: str, output_file: str, roi, hardware_info: Dict[str, Any],
+                       effective_duration: float, pbar=None):
+    """分段并行编码：每段用和整段相同的裁剪/编码参数，完成的分段记在 <输出>.chunks.json 里用于续传"""
+    start = HEAD_CUT_TIME if ENABLE_HEAD_TAIL_CUT else 0.0
+    chunks = plan_chunks(input_file, start, start + effective_duration, CHUNK_SECONDS, FFPROBE_PATH)
+    
+    def build_command(chunk_start: float, length: float, chunk_output: str) -> List[str]:
+        return build_unified_ffmpeg_command(input_file, chunk_output, roi, hardware_info,
+                                            time_range=(chunk_start, length))
+    
+    def on_progress(done_seconds: float, total_seconds: float):
+        if pbar is None:
+            return
+        target = min(95, 10 + done_seconds * 85 / total_seconds)
+        if target > pbar.n:
+            pbar.update(target - pbar.n)
+        pbar.set_postfix_str(f"🧩 分段编码 {done_seconds:.0f}s/{total_seconds:.0f}s")
+    
+    encoder = ChunkedEncoder(input_file, output_file, chunks, build_command, concat_mp4_files,
+                             executor=get_chunk_executor(hardware_info),
+                             stall_timeout=600 if effective_duration > 3600 else 300, logger=logging.getLogger())
+    if pbar is not None:
+        pbar.set_postfix_str(f"🧩 分段编码 ({len(chunks)}段)...")
+    encoder.run(progress=on_progress)
 
 def run_ffmpeg_process(cmd: List[str], expected_duration: float, pbar, video_path: str, 
                       i9_optimizer: Optional[I9PerformanceOptimizer] = None):
-    """🚀 运行FFmpeg进程并监控进度 - 2025年极限优化版"""
-    process = subprocess.Popen(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
-        universal_newlines=True, encoding='utf-8', errors='ignore', bufsize=1
-    )
-    
-    # 🔥 i9处理器CPU亲和性优化
-    if i9_optimizer:
-        i9_optimizer.set_process_affinity(process, 'ffmpeg_encoding')
-    
+    """🚀 运行FFmpeg进程并通过 -progress 通道监控进度，stderr 只用于错误信息"""
     last_percentage = 0
-    last_update_time = time.time()
-    stalled_time = 0
-    no_progress_count = 0
+    slow_since = None
     
     # 对长视频调整超时参数
     is_long_video = expected_duration > 3600
@@ -5227,70 +5256,50 @@ def run_ffmpeg_process(cmd: List[str], expected_duration: float, pbar, video_pat
     print(f"🎬 开始FFmpeg处理: 时长={expected_duration:.1f}s, 长视频模式={is_long_video}")
     logging.info(f"开始处理: 时长={expected_duration:.1f}s, 长视频模式={is_long_video}")
     
-    while process.poll() is None:
-        line = process.stderr.readline()
-        if line:
-            progress_info = parse_progress(line)
-            if 'time' in progress_info:
-                last_update_time = time.time()
-                no_progress_count = 0
-                
-                current_time = progress_info['time']
-                if current_time > expected_duration:
-                    current_time = expected_duration
-                
-                # 进度计算：0-95%范围
-                if current_time >= expected_duration * 0.95:
-                    percentage = 95
-                else:
-                    percentage = min(95, 10 + current_time * 85 / expected_duration)
-                
-                if percentage > last_percentage:
-                    pbar.update(percentage - last_percentage)
-                    last_percentage = percentage
-                    
-                    postfix = {
-                        'FPS': f"{progress_info.get('fps', 0):.1f}",
-                        '速度': f"{progress_info.get('speed', 0):.1f}x",
-                        '时间': f"{current_time:.1f}s/{expected_duration:.1f}s",
-                        '进度': f"{current_time/expected_duration*100:.1f}%"
-                    }
-                    pbar.set_postfix(postfix)
-                
-                # 卡死检测
-                speed = progress_info.get('speed', 1.0)
-                if speed < 0.01:
-                    stalled_time += 1
-                elif speed < 0.1 and is_long_video:
-                    stalled_time += 0.5
-                else:
-                    stalled_time = 0
-                
-                if stalled_time > max_stall_time:
-                    process.terminate()
-                    raise Exception(f"处理速度过慢，可能已卡死 (速度: {speed}x)")
+    def on_start(process):
+        # 🔥 i9处理器CPU亲和性优化
+        if i9_optimizer:
+            i9_optimizer.set_process_affinity(process, 'ffmpeg_encoding')
+    
+    def on_progress(progress_info: Dict[str, Any]):
+        nonlocal last_percentage, slow_since
+        if 'time' not in progress_info:
+            return
+        
+        current_time = min(expected_duration, progress_info['time'])
+        
+        # 进度计算：0-95%范围
+        if current_time >= expected_duration * 0.95:
+            percentage = 95
         else:
-            no_progress_count += 1
-            if time.time() - last_update_time > max_no_progress_time:
-                process.terminate()
-                raise Exception(f"处理超时，{max_no_progress_time}秒内无进度更新")
+            percentage = min(95, 10 + current_time * 85 / expected_duration)
         
-        time.sleep(1 if is_long_video else 0.5)
+        if percentage > last_percentage:
+            pbar.update(percentage - last_percentage)
+            last_percentage = percentage
+            
+            postfix = {
+                'FPS': f"{progress_info.get('fps', 0):.1f}",
+                '速度': f"{progress_info.get('speed', 0):.1f}x",
+                '时间': f"{current_time:.1f}s/{expected_duration:.1f}s",
+                '进度': f"{current_time/expected_duration*100:.1f}%"
+            }
+            pbar.set_postfix(postfix)
+        
+        # 卡死检测：速度持续过慢超过 max_stall_time 秒
+        speed = progress_info.get('speed', 1.0)
+        if speed < 0.01 or (speed < 0.1 and is_long_video):
+            slow_since = slow_since or time.time()
+            if time.time() - slow_since > max_stall_time:
+                raise Exception(f"处理速度过慢，可能已卡死 (速度: {speed}x)")
+        else:
+            slow_since = None
+    
+    runner = run_ffmpeg(cmd, on_progress=on_progress, stall_timeout=max_no_progress_time, on_start=on_start)
     
     # 检查返回码
-    if process.returncode != 0:
-        remaining_stderr = process.stderr.read()
-        error_lines = []
-        for line in remaining_stderr.split('\n'):
-            if (line.strip() and 
-                not line.startswith('frame=') and 
-                not line.startswith('size=') and
-                'fps=' not in line):
-                error_lines.append(line.strip())
-        
-        filtered_errors = error_lines[-10:] if error_lines else ["无具体错误信息"]
-        error_msg = '\n'.join(filtered_errors)
-        raise Exception(f"ffmpeg处理失败 (代码 {process.returncode}): {error_msg}")
+    if runner.returncode != 0:
+        raise Exception(f"ffmpeg处理失败 (代码 {runner.returncode}): {runner.error_text(10)}")
     
     # 确保进度条到达95%
     if last_percentage < 95:
@@ -5341,16 +5350,23 @@ def process_single_video(video_path: str, output_path: str, roi: Optional[Tuple[
         
         pbar.set_postfix_str("构建处理命令...")
         
-        # 构建FFmpeg命令
-        cmd = build_unified_ffmpeg_command(video_path, output_path, roi, hardware_info)
-        
-        logging.info(f"执行命令: {' '.join(cmd)}")
-        
-        pbar.set_postfix_str("开始处理视频...")
-        
-        # 🚀 运行FFmpeg (使用i9优化器)
-        i9_optimizer = hardware_info.get('i9_optimizer')
-        run_ffmpeg_process(cmd, effective_duration, pbar, video_path, i9_optimizer)
+        # 只切头尾时优先关键帧对齐切割
+        if try_smart_cut(video_path, output_path, pbar):
+            pass
+        elif should_use_chunked_encode(output_path, effective_duration, hardware_info):
+            # 长视频分段并行编码
+            run_chunked_encode(video_path, output_path, roi, hardware_info, effective_duration, pbar)
+        else:
+            # 构建FFmpeg命令
+            cmd = build_unified_ffmpeg_command(video_path, output_path, roi, hardware_info)
+            
+            logging.info(f"执行命令: {' '.join(cmd)}")
+            
+            pbar.set_postfix_str("开始处理视频...")
+            
+            # 🚀 运行FFmpeg (使用i9优化器)
+            i9_optimizer = hardware_info.get('i9_optimizer')
+            run_ffmpeg_process(cmd, effective_duration, pbar, video_path, i9_optimizer)
         
         # 更新最终进度 (95-100%)
         if pbar.n < 100:
@@ -5384,14 +5400,8 @@ def find_video_files(directory: str) -> List[str]:
     video_files = []
     
     try:
-        for format_ext in SUPPORTED_VIDEO_FORMATS:
-            pattern = os.path.join(directory, f'*{format_ext}')
-            files = [f for f in os.listdir(directory) 
-                    if f.lower().endswith(format_ext.lower())]
-            video_files.extend([os.path.join(directory, f) for f in files])
-        
-        video_files = list(set(video_files))  # 去重
-        video_files.sort()
+        # 增量目录索引：目录没有变化时直接从索引读取，不再重复 listdir
+        video_files = sorted(iter_video_files(directory, SUPPORTED_VIDEO_FORMATS, recursive=False))
         
         logging.info(f"在目录 {directory} 中找到 {len(video_files)} 个支持的视频文件")
         
@@ -5601,11 +5611,13 @@ def process_single_video_file(input_path: str, original_path: str, roi: Optional
         # 创建临时输出路径
         temp_output = output_path + ".tmp"
         
-        # 构建FFmpeg命令（使用已有函数）
-        cmd = build_unified_ffmpeg_command(input_path, temp_output, roi, hardware_info)
-        
-        # 执行处理
-        success = _execute_ffmpeg_safe(cmd, video_name)
+        # 只切头尾时优先关键帧对齐切割，否则构建FFmpeg命令（使用已有函数）
+        success = try_smart_cut(input_path, temp_output)
+        if not success:
+            cmd = build_unified_ffmpeg_command(input_path, temp_output, roi, hardware_info)
+            
+            # 执行处理
+            success = _execute_ffmpeg_safe(cmd, video_name)
         
         if success and os.path.exists(temp_output):
             # 移动到最终位置
@@ -6398,7 +6410,7 @@ def main():
             print(f"✅ 使用断点续传的ROI设置: {roi}")
         else:
             # 检查是否有保存的ROI设置
-            saved_roi = progress_manager.progress_data.get('roi_settings')
+            saved_roi = progress_manager.get_roi_settings()
             if saved_roi:
                 print(f"发现保存的ROI设置: {saved_roi}")
                 use_saved = input("使用保存的ROI设置? (y/n，回车默认是): ").strip().lower()
@@ -6420,8 +6432,7 @@ def main():
                     return
                 
                 # 保存ROI设置（包含基准尺寸）
-                progress_manager.progress_data['roi_settings'] = roi
-                progress_manager.save_progress()
+                progress_manager.set_roi_settings(roi)
                 
                 if len(roi) == 6:
                     x, y, w, h, base_w, base_h = roi
@@ -6573,7 +6584,7 @@ def main():
         failed_stats = progress_manager.get_statistics()
         if failed_stats['failed'] > 0:
             print(f"\n❌ 失败文件详情:")
-            for fail_info in progress_manager.progress_data['failed']:
+            for fail_info in progress_manager.get_failed_records():
                 if isinstance(fail_info, dict):
                     print(f"  - {fail_info.get('name', 'Unknown')}: {fail_info.get('error', 'Unknown error')}")
         
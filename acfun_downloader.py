@@ -28,6 +28,7 @@ import io
 import hashlib
 import psutil
 import tempfile
+from contextlib import contextmanager
 try:
     import fcntl  # Unix/Linux文件锁
     HAS_FCNTL = True
@@ -38,6 +39,11 @@ try:
     HAS_MSVCRT = True
 except ImportError:
     HAS_MSVCRT = False
+try:
+    import yt_dlp  # 进程内调用yt-dlp，省去每个视频启动Python进程和初始化提取器的开销
+    HAS_YTDLP_MODULE = True
+except ImportError:
+    HAS_YTDLP_MODULE = False
 
 # ====================================================================
 # 📋 配置区域 - 所有可配置项都在这里
@@ -79,6 +85,7 @@ DEFAULT_CONFIG = {
     
     # 下载器配置
     'preferred_downloader': 'yt-dlp',  # 优先使用的下载器: yt-dlp, you-get
+    'embedded_ytdlp': True,     # 已安装yt_dlp库时在进程内调用（复用实例和连接，进度来自回调），False则每个视频启动一个yt-dlp子进程
     'retry_times': 3,           # 重试次数
     'timeout': 300,             # 下载超时时间(秒)，增加到5分钟
     'concurrent_downloads': 2,   # 并发下载数，降低以减少服务器压力
@@ -135,7 +142,21 @@ DEFAULT_CONFIG = {
 # ====================================================================
 
 class DownloadStatusManager:
-    """下载状态管理器，支持多台电脑并发访问"""
+    """
+    下载状态管理器，支持多台电脑并发访问
+
+    状态文件放在共享盘上，以前每查一个URL都要加锁、把整个 JSON 重新读一遍，每次更新又整个重写，
+    几万条URL过滤一遍是 O(N²) 的读取量。现在改为追加日志 + 内存索引：
+    - 每次更新只在 .jsonl 日志末尾追加一行，仍然用锁文件在多台电脑间互斥；
+    - 内存里按URL哈希建索引，每次查询前只读取日志上次读到位置之后新增的内容（其他电脑写的也会读到）；
+    - 日志行数超过有效记录数的两倍时压缩重写，首行的 generation 变化时其他电脑会自动从头重建索引；
+    - 旧版 download_status.json 在首次启动时自动导入。
+    （共享盘上 SQLite 的 WAL 依赖本机共享内存，跨电脑不可靠，所以这里不用 SQLite。）
+    """
+
+    # 日志行数超过有效记录数的多少倍时压缩
+    COMPACT_RATIO = 2
+    COMPACT_MIN_LINES = 1000
     
     def __init__(self, status_dir: str, status_file: str = 'download_status.json'):
         """
@@ -143,16 +164,25 @@ class DownloadStatusManager:
         
         Args:
             status_dir: 状态文件存储目录
-            status_file: 状态文件名
+            status_file: 旧版状态文件名（日志文件与它同名，扩展名为 .jsonl）
         """
         self.status_dir = Path(status_dir)
         self.status_file_path = self.status_dir / status_file
+        self.log_file_path = self.status_dir / f"{Path(status_file).stem}.jsonl"
         self.lock_file_path = self.status_dir / f"{status_file}.lock"
+
+        # 内存索引：URL哈希 -> 记录；已读到的日志位置和日志代次
+        self._index = {}
+        self._offset = 0
+        self._generation = None
+        self._log_lines = 0
+        # 同一进程内多个下载线程共用
+        self._mutex = threading.RLock()
         
         # 确保目录存在
         self._ensure_directory()
         
-        # 初始化状态文件
+        # 初始化日志文件（必要时导入旧版 JSON）
         self._ensure_status_file()
     
     def _ensure_directory(self):
@@ -165,14 +195,28 @@ class DownloadStatusManager:
             raise
     
     def _ensure_status_file(self):
-        """确保状态文件存在且格式正确"""
-        if not self.status_file_path.exists():
+        """确保状态日志存在，首次使用时导入旧版 JSON 状态文件"""
+        with self._locked():
+            if self.log_file_path.exists():
+                self._refresh()
+                return
+            legacy = {}
+            if self.status_file_path.exists():
+                try:
+                    with open(self.status_file_path, 'r', encoding=SYSTEM_CONFIG['encoding']) as f:
+                        content = f.read().strip()
+                    legacy = json.loads(content) if content else {}
+                except (OSError, json.JSONDecodeError) as e:
+                    print(f"⚠️ 读取旧版状态文件失败，将从空状态开始: {e}")
             try:
-                self._write_status_file({})
-                print(f"📄 已创建状态文件: {self.status_file_path}")
+                self._rewrite_log(legacy)
             except Exception as e:
                 print(f"❌ 无法创建状态文件: {e}")
                 raise
+            if legacy:
+                print(f"📄 已从旧版状态文件导入 {len(legacy)} 条记录: {self.log_file_path}")
+            else:
+                print(f"📄 已创建状态文件: {self.log_file_path}")
     
     def _generate_url_hash(self, url: str) -> str:
         """为URL生成唯一哈希标识"""
@@ -205,38 +249,70 @@ class DownloadStatusManager:
         else:
             # 如果都不支持，什么都不做
             pass
-    
-    def _read_status_file(self) -> dict:
-        """安全读取状态文件"""
-        try:
-            with open(self.status_file_path, 'r', encoding=SYSTEM_CONFIG['encoding']) as f:
+
+    @contextmanager
+    def _locked(self):
+        """进程内互斥 + 锁文件跨电脑互斥（msvcrt 锁的是当前位置的字节，所以固定锁第 0 字节）"""
+        with self._mutex:
+            with open(self.lock_file_path, 'a+') as f:
+                f.seek(0)
                 self._acquire_lock(f)
                 try:
-                    content = f.read().strip()
-                    if not content:
-                        return {}
-                    return json.loads(content)
+                    yield
                 finally:
+                    f.seek(0)
                     self._release_lock(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {}
-        except Exception as e:
-            print(f"⚠️ 读取状态文件时出错: {e}")
-            return {}
-    
-    def _write_status_file(self, status_data: dict):
-        """安全写入状态文件"""
-        try:
-            with open(self.status_file_path, 'w', encoding=SYSTEM_CONFIG['encoding']) as f:
-                self._acquire_lock(f)
+
+    def _rewrite_log(self, records: dict):
+        """以新的代次重写日志（压缩 / 导入 / 批量重置），调用方持有锁"""
+        generation = hashlib.md5(f"{socket.gethostname()}-{time.time()}".encode('utf-8')).hexdigest()
+        tmp_path = self.log_file_path.with_name(self.log_file_path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps({'_generation': generation}).encode('utf-8') + b'\n')
+            for url_hash, info in records.items():
+                f.write(json.dumps({'hash': url_hash, **info}, ensure_ascii=False).encode('utf-8') + b'\n')
+        os.replace(tmp_path, self.log_file_path)
+        self._index = dict(records)
+        self._generation = generation
+        self._offset = self.log_file_path.stat().st_size
+        self._log_lines = len(records)
+
+    def _refresh(self):
+        """把日志里新增的行读进内存索引；日志被其他电脑压缩过（代次变化）时从头读取"""
+        with self._mutex:
+            try:
+                with open(self.log_file_path, 'rb') as f:
+                    header = f.readline()
+                    try:
+                        generation = json.loads(header).get('_generation')
+                    except ValueError:
+                        generation = None
+                    if generation != self._generation:
+                        self._index = {}
+                        self._generation = generation
+                        self._offset = f.tell()
+                        self._log_lines = 0
+                    f.seek(self._offset)
+                    data = f.read()
+            except FileNotFoundError:
+                return
+            # 只处理完整的行，别的电脑正在追加的半行留到下次
+            end = data.rfind(b'\n') + 1
+            if not end:
+                return
+            for line in data[:end].splitlines():
+                if not line.strip():
+                    continue
                 try:
-                    json.dump(status_data, f, ensure_ascii=False, indent=2)
-                finally:
-                    self._release_lock(f)
-        except Exception as e:
-            print(f"❌ 写入状态文件时出错: {e}")
-            raise
-    
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                url_hash = record.pop('hash', None)
+                if url_hash:
+                    self._index[url_hash] = record
+                    self._log_lines += 1
+            self._offset += end
+
     def get_url_status(self, url: str) -> int:
         """
         获取URL的下载状态
@@ -247,13 +323,13 @@ class DownloadStatusManager:
         Returns:
             int: 0=未下载, 1=已下载
         """
-        url_hash = self._generate_url_hash(url)
-        status_data = self._read_status_file()
-        return status_data.get(url_hash, {}).get('status', 0)
+        with self._mutex:
+            self._refresh()
+            return self._index.get(self._generate_url_hash(url), {}).get('status', 0)
     
     def set_url_status(self, url: str, status: int, title: str = "", download_time: str = ""):
         """
-        设置URL的下载状态
+        设置URL的下载状态（只追加一行日志）
         
         Args:
             url: 视频URL
@@ -262,39 +338,68 @@ class DownloadStatusManager:
             download_time: 下载时间
         """
         url_hash = self._generate_url_hash(url)
-        status_data = self._read_status_file()
-        
-        if url_hash not in status_data:
-            status_data[url_hash] = {}
-        
-        status_data[url_hash].update({
-            'url': url,
-            'status': status,
-            'title': title,
-            'download_time': download_time or time.strftime('%Y-%m-%d %H:%M:%S'),
-            'last_updated': time.strftime('%Y-%m-%d %H:%M:%S')
-        })
-        
-        self._write_status_file(status_data)
+        with self._locked():
+            self._refresh()
+            record = dict(self._index.get(url_hash, {}))
+            record.update({
+                'url': url,
+                'status': status,
+                'title': title,
+                'download_time': download_time or time.strftime('%Y-%m-%d %H:%M:%S'),
+                'last_updated': time.strftime('%Y-%m-%d %H:%M:%S')
+            })
+            try:
+                line = json.dumps({'hash': url_hash, **record}, ensure_ascii=False).encode('utf-8') + b'\n'
+                with open(self.log_file_path, 'ab') as f:
+                    f.write(line)
+            except Exception as e:
+                print(f"❌ 写入状态文件时出错: {e}")
+                raise
+            # 自己写的这行也读进索引，顺便推进读取位置
+            self._refresh()
+
+            if self._log_lines > max(self.COMPACT_MIN_LINES, len(self._index) * self.COMPACT_RATIO):
+                try:
+                    self._rewrite_log(self._index)
+                except OSError as e:
+                    # 其他电脑正打开着日志时 Windows 上可能替换失败，下次再压缩
+                    print(f"⚠️ 压缩状态日志失败，稍后重试: {e}")
     
     def get_downloaded_urls(self) -> List[str]:
         """获取所有已下载的URL列表"""
-        status_data = self._read_status_file()
-        return [info['url'] for info in status_data.values() if info.get('status') == 1]
+        with self._mutex:
+            self._refresh()
+            return [info['url'] for info in self._index.values() if info.get('status') == 1]
     
     def get_pending_urls(self, all_urls: List[str]) -> List[str]:
-        """从URL列表中筛选出未下载的URL"""
-        pending = []
-        for url in all_urls:
-            if self.get_url_status(url) == 0:
-                pending.append(url)
-        return pending
+        """从URL列表中筛选出未下载的URL（只刷新一次索引，一遍过滤）"""
+        with self._mutex:
+            self._refresh()
+            index = self._index
+            return [url for url in all_urls
+                    if index.get(self._generate_url_hash(url), {}).get('status', 0) == 0]
+
+    def reset_all(self) -> int:
+        """把所有已下载的URL重置为未下载，返回重置数量"""
+        with self._locked():
+            self._refresh()
+            records = {url_hash: dict(info) for url_hash, info in self._index.items()}
+            reset_count = 0
+            for info in records.values():
+                if info.get('status') == 1:
+                    info['status'] = 0
+                    info['last_updated'] = time.strftime('%Y-%m-%d %H:%M:%S')
+                    reset_count += 1
+            if reset_count:
+                self._rewrite_log(records)
+            return reset_count
     
     def get_status_summary(self) -> dict:
         """获取下载状态统计摘要"""
-        status_data = self._read_status_file()
-        total = len(status_data)
-        downloaded = sum(1 for info in status_data.values() if info.get('status') == 1)
+        with self._mutex:
+            self._refresh()
+            total = len(self._index)
+            downloaded = sum(1 for info in self._index.values() if info.get('status') == 1)
         pending = total - downloaded
         
         return {
@@ -309,6 +414,28 @@ class DownloadStatusManager:
 # 🎬 AcFun下载器类
 # ====================================================================
 
+class YtDlpLogger:
+    """进程内yt-dlp的日志：错误由下载流程统一分析和打印，这里只在详细模式下输出"""
+    
+    def __init__(self, verbose: bool = False):
+        self.verbose = verbose
+    
+    def debug(self, msg):
+        if self.verbose and not msg.startswith('[debug] '):
+            print(f"   {msg}")
+    
+    def info(self, msg):
+        self.debug(msg)
+    
+    def warning(self, msg):
+        if self.verbose:
+            print(f"   ⚠️ {msg}")
+    
+    def error(self, msg):
+        if self.verbose:
+            print(f"   ❌ {msg}")
+
+
 class AcFunDownloader:
     def __init__(self, 
                  output_dir: str = None,
@@ -379,6 +506,11 @@ class AcFunDownloader:
         self.current_video_progress = {}
         self.progress_lock = threading.Lock()
         
+        # 进程内yt-dlp：YoutubeDL实例不能跨线程共用，每个下载线程一个实例，跨URL复用
+        self.use_embedded_ytdlp = HAS_YTDLP_MODULE and self.config['embedded_ytdlp']
+        self._ytdl_local = threading.local()
+        self._ytdl_instances = []
+        
         # 检查下载器可用性
         self.available_downloaders = self._check_downloaders()
         
@@ -526,14 +658,18 @@ class AcFunDownloader:
         available = []
         
         # 检查yt-dlp
-        try:
-            result = subprocess.run(['yt-dlp', '--version'], 
-                                  capture_output=True, text=True, timeout=10)
-            if result.returncode == 0:
-                available.append('yt-dlp')
-                print(f"✓ yt-dlp版本: {result.stdout.strip()}")
-        except (FileNotFoundError, subprocess.TimeoutExpired):
-            pass
+        if self.use_embedded_ytdlp:
+            available.append('yt-dlp')
+            print(f"✓ yt-dlp版本: {yt_dlp.version.__version__} (进程内调用)")
+        else:
+            try:
+                result = subprocess.run(['yt-dlp', '--version'], 
+                                      capture_output=True, text=True, timeout=10)
+                if result.returncode == 0:
+                    available.append('yt-dlp')
+                    print(f"✓ yt-dlp版本: {result.stdout.strip()}")
+            except (FileNotFoundError, subprocess.TimeoutExpired):
+                pass
         
         # 检查you-get
         try:
@@ -769,6 +905,37 @@ class AcFunDownloader:
         # 默认重试策略
         return True, 2 ** attempt
     
+    def _summarize_ytdlp_info(self, data: dict) -> dict:
+        """把yt-dlp的信息字典整理成统一格式并打印"""
+        # 安全获取字段，避免NoneType错误
+        title = data.get('title') or 'Unknown'
+        width = data.get('width') or 0
+        height = data.get('height') or 0
+        resolution = f"{width}x{height}" if width and height else "Unknown"
+        duration = data.get('duration') or 0
+        duration_str = f"{int(duration//60):02d}:{int(duration%60):02d}" if duration else "Unknown"
+        uploader = data.get('uploader') or 'Unknown'
+        
+        # 确保title是字符串类型
+        if not isinstance(title, str):
+            title = str(title) if title else 'Unknown'
+        
+        print(f"   ✓ 视频标题: {title[:50]}")
+        if self.config['show_resolution']:
+            print(f"   📺 分辨率: {resolution}")
+            print(f"   ⏱️ 时长: {duration_str}")
+            print(f"   👤 UP主: {uploader}")
+        
+        return {
+            'title': title,
+            'resolution': resolution,
+            'width': width,
+            'height': height,
+            'duration': duration,
+            'uploader': uploader,
+            'view_count': data.get('view_count') or 0
+        }
+    
     def _get_video_info(self, url: str) -> Optional[dict]:
         """获取视频信息，采用容错策略"""
         print(f"🔍 正在获取视频信息: {url}")
@@ -807,34 +974,7 @@ class AcFunDownloader:
                     
                     # 统一返回格式
                     if downloader == 'yt-dlp':
-                        # 安全获取字段，避免NoneType错误
-                        title = data.get('title') or 'Unknown'
-                        width = data.get('width') or 0
-                        height = data.get('height') or 0
-                        resolution = f"{width}x{height}" if width and height else "Unknown"
-                        duration = data.get('duration') or 0
-                        duration_str = f"{int(duration//60):02d}:{int(duration%60):02d}" if duration else "Unknown"
-                        uploader = data.get('uploader') or 'Unknown'
-                        
-                        # 确保title是字符串类型
-                        if not isinstance(title, str):
-                            title = str(title) if title else 'Unknown'
-                        
-                        print(f"   ✓ 视频标题: {title[:50]}")
-                        if self.config['show_resolution']:
-                            print(f"   📺 分辨率: {resolution}")
-                            print(f"   ⏱️ 时长: {duration_str}")
-                            print(f"   👤 UP主: {uploader}")
-                        
-                        return {
-                            'title': title,
-                            'resolution': resolution,
-                            'width': width,
-                            'height': height,
-                            'duration': duration,
-                            'uploader': uploader,
-                            'view_count': data.get('view_count') or 0
-                        }
+                        return self._summarize_ytdlp_info(data)
                     else:
                         print(f"   ✓ you-get返回数据")
                         return data
@@ -954,9 +1094,15 @@ class AcFunDownloader:
         
         return renamed_files
     
-    def _show_downloaded_file_location(self, video_title):
-        """显示下载文件的具体位置"""
+    def _show_downloaded_file_location(self, video_title, file_path: Optional[str] = None):
+        """显示下载文件的具体位置，file_path为进程内yt-dlp返回的实际路径"""
         try:
+            if file_path and os.path.exists(file_path):
+                file_size = os.path.getsize(file_path) / (1024 * 1024)  # 转换为MB
+                print(f"   📍 文件已保存到: {os.path.abspath(file_path)}")
+                print(f"   📦 文件大小: {file_size:.1f} MB")
+                return
+            
             # 查找最近下载的视频文件
             video_extensions = ['.mp4', '.mkv', '.webm', '.avi', '.mov', '.flv']
             recent_files = []
@@ -1241,6 +1387,228 @@ class AcFunDownloader:
         ]
         return cmd
 
+    def _build_ytdlp_options(self, is_backup: bool = False) -> dict:
+        """构建进程内YoutubeDL的参数，与 _build_ytdlp_command 的命令行选项一一对应"""
+        options = {
+            'overwrites': False,            # --no-overwrites
+            'nopart': True,                 # --no-part
+            'writedescription': self.config['write_description'],
+            'writeinfojson': self.config['write_info_json'],
+            'writethumbnail': self.config['write_thumbnail'],
+            'writesubtitles': self.config['write_subtitles'],
+            'writeannotations': self.config['write_annotations'],
+            'getcomments': self.config['write_comments'],
+            'allow_playlist_files': False,
+            'writeautomaticsub': False,
+            'nopostoverwrites': True,
+            # 重试配置和错误恢复
+            'retries': self.config['internal_retries'] if not is_backup else 1,
+            'fragment_retries': self.config['fragment_retries'] if not is_backup else 1,
+            'retry_sleep_functions': {'http': lambda n: min(1 + 8 * n, 3)},  # --retry-sleep linear=1:3:8
+            'file_access_retries': 3,
+            'ignoreerrors': False,          # --abort-on-error
+            'keep_fragments': False,
+            'format': f'{self.config["video_quality"]}[ext={self.config["video_format"]}]/{self.config["video_quality"]}',
+            'outtmpl': str(self.output_dir / self.config['filename_template']),
+            'concurrent_fragment_downloads': 1,
+            # 进度由回调获取，不往控制台打印
+            'quiet': True,
+            'noprogress': True,
+            'no_warnings': not self.config['verbose_mode'],
+            'logger': YtDlpLogger(self.config['verbose_mode']),
+        }
+        
+        if self.system_config['ffmpeg_path']:
+            options['ffmpeg_location'] = self.system_config['ffmpeg_path']
+        
+        if self.system_config['windows_compatible']:
+            options['restrictfilenames'] = True
+            options['windowsfilenames'] = True
+        
+        if self.config['merge_output_format']:
+            options['merge_output_format'] = self.config['video_format']
+        
+        if self.config['embed_metadata']:
+            options['postprocessors'] = [{
+                'key': 'FFmpegMetadata',
+                'add_chapters': False,
+                'add_metadata': True,
+                'add_infojson': False,
+            }]
+        
+        if self.config['socket_timeout']:
+            options['socket_timeout'] = self.config['socket_timeout']
+        
+        return options
+    
+    def _get_embedded_ytdlp(self):
+        """取当前下载线程的YoutubeDL实例和回调槽位，第一次调用时创建，之后跨URL复用"""
+        ydl = getattr(self._ytdl_local, 'ydl', None)
+        if ydl is None:
+            # 回调在创建实例时注册一次，每个视频下载时把自己的处理函数放进槽位
+            hooks = {'progress': None, 'postprocessor': None}
+            
+            def progress_hook(d):
+                if hooks['progress']:
+                    hooks['progress'](d)
+            
+            def postprocessor_hook(d):
+                if hooks['postprocessor']:
+                    hooks['postprocessor'](d)
+            
+            options = self._build_ytdlp_options()
+            options['progress_hooks'] = [progress_hook]
+            options['postprocessor_hooks'] = [postprocessor_hook]
+            ydl = yt_dlp.YoutubeDL(options)
+            self._ytdl_local.ydl = ydl
+            self._ytdl_local.hooks = hooks
+            with self.stats_lock:
+                self._ytdl_instances.append(ydl)
+        return ydl, self._ytdl_local.hooks
+    
+    def _close_embedded_ytdlp(self):
+        """关闭所有下载线程创建的YoutubeDL实例（释放HTTP连接池）"""
+        with self.stats_lock:
+            instances = self._ytdl_instances
+            self._ytdl_instances = []
+        for ydl in instances:
+            try:
+                close = getattr(ydl, 'close', None)
+                if close:
+                    close()
+            except Exception:
+                pass
+        self._ytdl_local = threading.local()
+    
+    def _run_embedded_ytdlp(self, url: str, prefix: str):
+        """
+        一次 extract_info 同时完成信息获取和下载
+        
+        Returns:
+            (result, video_info, file_path)：result与子进程结果同形，供错误分析和重试判断复用；
+            video_info在拿到视频信息后即有值（下载失败时也可能有）
+        """
+        ydl, hooks = self._get_embedded_ytdlp()
+        video_id = url.split('/')[-1]
+        start_time = time.time()
+        state = {'info': None, 'hook': None, 'processing': False}
+        
+        def ensure_info(info_dict):
+            if state['info'] is None:
+                state['info'] = self._summarize_ytdlp_info(info_dict or {})
+                state['hook'] = self._create_progress_hook(video_id, state['info']['title'])
+        
+        def on_progress(d):
+            # 没有数据时由socket_timeout兜底，这里控制整体下载时长
+            if time.time() - start_time > self.timeout:
+                raise TimeoutError(f"download timed out after {self.timeout}s")
+            ensure_info(d.get('info_dict'))
+            if self.config['show_individual_progress']:
+                # 回调里的字段可能为None，整理后交给进度条
+                state['hook']({
+                    'status': d.get('status'),
+                    'total_bytes': d.get('total_bytes') or d.get('total_bytes_estimate') or 0,
+                    'downloaded_bytes': d.get('downloaded_bytes') or 0,
+                    'speed': d.get('speed') or 0,
+                    'eta': int(d.get('eta') or 0),
+                })
+        
+        def on_postprocess(d):
+            if d.get('status') == 'started' and not state['processing']:
+                state['processing'] = True
+                print(f"   🔄 {prefix} 正在进行后处理，请稍候...")
+                if state['hook']:
+                    state['hook']({'status': 'processing'})
+        
+        hooks['progress'] = on_progress
+        hooks['postprocessor'] = on_postprocess
+        try:
+            info = ydl.extract_info(url, download=True)
+            ensure_info(info)
+            file_path = None
+            requested = info.get('requested_downloads') or []
+            if requested:
+                file_path = requested[-1].get('filepath')
+            if not file_path:
+                file_path = ydl.prepare_filename(info)
+            result = type('Result', (), {'returncode': 0, 'stdout': '', 'stderr': ''})()
+            return result, state['info'], file_path
+        except Exception as e:  # DownloadError、超时及提取器内部异常都按失败处理
+            result = type('Result', (), {'returncode': 1, 'stdout': '', 'stderr': str(e)})()
+            return result, state['info'], None
+        finally:
+            hooks['progress'] = None
+            hooks['postprocessor'] = None
+    
+    def _close_video_progress(self, video_id: str, video_title: str, icon: str, label: str, delay: float = 0.5):
+        """关闭单个视频的进度条"""
+        with self.progress_lock:
+            if video_id in self.current_video_progress:
+                pbar = self.current_video_progress[video_id]
+                if icon == '✅':
+                    pbar.n = 100
+                clean_title = video_title.replace('\n', ' ').replace('\r', ' ').strip()
+                pbar.set_description(f"{icon} {clean_title[:28]}... {label}")
+                try:
+                    pbar.refresh()
+                    time.sleep(delay)
+                    pbar.close()
+                except:
+                    pass
+                del self.current_video_progress[video_id]
+    
+    def _download_with_embedded_ytdlp(self, url: str, prefix: str) -> tuple[bool, str]:
+        """
+        进程内yt-dlp下载（带重试），返回(是否成功, 视频标题)
+        
+        复用当前线程的YoutubeDL实例，不再为每个视频启动进程、单独获取一次信息、再从输出里解析进度
+        """
+        video_id = url.split('/')[-1]
+        video_title = "Unknown"
+        
+        for attempt in range(self.retry_times):
+            result, video_info, file_path = self._run_embedded_ytdlp(url, prefix)
+            if video_info and video_info.get('title'):
+                title = video_info['title']
+                video_title = title[:50] + "..." if len(title) > 50 else title
+            
+            if result.returncode == 0:
+                print(f"✓ {prefix} 下载成功: {video_title} (使用 yt-dlp)")
+                self._close_video_progress(video_id, video_title, '✅', '完成', delay=0.1)
+                # 显示下载的文件位置
+                self._show_downloaded_file_location(video_title, file_path)
+                # 清理临时文件
+                if self.config['cleanup_temp_files']:
+                    self._cleanup_temp_files()
+                # 更新下载状态
+                if self.status_manager:
+                    try:
+                        self.status_manager.set_url_status(url, 1, video_title)
+                    except Exception as e:
+                        print(f"⚠️ {prefix} 状态更新失败: {e}")
+                return True, video_title
+            
+            error_msg = self._get_detailed_error_info(result, None)
+            print(f"⚠️ {prefix} yt-dlp下载失败 (尝试 {attempt+1}/{self.retry_times}): {error_msg}")
+            
+            if attempt == self.retry_times - 1:
+                self._close_video_progress(video_id, video_title, '❌', '失败')
+                break
+            
+            # 智能判断是否重试
+            should_retry, wait_time = self._should_retry_error(result, attempt)
+            if not should_retry:
+                print(f"   检测到不可恢复的错误，跳过重试")
+                self._close_video_progress(video_id, video_title, '❌', '失败')
+                break
+            if wait_time > 10:
+                print(f"   检测到服务器繁忙或临时问题，等待 {wait_time} 秒后重试...")
+            else:
+                print(f"   等待 {wait_time} 秒后重试...")
+            time.sleep(wait_time)
+        
+        return False, video_title
+    
     def _parse_ytdlp_progress(self, line: str, progress_hook):
         """解析yt-dlp的进度输出 - 优化版本"""
         try:
@@ -1402,35 +1770,8 @@ class AcFunDownloader:
         
         return False
     
-    def _download_single_video(self, url: str, index: int = 0, total: int = 0) -> bool:
-        """
-        下载单个视频
-        
-        Args:
-            url: 视频URL
-            index: 当前视频索引
-            total: 总视频数
-            
-        Returns:
-            bool: 下载是否成功
-        """
-        # 清理和标准化URL
-        url = self._clean_url(url)
-        if not url:
-            return False
-            
-        if not self._is_valid_acfun_url(url):
-            print(f"❌ 无效的AcFun URL: {url}")
-            return False
-        
-        prefix = f"[{index+1}/{total}]" if total > 0 else ""
-        print(f"{prefix} 开始下载: {url}")
-        
-        # 检查网络连接（宽松检查，主要用于提示）
-        network_ok = self._check_network_connection()
-        if not network_ok:
-            print(f"⚠️ {prefix} 网络连接检查失败，但仍将尝试下载")
-        
+    def _download_with_subprocess(self, url: str, prefix: str) -> tuple[bool, str]:
+        """启动下载器子进程下载（带重试），返回(是否成功, 视频标题)"""
         # 获取视频信息（不阻塞下载流程）
         video_info = None
         video_title = "Unknown"
@@ -1442,7 +1783,6 @@ class AcFunDownloader:
         except Exception as e:
             print(f"⚠️ {prefix} 获取视频信息失败，但继续下载: {str(e)[:50]}")
         
-        # 首先尝试主要下载器（通常是yt-dlp）
         success = False
         for attempt in range(self.retry_times):
             result = None  # 初始化result变量
@@ -1645,6 +1985,43 @@ class AcFunDownloader:
                     print(f"   检测到不可恢复的错误，跳过重试")
                     break  # 不再重试，直接退出循环
         
+        return success, video_title
+    
+    def _download_single_video(self, url: str, index: int = 0, total: int = 0) -> bool:
+        """
+        下载单个视频
+        
+        Args:
+            url: 视频URL
+            index: 当前视频索引
+            total: 总视频数
+            
+        Returns:
+            bool: 下载是否成功
+        """
+        # 清理和标准化URL
+        url = self._clean_url(url)
+        if not url:
+            return False
+            
+        if not self._is_valid_acfun_url(url):
+            print(f"❌ 无效的AcFun URL: {url}")
+            return False
+        
+        prefix = f"[{index+1}/{total}]" if total > 0 else ""
+        print(f"{prefix} 开始下载: {url}")
+        
+        # 检查网络连接（宽松检查，主要用于提示）
+        network_ok = self._check_network_connection()
+        if not network_ok:
+            print(f"⚠️ {prefix} 网络连接检查失败，但仍将尝试下载")
+        
+        # 首先尝试主要下载器（通常是yt-dlp）
+        if self.use_embedded_ytdlp and self.available_downloaders['primary'] == 'yt-dlp':
+            success, video_title = self._download_with_embedded_ytdlp(url, prefix)
+        else:
+            success, video_title = self._download_with_subprocess(url, prefix)
+        
         # 如果主要下载器失败，尝试备用下载器
         if not success and len(self.available_downloaders['available']) > 1:
             for backup_downloader in self.available_downloaders['available']:
@@ -1852,6 +2229,9 @@ class AcFunDownloader:
                             except:
                                 pass
         
+        # 下载线程已经结束，释放它们各自的YoutubeDL实例
+        self._close_embedded_ytdlp()
+        
         # 关闭总体进度条
         if self.overall_progress:
             self.overall_progress.close()
@@ -2011,16 +2391,7 @@ def handle_status_commands(args):
             print("⚠️ 此操作将重置所有URL的下载状态，请确认...")
             response = input("输入 'yes' 确认重置所有状态: ")
             if response.lower() == 'yes':
-                # 读取所有状态并重置为0
-                status_data = status_manager._read_status_file()
-                reset_count = 0
-                for url_hash, info in status_data.items():
-                    if info.get('status') == 1:
-                        info['status'] = 0
-                        info['last_updated'] = time.strftime('%Y-%m-%d %H:%M:%S')
-                        reset_count += 1
-                
-                status_manager._write_status_file(status_data)
+                reset_count = status_manager.reset_all()
                 print(f"✅ 已重置 {reset_count} 个URL的下载状态")
             else:
                 print("❌ 操作已取消")
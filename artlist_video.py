@@ -8,8 +8,6 @@ import time
 import requests
 import mysql.connector
 from mysql.connector import Error
-import shutil
-import subprocess
 import logging
 from tqdm import tqdm
 from datetime import datetime
@@ -17,6 +15,9 @@ import random
 import uuid
 from concurrent.futures import ThreadPoolExecutor
 
+from hls_engine import HLSSegmentEngine, FFmpegRemuxSink
+from hls_playlist import get_playlist_fetcher
+
 # 日志配置
 logging.basicConfig(
     level=logging.INFO,
@@ -45,6 +46,9 @@ os.makedirs(SAVE_DIR, exist_ok=True)
 DATAL_ID_PREFIX = "大12"
 page_start = 7
 
+# 清晰度选择：不低于该高度的清晰度里取最小的一档（都达不到时取最高的）
+TARGET_MIN_HEIGHT = 1080
+
 # 添加关键词组配置
 KEYWORDS = [
     "Stability Ball Crunch",
@@ -226,137 +230,42 @@ def process_m3u8(video_item,keyword):
         original_url = video_item['clipPath']
         logger.debug(f"下载原始m3u8: {original_url}")
 
-        response = requests.get(original_url)
-        response.raise_for_status()
-
-        # 解析最高画质片段
-        lines = response.text.split('\n')
-        last_stream = None
-        for i, line in enumerate(lines):
-            if "#EXT-X-STREAM-INF" in line:
-                last_stream = lines[i + 1].strip()
-
-        if not last_stream:
-            raise ValueError("未找到有效视频流")
-
-        # 构建新URL
-        base_url = '/'.join(original_url.split('/')[:-1])
-        new_url = f"{base_url}/{last_stream}"
-        logger.debug(f"解析到高清流地址: {new_url}")
+        # 解析主列表，按清晰度策略选一档（不低于1080p里最小的那个），再取对应的媒体列表
+        fetcher = get_playlist_fetcher()
+        playlist = fetcher.resolve_media(original_url, min_height=TARGET_MIN_HEIGHT)
+        logger.debug(f"解析到视频流地址: {playlist.url}")
 
         out_path=os.path.join(SAVE_DIR,keyword)
         os.makedirs(out_path,exist_ok=True)
 
-        # 下载实际m3u8
-        m3u8_path = os.path.join(out_path, f"{video_id}.m3u8")
-        response = requests.get(new_url)
-        response.raise_for_status()
-        with open(m3u8_path, 'wb') as f:
-            f.write(response.content)
-        logger.info(f"已下载m3u8文件: {m3u8_path}")
-
-        # 解析m3u8文件，获取所有ts片段
-        ts_files = []
-        with open(m3u8_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            lines = content.split('\n')
-            for i, line in enumerate(lines):
-                if line.strip().startswith('#EXTINF'):
-                    # 下一行是ts文件
-                    if i + 1 < len(lines):
-                        ts_file = lines[i + 1].strip()
-                        if ts_file:
-                            ts_files.append(ts_file)
-
-        if not ts_files:
+        ts_segments = playlist.segments
+        if not ts_segments:
             raise ValueError("未找到有效的ts片段")
+        logger.info(f"共 {len(ts_segments)} 个ts片段, 时长 {playlist.duration:.1f}s"
+                    + (", 已加密" if playlist.is_encrypted else ""))
 
-        # 创建视频文件夹
-        video_save_dir = os.path.join(out_path, f"{video_id}")
-        os.makedirs(video_save_dir, exist_ok=True)
-
-        # 添加并发下载ts片段
-        def download_ts_segment(ts_info):
-            ts_url, ts_path = ts_info
-            for _ in range(3):  # 重试机制
-                try:
-                    response = requests.get(ts_url, headers=get_random_headers(), stream=True)
-                    response.raise_for_status()
-                    with open(ts_path, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                    return True
-                except Exception as e:
-                    logger.warning(f"下载ts片段失败，重试: {ts_url}, 错误: {e}")
-                    time.sleep(random.uniform(1, 3))
-            return False
-
-        # 并发下载ts片段
-        ts_download_tasks = [(f"{base_url}/{ts_file}", os.path.join(video_save_dir, ts_file)) 
-                           for ts_file in ts_files]
-        
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            results = list(tqdm(
-                executor.map(download_ts_segment, ts_download_tasks),
-                total=len(ts_download_tasks),
-                desc="下载视频片段"
-            ))
-
-        if not all(results):
-            raise Exception("部分视频片段下载失败")
-
-        # 生成输入列表文件
-        input_list_path = os.path.join(video_save_dir, 'input_list.txt')
-        with open(input_list_path, 'w', encoding='utf-8') as f:
-            for ts_file in ts_files:
-                f.write(f"file '{os.path.join(video_save_dir, ts_file)}'\n")
-
-        logger.info(f"生成输入列表文件: {input_list_path}")
-
-        # 转换MP4
+        # 流式下载ts片段并直接封装MP4：分片按顺序写进同一个 ffmpeg 进程，不再逐个落盘再 concat
+        # （异步分片引擎：同一视频的分片复用连接，并发按吞吐自动调整，乱序到达的分片在重排缓冲区等待）
         output_path = os.path.join(out_path, f"{video_id}.mp4")
-        logger.info(f"开始视频转换: {output_path}")
+        logger.info(f"开始下载并转换视频: {output_path}")
         ffmpeg_path = r"D:\ffmpeg-master-latest-win64-gpl\bin\ffmpeg.exe"
-        ffmpeg_cmd = [
-            ffmpeg_path,
-            '-y',
-            '-loglevel', 'debug',
-            '-protocol_whitelist', 'file,pipe,concat',
-            '-f', 'concat',
-            '-safe', '0',
-            '-i', input_list_path,
-            '-c', 'copy',
-            output_path
-        ]
-
-        process = subprocess.run(
-            ffmpeg_cmd,
-            check=True,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            encoding='utf-8',  # 显式设置编码为 UTF-8
-            errors='ignore',  # 忽略无法解码的字符
-            text=True
-        )
 
-        logger.info(f"视频转换完成: {output_path}")
-
-        # 删除处理过程中生成的中间文件和文件夹
-        logger.info("开始清理临时文件...")
-        # 删除m3u8文件
-        if os.path.exists(m3u8_path):
-            os.remove(m3u8_path)
-            logger.debug(f"已删除m3u8文件: {m3u8_path}")
-        # 删除输入列表文件
-        if os.path.exists(input_list_path):
-            os.remove(input_list_path)
-            logger.debug(f"已删除输入列表文件: {input_list_path}")
-        # 删除视频文件夹及其内容
-        if os.path.exists(video_save_dir):
-            shutil.rmtree(video_save_dir)
-            logger.debug(f"已删除视频文件夹: {video_save_dir}")
-        logger.info("临时文件清理完成.")
+        engine = HLSSegmentEngine(headers=get_random_headers(), initial_concurrency=5,
+                                  max_concurrency=16, logger=logger)
+        sink = FFmpegRemuxSink(output_path, ffmpeg_path)
+        try:
+            with tqdm(total=len(ts_segments), desc="下载视频片段") as pbar:
+                stats = engine.download_to_sink(ts_segments, sink,
+                                                progress_callback=lambda index, path, ok: pbar.update(1),
+                                                transform=fetcher.segment_transform(playlist))
+            if stats['failed']:
+                raise Exception(f"部分视频片段下载失败: {len(stats['failed'])} 个")
+            filesize = sink.close()
+        except Exception:
+            sink.abort()
+            raise
+
+        logger.info(f"视频转换完成: {output_path} ({filesize} 字节)")
 
         return output_path
 
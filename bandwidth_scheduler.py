@@ -0,0 +1,494 @@
+# _*_ coding: utf-8 _*_
+"""
+本机带宽调度守护进程（令牌桶）- 各下载器和移动脚本共用
+
+main.py 同时跑 sql_download_pro.py 和 video_moving.py，旁边还经常开着虎牙/B站/m3u8 下载器，
+这些进程互不知道对方的存在，一起抢出口带宽和目标盘的写入，谁都跑不满还互相拖慢。这里加一个
+本机守护进程统一分配字节额度：
+- 守护进程监听 Unix socket（Windows 没有 AF_UNIX 时监听 127.0.0.1 端口），每类资源一个令牌桶：
+  net（下载）和 disk（跨盘移动写入），全局限速在下面的配置区设置；
+- 限速可以按时间段变化，时间段的判断方式与 video_moving.is_time_in_unrestricted_window 相同
+  （开始晚于结束表示跨午夜），比如夜里不限速、白天限到一半；
+- 每个任务连接时带一个优先级（权重），多个任务同时等额度时按权重公平分配：
+  优先级 2 的任务拿到的带宽是优先级 1 的两倍，低优先级的不会被饿死；
+- 客户端一次向守护进程申请一大块额度（默认 4MB）在本地慢慢扣，绝大多数 throttle() 调用
+  不需要 socket 往返；
+- 守护进程没启动或中途退出时客户端自动放行（不限速），隔一段时间再重连，下载器不会因此出错。
+
+使用方式：
+    python bandwidth_scheduler.py              # 启动守护进程（main.py 会一起拉起）
+    python bandwidth_scheduler.py --status     # 查看当前限速和各任务用量
+
+    from bandwidth_scheduler import BandwidthClient
+    limiter = BandwidthClient('huya', resource='net', priority=1)
+    for chunk in resp.iter_content(chunk_size=1024 * 1024):
+        limiter.throttle(len(chunk))           # 额度不够时阻塞到拿到为止
+        f.write(chunk)
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import socketserver
+from collections import defaultdict
+from datetime import datetime, time as dt_time
+from typing import Any, Dict, Optional
+
+# ==================== 配置 ====================
+# 守护进程地址：有 AF_UNIX 时用 socket 文件，否则用本机 TCP 端口
+SOCKET_PATH = os.path.join(tempfile.gettempdir(), 'bandwidth_scheduler.sock')
+TCP_ADDRESS = ('127.0.0.1', 47321)
+HAS_AF_UNIX = hasattr(socket, 'AF_UNIX')
+DEFAULT_ADDRESS = SOCKET_PATH if HAS_AF_UNIX else TCP_ADDRESS
+
+# 各资源的全局速率上限（字节/秒），None 表示不限速
+RATE_LIMITS = {
+    'net': 40 * 1024 * 1024,    # 所有下载器合计
+    'disk': 150 * 1024 * 1024,  # 所有跨盘移动合计
+}
+# 按时间段覆盖上面的限速：((开始时, 分), (结束时, 分), {资源: 速率})，按顺序取第一个命中的时间段；
+# 开始晚于结束表示跨午夜（例如 (20, 0) - (9, 0)）
+TIME_WINDOWS = [
+    ((1, 0), (7, 0), {'net': None, 'disk': None}),  # 凌晨没人用网，不限速
+]
+# 令牌桶容量 = 速率 × 该秒数，允许短时间的突发
+BURST_SECONDS = 1.0
+# 单次授予的最小额度，避免速率很低时容量小于一次申请
+MIN_BUCKET_CAPACITY = 256 * 1024
+# 客户端一次申请的额度
+CLIENT_QUANTUM = 4 * 1024 * 1024
+# 守护进程连不上时，客户端多久重试一次（秒）
+RECONNECT_INTERVAL = 30
+# 守护进程打印统计的间隔（秒）
+STATS_INTERVAL = 300
+DEFAULT_PRIORITY = 1
+
+
+def is_time_in_window(start_time: dt_time, end_time: dt_time, now: Optional[dt_time] = None) -> bool:
+    """当前时间是否在时间段内，与 video_moving.is_time_in_unrestricted_window 的规则相同"""
+    now = now or datetime.now().time()
+    # 跨午夜的情况 (例如: 20:00 - 09:00)
+    if start_time > end_time:
+        return now >= start_time or now < end_time
+    # 当天内的情况
+    return start_time <= now < end_time
+
+
+def _send(f, message: Dict[str, Any]):
+    f.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+    f.flush()
+
+
+def _recv(f) -> Dict[str, Any]:
+    line = f.readline()
+    if not line:
+        raise ConnectionError("带宽调度守护进程已断开")
+    return json.loads(line)
+
+
+def _connect(address, timeout: Optional[float] = None) -> socket.socket:
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address)
+    except OSError:
+        sock.close()
+        raise
+    sock.settimeout(None)
+    return sock
+
+
+# ==================== 守护进程 ====================
+class TokenBucket:
+    """单个资源的令牌桶"""
+
+    def __init__(self, rate: Optional[float], burst_seconds: float = BURST_SECONDS):
+        self.burst_seconds = burst_seconds
+        self.rate = None
+        self.capacity = MIN_BUCKET_CAPACITY
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        self.set_rate(rate)
+        self.tokens = self.capacity
+
+    def set_rate(self, rate: Optional[float]):
+        if rate == self.rate:
+            return
+        self.refill()
+        self.rate = rate
+        if rate is not None:
+            self.capacity = max(rate * self.burst_seconds, MIN_BUCKET_CAPACITY)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def refill(self):
+        now = time.monotonic()
+        if self.rate is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+
+class _Job:
+    """一个已连接的客户端"""
+    __slots__ = ('id', 'name', 'resource', 'weight', 'pid', 'tag', 'finish',
+                 'waiting', 'granted', 'requests', 'connected_at')
+
+    def __init__(self, job_id, name, resource, priority, pid):
+        self.id = job_id
+        self.name = name
+        self.resource = resource
+        self.weight = max(1.0, float(priority))
+        self.pid = pid
+        self.tag = 0.0      # 本次申请的虚拟开始时间
+        self.finish = 0.0   # 上次授予的虚拟结束时间
+        self.waiting = False
+        self.granted = 0
+        self.requests = 0
+        self.connected_at = time.time()
+
+
+class RateScheduler:
+    """
+    按资源维护令牌桶，并在同一资源的等待者之间按权重公平排队（start-time fair queuing）：
+    每次申请的虚拟开始时间 = max(本任务上次的虚拟结束时间, 资源的虚拟时钟)，
+    虚拟开始时间最小的先拿令牌，拿到后虚拟结束时间前进 字节数 / 权重。
+    """
+
+    def __init__(self, rate_limits: Optional[Dict[str, Optional[float]]] = None,
+                 time_windows=None, burst_seconds: float = BURST_SECONDS):
+        self.rate_limits = dict(RATE_LIMITS if rate_limits is None else rate_limits)
+        self.time_windows = [(dt_time(*start), dt_time(*end), rates)
+                             for start, end, rates in (TIME_WINDOWS if time_windows is None else time_windows)]
+        self.burst_seconds = burst_seconds
+        self._cond = threading.Condition()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._vclock: Dict[str, float] = defaultdict(float)
+        self._jobs: Dict[int, _Job] = {}
+        self._next_id = 1
+        self._totals: Dict[str, int] = defaultdict(int)
+
+    def current_rate(self, resource: str) -> Optional[float]:
+        """当前时间段内该资源的速率上限"""
+        for start, end, rates in self.time_windows:
+            if resource in rates and is_time_in_window(start, end):
+                return rates[resource]
+        return self.rate_limits.get(resource)
+
+    def _bucket(self, resource: str) -> TokenBucket:
+        bucket = self._buckets.get(resource)
+        if bucket is None:
+            bucket = self._buckets[resource] = TokenBucket(self.current_rate(resource), self.burst_seconds)
+        else:
+            bucket.set_rate(self.current_rate(resource))
+        return bucket
+
+    def register(self, name: str, resource: str, priority: float, pid: Optional[int] = None) -> int:
+        with self._cond:
+            job_id = self._next_id
+            self._next_id += 1
+            job = _Job(job_id, name, resource, priority, pid)
+            # 新连接从当前虚拟时钟开始排，不能拿以前空闲的时间攒额度
+            job.finish = self._vclock[resource]
+            self._jobs[job_id] = job
+            return job_id
+
+    def unregister(self, job_id: int):
+        with self._cond:
+            self._jobs.pop(job_id, None)
+            self._cond.notify_all()
+
+    def acquire(self, job_id: int, nbytes: int) -> int:
+        """阻塞到能授予为止，返回授予的字节数（可能小于申请数，调用方继续申请剩下的）"""
+        with self._cond:
+            job = self._jobs[job_id]
+            resource = job.resource
+            job.tag = max(job.finish, self._vclock[resource])
+            job.waiting = True
+            try:
+                while True:
+                    bucket = self._bucket(resource)
+                    if bucket.rate is None:
+                        granted = nbytes
+                        break
+                    granted = min(nbytes, int(bucket.capacity))
+                    head = min((j for j in self._jobs.values() if j.waiting and j.resource == resource),
+                               key=lambda j: (j.tag, j.id))
+                    if head is job:
+                        bucket.refill()
+                        if bucket.tokens >= granted:
+                            bucket.tokens -= granted
+                            break
+                        self._cond.wait((granted - bucket.tokens) / bucket.rate)
+                    else:
+                        # 排在别人后面，等队首拿到令牌后被唤醒
+                        self._cond.wait(1.0)
+                self._vclock[resource] = job.tag
+                job.finish = job.tag + granted / job.weight
+                job.granted += granted
+                job.requests += 1
+                self._totals[resource] += granted
+                return granted
+            finally:
+                job.waiting = False
+                self._cond.notify_all()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            resources = sorted(set(self.rate_limits) | set(self._buckets))
+            return {
+                'rates': {resource: self.current_rate(resource) for resource in resources},
+                'totals': dict(self._totals),
+                'jobs': [{'id': job.id, 'name': job.name, 'resource': job.resource, 'priority': job.weight,
+                          'pid': job.pid, 'granted': job.granted, 'requests': job.requests,
+                          'waiting': job.waiting, 'seconds': round(time.time() - job.connected_at)}
+                         for job in self._jobs.values()],
+            }
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """一个客户端连接：一行一个 JSON 请求，一行一个 JSON 回复"""
+
+    def handle(self):
+        scheduler: RateScheduler = self.server.scheduler
+        job_id = None
+        try:
+            for line in self.rfile:
+                message = json.loads(line)
+                op = message.get('op')
+                if op == 'hello':
+                    job_id = scheduler.register(str(message.get('job', '?')), message.get('resource', 'net'),
+                                                message.get('priority', DEFAULT_PRIORITY), message.get('pid'))
+                    reply = {'ok': True, 'id': job_id}
+                elif op == 'acquire' and job_id is not None:
+                    reply = {'granted': scheduler.acquire(job_id, max(1, int(message['bytes'])))}
+                elif op == 'status':
+                    reply = scheduler.snapshot()
+                else:
+                    reply = {'error': f'unknown op: {op}'}
+                _send(self.wfile, reply)
+        except (OSError, ValueError, KeyError):
+            pass
+        finally:
+            if job_id is not None:
+                scheduler.unregister(job_id)
+
+
+if HAS_AF_UNIX:
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(address=DEFAULT_ADDRESS, scheduler: Optional[RateScheduler] = None, logger=None) -> int:
+    """启动守护进程，阻塞到 Ctrl+C / SIGTERM"""
+    logger = logger or logging.getLogger('bandwidth_scheduler')
+    scheduler = scheduler or RateScheduler()
+
+    # 已经有守护进程在跑（比如手动启动的）就待命，它退出后再接手，免得 main.py 反复重启本进程；
+    # 连不上的 socket 文件是上次异常退出留下的
+    announced = False
+    while True:
+        try:
+            _connect(address, timeout=2).close()
+        except OSError:
+            break
+        if not announced:
+            logger.info(f"带宽调度守护进程已在运行: {address}，本进程待命")
+            announced = True
+        time.sleep(RECONNECT_INTERVAL)
+    if isinstance(address, str) and os.path.exists(address):
+        os.remove(address)
+
+    if isinstance(address, str):
+        server = _UnixServer(address, _RequestHandler)
+        os.chmod(address, 0o666)  # 其他用户启动的下载器也能连
+    else:
+        server = _TCPServer(address, _RequestHandler)
+    server.scheduler = scheduler
+
+    def report():
+        while True:
+            time.sleep(STATS_INTERVAL)
+            log_status(scheduler.snapshot(), logger)
+
+    threading.Thread(target=report, name='bandwidth-stats', daemon=True).start()
+    rates = ', '.join(f"{resource}={_format_rate(rate)}" for resource, rate in scheduler.snapshot()['rates'].items())
+    logger.info(f"🚦 带宽调度守护进程已启动: {address} ({rates})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("收到中断信号，带宽调度守护进程退出")
+    finally:
+        server.server_close()
+        if isinstance(address, str) and os.path.exists(address):
+            os.remove(address)
+    return 0
+
+
+def _format_rate(rate: Optional[float]) -> str:
+    return '不限速' if rate is None else f"{rate / 1024 / 1024:.1f}MB/s"
+
+
+def log_status(status: Dict[str, Any], logger=None):
+    logger = logger or logging.getLogger('bandwidth_scheduler')
+    rates = ', '.join(f"{resource} {_format_rate(rate)} (累计 {status['totals'].get(resource, 0) / 1024 ** 3:.2f}GB)"
+                      for resource, rate in status['rates'].items())
+    logger.info(f"🚦 带宽调度: {rates}, {len(status['jobs'])} 个任务在线")
+    for job in status['jobs']:
+        logger.info(f"   [{job['resource']}] {job['name']} (pid {job['pid']}, 优先级 {job['priority']:g}): "
+                    f"已授予 {job['granted'] / 1024 ** 2:.0f}MB / {job['requests']} 次"
+                    f"{'，等待中' if job['waiting'] else ''}")
+
+
+def query_status(address=DEFAULT_ADDRESS) -> Dict[str, Any]:
+    sock = _connect(address, timeout=5)
+    try:
+        f = sock.makefile('rwb')
+        _send(f, {'op': 'status'})
+        return _recv(f)
+    finally:
+        sock.close()
+
+
+# ==================== 客户端 ====================
+class BandwidthClient:
+    """
+    向守护进程申请字节额度。线程安全：同一进程的多个下载线程共用一个客户端（共用一份额度）。
+    守护进程不可用时 throttle() 直接放行。
+    """
+
+    def __init__(self, job: str, resource: str = 'net', priority: float = DEFAULT_PRIORITY,
+                 address=DEFAULT_ADDRESS, quantum: int = CLIENT_QUANTUM, logger=None):
+        self.job = job
+        self.resource = resource
+        self.priority = priority
+        self.address = address
+        self.quantum = max(1, quantum)
+        self.logger = logger or logging.getLogger('bandwidth_scheduler')
+        self._lock = threading.Lock()
+        self._sock = None
+        self._file = None
+        self._budget = 0
+        self._next_connect = 0.0
+        self._warned = False
+        self.stats = {'bytes': 0, 'round_trips': 0, 'wait_seconds': 0.0, 'unthrottled': 0}
+
+    def _ensure_connected(self) -> bool:
+        if self._file is not None:
+            return True
+        now = time.monotonic()
+        if now < self._next_connect:
+            return False
+        self._next_connect = now + RECONNECT_INTERVAL
+        try:
+            sock = _connect(self.address, timeout=2)
+            f = sock.makefile('rwb')
+            _send(f, {'op': 'hello', 'job': self.job, 'resource': self.resource,
+                      'priority': self.priority, 'pid': os.getpid()})
+            _recv(f)
+        except (OSError, ValueError) as e:
+            if not self._warned:
+                self.logger.info(f"未连接到带宽调度守护进程 ({e})，暂不限速")
+                self._warned = True
+            return False
+        self._sock, self._file = sock, f
+        if self._warned:
+            self.logger.info("已连接到带宽调度守护进程")
+            self._warned = False
+        return True
+
+    def _disconnect(self, reason):
+        self.logger.warning(f"与带宽调度守护进程的连接断开 ({reason})，暂不限速")
+        self._warned = True
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+        self._sock = self._file = None
+        self._budget = 0
+
+    def try_consume(self, nbytes: int) -> bool:
+        """不阻塞地扣额度：本地额度够或当前不限速时返回 True，否则调用方应改用 throttle()"""
+        with self._lock:
+            if self._budget >= nbytes:
+                self._budget -= nbytes
+                self.stats['bytes'] += nbytes
+                return True
+            return self._file is None and time.monotonic() < self._next_connect
+
+    def throttle(self, nbytes: int):
+        """扣除 nbytes 字节的额度，不够时向守护进程申请，阻塞到拿到为止"""
+        if nbytes <= 0:
+            return
+        with self._lock:
+            self.stats['bytes'] += nbytes
+            if self._budget >= nbytes:
+                self._budget -= nbytes
+                return
+            need = nbytes - self._budget
+            self._budget = 0
+            start = time.monotonic()
+            while need > 0:
+                if not self._ensure_connected():
+                    self.stats['unthrottled'] += need
+                    return
+                try:
+                    _send(self._file, {'op': 'acquire', 'bytes': max(need, self.quantum)})
+                    granted = int(_recv(self._file)['granted'])
+                except (OSError, ValueError, KeyError) as e:
+                    self._disconnect(e)
+                    continue
+                self.stats['round_trips'] += 1
+                if granted >= need:
+                    self._budget = granted - need
+                    need = 0
+                else:
+                    need -= granted
+            self.stats['wait_seconds'] += time.monotonic() - start
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                try:
+                    self._sock.close()
+                except OSError:
+                    pass
+            self._sock = self._file = None
+
+    def log_stats(self):
+        s = self.stats
+        self.logger.info(f"🚦 带宽额度 [{self.resource}] {self.job}: {s['bytes'] / 1024 ** 2:.0f}MB, "
+                         f"申请 {s['round_trips']} 次, 等待 {s['wait_seconds']:.1f}s, "
+                         f"未限速 {s['unthrottled'] / 1024 ** 2:.0f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本机带宽调度守护进程')
+    parser.add_argument('--status', action='store_true', help='查看正在运行的守护进程的状态')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.status:
+        try:
+            log_status(query_status())
+        except OSError as e:
+            logging.error(f"带宽调度守护进程未运行: {e}")
+            return 1
+        return 0
+    return serve()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,7 +9,6 @@ import json
 import os
 import sys
 import time
-import subprocess
 from datetime import datetime
 from loguru import logger
 import threading
@@ -17,6 +16,7 @@ import queue
 import socket
 import platform
 from typing import Dict, Any, Optional, List
+from urllib.parse import urlparse
 # from concurrent.futures import ThreadPoolExecutor, as_completed # 已移除
 
 # --- 新增数据库依赖 ---
@@ -27,9 +27,26 @@ from mysql.connector import errorcode
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext
 
+# --- 下载引擎 ---
+from dash_downloader import DashDownloader
+from task_pool import PrefetchWorkerPool
+from task_claim import TaskClaimer
+from bandwidth_scheduler import BandwidthClient
+
 # --- 配置文件 ---
 CONFIG_FILE = "config.json"
 
+# 大文件分几段并行下载（音频和视频本身也同时下载）
+DOWNLOAD_PARTS = 4
+# 边下边合并：ffmpeg 直接读音视频流写成品，不落地中间文件（不分段、不支持续传）
+MERGE_WHILE_DOWNLOADING = False
+# 工作池：同时下载的任务数、同一 CDN 主机同时下载的任务数、一次预取（领取并解析播放地址）的任务数
+DOWNLOAD_WORKERS = 2
+DOWNLOADS_PER_HOST = 2
+PREFETCH_TASKS = 2
+# 与本机其他下载器共用 bandwidth_scheduler 守护进程的总限速，数值越大分到的带宽越多
+BANDWIDTH_PRIORITY = 1
+
 # ==============================================================================
 # 0. 数据库配置与连接模块 (【逻辑微调】)
 # ==============================================================================
@@ -112,58 +129,6 @@ def initialize_database():
             conn.close()
 
 
-def get_task_to_resume(computer_name: str) -> Optional[Dict[str, Any]]:
-    """查找本机之前未完成的任务"""
-    conn = get_db_connection()
-    if not conn: return None
-    task = None
-    try:
-        cursor = conn.cursor(dictionary=True)
-        # 查找本机已分配但未完成的任务 (is_used=0 表示已分配但未完成)
-        query = "SELECT id, url FROM bilibili_link_ljn WHERE is_used = 0 AND computer_name = %s LIMIT 1"
-        cursor.execute(query, (computer_name,))
-        task = cursor.fetchone()
-        if task:
-            logger.info(f"发现本机未完成的已分配任务: ID={task['id']}")
-    except Exception as e:
-        logger.error(f"查询待恢复任务失败: {e}")
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
-    return task
-
-
-def get_new_task(computer_name: str) -> Optional[Dict[str, Any]]:
-    """原子性地获取一个新任务并标记为正在下载"""
-    conn = get_db_connection()
-    if not conn: return None
-    task = None
-    try:
-        cursor = conn.cursor(dictionary=True)
-        conn.start_transaction()
-        # 查找未分配的任务 (is_used 为 NULL 表示未分配)
-        query = "SELECT id, url FROM bilibili_link_ljn WHERE is_used IS NULL AND status = 0 LIMIT 1 FOR UPDATE"
-        cursor.execute(query)
-        row = cursor.fetchone()
-        if row:
-            task_id = row['id']
-            # 分配任务：设置 is_used=0(已分配未完成), status=2(正在下载), computer_name
-            update_query = "UPDATE bilibili_link_ljn SET status = 2, is_used = 0, computer_name = %s WHERE id = %s"
-            cursor.execute(update_query, (computer_name, task_id))
-            task = row
-            logger.info(f"成功分配新任务给 {computer_name}: ID={task_id}")
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"获取新任务失败: {e}")
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
-    return task
-
-
 def update_task_status(task_id: int, status: int, title: Optional[str] = None):
     """更新任务状态"""
     conn = get_db_connection()
@@ -431,6 +396,10 @@ class DownloaderApp:
 # ==============================================================================
 BASE_DOWNLOAD_DIR, FFMPEG_PATH = '', ''
 session = requests.Session()
+# 多个任务同时分段下载，连接池要容纳 任务数 × 音视频 × 分段数 个连接
+session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=DOWNLOAD_WORKERS * 2 * DOWNLOAD_PARTS + 4))
+bandwidth_limiter = BandwidthClient('bilibili', resource='net', priority=BANDWIDTH_PRIORITY, logger=logger)
+dash_downloader = DashDownloader(session, parts=DOWNLOAD_PARTS, limiter=bandwidth_limiter, logger=logger)
 
 
 def get_playinfo_from_api(bvid: str, page_number: int = 1) -> Optional[Dict[str, str]]:
@@ -504,7 +473,9 @@ def get_playinfo_from_api(bvid: str, page_number: int = 1) -> Optional[Dict[str,
         return {
             'videoTitle': final_title,
             'videoUrl': best_video_stream['baseUrl'],
-            'audioUrl': best_audio_stream['baseUrl']
+            'audioUrl': best_audio_stream['baseUrl'],
+            'videoCodecs': best_video_stream.get('codecs'),
+            'audioCodecs': best_audio_stream.get('codecs')
         }
 
     except requests.exceptions.RequestException as e:
@@ -515,99 +486,59 @@ def get_playinfo_from_api(bvid: str, page_number: int = 1) -> Optional[Dict[str,
         return None
 
 
-def saveMedia_single_thread(fileName: str, url: str, desc: str) -> Optional[str]:
+def saveMedia_parallel(fileName: str, audio_url: str, video_url: str):
     """
-    【核心修改】
-    使用单线程流式下载媒体文件，支持断点续传并显示进度条。
+    同时下载音频和视频，大文件按 Range 分段多连接下载，断点续传按段记录（见 dash_downloader.py）。
+    返回 (音频路径, 视频路径)，失败的为 None
     """
     os.makedirs(name=BASE_DOWNLOAD_DIR, exist_ok=True)
-    final_file_path = os.path.join(BASE_DOWNLOAD_DIR, f"{fileName}.{desc}")
-    temp_file_path = final_file_path + ".tmp"
+    audio_path, video_path = dash_downloader.download_many([
+        (audio_url, os.path.join(BASE_DOWNLOAD_DIR, f"{fileName}.audio"), 'audio'),
+        (video_url, os.path.join(BASE_DOWNLOAD_DIR, f"{fileName}.video"), 'video'),
+    ])
+    return audio_path, video_path
+
+
+def AvMerge(mp3Path: str, mp4Path: str, savePath: str, video_codecs: Optional[str] = None,
+            audio_codecs: Optional[str] = None) -> bool:
+    """合并音视频：编码兼容时 -c copy 直接复制，否则音频转 AAC（见 dash_downloader.py）"""
+    if not dash_downloader.merge(FFMPEG_PATH, mp4Path, mp3Path, savePath, video_codecs, audio_codecs):
+        logger.error(f"FFmpeg合并失败: {os.path.basename(savePath)}")
+        return False
+    os.remove(mp3Path)
+    os.remove(mp4Path)
+    return True
 
-    if os.path.exists(final_file_path):
-        logger.info(f"{desc} 最终文件已存在，跳过下载。")
-        return final_file_path
 
-    try:
-        downloaded_size = 0
-        if os.path.exists(temp_file_path):
-            downloaded_size = os.path.getsize(temp_file_path)
-
-        headers = session.headers.copy()
-        if downloaded_size > 0:
-            headers['Range'] = f'bytes={downloaded_size}-'
-            logger.info(f"发现未完成的 {desc} 文件，从 {downloaded_size / 1024 / 1024:.2f} MB 处继续下载。")
-
-        with session.get(url, headers=headers, stream=True, timeout=(30, 3600)) as r:
-            # B站有时对Range请求返回200而不是206，但内容是正确的，所以不强制检查206
-            if r.status_code not in [200, 206]:
-                r.raise_for_status()
-
-            # 从 'Content-Range' (续传) 或 'Content-Length' (新下载) 获取总大小
-            total_size_str = r.headers.get('Content-Range', r.headers.get('content-length'))
-            total_size = 0
-            if total_size_str:
-                if '/' in total_size_str:  # Format is 'bytes start-end/total'
-                    total_size = int(total_size_str.split('/')[-1])
-                else:  # Just content-length
-                    total_size = downloaded_size + int(total_size_str)
-            else:  # 无法获取总大小
-                total_size = downloaded_size  # 只能显示已下载部分
-
-            with tqdm(total=total_size, initial=downloaded_size, desc=desc, unit='B', unit_scale=True,
-                      unit_divisor=1024, leave=False) as pbar:
-                with open(temp_file_path, 'ab') as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            pbar.update(len(chunk))
-
-        os.rename(temp_file_path, final_file_path)
-        logger.success(f"{desc}: 文件下载完成 -> {os.path.basename(final_file_path)}")
-        return final_file_path
-
-    except requests.exceptions.HTTPError as http_err:
-        logger.error(f"HTTP错误导致 {desc} 下载失败: {http_err}. 请检查Cookie是否已过期或不正确。")
-        return None
-    except Exception as e:
-        logger.error(f"{desc} 下载过程中发生错误: {e}")
+def parse_video_url(url: str) -> Optional[tuple]:
+    """从链接中提取 (BVID, 分P号)，提取不到 BVID 时返回 None"""
+    bvid_match = re.search(r'BV([a-zA-Z0-9]{10})', url)
+    if not bvid_match:
         return None
+    page_match = re.search(r'[?&]p=(\d+)', url)
+    return bvid_match.group(0), int(page_match.group(1)) if page_match else 1
 
 
-def AvMerge(mp3Path: str, mp4Path: str, savePath: str) -> bool:
-    """合并音视频 (无改动)"""
-    try:
-        command = [FFMPEG_PATH, '-y', '-i', mp4Path, '-i', mp3Path, '-c:v', 'copy', '-c:a', 'aac', '-strict',
-                   'experimental', savePath]
-        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL);
-        logger.success(f"合并成功: {os.path.basename(savePath)}");
-        os.remove(mp3Path);
-        os.remove(mp4Path);
-        return True
-    except Exception as e:
-        logger.error(f"FFmpeg合并失败: {e}");
-        return False
-
-
-def processVideoUrl(url: str) -> Dict[str, Any]:
+def processVideoUrl(url: str, prefetched_info: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
     """
-    处理单个视频链接，调用单线程下载函数。
+    处理单个视频链接，音频和视频并行下载。
+    prefetched_info 为工作池提前取好的播放信息，第一次尝试直接使用，重试时重新获取。
     """
     MAX_RETRIES = 5
 
-    bvid_match = re.search(r'BV([a-zA-Z0-9]{10})', url)
-    if not bvid_match:
+    parsed = parse_video_url(url)
+    if not parsed:
         return {'success': False, 'title': None, 'error_msg': f"无法从URL中提取BVID: {url}"}
-    bvid = bvid_match.group(0)
-
-    page_match = re.search(r'[?&]p=(\d+)', url)
-    page_number = int(page_match.group(1)) if page_match else 1
+    bvid, page_number = parsed
 
     logger.info(f"识别到 BVID: {bvid}, 分P: {page_number}")
 
     for attempt in range(1, MAX_RETRIES + 1):
         try:
-            videoInfo = get_playinfo_from_api(bvid, page_number)
+            if attempt == 1 and prefetched_info:
+                videoInfo = prefetched_info
+            else:
+                videoInfo = get_playinfo_from_api(bvid, page_number)
             if not videoInfo:
                 raise Exception("通过API获取视频信息失败。")
 
@@ -618,14 +549,19 @@ def processVideoUrl(url: str) -> Dict[str, Any]:
                 logger.info(f"文件已存在，跳过: {safe_title}.mp4")
                 return {'success': True, 'title': safe_title}
 
-            # 【核心修改】调用单线程下载函数
-            mp3_path = saveMedia_single_thread(safe_title, videoInfo['audioUrl'], 'audio')
-            if not mp3_path: raise Exception("下载音频文件失败。请检查Cookie是否已过期或不正确。")
+            if MERGE_WHILE_DOWNLOADING:
+                if not dash_downloader.download_and_merge(FFMPEG_PATH, videoInfo['videoUrl'], videoInfo['audioUrl'],
+                                                          final_output, videoInfo.get('videoCodecs'),
+                                                          videoInfo.get('audioCodecs')):
+                    raise Exception("边下边合并失败。请检查Cookie是否已过期或不正确。")
+                return {'success': True, 'title': safe_title}
 
-            mp4_path = saveMedia_single_thread(safe_title, videoInfo['videoUrl'], 'video')
+            # 音频和视频同时下载
+            mp3_path, mp4_path = saveMedia_parallel(safe_title, videoInfo['audioUrl'], videoInfo['videoUrl'])
+            if not mp3_path: raise Exception("下载音频文件失败。请检查Cookie是否已过期或不正确。")
             if not mp4_path: raise Exception("下载视频文件失败。请检查Cookie是否已过期或不正确。")
 
-            if not AvMerge(mp3_path, mp4_path, final_output):
+            if not AvMerge(mp3_path, mp4_path, final_output, videoInfo.get('videoCodecs'), videoInfo.get('audioCodecs')):
                 raise Exception("合并音视频文件失败")
 
             return {'success': True, 'title': safe_title}
@@ -658,40 +594,54 @@ def main_downloader_loop(config, stop_event):
     logger.info(f"\n{'=' * 20}\n下载器核心已启动 (本机: {COMPUTER_NAME})，进入数据库监控模式...\n{'=' * 20}")
     initialize_database()
 
-    while not stop_event.is_set():
-        task = None
-        try:
-            task = get_task_to_resume(COMPUTER_NAME)
-            if task:
-                logger.info(f"发现本机未完成的任务，继续处理: {task['url']}")
-            else:
-                task = get_new_task(COMPUTER_NAME)
-
-            if task:
-                task_id, url = task['id'], task['url']
-                logger.info(f"开始处理任务 (ID: {task_id}): {url}")
-                result = processVideoUrl(url)
-
-                if result['success']:
-                    update_task_status(task_id, 1, result['title'])
-                    logger.success(f"任务 (ID: {task_id}) 处理成功: {url}")
-                else:
-                    # 【修改点】 当任务最终失败时，更新状态为3
-                    update_task_status(task_id, 3)
-                    logger.error(f"任务 (ID: {task_id}) 处理失败，已标记为失败状态: {url}.")
-            else:
-                logger.info("数据库中无待处理链接，等待下一次检查...")
-                stop_event.wait(timeout=30)
+    # 批量领取 (SKIP LOCKED) + 租约：本机或其他机器中断的任务租约过期后自动重新领取
+    # 领取时设置 is_used=0(已分配未完成), status=2(正在下载), computer_name；还回时重置为未分配
+    claimer = TaskClaimer(get_db_connection, 'bilibili_link_ljn', columns=('id', 'url'),
+                          pending_statuses=(0,), claimed_status=2,
+                          owner_column='computer_name', owner=COMPUTER_NAME,
+                          claim_values={'is_used': 0}, release_values={'is_used': None},
+                          failed_status=3, logger=logger)
+    try:
+        claimer.ensure_schema()
+        claimer.expire_own_leases()
+    except Exception as e:
+        logger.error(f"初始化任务领取表结构失败: {e}")
 
-            if not task:
-                time.sleep(1)
+    def resolve_task(task):
+        # 元数据线程上提前取好播放地址，下载线程拿到任务就能直接开始
+        parsed = parse_video_url(task['url'])
+        return get_playinfo_from_api(*parsed) if parsed else None
 
-        except Exception as e:
-            logger.error(f"监控循环发生未知错误: {e}", exc_info=True)
-            if task and 'id' in task:
-                logger.warning(f"将任务 {task['id']} 状态重置为0")
-                update_task_status(task['id'], 0)
-            stop_event.wait(timeout=60)
+    def task_host(task, video_info):
+        return urlparse(video_info['videoUrl']).netloc if video_info else 'api.bilibili.com'
+
+    def process_task(task, video_info):
+        task_id, url = task['id'], task['url']
+        logger.info(f"开始处理任务 (ID: {task_id}): {url}")
+        result = processVideoUrl(url, video_info)
+
+        if result['success']:
+            update_task_status(task_id, 1, result['title'])
+            logger.success(f"任务 (ID: {task_id}) 处理成功: {url}")
+        else:
+            # 【修改点】 当任务最终失败时，更新状态为3
+            update_task_status(task_id, 3)
+            logger.error(f"任务 (ID: {task_id}) 处理失败，已标记为失败状态: {url}.")
+
+    pool = PrefetchWorkerPool(
+        claim=claimer.claim,
+        process=process_task,
+        release=claimer.release,
+        fail=claimer.fail,
+        resolve=resolve_task,
+        host_of=task_host,
+        workers=DOWNLOAD_WORKERS, per_host=DOWNLOADS_PER_HOST, prefetch=PREFETCH_TASKS,
+        stop_event=stop_event, idle_wait=30, logger=logger)
+    pool.run()
+    pool.log_stats()
+    claimer.log_stats()
+    claimer.close()
+    bandwidth_limiter.log_stats()
 
     if wechat_work_notifier_instance and wechat_work_notifier_instance.enabled:
         wechat_work_notifier_instance.send_message_async("下载监控任务已停止。")
@@ -723,23 +673,6 @@ def save_config(config_data):
 
 
 if __name__ == '__main__':
-    try:
-        from tqdm import tqdm
-    except ImportError:
-        root = tk.Tk();
-        root.withdraw();
-        messagebox.showerror("依赖缺失", "错误：tqdm 库未安装。\n请在命令行运行 'pip install tqdm' 进行安装。");
-        sys.exit(1)
-
-    try:
-        import mysql.connector
-    except ImportError:
-        root = tk.Tk();
-        root.withdraw();
-        messagebox.showerror("依赖缺失",
-                             "错误：mysql-connector-python 库未安装。\n请在命令行运行 'pip install mysql-connector-python' 进行安装。");
-        sys.exit(1)
-
     root = tk.Tk();
     app = DownloaderApp(root);
     root.mainloop()
\ No newline at end of file
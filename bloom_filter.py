@@ -0,0 +1,98 @@
+# _*_ coding: utf-8 _*_
+"""
+本地布隆过滤器 - 在查询数据库之前先排除「肯定不存在」的记录
+
+布隆过滤器说「不存在」就一定不存在，说「可能存在」才需要真正去查数据库。
+查重脚本里绝大多数文件都是新文件，用它挡掉这部分查询，MySQL 只需要处理少量「可能存在」的记录。
+
+过滤器保存在本地文件里，下次启动直接加载，只需从数据库增量同步新增的记录。
+
+使用方式：
+    bloom, meta = BloomFilter.load(path) or (BloomFilter(10_000_000), {})
+    bloom.add('md5:' + md5)
+    if 'md5:' + md5 in bloom: ...   # 可能存在，再查数据库
+    bloom.save(path, meta)
+"""
+
+import os
+import json
+import math
+import struct
+import hashlib
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+# 文件头魔数
+_MAGIC = b'BLM1'
+
+
+class BloomFilter:
+    """位数组 + 双重哈希的布隆过滤器"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        """
+        Args:
+            capacity: 预计元素个数，超过后误判率会上升
+            error_rate: 期望误判率
+        """
+        self.capacity = max(1, int(capacity))
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / self.capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(key.encode('utf-8')).digest())
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    @property
+    def is_saturated(self) -> bool:
+        """元素数超过设计容量，误判率已明显高于预期"""
+        return self.count > self.capacity
+
+    def save(self, path: str, meta: Optional[Dict[str, Any]] = None):
+        """原子写入本地文件，meta 用于保存同步进度等附加信息"""
+        header = json.dumps({
+            'capacity': self.capacity,
+            'error_rate': self.error_rate,
+            'count': self.count,
+            'meta': meta or {},
+        }).encode('utf-8')
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            f.write(self.bits)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional[Tuple['BloomFilter', Dict[str, Any]]]:
+        """从文件加载，文件不存在或损坏时返回 None"""
+        try:
+            with open(path, 'rb') as f:
+                if f.read(4) != _MAGIC:
+                    return None
+                header_len = struct.unpack('<I', f.read(4))[0]
+                header = json.loads(f.read(header_len).decode('utf-8'))
+                bloom = cls(header['capacity'], header['error_rate'])
+                bits = f.read()
+            if len(bits) != len(bloom.bits):
+                return None
+            bloom.bits = bytearray(bits)
+            bloom.count = header['count']
+            return bloom, header.get('meta', {})
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            logging.warning(f"加载布隆过滤器失败，将重新构建: {e}")
+            return None
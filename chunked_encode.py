@@ -0,0 +1,270 @@
+# _*_ coding: utf-8 _*_
+"""
+长视频分段并行编码 - 批量裁剪 / MC_L 共用
+
+以前每个视频是一个 ffmpeg 任务，批量处理到最后只剩一个三小时的长视频时，只有一个工作线程在编码，
+其余线程全部空闲。这里把一个视频的有效区间切成若干段：
+- 分段点对齐到源视频的关键帧（只读分段点附近的包，不解码），每段从关键帧开始输入 seek，
+  不需要解码前一段的画面；
+- 每段用和整段编码完全相同的裁剪/缩放滤镜和编码参数，放到共享的线程池里并行编码，
+  输出为独立的 MP4 分段；
+- 全部完成后用 concat demuxer 无损拼接；
+- 每完成一段写一次清单，程序中断后重新运行只编码还没完成的段。
+
+清单默认写在输出文件旁（<输出>.chunks.json），只记录分段方案、编码参数签名和已完成的分段，
+不含电脑标识，输出目录在共享盘上时任何一台电脑都能接着编码。分段方案只由源视频的关键帧决定，
+同一个源文件在不同电脑上切出的分段完全相同；编码参数签名不同时（例如换成了另一种编码器）
+已有分段不能直接拼接，全部重新编码。调用方也可以通过 load_checkpoint / save_checkpoint
+接入自己的检查点机制。
+
+分段先写到 .part.mp4，编码成功后才改名，中断时不会把写了一半的分段当成已完成。
+只有一段时直接改名为输出文件，不再拼接。
+
+使用方式：
+    chunks = plan_chunks(video_path, start, end, chunk_seconds=300, ffprobe_path=FFPROBE_PATH)
+    encoder = ChunkedEncoder(video_path, output_path, chunks,
+                             build_command=lambda start, length, out: [...ffmpeg 命令...],
+                             concat=concat_mp4_files, executor=chunk_executor,
+                             signature={'encoder': 'h264_nvenc', 'filter': filter_complex})
+    encoder.run(progress=lambda done_seconds, total_seconds: ...)
+"""
+
+import os
+import json
+import bisect
+import logging
+import threading
+import concurrent.futures
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from smart_cut import KEYFRAME_SEARCH_WINDOW, probe_keyframes
+from ffmpeg_progress import run_ffmpeg
+
+# ==================== 配置 ====================
+DEFAULT_CHUNK_SECONDS = 300
+# 分段短于这个时长时并入前一段（秒）
+MIN_CHUNK_SECONDS = 60
+DEFAULT_WORKERS = 2
+# 单段编码超过这么久（秒）没有任何进度时视为卡死（不限制总时长，慢速 CPU 编码不会被误杀）
+CHUNK_STALL_TIMEOUT = 300
+# 小于这个大小的分段视为无效
+MIN_CHUNK_BYTES = 1024
+CHECKPOINT_MODE = 'chunked'
+
+
+def plan_chunks(video_path: str, start: float, end: float,
+                chunk_seconds: float = DEFAULT_CHUNK_SECONDS,
+                ffprobe_path: str = 'ffprobe') -> List[Tuple[float, float]]:
+    """把 [start, end) 按 chunk_seconds 切段，分段点对齐到之后最近的关键帧
+
+    start / end 和返回的分段点都相对容器 start_time（probe_keyframes 已换算），和 -ss 一致。
+    """
+    targets = []
+    t = start + chunk_seconds
+    while t < end - MIN_CHUNK_SECONDS:
+        targets.append(t)
+        t += chunk_seconds
+    if not targets:
+        return [(start, end)]
+
+    keyframes = probe_keyframes(video_path, [(t, t + KEYFRAME_SEARCH_WINDOW) for t in targets], ffprobe_path)
+    boundaries = [start]
+    for t in targets:
+        # 窗口内找不到关键帧时按原时间点切（重新编码本身是逐帧精确的，只是 seek 稍慢）
+        i = bisect.bisect_left(keyframes, t)
+        point = keyframes[i] if i < len(keyframes) and keyframes[i] - t <= KEYFRAME_SEARCH_WINDOW else t
+        if point - boundaries[-1] >= MIN_CHUNK_SECONDS and end - point >= MIN_CHUNK_SECONDS:
+            boundaries.append(point)
+    boundaries.append(end)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def run_chunk_command(cmd: List[str], on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                      stall_timeout: Optional[float] = CHUNK_STALL_TIMEOUT):
+    """通过 -progress 通道运行一段的编码命令，长时间无进度或失败时抛出带最后几行错误信息的异常"""
+    runner = run_ffmpeg(cmd, on_progress=on_progress, stall_timeout=stall_timeout)
+    if runner.returncode != 0:
+        raise RuntimeError(f"分段编码失败 (代码 {runner.returncode}): {' | '.join(runner.error_lines(5)) or '无具体错误信息'}")
+
+
+class ChunkedEncoder:
+    """按分段并行编码一个视频，支持按段续传"""
+
+    def __init__(self, video_path: str, output_path: str, chunks: Sequence[Tuple[float, float]],
+                 build_command: Callable[[float, float, str], List[str]],
+                 concat: Callable[[List[str], str], None],
+                 executor: Optional[concurrent.futures.Executor] = None,
+                 workers: int = DEFAULT_WORKERS,
+                 load_checkpoint: Optional[Callable[[], Optional[Dict]]] = None,
+                 save_checkpoint: Optional[Callable[[float, Dict], None]] = None,
+                 run_command: Callable[..., None] = run_chunk_command,
+                 stall_timeout: Optional[float] = CHUNK_STALL_TIMEOUT,
+                 signature: Optional[Dict] = None,
+                 logger=None):
+        """
+        Args:
+            chunks: plan_chunks 的结果 [(开始秒, 结束秒), ...]
+            build_command: build_command(开始秒, 时长, 分段输出路径) 返回该段的 ffmpeg 命令
+            concat: concat(分段路径列表, 输出路径) 无损拼接
+            executor: 共享的线程池；不提供时内部按 workers 创建
+            load_checkpoint: 返回上次保存的检查点（含 segment_info），没有返回 None
+            save_checkpoint: save_checkpoint(已完成秒数, segment_info)，每完成一段调用一次
+            两个都不提供时使用输出文件旁的清单 <输出>.chunks.json，拼接完成后删除
+            signature: 编码参数签名（可 JSON 序列化），和清单里记录的不同时已有分段作废
+            run_command: run_command(命令, on_progress, stall_timeout) 运行一段的编码，失败时抛出异常
+            stall_timeout: 单段超过这么久没有进度时终止（秒）
+        """
+        self.video_path = video_path
+        self.output_path = output_path
+        self.chunks = [(round(a, 6), round(b, 6)) for a, b in chunks]
+        self.build_command = build_command
+        self.concat = concat
+        self.executor = executor
+        self.workers = max(1, workers)
+        self.signature = json.loads(json.dumps(signature or {}))
+        self.checkpoint_path = None
+        if load_checkpoint is None and save_checkpoint is None:
+            self.checkpoint_path = self.manifest_path(output_path)
+            load_checkpoint, save_checkpoint = self._load_checkpoint_file, self._save_checkpoint_file
+        self.load_checkpoint = load_checkpoint
+        self.save_checkpoint = save_checkpoint
+        self.run_command = run_command
+        self.stall_timeout = stall_timeout
+        self.logger = logger or logging.getLogger('chunked_encode')
+
+        self.total_seconds = sum(b - a for a, b in self.chunks)
+        self._lock = threading.Lock()
+        self._done: Set[int] = set()
+        # 正在编码的分段已编码的秒数，只用于进度显示
+        self._partial: Dict[int, float] = {}
+
+    @staticmethod
+    def manifest_path(output_path: str) -> str:
+        return output_path + '.chunks.json'
+
+    def chunk_path(self, index: int) -> str:
+        return f"{self.output_path}.chunk{index:03d}.mp4"
+
+    def _load_checkpoint_file(self) -> Optional[Dict]:
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_checkpoint_file(self, done_seconds: float, segment_info: Dict):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'video_path': self.video_path, 'current_time': done_seconds,
+                       'segment_info': segment_info}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _segment_info(self) -> Dict:
+        return {'mode': CHECKPOINT_MODE, 'chunks': [list(c) for c in self.chunks],
+                'signature': self.signature, 'done': sorted(self._done)}
+
+    def _done_seconds(self) -> float:
+        return sum(self.chunks[i][1] - self.chunks[i][0] for i in self._done)
+
+    def _restore(self):
+        """从检查点恢复已完成的分段：分段方案和编码参数相同且分段文件还在才算数"""
+        checkpoint = self.load_checkpoint() if self.load_checkpoint else None
+        segment_info = (checkpoint or {}).get('segment_info') or {}
+        if segment_info.get('mode') != CHECKPOINT_MODE:
+            return
+        if [tuple(c) for c in segment_info.get('chunks', [])] != self.chunks:
+            self.logger.info(f"分段方案已变化，重新编码全部分段: {os.path.basename(self.video_path)}")
+            return
+        if segment_info.get('signature', {}) != self.signature:
+            self.logger.info(f"编码参数已变化，重新编码全部分段: {os.path.basename(self.video_path)}")
+            return
+        for index in segment_info.get('done', []):
+            path = self.chunk_path(index)
+            if 0 <= index < len(self.chunks) and os.path.exists(path) and os.path.getsize(path) > MIN_CHUNK_BYTES:
+                self._done.add(index)
+
+    def _encode_one(self, index: int, progress: Optional[Callable[[float, float], None]]):
+        start, end = self.chunks[index]
+        final_path = self.chunk_path(index)
+        part_path = final_path[:-len('.mp4')] + '.part.mp4'
+        cmd = self.build_command(start, end - start, part_path)
+
+        def on_chunk_progress(info: Dict[str, Any]):
+            if 'time' not in info or not progress:
+                return
+            with self._lock:
+                self._partial[index] = min(info['time'], end - start)
+                progress(self._done_seconds() + sum(self._partial.values()), self.total_seconds)
+
+        try:
+            self.run_command(cmd, on_chunk_progress, self.stall_timeout)
+        finally:
+            with self._lock:
+                self._partial.pop(index, None)
+        if not os.path.exists(part_path) or os.path.getsize(part_path) <= MIN_CHUNK_BYTES:
+            raise RuntimeError(f"分段 {index} 输出无效: {part_path}")
+        os.replace(part_path, final_path)
+        with self._lock:
+            self._done.add(index)
+            done_seconds = self._done_seconds()
+            if self.save_checkpoint:
+                self.save_checkpoint(done_seconds, self._segment_info())
+            if progress:
+                progress(done_seconds, self.total_seconds)
+
+    def run(self, progress: Optional[Callable[[float, float], None]] = None):
+        """编码所有未完成的分段并拼接到 output_path，任何一段失败时抛出异常（已完成的分段保留用于续传）"""
+        name = os.path.basename(self.video_path)
+        self._restore()
+        pending = [i for i in range(len(self.chunks)) if i not in self._done]
+        if self._done:
+            self.logger.info(f"🔄 分段续传: {name} 已完成 {len(self._done)}/{len(self.chunks)} 段")
+            if progress:
+                progress(self._done_seconds(), self.total_seconds)
+        self.logger.info(f"🧩 分段编码: {name} 共 {len(self.chunks)} 段, 待编码 {len(pending)} 段")
+
+        own_executor = None
+        executor = self.executor
+        if executor is None:
+            own_executor = executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix='chunk')
+        try:
+            futures = [executor.submit(self._encode_one, index, progress) for index in pending]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        finally:
+            if own_executor is not None:
+                own_executor.shutdown(wait=True)
+
+        chunk_files = [self.chunk_path(i) for i in range(len(self.chunks))]
+        if len(chunk_files) == 1:
+            os.replace(chunk_files[0], self.output_path)
+        else:
+            self.concat(chunk_files, self.output_path)
+        self.remove_chunks(self.output_path)
+        self.logger.info(f"🧩 分段编码完成: {name} ({len(self.chunks)} 段)")
+
+    @staticmethod
+    def remove_chunks(output_path: str):
+        """删除 output_path 对应的分段文件和清单（拼接完成或改用整段编码后调用）"""
+        try:
+            os.remove(ChunkedEncoder.manifest_path(output_path))
+        except OSError:
+            pass
+        folder = os.path.dirname(output_path) or '.'
+        prefix = os.path.basename(output_path) + '.chunk'
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            return
+        for filename in names:
+            if filename.startswith(prefix) and filename.endswith('.mp4'):
+                try:
+                    os.remove(os.path.join(folder, filename))
+                except OSError:
+                    pass
@@ -0,0 +1,380 @@
+# _*_ coding: utf-8 _*_
+"""
+DASH 音视频并行下载 - B 站下载脚本共用
+
+以前先下音频再下视频，每个文件一条连接、8KB 一块地读。CDN 对单条连接限速，
+一条连接只能跑到带宽的一小部分。这里改为：
+- 音频和视频同时下载；
+- 大文件先用 Range: bytes=0-0 探测总大小，再切成 N 段，每段一条连接并行下载，
+  直接写进同一个 .tmp 文件的对应位置（不需要事后拼接）；
+- 断点续传按段记录：每段已完成的字节数保存在 .tmp.parts 里，重启后每段从断点继续；
+  旧版单连接留下的 .tmp（只有前缀）也能接着用，剩余部分再分段；
+- 小文件或服务器不支持 Range 时，退回原来的单连接追加写 .tmp 续传；
+- 汇总输出每个文件和整体的吞吐（MB/s）。
+
+合并音视频时，B 站给的 H.264/HEVC/AV1 + AAC 本来就能直接放进 MP4，用 -c copy 不重新编码；
+编码不兼容或复制失败时才退回音频转 AAC。也可以边下边合并：ffmpeg 直接读两路流写成品，
+不落地中间文件（这种方式不分段、不续传）。
+
+传入 limiter（bandwidth_scheduler.BandwidthClient）时，写盘前先向本机带宽调度守护进程扣额度，
+和同机的其他下载器共用总带宽（边下边合并由 ffmpeg 直接拉流，不经过限速）。
+
+使用方式：
+    downloader = DashDownloader(session, parts=4, limiter=BandwidthClient('bilibili'), logger=logger)
+    audio_path, video_path = downloader.download_many([
+        (audio_url, os.path.join(save_dir, f"{title}.audio"), 'audio'),
+        (video_url, os.path.join(save_dir, f"{title}.video"), 'video'),
+    ])
+    downloader.merge(ffmpeg_path, video_path, audio_path, output_path, video_codecs, audio_codecs)
+
+各下载方法的 headers 参数是本次下载额外的请求头（比如每个任务自己的 Cookie），
+会覆盖 session 上的同名请求头，不修改共用的 session。
+"""
+
+import os
+import json
+import time
+import subprocess
+import logging
+import threading
+import concurrent.futures
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import requests
+from tqdm import tqdm
+
+# ==================== 配置 ====================
+# 每个文件最多分几段并行下载
+DEFAULT_PARTS = 4
+# 每段至少多大，小于 2 段的文件走单连接
+MIN_PART_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+# (连接超时, 读取超时)
+REQUEST_TIMEOUT = (30, 3600)
+PART_RETRIES = 3
+# 分段进度落盘间隔（秒）
+STATE_SAVE_INTERVAL = 2.0
+
+# MP4 容器能直接容纳的编码（DASH codecs 字符串前缀）
+MP4_VIDEO_CODECS = ('avc1', 'avc3', 'hev1', 'hvc1', 'av01')
+MP4_AUDIO_CODECS = ('mp4a', 'ac-3', 'ec-3', 'opus')
+
+
+class DashDownloader:
+    """分段多连接下载器，可以同时下载多个文件"""
+
+    def __init__(self, session: requests.Session, parts: int = DEFAULT_PARTS,
+                 min_part_size: int = MIN_PART_SIZE, limiter=None, logger=None):
+        self.session = session
+        self.parts = max(1, parts)
+        self.min_part_size = min_part_size
+        self.limiter = limiter
+        self.logger = logger or logging.getLogger('DashDownloader')
+
+    # ---------- 公共接口 ----------
+
+    def download_many(self, items: Sequence[Tuple[str, str, str]],
+                      headers: Optional[Dict[str, str]] = None) -> List[Optional[str]]:
+        """
+        同时下载多个文件
+
+        Args:
+            items: [(URL, 最终文件路径, 描述)]
+            headers: 额外的请求头
+
+        Returns:
+            与 items 对应的最终文件路径，失败的为 None
+        """
+        start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(items)),
+                                                   thread_name_prefix='dash') as executor:
+            futures = [executor.submit(self._download_timed, url, path, desc, headers) for url, path, desc in items]
+            results = [future.result() for future in futures]
+
+        elapsed = time.time() - start
+        total = sum(nbytes for _, nbytes in results)
+        if total > 0 and elapsed > 0:
+            self.logger.info(f"⚡ 本次下载 {total / 1024 / 1024:.1f} MB, 用时 {elapsed:.1f}s, "
+                             f"整体 {total / 1024 / 1024 / elapsed:.1f} MB/s")
+        return [path for path, _ in results]
+
+    def download(self, url: str, final_path: str, desc: str,
+                 headers: Optional[Dict[str, str]] = None) -> Optional[str]:
+        """下载单个文件，返回最终文件路径，失败返回 None"""
+        return self._download_timed(url, final_path, desc, headers)[0]
+
+    def _headers(self, extra: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """session 的请求头加上本次下载的额外请求头"""
+        headers = self.session.headers.copy()
+        if extra:
+            headers.update(extra)
+        return headers
+
+    # ---------- 单个文件 ----------
+
+    def _download_timed(self, url: str, final_path: str, desc: str,
+                        extra_headers: Optional[Dict[str, str]] = None) -> Tuple[Optional[str], int]:
+        """返回 (最终路径或 None, 本次实际下载的字节数)"""
+        os.makedirs(os.path.dirname(os.path.abspath(final_path)), exist_ok=True)
+        if os.path.exists(final_path):
+            self.logger.info(f"{desc} 最终文件已存在，跳过下载。")
+            return final_path, 0
+
+        start = time.time()
+        try:
+            total_size = self._probe_size(url, extra_headers)
+            state_path = final_path + '.tmp.parts'
+            if total_size and (total_size >= self.min_part_size * 2 or os.path.exists(state_path)) \
+                    and self.parts > 1:
+                nbytes = self._download_parts(url, final_path, desc, total_size, extra_headers)
+            else:
+                nbytes = self._download_single(url, final_path, desc, extra_headers)
+        except requests.exceptions.HTTPError as http_err:
+            self.logger.error(f"HTTP错误导致 {desc} 下载失败: {http_err}. 请检查Cookie是否已过期或不正确。")
+            return None, 0
+        except Exception as e:
+            self.logger.error(f"{desc} 下载过程中发生错误: {e}")
+            return None, 0
+
+        elapsed = time.time() - start
+        speed = nbytes / 1024 / 1024 / elapsed if elapsed > 0 else 0.0
+        # loguru 有 success 级别，标准 logging 没有
+        log_success = getattr(self.logger, 'success', self.logger.info)
+        log_success(f"{desc}: 文件下载完成 -> {os.path.basename(final_path)} "
+                    f"({nbytes / 1024 / 1024:.1f} MB, {speed:.1f} MB/s)")
+        return final_path, nbytes
+
+    def _probe_size(self, url: str, extra_headers: Optional[Dict[str, str]] = None) -> Optional[int]:
+        """用 Range: bytes=0-0 探测总大小；服务器不支持 Range 时返回 None"""
+        headers = self._headers(extra_headers)
+        headers['Range'] = 'bytes=0-0'
+        with self.session.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT[0]) as r:
+            if r.status_code != 206:
+                if r.status_code != 200:
+                    r.raise_for_status()
+                return None
+            content_range = r.headers.get('Content-Range', '')
+            if '/' not in content_range or content_range.endswith('/*'):
+                return None
+            return int(content_range.split('/')[-1])
+
+    def _download_single(self, url: str, final_path: str, desc: str,
+                         extra_headers: Optional[Dict[str, str]] = None) -> int:
+        """单连接下载，.tmp 追加写续传"""
+        temp_file_path = final_path + ".tmp"
+        downloaded_size = os.path.getsize(temp_file_path) if os.path.exists(temp_file_path) else 0
+
+        headers = self._headers(extra_headers)
+        if downloaded_size > 0:
+            headers['Range'] = f'bytes={downloaded_size}-'
+            self.logger.info(f"发现未完成的 {desc} 文件，从 {downloaded_size / 1024 / 1024:.2f} MB 处继续下载。")
+
+        nbytes = 0
+        with self.session.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as r:
+            # B站有时对Range请求返回200而不是206
+            if r.status_code not in [200, 206]:
+                r.raise_for_status()
+            if downloaded_size > 0 and r.status_code == 200:
+                # 服务器忽略了 Range，只能从头下载
+                downloaded_size = 0
+                open(temp_file_path, 'wb').close()
+
+            total_size_str = r.headers.get('Content-Range', r.headers.get('content-length'))
+            if total_size_str:
+                if '/' in total_size_str:
+                    total_size = int(total_size_str.split('/')[-1])
+                else:
+                    total_size = downloaded_size + int(total_size_str)
+            else:
+                total_size = downloaded_size
+
+            with tqdm(total=total_size, initial=downloaded_size, desc=desc, unit='B', unit_scale=True,
+                      unit_divisor=1024, leave=False) as pbar:
+                with open(temp_file_path, 'ab') as f:
+                    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                        if chunk:
+                            if self.limiter is not None:
+                                self.limiter.throttle(len(chunk))
+                            f.write(chunk)
+                            nbytes += len(chunk)
+                            pbar.update(len(chunk))
+
+        os.replace(temp_file_path, final_path)
+        return nbytes
+
+    # ---------- 分段下载 ----------
+
+    def _plan_parts(self, temp_file_path: str, state_path: str, total_size: int) -> List[List[int]]:
+        """返回每段 [起始, 结束(含), 已完成字节数]，优先沿用上次的分段进度"""
+        if os.path.exists(state_path) and os.path.exists(temp_file_path):
+            try:
+                with open(state_path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                if state.get('size') == total_size:
+                    return [list(part) for part in state['parts']]
+            except (OSError, ValueError, KeyError):
+                pass
+            self.logger.warning("分段进度文件无效或文件大小已变化，重新下载。")
+            prefix = 0
+        else:
+            # 旧版单连接留下的 .tmp 是一段有效前缀
+            prefix = os.path.getsize(temp_file_path) if os.path.exists(temp_file_path) else 0
+            prefix = prefix if prefix < total_size else 0
+
+        remaining = total_size - prefix
+        count = max(1, min(self.parts, remaining // self.min_part_size))
+        step = -(-remaining // count)
+        parts = [[0, prefix - 1, prefix]] if prefix else []
+        for offset in range(prefix, total_size, step):
+            parts.append([offset, min(offset + step, total_size) - 1, 0])
+        return parts
+
+    def _download_parts(self, url: str, final_path: str, desc: str, total_size: int,
+                        extra_headers: Optional[Dict[str, str]] = None) -> int:
+        temp_file_path = final_path + ".tmp"
+        state_path = temp_file_path + ".parts"
+        parts = self._plan_parts(temp_file_path, state_path, total_size)
+        already = sum(part[2] for part in parts)
+        if already:
+            self.logger.info(f"发现未完成的 {desc} 文件，已完成 {already / 1024 / 1024:.2f} MB，分段继续下载。")
+
+        # 预分配到最终大小，各段直接写到自己的位置；旧的 .tmp 比最终大小还长时（分段进度作废、
+        # 或者旧版留下的前缀不比总大小小）同样截断，否则多出来的尾巴会留在成品里
+        with open(temp_file_path, 'ab') as f:
+            f.truncate(total_size)
+
+        lock = threading.Lock()
+        state = {'size': total_size, 'parts': parts}
+        last_save = [time.time()]
+        downloaded = [0]
+
+        def save_state(force: bool = False):
+            now = time.time()
+            if not force and now - last_save[0] < STATE_SAVE_INTERVAL:
+                return
+            last_save[0] = now
+            tmp_state = state_path + '.new'
+            with open(tmp_state, 'w', encoding='utf-8') as sf:
+                json.dump(state, sf)
+            os.replace(tmp_state, state_path)
+
+        with lock:
+            save_state(force=True)
+
+        pending = [part for part in parts if part[0] + part[2] <= part[1]]
+        self.logger.info(f"{desc}: {total_size / 1024 / 1024:.1f} MB，{len(pending)} 段并行下载")
+
+        with tqdm(total=total_size, initial=already, desc=desc, unit='B', unit_scale=True,
+                  unit_divisor=1024, leave=False) as pbar:
+
+            def fetch_part(part: List[int]):
+                for attempt in range(PART_RETRIES):
+                    start, end, done = part
+                    if start + done > end:
+                        return
+                    headers = self._headers(extra_headers)
+                    headers['Range'] = f'bytes={start + done}-{end}'
+                    try:
+                        with self.session.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as r:
+                            if r.status_code != 206:
+                                r.raise_for_status()
+                                raise requests.exceptions.HTTPError(f"分段请求未返回206 (状态码 {r.status_code})")
+                            with open(temp_file_path, 'r+b') as f:
+                                f.seek(start + done)
+                                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                                    if not chunk:
+                                        continue
+                                    chunk = chunk[:end + 1 - (start + part[2])]
+                                    if self.limiter is not None:
+                                        self.limiter.throttle(len(chunk))
+                                    f.write(chunk)
+                                    pbar.update(len(chunk))
+                                    with lock:
+                                        part[2] += len(chunk)
+                                        downloaded[0] += len(chunk)
+                                        save_state()
+                                    if start + part[2] > end:
+                                        break
+                        if start + part[2] > end:
+                            return
+                        raise IOError("分段数据不完整")
+                    except (requests.exceptions.RequestException, IOError) as e:
+                        self.logger.warning(f"{desc} 分段 {start}-{end} 第 {attempt + 1}/{PART_RETRIES} 次失败: {e}")
+                        if attempt == PART_RETRIES - 1:
+                            raise
+                        time.sleep(2 * (attempt + 1))
+
+            try:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=len(pending) or 1,
+                                                           thread_name_prefix=f'{desc}-part') as executor:
+                    for future in [executor.submit(fetch_part, part) for part in pending]:
+                        future.result()
+            finally:
+                with lock:
+                    save_state(force=True)
+
+        os.remove(state_path)
+        os.replace(temp_file_path, final_path)
+        return downloaded[0]
+
+    # ---------- 音视频合并 ----------
+
+    def merge(self, ffmpeg_path: str, video_input: str, audio_input: str, output_path: str,
+              video_codecs: Optional[str] = None, audio_codecs: Optional[str] = None,
+              input_args: Sequence[str] = ()) -> bool:
+        """
+        合并音视频：编码 MP4 能直接容纳时 -c copy（不重新编码），否则或失败时退回音频转 AAC
+
+        输入可以是本地文件，也可以是 URL（配合 input_args 里的请求头，边下边合并）。
+        先写到 output_path + '.part'，成功后再改名，避免半成品被当成已完成的文件。
+        """
+        attempts = []
+        if can_stream_copy(video_codecs, audio_codecs):
+            attempts.append(('直接复制', ['-c', 'copy']))
+        attempts.append(('音频转AAC', ['-c:v', 'copy', '-c:a', 'aac']))
+
+        temp_output = output_path + '.part'
+        for label, codec_args in attempts:
+            command = [ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
+                       *input_args, '-i', video_input, *input_args, '-i', audio_input,
+                       '-map', '0:v:0', '-map', '1:a:0', *codec_args, '-f', 'mp4', temp_output]
+            start = time.time()
+            try:
+                result = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.PIPE)
+            except OSError as e:
+                self.logger.error(f"FFmpeg启动失败: {e}")
+                return False
+            if result.returncode == 0:
+                os.replace(temp_output, output_path)
+                log_success = getattr(self.logger, 'success', self.logger.info)
+                log_success(f"合并成功 ({label}, {time.time() - start:.1f}s): {os.path.basename(output_path)}")
+                return True
+            error_tail = result.stderr.decode('utf-8', errors='ignore').strip().splitlines()[-3:]
+            self.logger.warning(f"FFmpeg合并失败 ({label}): {' | '.join(error_tail)}")
+            if os.path.exists(temp_output):
+                os.remove(temp_output)
+        return False
+
+    def download_and_merge(self, ffmpeg_path: str, video_url: str, audio_url: str, output_path: str,
+                           video_codecs: Optional[str] = None, audio_codecs: Optional[str] = None,
+                           headers: Optional[Dict[str, str]] = None) -> bool:
+        """边下边合并：ffmpeg 直接读两路 HTTP 流写进 MP4，最后一个字节到达时成品就绪（不分段、不续传）"""
+        all_headers = self._headers(headers)
+        request_headers = {k: v for k, v in all_headers.items()
+                           if k.lower() not in ('user-agent', 'accept-encoding', 'connection')}
+        input_args = ['-user_agent', all_headers.get('User-Agent', ''),
+                      '-headers', ''.join(f'{k}: {v}\r\n' for k, v in request_headers.items()),
+                      '-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5']
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        self.logger.info(f"边下边合并: {os.path.basename(output_path)}")
+        return self.merge(ffmpeg_path, video_url, audio_url, output_path, video_codecs, audio_codecs, input_args)
+
+
+def can_stream_copy(video_codecs: Optional[str], audio_codecs: Optional[str]) -> bool:
+    """根据 codecs 字符串判断能否直接 -c copy 进 MP4；不知道编码时先按能处理（失败再回退）"""
+    if video_codecs and not video_codecs.lower().startswith(MP4_VIDEO_CODECS):
+        return False
+    if audio_codecs and not audio_codecs.lower().startswith(MP4_AUDIO_CODECS):
+        return False
+    return True
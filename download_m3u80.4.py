@@ -5,22 +5,55 @@ import subprocess
 import time
 import json
 import pymysql
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urlparse
 from datetime import datetime
 import threading
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import sys
 from tqdm import tqdm
 import glob
 import socket
 
+from hls_engine import HLSSegmentEngine, FFmpegRemuxSink, TSAppendSink
+from hls_playlist import get_playlist_fetcher, parse_playlist
+from task_claim import TaskClaimer, CURRENT_TIMESTAMP
+from bandwidth_scheduler import BandwidthClient
+
+# TS片段输出方式：
+#   None     = 每个分片单独保存在 {liveId} 文件夹里（默认，数据库记录文件夹，支持按分片续传）
+#   "remux"  = 按顺序直接写进 ffmpeg 封装成 {liveId}.mp4（不落地单个分片，不能续传）
+#   "append" = 按顺序拼接成一个 {liveId}.ts（不能续传）
+# 后两种会改变写入数据库的文件名/大小，需要下游能处理时再开启
+STREAM_MODE = None
+
+# 主列表（多清晰度）时的选择策略：不低于该高度的清晰度里取最小的一档
+TARGET_MIN_HEIGHT = 1080
+
+# 与本机其他下载器共用 bandwidth_scheduler 守护进程的总限速，数值越大分到的带宽越多
+BANDWIDTH_PRIORITY = 1
+
+# 淘宝回放请求头（m3u8 列表和密钥）
+TAOBAO_HEADERS = {
+    'accept': '*/*',
+    'accept-language': 'zh-CN,zh;q=0.9,en;q=0.8,en-GB;q=0.7,en-US;q=0.6',
+    'referer': 'https://pages-fast.m.taobao.com/wow/z/app/tbpc/tbzb-anchor/index?spm=a21bo.29164217.0.0.3a8cbt02bt02e5&x-ssr=true&id=1714128138',
+    'sec-ch-ua': '"Microsoft Edge";v="141", "Not?A_Brand";v="8", "Chromium";v="141"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"Windows"',
+    'sec-fetch-dest': 'script',
+    'sec-fetch-mode': 'no-cors',
+    'sec-fetch-site': 'same-site',
+    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36 Edg/141.0.0.0',
+    'origin': 'https://pages-fast.m.taobao.com',
+}
+
 
 class M3U8Downloader:
-    def __init__(self, db_config, download_dir="downloads", max_workers=5):
+    def __init__(self, db_config, download_dir="downloads", max_workers=5, stream_mode=STREAM_MODE):
         self.db_config = db_config
         self.download_dir = download_dir
         self.max_workers = max_workers
+        self.stream_mode = stream_mode
 
         # 获取当前电脑名
         self.computer_name = socket.gethostname()
@@ -32,6 +65,25 @@ class M3U8Downloader:
         self.ffmpeg_path = r"C:\ffmpeg-master-latest-win64-gpl\bin\ffmpeg.exe"
         self.ffprobe_path = r"C:\ffmpeg-master-latest-win64-gpl\bin\ffprobe.exe"
 
+        # 分片下载走异步分片引擎，并发从 max_workers 起步，按吞吐最多加到 3 倍
+        self.hls_engine = HLSSegmentEngine(initial_concurrency=max_workers,
+                                           min_concurrency=2,
+                                           max_concurrency=max_workers * 3,
+                                           bandwidth_limiter=BandwidthClient('m3u8', resource='net',
+                                                                             priority=BANDWIDTH_PRIORITY,
+                                                                             logger=self.logger),
+                                           logger=self.logger)
+
+        # 任务领取：状态 0/3 可领取，领取后直接为 2（下载中）并记录电脑名，
+        # 租约覆盖整个下载过程，下载中途宕机的任务租约过期后自动重新可领取；
+        # 旧版本留下的 4（下载队列中）在 ensure_schema 时改回 0
+        self.task_claimer = TaskClaimer(self.get_database_connection, 'taobao_live',
+                                        columns=('liveId', 'replayUrl'), id_column='liveId',
+                                        pending_statuses=(0, 3), claimed_status=2,
+                                        owner_column='computer', owner=self.computer_name,
+                                        claim_values={'update_time': CURRENT_TIMESTAMP},
+                                        order_by='update_time', legacy_statuses=(4,), logger=self.logger)
+
         # 创建下载目录
         os.makedirs(download_dir, exist_ok=True)
 
@@ -83,6 +135,10 @@ class M3U8Downloader:
                     connection.commit()
                     self.log_info("成功添加computer字段到taobao_live表")
 
+            # 租约相关的列和索引
+            self.task_claimer.ensure_schema()
+            # 本机上次没下完的任务租约立即过期，马上重新领取
+            self.task_claimer.expire_own_leases()
             return True
         except Exception as e:
             self.log_error(f"检查更新表结构失败: {e}")
@@ -172,61 +228,19 @@ class M3U8Downloader:
             return None
 
     def get_pending_downloads(self):
-        """获取待下载的视频列表 - 每次获取3个任务"""
-        connection = self.get_database_connection()
-        if not connection:
-            return []
-
+        """领取待下载的视频 - 每次领取3个任务（SKIP LOCKED + 租约，中断的任务租约过期后自动重新领取）"""
         try:
-            with connection.cursor() as cursor:
-                # 先获取当前电脑的未完成任务（状态4）
-                sql = "SELECT liveId, replayUrl FROM taobao_live WHERE status = 4 AND computer = %s LIMIT 3"
-                cursor.execute(sql, (self.computer_name,))
-                current_tasks = cursor.fetchall()
-
-                if current_tasks:
-                    count_msg = f"找到 {len(current_tasks)} 个当前电脑的未完成任务"
-                    self.log_info(count_msg)
-                    return [{"liveId": row[0], "replayUrl": row[1]} for row in current_tasks]
-
-                # 如果没有当前电脑的未完成任务，获取新的任务
-                sql = """
-                SELECT liveId, replayUrl FROM taobao_live 
-                WHERE (status = 0 OR status = 3) 
-                ORDER BY update_time ASC 
-                LIMIT 3
-                """
-                cursor.execute(sql)
-                results = cursor.fetchall()
-
-                if results:
-                    # 更新这些任务的状态为4（下载队列中）并记录电脑名
-                    live_ids = [row[0] for row in results]
-
-                    # 构建IN条件的占位符
-                    placeholders = ','.join(['%s'] * len(live_ids))
-
-                    update_sql = f"""
-                    UPDATE taobao_live 
-                    SET status = 4, computer = %s, update_time = CURRENT_TIMESTAMP 
-                    WHERE liveId IN ({placeholders})
-                    """
-
-                    cursor.execute(update_sql, [self.computer_name] + live_ids)
-                    connection.commit()
+            results = self.task_claimer.claim(3)
+            count_msg = f"获取到 {len(results)} 个新的待下载视频"
+            self.log_info(count_msg)
+            self.save_operation_log("get_pending_downloads", "success", count_msg)
 
-                count_msg = f"获取到 {len(results)} 个新的待下载视频"
-                self.log_info(count_msg)
-                self.save_operation_log("get_pending_downloads", "success", count_msg)
-
-                return [{"liveId": row[0], "replayUrl": row[1]} for row in results]
+            return [{"liveId": row['liveId'], "replayUrl": row['replayUrl']} for row in results]
         except Exception as e:
             error_msg = f"获取待下载列表失败: {e}"
             self.log_error(error_msg)
             self.save_operation_log("get_pending_downloads", "failed", error_msg)
             return []
-        finally:
-            connection.close()
 
     def check_task_status(self, live_id):
         """检查任务状态，确保可以下载"""
@@ -244,8 +258,8 @@ class M3U8Downloader:
                     return False
 
                 status, computer = result
-                # 只有状态为4且电脑名为当前电脑，或者状态为0或3的任务才可以下载
-                return (status == 4 and computer == self.computer_name) or status in [0, 3]
+                # 只有本机领取的（状态为2且电脑名为当前电脑），或者状态为0或3的任务才可以下载
+                return (status == 2 and computer == self.computer_name) or status in [0, 3]
         except Exception as e:
             self.log_error(f"检查任务状态失败 {live_id}: {e}")
             return False
@@ -293,19 +307,7 @@ class M3U8Downloader:
 
     def download_m3u8_file(self, m3u8_url, live_id):
         """下载m3u8文件"""
-        headers = {
-            'accept': '*/*',
-            'accept-language': 'zh-CN,zh;q=0.9,en;q=0.8,en-GB;q=0.7,en-US;q=0.6',
-            'referer': 'https://pages-fast.m.taobao.com/wow/z/app/tbpc/tbzb-anchor/index?spm=a21bo.29164217.0.0.3a8cbt02bt02e5&x-ssr=true&id=1714128138',
-            'sec-ch-ua': '"Microsoft Edge";v="141", "Not?A_Brand";v="8", "Chromium";v="141"',
-            'sec-ch-ua-mobile': '?0',
-            'sec-ch-ua-platform': '"Windows"',
-            'sec-fetch-dest': 'script',
-            'sec-fetch-mode': 'no-cors',
-            'sec-fetch-site': 'same-site',
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36 Edg/141.0.0.0',
-            'origin': 'https://pages-fast.m.taobao.com',
-        }
+        headers = TAOBAO_HEADERS
 
         try:
             self.log_info(f"开始下载M3U8文件: {m3u8_url}")
@@ -329,98 +331,107 @@ class M3U8Downloader:
             self.save_operation_log("download_m3u8", "failed", error_msg, live_id)
             return None, None
 
-    def parse_m3u8_content(self, m3u8_content, base_url):
-        """解析m3u8内容，提取ts片段URL"""
-        ts_urls = []
-        lines = m3u8_content.split('\n')
-
-        for line in lines:
-            line = line.strip()
-            if line and not line.startswith('#') and line.endswith('.ts'):
-                # 构建完整的ts URL
-                if line.startswith('http'):
-                    ts_url = line
-                else:
-                    ts_url = urljoin(base_url, line)
-                ts_urls.append(ts_url)
-
-        self.log_info(f"解析到 {len(ts_urls)} 个ts片段")
-        return ts_urls
-
-    def download_ts_file(self, ts_url, ts_filename, live_id_folder, progress_callback=None, retry_count=3):
-        """下载单个ts文件"""
-        for attempt in range(retry_count):
-            try:
-                response = requests.get(ts_url, timeout=30)
-                response.raise_for_status()
-
-                ts_file_path = os.path.join(live_id_folder, ts_filename)
-                with open(ts_file_path, 'wb') as f:
-                    f.write(response.content)
-
-                if progress_callback:
-                    progress_callback(1)  # 通知进度更新
-
-                self.log_debug(f"下载ts片段成功: {ts_filename}")
-                return True
-            except Exception as e:
-                warning_msg = f"下载ts片段失败 {ts_filename} (尝试 {attempt + 1}/{retry_count}): {e}"
-                self.log_warning(warning_msg)
-                if attempt < retry_count - 1:
-                    time.sleep(2)  # 等待2秒后重试
-
-        error_msg = f"下载ts片段失败，已重试{retry_count}次: {ts_filename}"
-        self.log_error(error_msg)
-        return False
-
-    def download_all_ts_files(self, ts_urls, live_id):
-        """下载所有ts文件（添加tqdm进度显示）"""
+    def parse_m3u8_content(self, m3u8_content, base_url, headers=None):
+        """解析m3u8内容，返回媒体列表（分片带绝对地址、字节范围、密钥）；主列表按清晰度策略选一档"""
+        playlist = get_playlist_fetcher().select_media(parse_playlist(m3u8_content, base_url),
+                                                       headers=headers, min_height=TARGET_MIN_HEIGHT)
+
+        extra = []
+        if playlist.is_encrypted:
+            extra.append("AES-128加密")
+        if playlist.discontinuity_count:
+            extra.append(f"{playlist.discontinuity_count} 处不连续")
+        self.log_info(f"解析到 {len(playlist.segments)} 个ts片段, 时长 {playlist.duration:.1f}s"
+                      + (f" ({', '.join(extra)})" if extra else ""))
+        return playlist
+
+    def download_all_ts_files(self, ts_segments, live_id, transform=None):
+        """下载所有ts文件（异步分片引擎：连接复用、自适应并发、流式写盘、单片重试）"""
         live_id_folder = os.path.join(self.download_dir, live_id)
         os.makedirs(live_id_folder, exist_ok=True)
 
-        downloaded_count = 0
-        failed_count = 0
-        total_count = len(ts_urls)
+        total_count = len(ts_segments)
 
         self.log_info(f"开始下载 {total_count} 个TS片段...")
 
+        # TS文件命名前缀加上liveid
+        tasks = [(segment, os.path.join(live_id_folder, f"{live_id}_{i + 1:05d}.ts"))
+                 for i, segment in enumerate(ts_segments)]
+
         # 创建tqdm进度条
         pbar = tqdm(total=total_count, desc=f"下载TS {live_id}", unit="file")
+        try:
+            stats = self.hls_engine.download(tasks, progress_callback=lambda index, path, ok: pbar.update(1),
+                                             transform=transform)
+        finally:
+            pbar.close()
 
-        def update_progress(increment=1):
-            nonlocal downloaded_count
-            downloaded_count += increment
-            pbar.update(increment)
-
-        # 使用线程池并发下载
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            future_to_ts = {}
-
-            for i, ts_url in enumerate(ts_urls):
-                # TS文件命名前缀加上liveid
-                ts_filename = f"{live_id}_{i + 1:05d}.ts"
-                future = executor.submit(self.download_ts_file, ts_url, ts_filename, live_id_folder, update_progress)
-                future_to_ts[future] = (ts_url, ts_filename)
-
-            # 处理下载结果
-            for future in as_completed(future_to_ts):
-                ts_url, ts_filename = future_to_ts[future]
-                try:
-                    if not future.result():
-                        failed_count += 1
-                except Exception as e:
-                    self.log_error(f"下载ts片段异常 {ts_filename}: {e}")
-                    failed_count += 1
-
-        pbar.close()
+        downloaded_count = stats['done'] + stats['skipped']
+        failed_count = len(stats['failed'])
+        speed = stats['bytes'] / 1024 / 1024 / stats['seconds'] if stats['seconds'] > 0 else 0
 
         # 最终结果
-        result_msg = f"TS下载完成: {downloaded_count}/{total_count}, 失败: {failed_count}"
+        result_msg = (f"TS下载完成: {downloaded_count}/{total_count}, 失败: {failed_count}, "
+                      f"{speed:.1f}MB/s, 并发 {stats['concurrency']}")
         self.log_info(result_msg)
         self.save_operation_log("download_ts_files", "success", result_msg, live_id)
 
         return downloaded_count, failed_count, live_id_folder
 
+    def download_ts_stream(self, ts_segments, live_id, max_failed_ratio=0.1, transform=None):
+        """按顺序流式下载ts片段，直接写成一个文件（remux=MP4，append=TS），不保留单个分片
+
+        返回 (downloaded_count, failed_count, output_path, filesize)，失败率过高或封装失败时 output_path 为 None
+        """
+        ext = "mp4" if self.stream_mode == "remux" else "ts"
+        output_path = os.path.join(self.download_dir, f"{live_id}.{ext}")
+        total_count = len(ts_segments)
+
+        self.log_info(f"开始流式下载 {total_count} 个TS片段 -> {output_path}")
+        if self.stream_mode == "remux":
+            sink = FFmpegRemuxSink(output_path, self.ffmpeg_path)
+        else:
+            sink = TSAppendSink(output_path)
+
+        pbar = tqdm(total=total_count, desc=f"下载TS {live_id}", unit="file")
+        try:
+            stats = self.hls_engine.download_to_sink(ts_segments, sink,
+                                                     progress_callback=lambda index, path, ok: pbar.update(1),
+                                                     transform=transform)
+        except Exception as e:
+            sink.abort()
+            error_msg = f"流式下载TS片段异常 {live_id}: {e}"
+            self.log_error(error_msg)
+            self.save_operation_log("download_ts_stream", "failed", error_msg, live_id)
+            return 0, total_count, None, 0
+        finally:
+            pbar.close()
+
+        downloaded_count = stats['done']
+        failed_count = len(stats['failed'])
+        if failed_count > total_count * max_failed_ratio:
+            sink.abort()
+            error_msg = f"ts片段下载失败率过高: {live_id}, 失败 {failed_count}/{total_count}"
+            self.log_error(error_msg)
+            self.save_operation_log("download_ts_stream", "failed", error_msg, live_id)
+            return downloaded_count, failed_count, None, 0
+
+        try:
+            filesize = sink.close()
+        except Exception as e:
+            error_msg = f"写入输出文件失败 {live_id}: {e}"
+            self.log_error(error_msg)
+            self.save_operation_log("download_ts_stream", "failed", error_msg, live_id)
+            return downloaded_count, failed_count, None, 0
+
+        speed = stats['bytes'] / 1024 / 1024 / stats['seconds'] if stats['seconds'] > 0 else 0
+        result_msg = (f"TS流式下载完成: {downloaded_count}/{total_count}, 失败: {failed_count}, "
+                      f"{speed:.1f}MB/s, 输出 {output_path} ({filesize} 字节)")
+        self.log_info(result_msg)
+        self.save_operation_log("download_ts_stream", "success", result_msg, live_id)
+
+        return downloaded_count, failed_count, output_path, filesize
+
     def calculate_folder_size(self, folder_path):
         """计算文件夹总大小"""
         total_size = 0
@@ -448,10 +459,7 @@ class M3U8Downloader:
                 self.log_warning(f"任务状态检查失败，跳过下载: {live_id}")
                 return False
 
-            # 更新状态为下载中
-            if not self.update_video_status(live_id, 2):  # 2=下载中
-                self.log_error(f"无法更新视频状态为下载中: {live_id}")
-                return False
+            # 领取时已经是 2=下载中（带租约），这里不再单独更新状态
 
             # 1. 下载m3u8文件
             self.log_info(f"步骤1/5: 下载M3U8文件...")
@@ -460,40 +468,54 @@ class M3U8Downloader:
                 self.update_video_status(live_id, 3)  # 3=下载失败
                 return False
 
-            # 2. 解析m3u8内容，获取ts片段URL
+            # 2. 解析m3u8内容，获取ts片段（主列表先选清晰度，加密分片准备好解密）
             self.log_info(f"步骤2/5: 解析M3U8内容...")
             base_url = replay_url.rsplit('/', 1)[0] + '/'  # 获取基础URL
-            ts_urls = self.parse_m3u8_content(m3u8_content, base_url)
+            playlist = self.parse_m3u8_content(m3u8_content, base_url, headers=TAOBAO_HEADERS)
+            ts_segments = playlist.segments
+            transform = get_playlist_fetcher().segment_transform(playlist, headers=TAOBAO_HEADERS)
 
-            if not ts_urls:
+            if not ts_segments:
                 self.log_error(f"未找到ts片段: {live_id}")
                 self.update_video_status(live_id, 3)
                 return False
 
-            # 3. 下载所有ts片段
-            self.log_info(f"步骤3/5: 下载TS片段...")
-            downloaded_count, failed_count, live_id_folder = self.download_all_ts_files(ts_urls, live_id)
-
-            if failed_count > len(ts_urls) * 0.1:  # 如果失败率超过10%，认为下载失败
-                error_msg = f"ts片段下载失败率过高: {live_id}"
-                self.log_error(error_msg)
-                self.update_video_status(live_id, 3)
-                return False
+            if self.stream_mode:
+                # 3. 流式下载ts片段，直接写成一个文件
+                self.log_info(f"步骤3/4: 流式下载TS片段...")
+                downloaded_count, failed_count, output_path, total_filesize = self.download_ts_stream(
+                    ts_segments, live_id, transform=transform)
+                if not output_path:
+                    self.update_video_status(live_id, 3)
+                    return False
+                live_id_folder = None
+                filename = os.path.basename(output_path)  # filename写入输出文件名
+            else:
+                # 3. 下载所有ts片段
+                self.log_info(f"步骤3/5: 下载TS片段...")
+                downloaded_count, failed_count, live_id_folder = self.download_all_ts_files(ts_segments, live_id, transform)
+
+                if failed_count > len(ts_segments) * 0.1:  # 如果失败率超过10%，认为下载失败
+                    error_msg = f"ts片段下载失败率过高: {live_id}"
+                    self.log_error(error_msg)
+                    self.update_video_status(live_id, 3)
+                    return False
 
-            # 4. 计算整个文件夹的大小
-            self.log_info(f"步骤4/5: 计算文件夹大小...")
-            total_filesize = self.calculate_folder_size(live_id_folder)
+                # 4. 计算整个文件夹的大小
+                self.log_info(f"步骤4/5: 计算文件夹大小...")
+                total_filesize = self.calculate_folder_size(live_id_folder)
+                filename = live_id  # filename写入liveid
 
             # 5. 更新数据库状态
-            self.log_info(f"步骤5/5: 更新数据库状态...")
+            self.log_info(f"更新数据库状态...")
             self.update_video_status(
                 live_id,
                 1,  # 1=下载成功
-                filename=live_id,  # filename写入liveid
-                filesize=total_filesize  # filesize写入整个文件夹的大小
+                filename=filename,
+                filesize=total_filesize  # 流式模式为输出文件大小，旧模式为整个文件夹的大小
             )
 
-            success_msg = f"视频TS片段下载完成: {live_id}, 总大小: {total_filesize} 字节, TS文件数: {downloaded_count}"
+            success_msg = f"视频TS片段下载完成: {live_id}, 总大小: {total_filesize} 字节, TS片段数: {downloaded_count}"
             self.log_info(success_msg)
             self.save_operation_log("video_processing", "success", success_msg, live_id)
 
@@ -517,7 +539,7 @@ class M3U8Downloader:
                 os.remove(m3u8_file_path)
                 self.log_info(f"已删除M3U8文件: {m3u8_file_path}")
 
-            cleanup_msg = f"已清理临时文件，保留TS片段"
+            cleanup_msg = f"已清理临时文件，保留TS片段" if live_id_folder else f"已清理临时文件"
             self.log_info(cleanup_msg)
             self.save_operation_log("cleanup_files", "success", cleanup_msg, live_id)
 
@@ -0,0 +1,219 @@
+# _*_ coding: utf-8 _*_
+"""
+FFmpeg 进度通道 - 各批处理脚本共用
+
+以前每个脚本都从 stderr 按行读统计信息，每行跑最多五个正则，循环里再 sleep 0.5~1 秒，
+卡死要等下一次 sleep 醒来才能发现，整个 stderr 还要经过文本解码。这里改为：
+- 命令里加 -progress pipe:1 -nostats，ffmpeg 把进度按 key=value 逐行写到 stdout，
+  以 progress=continue / progress=end 结束一组，按 '=' 切分即可，不用正则；
+- stdout、stderr 各由一个后台线程阻塞读取，读到一组进度就放进队列，调用方线程从队列取，
+  回调在调用方线程里执行（回调里抛异常会终止 ffmpeg 并向上抛出）；
+- stderr 只保留最后 STDERR_TAIL_LINES 行原始字节，出错时才解码用于错误信息；
+- 超过 stall_timeout 秒没有任何进度时终止 ffmpeg 并抛出 FFmpegStalledError。
+
+进度字典的键和以前 parse_progress 的结果一致：
+    time(秒) / frame / fps / speed / size(kB)，另有 bitrate(kbit/s) 和 end(是否为最后一组)
+
+使用方式：
+    runner = run_ffmpeg(cmd, on_progress=lambda info: ..., stall_timeout=300)
+    if runner.returncode != 0:
+        raise Exception(f"ffmpeg处理失败 (代码 {runner.returncode}): {runner.error_text()}")
+"""
+
+import time
+import queue
+import logging
+import threading
+import subprocess
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# ==================== 配置 ====================
+PROGRESS_ARGS = ['-progress', 'pipe:1', '-nostats']
+# stderr 保留的最后行数（只用于错误信息）
+STDERR_TAIL_LINES = 50
+# 等待进度的轮询间隔（秒），只影响卡死检测的精度，不影响进度延迟
+POLL_INTERVAL = 0.5
+# 终止 ffmpeg 后等待退出的时间（秒），超时强制结束
+TERMINATE_TIMEOUT = 5
+
+
+class FFmpegStalledError(Exception):
+    """ffmpeg 长时间没有任何进度"""
+
+
+def with_progress_args(cmd: List[str]) -> List[str]:
+    """在 ffmpeg 可执行文件之后插入 -progress pipe:1 -nostats（已有 -progress 时不重复添加）"""
+    if '-progress' in cmd:
+        return list(cmd)
+    return [cmd[0], *PROGRESS_ARGS, *cmd[1:]]
+
+
+def parse_progress_block(fields: Dict[str, str]) -> Dict[str, Any]:
+    """把一组 key=value 转成进度字典，N/A 和无法解析的值直接跳过"""
+    info: Dict[str, Any] = {'end': fields.get('progress') == 'end'}
+    value = fields.get('out_time_us') or fields.get('out_time_ms')
+    if value and value != 'N/A':
+        try:
+            info['time'] = max(0.0, int(value) / 1000000)
+        except ValueError:
+            pass
+    for key, convert in (('frame', int), ('fps', float)):
+        value = fields.get(key)
+        if value and value != 'N/A':
+            try:
+                info[key] = convert(value)
+            except ValueError:
+                pass
+    value = fields.get('speed', '').strip()
+    if value.endswith('x'):
+        try:
+            info['speed'] = float(value[:-1])
+        except ValueError:
+            pass
+    value = fields.get('total_size')
+    if value and value != 'N/A':
+        try:
+            info['size'] = int(value) // 1024
+        except ValueError:
+            pass
+    value = fields.get('bitrate', '').strip()
+    if value.endswith('kbits/s'):
+        try:
+            info['bitrate'] = float(value[:-len('kbits/s')])
+        except ValueError:
+            pass
+    return info
+
+
+class FFmpegProgressProcess:
+    """带进度通道的 ffmpeg 进程"""
+
+    def __init__(self, cmd: List[str], stderr_lines: int = STDERR_TAIL_LINES, **popen_kwargs):
+        self.cmd = with_progress_args(cmd)
+        self.popen_kwargs = popen_kwargs
+        self.process: Optional[subprocess.Popen] = None
+        self._events: queue.Queue = queue.Queue()
+        self._stderr_tail: deque = deque(maxlen=stderr_lines)
+        self._readers: List[threading.Thread] = []
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self.process.returncode if self.process else None
+
+    def start(self) -> subprocess.Popen:
+        self.process = subprocess.Popen(self.cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, **self.popen_kwargs)
+        for target in (self._read_progress, self._read_stderr):
+            reader = threading.Thread(target=target, name='ffmpeg-progress', daemon=True)
+            reader.start()
+            self._readers.append(reader)
+        return self.process
+
+    def _read_progress(self):
+        fields: Dict[str, str] = {}
+        try:
+            for raw in iter(self.process.stdout.readline, b''):
+                key, sep, value = raw.strip().partition(b'=')
+                if not sep:
+                    continue
+                fields[key.decode('ascii', errors='ignore')] = value.decode('utf-8', errors='ignore')
+                if key == b'progress':
+                    self._events.put(parse_progress_block(fields))
+                    fields = {}
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._events.put(None)
+
+    def _read_stderr(self):
+        try:
+            for raw in iter(self.process.stderr.readline, b''):
+                self._stderr_tail.append(raw)
+        except (OSError, ValueError):
+            pass
+
+    def events(self, poll_interval: float = POLL_INTERVAL) -> Iterator[Optional[Dict[str, Any]]]:
+        """依次产出进度字典；poll_interval 内没有新进度时产出 None（方便调用方做超时检查），进度通道关闭后结束"""
+        while True:
+            try:
+                info = self._events.get(timeout=poll_interval)
+            except queue.Empty:
+                yield None
+                continue
+            if info is None:
+                return
+            yield info
+
+    def wait(self) -> int:
+        """等待 ffmpeg 结束和读取线程退出，并关闭管道"""
+        returncode = self.process.wait()
+        for reader in self._readers:
+            reader.join(timeout=TERMINATE_TIMEOUT)
+        for pipe in (self.process.stdout, self.process.stderr):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        return returncode
+
+    def terminate(self):
+        """终止 ffmpeg，超时后强制结束"""
+        if self.process is None or self.process.poll() is not None:
+            return
+        try:
+            self.process.terminate()
+            self.process.wait(timeout=TERMINATE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        except OSError:
+            pass
+
+    def error_lines(self, max_lines: int = 10) -> List[str]:
+        lines = []
+        for raw in self._stderr_tail:
+            line = raw.decode('utf-8', errors='ignore').strip()
+            if line and not line.startswith('Last message repeated'):
+                lines.append(line)
+        return lines[-max_lines:]
+
+    def error_text(self, max_lines: int = 10) -> str:
+        return '\n'.join(self.error_lines(max_lines)) or '无具体错误信息'
+
+
+def run_ffmpeg(cmd: List[str],
+               on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+               stall_timeout: Optional[float] = None,
+               on_start: Optional[Callable[[subprocess.Popen], None]] = None,
+               poll_interval: float = POLL_INTERVAL,
+               stderr_lines: int = STDERR_TAIL_LINES,
+               logger=None,
+               **popen_kwargs) -> FFmpegProgressProcess:
+    """运行 ffmpeg 直到结束，每组进度调用一次 on_progress
+
+    返回已结束的 FFmpegProgressProcess，由调用方检查 returncode；
+    on_progress 抛出异常或超过 stall_timeout 秒没有进度时终止 ffmpeg 并向上抛出。
+    """
+    logger = logger or logging.getLogger('ffmpeg_progress')
+    runner = FFmpegProgressProcess(cmd, stderr_lines=stderr_lines, **popen_kwargs)
+    process = runner.start()
+    try:
+        if on_start:
+            on_start(process)
+        last_event_time = time.time()
+        for info in runner.events(poll_interval):
+            if info is None:
+                if stall_timeout and time.time() - last_event_time > stall_timeout:
+                    raise FFmpegStalledError(f"处理超时，{stall_timeout}秒内无任何进度更新")
+                continue
+            last_event_time = time.time()
+            if on_progress:
+                on_progress(info)
+    except BaseException:
+        logger.debug(f"终止 ffmpeg 进程: {process.pid}")
+        runner.terminate()
+        runner.wait()
+        raise
+    runner.wait()
+    return runner
@@ -0,0 +1,148 @@
+# _*_ coding: utf-8 _*_
+"""
+并行大块 MD5 计算 + 持久哈希缓存
+
+以前按 4096 字节一块读文件，几 GB 的视频在 SMB 上要上百万次系统调用；而且每次运行
+都把同一批文件重新算一遍。这里改为：
+- 大块读取（默认 8MB，复用同一块缓冲区 readinto，不反复分配内存），本地磁盘可选 mmap；
+- 固定大小的 I/O 线程池，同时在途的任务数有上限，输入可以是生成器；
+- 结果以 (路径, 大小, 修改时间) 为键存入元数据缓存（见 video_meta_cache.py），
+  文件没变就不再重新计算；
+- 统计每个工作线程的吞吐（MB/s），方便判断瓶颈在网络还是磁盘。
+
+使用方式：
+    hasher = ParallelHasher(workers=8)
+    for path, md5 in hasher.hash_many(video_files):
+        ...
+    hasher.log_stats()
+"""
+
+import os
+import mmap
+import time
+import hashlib
+import logging
+import threading
+import concurrent.futures
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from video_meta_cache import get_meta_cache
+
+# ==================== 配置 ====================
+# 每次读取的块大小（SMB 上 4~16MB 效果最好）
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+# 本地磁盘可以开启 mmap（网络盘上 mmap 缺页读取反而更慢，默认关闭）
+USE_MMAP = False
+DEFAULT_WORKERS = 8
+
+# 缓存命名空间
+CACHE_KIND = 'file_md5'
+
+
+def md5_file(filepath: str, block_size: int = HASH_BLOCK_SIZE, use_mmap: bool = USE_MMAP) -> Tuple[str, int]:
+    """计算文件 MD5，返回 (md5, 读取字节数)；读取失败抛 OSError"""
+    hasher = hashlib.md5()
+    with open(filepath, 'rb') as f:
+        if use_mmap:
+            try:
+                size = os.fstat(f.fileno()).st_size
+                if size > 0:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        for offset in range(0, size, block_size):
+                            hasher.update(mapped[offset:offset + block_size])
+                    return hasher.hexdigest(), size
+            except (ValueError, OSError) as e:
+                # 文件系统不支持 mmap，退回普通读取
+                logging.debug(f"mmap不可用，改用普通读取: {os.path.basename(filepath)} - {e}")
+                f.seek(0)
+                hasher = hashlib.md5()
+
+        buffer = bytearray(block_size)
+        view = memoryview(buffer)
+        total = 0
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            hasher.update(view[:n])
+            total += n
+    return hasher.hexdigest(), total
+
+
+class ParallelHasher:
+    """I/O 线程池 + 哈希缓存"""
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, block_size: int = HASH_BLOCK_SIZE,
+                 use_mmap: bool = USE_MMAP):
+        self.workers = max(1, workers)
+        self.block_size = block_size
+        self.use_mmap = use_mmap
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix='hash')
+        self._stats_lock = threading.Lock()
+        # 线程名 -> [文件数, 字节数, 耗时]
+        self.worker_stats: Dict[str, list] = {}
+        self.cache_hits = 0
+
+    def _hash_uncached(self, filepath: str) -> Optional[str]:
+        start = time.time()
+        try:
+            md5, nbytes = md5_file(filepath, self.block_size, self.use_mmap)
+        except OSError as e:
+            logging.error(f"Error reading file {filepath}: {e}")
+            return None
+        elapsed = time.time() - start
+        with self._stats_lock:
+            stats = self.worker_stats.setdefault(threading.current_thread().name, [0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += nbytes
+            stats[2] += elapsed
+        return md5
+
+    def hash_file(self, filepath: str) -> Optional[str]:
+        """计算单个文件（在调用线程中执行），命中缓存时不读文件"""
+        computed = []
+
+        def compute():
+            computed.append(True)
+            return self._hash_uncached(filepath)
+
+        md5 = get_meta_cache().get_or_probe(CACHE_KIND, filepath, compute, bool)
+        if not computed:
+            with self._stats_lock:
+                self.cache_hits += 1
+        return md5
+
+    def hash_many(self, filepaths: Iterable[str]) -> Iterator[Tuple[str, Optional[str]]]:
+        """批量计算，按完成顺序产出 (路径, md5)，同时在途的任务数限制为线程数的 4 倍"""
+        max_in_flight = self.workers * 4
+        pending = {}
+        for filepath in filepaths:
+            pending[self._executor.submit(self.hash_file, filepath)] = filepath
+            if len(pending) >= max_in_flight:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+        for future in concurrent.futures.as_completed(list(pending)):
+            yield pending.pop(future), future.result()
+
+    def log_stats(self, logger: Optional[logging.Logger] = None):
+        """输出每个工作线程的吞吐"""
+        log = (logger or logging).info
+        total_bytes = sum(s[1] for s in self.worker_stats.values())
+        total_files = sum(s[0] for s in self.worker_stats.values())
+        log(f"#️⃣ MD5统计: 计算 {total_files} 个文件 ({total_bytes / 1024 ** 3:.2f}GB), "
+            f"缓存命中 {self.cache_hits} 个")
+        for name in sorted(self.worker_stats):
+            files, nbytes, elapsed = self.worker_stats[name]
+            speed = nbytes / 1024 ** 2 / elapsed if elapsed > 0 else 0.0
+            log(f"   [{name}] {files} 个文件, {nbytes / 1024 ** 2:.0f}MB, {speed:.1f} MB/s")
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,187 @@
+# _*_ coding: utf-8 _*_
+"""
+增量目录索引 - 代替每次启动都完整 os.walk / glob 整棵目录树
+
+把扫描结果（文件的 路径、大小、修改时间、inode，以及每个目录的修改时间）存进本地 SQLite。
+下次扫描时先 stat 目录：目录修改时间没变，说明里面没有增删改名，直接从索引里取文件列表，
+不再 listdir；只有修改时间变化的目录才重新列举。500TB 的 NAS 上，重扫从几十分钟降到
+每个目录一次 stat。
+
+注意：文件被原地覆盖写入（不改名）不会改变目录修改时间，索引里的 大小/修改时间 可能是旧的，
+需要准确大小时请调用方自己 os.stat。
+
+扫描结果以生成器形式产出，调用方可以边扫描边处理：
+    for video_path in iter_video_files(INPUT_DIR, SUPPORTED_VIDEO_FORMATS):
+        ...
+"""
+
+import os
+import time
+import sqlite3
+import logging
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# ==================== 配置 ====================
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.video_deal')
+FILE_INDEX_DB = os.path.join(CACHE_DIR, 'file_index.db')
+# 目录修改时间的精度（秒）。FAT/exFAT/SMB 只有 1~2 秒，列举时目录修改时间离现在不到这么久的，
+# 同一个时间单位里可能还会有文件加进来而修改时间不变，这种目录不记修改时间，下次重新列举
+MTIME_GRANULARITY = 2.0
+
+
+def _normalize_extensions(extensions: Optional[Iterable[str]]) -> Optional[Tuple[str, ...]]:
+    """统一成小写、带点的扩展名元组，None 表示不过滤"""
+    if extensions is None:
+        return None
+    if isinstance(extensions, str):
+        extensions = [extensions]
+    return tuple(ext.lower() if ext.startswith('.') else f'.{ext.lower()}' for ext in extensions)
+
+
+class FileIndex:
+    """基于 SQLite 的持久目录索引"""
+
+    def __init__(self, db_path: str = FILE_INDEX_DB):
+        self.db_path = db_path
+        self.dirs_listed = 0    # 重新列举的目录数
+        self.dirs_reused = 0    # 直接使用索引的目录数
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                parent TEXT,
+                mtime REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_dirs_parent ON dirs(parent);
+            CREATE TABLE IF NOT EXISTS files (
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                inode INTEGER,
+                PRIMARY KEY (dir, name)
+            );
+        ''')
+        return conn
+
+    def _forget_tree(self, conn: sqlite3.Connection, directory: str):
+        """目录被删除/改名后，清掉它和所有子目录的记录"""
+        prefix = directory.rstrip(os.sep) + os.sep
+        conn.execute('DELETE FROM files WHERE dir = ? OR substr(dir, 1, ?) = ?',
+                     (directory, len(prefix), prefix))
+        conn.execute('DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?',
+                     (directory, len(prefix), prefix))
+
+    def _list_directory(self, conn: sqlite3.Connection, directory: str,
+                        dir_mtime: float) -> Tuple[List[str], List[str]]:
+        """真正列举目录，并把结果写回索引"""
+        file_rows = []
+        subdirs = []
+        listed_at = time.time()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        file_rows.append((directory, entry.name, stat.st_size, stat.st_mtime, entry.inode()))
+                except OSError as e:
+                    logging.debug(f"读取目录项失败: {entry.path} - {e}")
+
+        known_subdirs = {row[0] for row in conn.execute('SELECT path FROM dirs WHERE parent = ?', (directory,))}
+        for removed in known_subdirs - set(subdirs):
+            self._forget_tree(conn, removed)
+        conn.execute('DELETE FROM files WHERE dir = ?', (directory,))
+        conn.executemany('INSERT INTO files (dir, name, size, mtime, inode) VALUES (?, ?, ?, ?, ?)', file_rows)
+        if listed_at - dir_mtime < MTIME_GRANULARITY:
+            # 修改时间太新（或者和本机时钟对不上），不能据此判断之后没有变化
+            dir_mtime = -1
+        conn.execute('INSERT OR REPLACE INTO dirs (path, parent, mtime) VALUES (?, ?, ?)',
+                     (directory, os.path.dirname(directory), dir_mtime))
+        # 子目录先占位（mtime=-1 保证下次一定会列举），这样父目录不变时也能找到它们
+        conn.executemany('INSERT OR IGNORE INTO dirs (path, parent, mtime) VALUES (?, ?, -1)',
+                         [(sub, directory) for sub in subdirs])
+        conn.commit()
+        self.dirs_listed += 1
+        return [row[1] for row in file_rows], subdirs
+
+    def scan(self, root: str, extensions: Optional[Iterable[str]] = None,
+             recursive: bool = True) -> Iterator[str]:
+        """
+        增量扫描目录，边扫描边产出匹配的文件路径
+
+        Args:
+            root: 根目录
+            extensions: 扩展名过滤（大小写不敏感，带不带点都行），None 表示全部文件
+            recursive: 是否递归子目录
+        """
+        exts = _normalize_extensions(extensions)
+        root = os.path.abspath(root)
+        conn = self._connect()
+        try:
+            stack = [root]
+            while stack:
+                directory = stack.pop()
+                try:
+                    dir_mtime = os.stat(directory).st_mtime
+                except OSError:
+                    self._forget_tree(conn, directory)
+                    conn.commit()
+                    continue
+
+                row = conn.execute('SELECT mtime FROM dirs WHERE path = ?', (directory,)).fetchone()
+                if row and row[0] == dir_mtime:
+                    names = [r[0] for r in conn.execute('SELECT name FROM files WHERE dir = ?', (directory,))]
+                    subdirs = [r[0] for r in conn.execute('SELECT path FROM dirs WHERE parent = ?', (directory,))]
+                    self.dirs_reused += 1
+                else:
+                    try:
+                        names, subdirs = self._list_directory(conn, directory, dir_mtime)
+                    except OSError as e:
+                        logging.warning(f"无法列举目录: {directory} - {e}")
+                        continue
+
+                for name in sorted(names):
+                    if exts is None or name.lower().endswith(exts):
+                        yield os.path.join(directory, name)
+
+                if recursive:
+                    stack.extend(sorted(subdirs, reverse=True))
+        finally:
+            conn.close()
+
+    def get_entry(self, file_path: str) -> Optional[Tuple[int, float, Optional[int]]]:
+        """查询索引中记录的 (大小, 修改时间, inode)，没有记录返回 None"""
+        file_path = os.path.abspath(file_path)
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT size, mtime, inode FROM files WHERE dir = ? AND name = ?',
+                                (os.path.dirname(file_path), os.path.basename(file_path))).fetchone()
+        finally:
+            conn.close()
+
+    def log_stats(self):
+        logging.info(f"📂 目录索引: 重新列举 {self.dirs_listed} 个目录, 直接复用 {self.dirs_reused} 个目录")
+
+
+_file_index: Optional[FileIndex] = None
+
+
+def get_file_index() -> FileIndex:
+    """获取全局索引实例"""
+    global _file_index
+    if _file_index is None:
+        _file_index = FileIndex()
+    return _file_index
+
+
+def iter_video_files(root: str, extensions: Optional[Iterable[str]] = None,
+                     recursive: bool = True) -> Iterator[str]:
+    """用全局索引增量扫描目录（生成器）"""
+    return get_file_index().scan(root, extensions, recursive)
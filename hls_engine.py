@@ -0,0 +1,629 @@
+# _*_ coding: utf-8 _*_
+"""
+HLS 分片下载引擎 - 淘宝回放 / Artlist 等 m3u8 下载脚本共用
+
+以前每个 ts 分片都 requests.get 一次：每片都要重新建 TCP/TLS 连接，整片读进内存再写盘，
+线程数固定。2 小时的回放有几千个分片，建连接的时间比下载本身还长。这里改为：
+- asyncio + aiohttp，同一主机的连接保持复用（keep-alive），DNS 结果缓存；
+- 自适应并发：按时间窗口统计吞吐，吞吐还在涨就加并发，下降或出错就减并发；
+- 边收边写盘（先写 .part，完成后改名），内存里只有一个块；已存在的分片直接跳过（断点续传）；
+- 每个分片独立重试，指数退避加随机抖动。
+
+还可以按顺序流式输出（download_to_sink）：分片下载到内存，乱序到达的先放在一个小的重排
+缓冲区里，按序号依次写进同一个 ffmpeg 进程（-f mpegts -i pipe:0 直接封装成 MP4）或追加到
+一个 .ts 文件。几千个分片文件不再落盘，也省掉了 concat 这一遍读写和事后统计目录大小。
+
+没装 aiohttp 时（pip install aiohttp）自动回退到 requests.Session 线程池，同样复用连接、
+流式写盘、单片重试，只是并发数固定。
+
+传入 bandwidth_limiter（bandwidth_scheduler.BandwidthClient）时，每收到一块数据先扣带宽额度，
+和同机的其他下载器共用总带宽；本地额度够时不离开事件循环，不够时在线程里等守护进程授予。
+
+使用方式：
+    engine = HLSSegmentEngine(headers=headers, initial_concurrency=5, max_concurrency=16)
+    stats = engine.download([(ts_url, ts_path), ...], progress_callback=lambda index, path, ok: pbar.update(1))
+    if stats['failed']: ...
+
+    sink = FFmpegRemuxSink(output_mp4, ffmpeg_path)        # 或 TSAppendSink(output_ts)
+    stats = engine.download_to_sink(ts_urls, sink)         # 也可以传 hls_playlist 的分片和解密 transform
+    filesize = sink.close()                                # 失败时 sink.abort()
+
+直接运行本文件会启动一个本地 HTTP 测试服务器，对比「每片新连接」和本引擎的吞吐。
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import subprocess
+import functools
+import collections
+import threading
+import concurrent.futures
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp  # 可选依赖：pip install aiohttp
+except ImportError:
+    aiohttp = None
+
+# ==================== 配置 ====================
+DEFAULT_INITIAL_CONCURRENCY = 4
+DEFAULT_MIN_CONCURRENCY = 2
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_RETRIES = 3
+DEFAULT_TIMEOUT = 30
+CHUNK_SIZE = 256 * 1024
+
+# 自适应并发的统计窗口（秒）
+ADAPT_WINDOW_SECONDS = 2.0
+# 重试退避基数（秒）：1, 2, 4 ... 再加随机抖动
+RETRY_BACKOFF_SECONDS = 1.0
+
+# 进度回调: (分片序号, 本地路径（流式输出时为 None）, 是否成功)
+ProgressCallback = Callable[[int, Optional[str], bool], None]
+# 分片内容变换: (分片序号, 下载到的内容) -> 写出的内容，例如 AES-128 解密（见 hls_playlist.py）
+SegmentTransform = Callable[[int, bytes], bytes]
+
+
+class _AdaptiveLimiter:
+    """可调上限的并发闸门：爬山法按吞吐调整同时下载的分片数"""
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.active = 0
+        self.peak = self.limit
+        self._cond = asyncio.Condition()
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_errors = 0
+        self._best_rate = 0.0
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def release(self, nbytes: int, ok: bool):
+        async with self._cond:
+            self.active -= 1
+            self._window_bytes += nbytes
+            if not ok:
+                self._window_errors += 1
+            self._adjust()
+            self._cond.notify_all()
+
+    def _adjust(self):
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < ADAPT_WINDOW_SECONDS:
+            return
+        rate = self._window_bytes / elapsed
+        if self._window_errors:
+            # 出错（限流、超时）时快速退让
+            self.limit = max(self.minimum, int(self.limit * 0.75))
+            self._best_rate = rate
+        elif rate > self._best_rate * 1.05:
+            # 加并发后吞吐还在涨，继续加
+            self._best_rate = rate
+            self.limit = min(self.maximum, self.limit + 1)
+        elif rate < self._best_rate * 0.8:
+            # 吞吐明显下降，减一档并重新测量
+            self.limit = max(self.minimum, self.limit - 1)
+            self._best_rate = rate
+        self.peak = max(self.peak, self.limit)
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_errors = 0
+
+
+class HLSSegmentEngine:
+    """HLS 分片批量下载引擎"""
+
+    def __init__(self, headers: Optional[Dict[str, str]] = None,
+                 initial_concurrency: int = DEFAULT_INITIAL_CONCURRENCY,
+                 min_concurrency: int = DEFAULT_MIN_CONCURRENCY,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 retries: int = DEFAULT_RETRIES,
+                 timeout: float = DEFAULT_TIMEOUT,
+                 bandwidth_limiter=None,
+                 logger: Optional[logging.Logger] = None):
+        self.headers = dict(headers or {})
+        self.initial_concurrency = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(max_concurrency, initial_concurrency)
+        self.retries = retries
+        self.timeout = timeout
+        self.bandwidth_limiter = bandwidth_limiter
+        self.logger = logger or logging.getLogger('HLSSegmentEngine')
+
+    # ---------- 公共接口 ----------
+
+    def download(self, tasks: Sequence[Tuple[Any, str]],
+                 progress_callback: Optional[ProgressCallback] = None,
+                 transform: Optional[SegmentTransform] = None) -> Dict[str, Any]:
+        """
+        下载一批分片到各自的文件（阻塞直到全部结束）
+
+        Args:
+            tasks: [(分片, 本地保存路径)]，列表顺序即分片序号。分片可以是 URL 字符串，
+                   也可以是带 uri / request_headers 属性的对象（hls_playlist.HLSSegment，支持字节范围）
+            progress_callback: 每个分片结束时调用 (序号, 路径, 是否成功)
+            transform: 写盘前对分片内容做变换（如解密），此时分片整片读入内存
+
+        Returns:
+            {'done': 成功数, 'failed': [失败序号], 'skipped': 已存在跳过数, 'bytes': 下载字节数,
+             'seconds': 耗时, 'retries': 重试次数, 'concurrency': 最终并发, 'peak_concurrency': 最高并发}
+        """
+        start = self._reset_stats()
+        if aiohttp is not None:
+            asyncio.run(self._download_async(list(tasks), progress_callback, transform))
+        else:
+            self._download_threaded(list(tasks), progress_callback, transform)
+        return self._finish_stats(start)
+
+    def download_to_sink(self, segments: Sequence[Any], sink: 'SegmentSink',
+                         progress_callback: Optional[ProgressCallback] = None,
+                         reorder_window: Optional[int] = None,
+                         transform: Optional[SegmentTransform] = None) -> Dict[str, Any]:
+        """
+        按分片顺序把内容写进 sink（单个分片不落地）
+
+        分片并发下载，先到的放在重排缓冲区里等前面的分片；缓冲区最多 reorder_window 个分片
+        （默认最大并发的 2 倍），满了就暂停发起新请求，内存占用有上限。
+        重试用尽的分片直接跳过（记入 failed），由调用方决定是否接受这个结果。
+        sink 写入失败（比如 ffmpeg 退出）会直接抛出异常，sink 的关闭/丢弃由调用方负责。
+
+        Returns:
+            同 download()，其中 skipped 恒为 0
+        """
+        window = max(reorder_window or self.max_concurrency * 2, 1)
+        start = self._reset_stats()
+        if aiohttp is not None:
+            asyncio.run(self._stream_async(list(segments), sink, progress_callback, window, transform))
+        else:
+            self._stream_threaded(list(segments), sink, progress_callback, window, transform)
+        return self._finish_stats(start)
+
+    # ---------- 公共小工具 ----------
+
+    def _reset_stats(self) -> float:
+        self._stats_lock = threading.Lock()
+        self._stats = {'done': 0, 'failed': [], 'skipped': 0, 'bytes': 0, 'retries': 0,
+                       'concurrency': self.initial_concurrency, 'peak_concurrency': self.initial_concurrency}
+        return time.time()
+
+    def _finish_stats(self, start: float) -> Dict[str, Any]:
+        stats = self._stats
+        stats['failed'].sort()
+        stats['seconds'] = time.time() - start
+        speed = stats['bytes'] / 1024 ** 2 / stats['seconds'] if stats['seconds'] > 0 else 0.0
+        self.logger.info(f"分片下载完成: 成功 {stats['done']}, 跳过 {stats['skipped']}, 失败 {len(stats['failed'])}, "
+                         f"{stats['bytes'] / 1024 ** 2:.1f}MB, {speed:.1f}MB/s, 重试 {stats['retries']} 次, "
+                         f"并发 {stats['concurrency']} (最高 {stats['peak_concurrency']})")
+        return stats
+
+    def _record(self, index: int, path: Optional[str], nbytes: Optional[int], skipped: bool,
+                progress_callback: Optional[ProgressCallback]):
+        with self._stats_lock:
+            if nbytes is None:
+                self._stats['failed'].append(index)
+            elif skipped:
+                self._stats['skipped'] += 1
+            else:
+                self._stats['done'] += 1
+                self._stats['bytes'] += nbytes
+        if progress_callback:
+            try:
+                progress_callback(index, path, nbytes is not None)
+            except Exception as e:
+                self.logger.warning(f"进度回调异常: {e}")
+
+    def _count_retry(self):
+        with self._stats_lock:
+            self._stats['retries'] += 1
+
+    @staticmethod
+    def _already_downloaded(path: str) -> bool:
+        return os.path.exists(path) and os.path.getsize(path) > 0
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return RETRY_BACKOFF_SECONDS * (2 ** attempt) + random.uniform(0, 1)
+
+    @staticmethod
+    def _segment_name(url: str, path: Optional[str]) -> str:
+        return os.path.basename(path) if path else url.split('?', 1)[0].rsplit('/', 1)[-1]
+
+    @staticmethod
+    def _request_of(segment) -> Tuple[str, Optional[Dict[str, str]]]:
+        """分片 -> (URL, 额外请求头)"""
+        if isinstance(segment, str):
+            return segment, None
+        return segment.uri, getattr(segment, 'request_headers', None)
+
+    @staticmethod
+    def _bind(transform: Optional[SegmentTransform], index: int) -> Optional[Callable[[bytes], bytes]]:
+        return functools.partial(transform, index) if transform else None
+
+    @staticmethod
+    def _write_file(path: str, data: bytes):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    # ---------- asyncio + aiohttp ----------
+
+    def _open_session(self):
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.max_concurrency,
+                                         ttl_dns_cache=300, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+        return aiohttp.ClientSession(headers=self.headers, connector=connector, timeout=timeout)
+
+    async def _download_async(self, tasks: List[Tuple[Any, str]],
+                              progress_callback: Optional[ProgressCallback],
+                              transform: Optional[SegmentTransform]):
+        limiter = _AdaptiveLimiter(self.initial_concurrency, self.min_concurrency, self.max_concurrency)
+        queue: asyncio.Queue = asyncio.Queue()
+        for index, task in enumerate(tasks):
+            queue.put_nowait((index, task))
+
+        async with self._open_session() as session:
+            async def worker():
+                while True:
+                    try:
+                        index, (segment, path) = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    if self._already_downloaded(path):
+                        self._record(index, path, os.path.getsize(path), True, progress_callback)
+                        continue
+                    await limiter.acquire()
+                    nbytes = None
+                    try:
+                        nbytes = await self._fetch_async(session, segment, path, self._bind(transform, index))
+                    finally:
+                        await limiter.release(nbytes or 0, nbytes is not None)
+                    self._record(index, path, nbytes, False, progress_callback)
+
+            await asyncio.gather(*(worker() for _ in range(self.max_concurrency)))
+
+        self._stats['concurrency'] = limiter.limit
+        self._stats['peak_concurrency'] = limiter.peak
+
+    async def _stream_async(self, segments: List[Any], sink: 'SegmentSink',
+                            progress_callback: Optional[ProgressCallback], window: int,
+                            transform: Optional[SegmentTransform]):
+        limiter = _AdaptiveLimiter(self.initial_concurrency, self.min_concurrency, self.max_concurrency)
+        loop = asyncio.get_running_loop()
+
+        async with self._open_session() as session:
+            async def fetch(index: int) -> Optional[bytes]:
+                await limiter.acquire()
+                data = None
+                try:
+                    data = await self._fetch_async(session, segments[index], None, self._bind(transform, index))
+                finally:
+                    await limiter.release(len(data) if data else 0, data is not None)
+                return data
+
+            # 重排缓冲区：按序号排队的下载任务，队头完成后才写入，后面先完成的在这里等
+            pending = collections.deque()
+            next_submit = 0
+            try:
+                for index in range(len(segments)):
+                    while next_submit < len(segments) and len(pending) < window:
+                        pending.append(asyncio.ensure_future(fetch(next_submit)))
+                        next_submit += 1
+                    data = await pending.popleft()
+                    if data is not None:
+                        # 写 ffmpeg 管道可能阻塞，放到线程里，不耽误其他分片下载
+                        await loop.run_in_executor(None, sink.write, data)
+                    self._record(index, None, len(data) if data is not None else None, False, progress_callback)
+            finally:
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        self._stats['concurrency'] = limiter.limit
+        self._stats['peak_concurrency'] = limiter.peak
+
+    async def _throttle_async(self, loop, nbytes: int):
+        """扣带宽额度：本地额度够时直接返回，否则在线程里阻塞等待，不卡住事件循环"""
+        if self.bandwidth_limiter is not None and not self.bandwidth_limiter.try_consume(nbytes):
+            await loop.run_in_executor(None, self.bandwidth_limiter.throttle, nbytes)
+
+    async def _fetch_async(self, session, segment, path: Optional[str] = None,
+                           transform: Optional[Callable[[bytes], bytes]] = None):
+        """下载单个分片：path 为 None 时返回内容 bytes，否则写盘返回字节数；重试用尽返回 None"""
+        loop = asyncio.get_running_loop()
+        url, headers = self._request_of(segment)
+        name = self._segment_name(url, path)
+        tmp_path = path + '.part' if path else None
+        for attempt in range(self.retries):
+            try:
+                nbytes = 0
+                async with session.get(url, headers=headers) as response:
+                    response.raise_for_status()
+                    if path is None or transform is not None:
+                        data = await response.read()
+                        await self._throttle_async(loop, len(data))
+                        if transform is not None:
+                            data = await loop.run_in_executor(None, transform, data)
+                        if path is None:
+                            return data
+                        await loop.run_in_executor(None, self._write_file, tmp_path, data)
+                        os.replace(tmp_path, path)
+                        return len(data)
+                    f = await loop.run_in_executor(None, open, tmp_path, 'wb')
+                    try:
+                        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                            await self._throttle_async(loop, len(chunk))
+                            # 写盘放到线程里，NAS 写入慢时不阻塞其他分片的下载
+                            await loop.run_in_executor(None, f.write, chunk)
+                            nbytes += len(chunk)
+                    finally:
+                        await loop.run_in_executor(None, f.close)
+                os.replace(tmp_path, path)
+                return nbytes
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError, requests.RequestException) as e:
+                self.logger.warning(f"下载分片失败 {name} (尝试 {attempt + 1}/{self.retries}): {e}")
+                if attempt < self.retries - 1:
+                    self._count_retry()
+                    await asyncio.sleep(self._backoff(attempt))
+        self.logger.error(f"下载分片失败，已重试{self.retries}次: {name}")
+        return None
+
+    # ---------- requests 线程池回退 ----------
+
+    def _requests_session(self, workers: int) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(self.headers)
+        return session
+
+    def _download_threaded(self, tasks: List[Tuple[Any, str]],
+                           progress_callback: Optional[ProgressCallback],
+                           transform: Optional[SegmentTransform]):
+        workers = max(1, self.initial_concurrency)
+        session = self._requests_session(workers)
+
+        def run(index: int, segment, path: str):
+            if self._already_downloaded(path):
+                self._record(index, path, os.path.getsize(path), True, progress_callback)
+                return
+            nbytes = self._fetch_threaded(session, segment, path, self._bind(transform, index))
+            self._record(index, path, nbytes, False, progress_callback)
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hls') as executor:
+                for future in [executor.submit(run, index, segment, path)
+                               for index, (segment, path) in enumerate(tasks)]:
+                    future.result()
+        finally:
+            session.close()
+        self._stats['concurrency'] = self._stats['peak_concurrency'] = workers
+
+    def _stream_threaded(self, segments: List[Any], sink: 'SegmentSink',
+                         progress_callback: Optional[ProgressCallback], window: int,
+                         transform: Optional[SegmentTransform]):
+        workers = max(1, self.initial_concurrency)
+        session = self._requests_session(workers)
+        pending = collections.deque()
+        next_submit = 0
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hls') as executor:
+                try:
+                    for index in range(len(segments)):
+                        while next_submit < len(segments) and len(pending) < window:
+                            pending.append(executor.submit(self._fetch_threaded, session, segments[next_submit],
+                                                           None, self._bind(transform, next_submit)))
+                            next_submit += 1
+                        data = pending.popleft().result()
+                        if data is not None:
+                            sink.write(data)
+                        self._record(index, None, len(data) if data is not None else None, False, progress_callback)
+                finally:
+                    for future in pending:
+                        future.cancel()
+        finally:
+            session.close()
+        self._stats['concurrency'] = self._stats['peak_concurrency'] = workers
+
+    def _fetch_threaded(self, session: requests.Session, segment, path: Optional[str] = None,
+                        transform: Optional[Callable[[bytes], bytes]] = None):
+        url, headers = self._request_of(segment)
+        name = self._segment_name(url, path)
+        tmp_path = path + '.part' if path else None
+        for attempt in range(self.retries):
+            try:
+                nbytes = 0
+                whole = path is None or transform is not None
+                with session.get(url, headers=headers, stream=not whole, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    if whole:
+                        if self.bandwidth_limiter is not None:
+                            self.bandwidth_limiter.throttle(len(response.content))
+                        data = transform(response.content) if transform is not None else response.content
+                        if path is None:
+                            return data
+                        self._write_file(tmp_path, data)
+                        os.replace(tmp_path, path)
+                        return len(data)
+                    with open(tmp_path, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            if chunk:
+                                if self.bandwidth_limiter is not None:
+                                    self.bandwidth_limiter.throttle(len(chunk))
+                                f.write(chunk)
+                                nbytes += len(chunk)
+                os.replace(tmp_path, path)
+                return nbytes
+            except (requests.RequestException, OSError, ValueError) as e:
+                self.logger.warning(f"下载分片失败 {name} (尝试 {attempt + 1}/{self.retries}): {e}")
+                if attempt < self.retries - 1:
+                    self._count_retry()
+                    time.sleep(self._backoff(attempt))
+        self.logger.error(f"下载分片失败，已重试{self.retries}次: {name}")
+        return None
+
+
+# ==================== 顺序写入目标 ====================
+
+class SegmentSink(ABC):
+    """download_to_sink 的写入目标：按分片顺序 write，结束后 close（返回最终文件大小）或 abort"""
+
+    @abstractmethod
+    def write(self, data: bytes):
+        """写入一个分片的数据"""
+
+    @abstractmethod
+    def close(self) -> int:
+        """正常结束，返回最终文件大小"""
+
+    @abstractmethod
+    def abort(self):
+        """出错时放弃并清理临时文件"""
+
+
+class TSAppendSink(SegmentSink):
+    """把分片依次追加到一个 .ts 文件（MPEG-TS 可以直接首尾相接）"""
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self._tmp_path = output_path + '.part'
+        self._file = open(self._tmp_path, 'wb')
+
+    def write(self, data: bytes):
+        self._file.write(data)
+
+    def close(self) -> int:
+        self._file.close()
+        os.replace(self._tmp_path, self.output_path)
+        return os.path.getsize(self.output_path)
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class FFmpegRemuxSink(SegmentSink):
+    """把分片依次写进一个 ffmpeg 进程的标准输入（-f mpegts -i pipe:0），直接封装成 MP4，不重新编码"""
+
+    def __init__(self, output_path: str, ffmpeg_path: str = 'ffmpeg'):
+        self.output_path = output_path
+        self._tmp_path = output_path + '.part'
+        cmd = [ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
+               '-f', 'mpegts', '-i', 'pipe:0',
+               '-c', 'copy', '-f', 'mp4', self._tmp_path]
+        self._process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                         stderr=subprocess.PIPE)
+        # 持续读走 stderr，避免管道写满把 ffmpeg 卡住；只保留最后几行用于报错
+        self._stderr_tail = collections.deque(maxlen=20)
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_thread.start()
+
+    def _drain_stderr(self):
+        for line in iter(self._process.stderr.readline, b''):
+            self._stderr_tail.append(line.decode('utf-8', errors='ignore').rstrip())
+
+    def write(self, data: bytes):
+        try:
+            self._process.stdin.write(data)
+        except (BrokenPipeError, OSError) as e:
+            raise RuntimeError(f"ffmpeg 已退出: {e}; {' | '.join(self._stderr_tail)}") from e
+
+    def close(self) -> int:
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        returncode = self._process.wait()
+        self._stderr_thread.join(timeout=5)
+        if returncode != 0:
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+            raise RuntimeError(f"ffmpeg 封装失败 (返回码 {returncode}): {' | '.join(self._stderr_tail)}")
+        os.replace(self._tmp_path, self.output_path)
+        return os.path.getsize(self.output_path)
+
+    def abort(self):
+        if self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+# ==================== 本地基准测试 ====================
+
+def run_benchmark(segment_count: int = 300, segment_size: int = 512 * 1024, baseline_workers: int = 5):
+    """启动本地 HTTP 服务器模拟分片源，对比「每片新连接」和本引擎"""
+    import shutil
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    payload = os.urandom(segment_size)
+
+    class SegmentHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # 支持 keep-alive
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/mp2t')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SegmentHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    total_mb = segment_count * segment_size / 1024 ** 2
+
+    try:
+        # 1. 旧方式：每片 requests.get，整片读进内存
+        baseline_dir = tempfile.mkdtemp(prefix='hls_baseline_')
+
+        def fetch_baseline(i):
+            response = requests.get(f"{base_url}/seg{i}.ts", timeout=30)
+            with open(os.path.join(baseline_dir, f"{i:05d}.ts"), 'wb') as f:
+                f.write(response.content)
+
+        start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=baseline_workers) as executor:
+            list(executor.map(fetch_baseline, range(segment_count)))
+        baseline_seconds = time.time() - start
+        shutil.rmtree(baseline_dir, ignore_errors=True)
+
+        # 2. 本引擎
+        engine_dir = tempfile.mkdtemp(prefix='hls_engine_')
+        engine = HLSSegmentEngine(initial_concurrency=baseline_workers)
+        stats = engine.download([(f"{base_url}/seg{i}.ts", os.path.join(engine_dir, f"{i:05d}.ts"))
+                                 for i in range(segment_count)])
+        shutil.rmtree(engine_dir, ignore_errors=True)
+    finally:
+        server.shutdown()
+
+    print(f"分片数 {segment_count}, 每片 {segment_size // 1024}KB, 共 {total_mb:.0f}MB "
+          f"({'aiohttp' if aiohttp else 'requests 回退模式'})")
+    print(f"  每片新连接: {baseline_seconds:.2f}s, {total_mb / baseline_seconds:.1f}MB/s")
+    print(f"  HLS 引擎:   {stats['seconds']:.2f}s, {total_mb / stats['seconds']:.1f}MB/s, "
+          f"最终并发 {stats['concurrency']}, 失败 {len(stats['failed'])}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    run_benchmark()
@@ -0,0 +1,390 @@
+# _*_ coding: utf-8 _*_
+"""
+HLS 播放列表模型 - 主列表（master）/ 媒体列表（media）解析、清晰度选择、AES-128 解密
+
+以前的做法：Artlist 直接取「最后一个 #EXT-X-STREAM-INF」，淘宝回放只收集以 .ts 结尾的行。
+最后一个不一定是想要的清晰度（经常是比 1080p 还大的 4K），带查询参数的分片地址、
+#EXT-X-KEY 加密、#EXT-X-BYTERANGE 和不连续点也都处理不了。这里改为：
+- 主列表解析成结构化的清晰度列表（带宽、分辨率、编码），按策略选择，
+  默认「不低于 1080p 里最小的那个」，没有达标的就取最高的；
+- 媒体列表解析成分片列表：绝对地址、时长、序号、字节范围、所用密钥、是否不连续；
+- AES-128 分片解密（密钥按 URI 缓存，一个视频只取一次），IV 缺省时按分片序号生成；
+- 同一次运行内 playlist 按 URL 记忆化，重复处理不再重复请求。
+
+AES-128 解密需要 cryptography 或 pycryptodome 之一（可选依赖），只有遇到加密列表时才用到。
+
+使用方式：
+    fetcher = get_playlist_fetcher()
+    playlist = fetcher.resolve_media(m3u8_url, headers=headers, min_height=1080)
+    transform = fetcher.segment_transform(playlist, headers=headers)   # 未加密时为 None
+    engine.download_to_sink(playlist.segments, sink, transform=transform)
+"""
+
+import logging
+import threading
+import collections
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import urljoin
+
+import requests
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes  # 可选依赖
+except ImportError:
+    Cipher = None
+
+try:
+    from Crypto.Cipher import AES  # pycryptodome，可选依赖
+except ImportError:
+    AES = None
+
+# ==================== 配置 ====================
+# 默认目标清晰度：不低于 1080p 里最小的那个
+DEFAULT_MIN_HEIGHT = 1080
+REQUEST_TIMEOUT = 30
+# 每次运行最多记住多少个 playlist（按 URL）
+PLAYLIST_CACHE_SIZE = 256
+
+
+@dataclass
+class HLSKey:
+    """#EXT-X-KEY"""
+    method: str
+    uri: Optional[str] = None
+    iv: Optional[bytes] = None
+
+
+@dataclass
+class HLSSegment:
+    """媒体列表中的一个分片"""
+    uri: str
+    duration: float
+    sequence: int
+    byte_range: Optional[Tuple[int, int]] = None  # (长度, 起始偏移)
+    key: Optional[HLSKey] = None
+    discontinuity: bool = False
+
+    @property
+    def request_headers(self) -> Optional[Dict[str, str]]:
+        """字节范围分片需要的 Range 请求头"""
+        if not self.byte_range:
+            return None
+        length, offset = self.byte_range
+        return {'Range': f'bytes={offset}-{offset + length - 1}'}
+
+
+@dataclass
+class HLSVariant:
+    """主列表中的一个清晰度"""
+    uri: str
+    bandwidth: int = 0
+    average_bandwidth: int = 0
+    resolution: Optional[Tuple[int, int]] = None
+    codecs: str = ''
+    frame_rate: float = 0.0
+
+    @property
+    def height(self) -> int:
+        return self.resolution[1] if self.resolution else 0
+
+
+@dataclass
+class MasterPlaylist:
+    url: str
+    variants: List[HLSVariant] = field(default_factory=list)
+
+
+@dataclass
+class MediaPlaylist:
+    url: str
+    segments: List[HLSSegment] = field(default_factory=list)
+    target_duration: float = 0.0
+    media_sequence: int = 0
+    endlist: bool = False
+
+    @property
+    def duration(self) -> float:
+        return sum(segment.duration for segment in self.segments)
+
+    @property
+    def is_encrypted(self) -> bool:
+        return any(segment.key is not None for segment in self.segments)
+
+    @property
+    def discontinuity_count(self) -> int:
+        return sum(1 for segment in self.segments if segment.discontinuity)
+
+
+def parse_attribute_list(text: str) -> Dict[str, str]:
+    """解析 KEY=VALUE,KEY="VALUE,带逗号" 形式的属性列表"""
+    attributes = {}
+    i, n = 0, len(text)
+    while i < n:
+        eq = text.find('=', i)
+        if eq < 0:
+            break
+        name = text[i:eq].strip()
+        i = eq + 1
+        if i < n and text[i] == '"':
+            end = text.find('"', i + 1)
+            end = n if end < 0 else end
+            value = text[i + 1:end]
+            i = end + 1
+        else:
+            end = text.find(',', i)
+            end = n if end < 0 else end
+            value = text[i:end].strip()
+            i = end
+        attributes[name] = value
+        comma = text.find(',', i)
+        if comma < 0:
+            break
+        i = comma + 1
+    return attributes
+
+
+def parse_playlist(text: str, url: str) -> Union[MasterPlaylist, MediaPlaylist]:
+    """解析 m3u8 文本；url 用于把相对地址解析成绝对地址"""
+    lines = [line.strip() for line in text.splitlines()]
+    if any(line.startswith('#EXT-X-STREAM-INF') for line in lines):
+        return _parse_master(lines, url)
+    return _parse_media(lines, url)
+
+
+def _parse_master(lines: List[str], url: str) -> MasterPlaylist:
+    playlist = MasterPlaylist(url=url)
+    pending: Optional[Dict[str, str]] = None
+    for line in lines:
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            pending = parse_attribute_list(line.split(':', 1)[1])
+        elif line and not line.startswith('#') and pending is not None:
+            resolution = None
+            if 'x' in pending.get('RESOLUTION', ''):
+                width, _, height = pending['RESOLUTION'].partition('x')
+                try:
+                    resolution = (int(width), int(height))
+                except ValueError:
+                    resolution = None
+            playlist.variants.append(HLSVariant(
+                uri=urljoin(url, line),
+                bandwidth=_to_int(pending.get('BANDWIDTH')),
+                average_bandwidth=_to_int(pending.get('AVERAGE-BANDWIDTH')),
+                resolution=resolution,
+                codecs=pending.get('CODECS', ''),
+                frame_rate=_to_float(pending.get('FRAME-RATE')),
+            ))
+            pending = None
+    return playlist
+
+
+def _parse_media(lines: List[str], url: str) -> MediaPlaylist:
+    playlist = MediaPlaylist(url=url)
+    sequence = 0
+    duration = 0.0
+    key: Optional[HLSKey] = None
+    byte_range: Optional[Tuple[int, Optional[int]]] = None
+    discontinuity = False
+    # 省略起始偏移的 BYTERANGE 接着同一个文件上一段的末尾
+    last_range_end: Dict[str, int] = {}
+
+    for line in lines:
+        if not line:
+            continue
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            sequence = playlist.media_sequence = _to_int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            playlist.target_duration = _to_float(line.split(':', 1)[1])
+        elif line.startswith('#EXTINF:'):
+            duration = _to_float(line.split(':', 1)[1].split(',', 1)[0])
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            length, _, offset = line.split(':', 1)[1].partition('@')
+            byte_range = (_to_int(length), _to_int(offset) if offset else None)
+        elif line.startswith('#EXT-X-KEY:'):
+            attributes = parse_attribute_list(line.split(':', 1)[1])
+            method = attributes.get('METHOD', 'NONE').upper()
+            if method == 'NONE':
+                key = None
+            else:
+                iv = attributes.get('IV')
+                key = HLSKey(method=method,
+                             uri=urljoin(url, attributes['URI']) if attributes.get('URI') else None,
+                             iv=bytes.fromhex(iv[2:] if iv.lower().startswith('0x') else iv) if iv else None)
+        elif line.startswith('#EXT-X-DISCONTINUITY') and not line.startswith('#EXT-X-DISCONTINUITY-SEQUENCE'):
+            discontinuity = True
+        elif line.startswith('#EXT-X-ENDLIST'):
+            playlist.endlist = True
+        elif not line.startswith('#'):
+            segment_uri = urljoin(url, line)
+            segment_range = None
+            if byte_range:
+                length, offset = byte_range
+                if offset is None:
+                    offset = last_range_end.get(segment_uri, 0)
+                segment_range = (length, offset)
+                last_range_end[segment_uri] = offset + length
+            playlist.segments.append(HLSSegment(uri=segment_uri, duration=duration, sequence=sequence,
+                                                byte_range=segment_range, key=key, discontinuity=discontinuity))
+            sequence += 1
+            duration = 0.0
+            byte_range = None
+            discontinuity = False
+    return playlist
+
+
+def select_variant(variants: List[HLSVariant], min_height: int = DEFAULT_MIN_HEIGHT,
+                   max_bandwidth: Optional[int] = None) -> Optional[HLSVariant]:
+    """
+    按清晰度策略选择：不低于 min_height 的里面取分辨率最小、带宽最小的；
+    都达不到时取最高的。max_bandwidth 可以额外限制带宽上限（达不到时忽略）。
+    """
+    if not variants:
+        return None
+    candidates = variants
+    if max_bandwidth:
+        candidates = [v for v in variants if v.bandwidth <= max_bandwidth] or variants
+    if not any(v.resolution for v in candidates):
+        # 没有分辨率信息，只能按带宽取最高
+        return max(candidates, key=lambda v: v.bandwidth)
+    qualified = [v for v in candidates if v.height >= min_height]
+    if qualified:
+        return min(qualified, key=lambda v: (v.height, v.bandwidth))
+    return max(candidates, key=lambda v: (v.height, v.bandwidth))
+
+
+def decrypt_aes128(data: bytes, key: bytes, iv: bytes) -> bytes:
+    """AES-128-CBC 解密并去掉 PKCS7 填充"""
+    if Cipher is not None:
+        decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+        plain = decryptor.update(data) + decryptor.finalize()
+    elif AES is not None:
+        plain = AES.new(key, AES.MODE_CBC, iv).decrypt(data)
+    else:
+        raise RuntimeError("分片使用 AES-128 加密，需要安装 cryptography 或 pycryptodome")
+    pad = plain[-1] if plain else 0
+    if 0 < pad <= 16 and plain.endswith(bytes([pad]) * pad):
+        plain = plain[:-pad]
+    return plain
+
+
+class PlaylistFetcher:
+    """playlist 获取（按 URL 记忆化）+ 密钥缓存"""
+
+    def __init__(self, timeout: float = REQUEST_TIMEOUT, cache_size: int = PLAYLIST_CACHE_SIZE):
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._playlists: 'collections.OrderedDict[str, Union[MasterPlaylist, MediaPlaylist]]' = collections.OrderedDict()
+        self._keys: Dict[str, bytes] = {}
+        self.hits = 0
+        self.fetches = 0
+
+    def _get(self, url: str, headers: Optional[Dict[str, str]]) -> requests.Response:
+        response = self._session.get(url, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def load(self, url: str, headers: Optional[Dict[str, str]] = None) -> Union[MasterPlaylist, MediaPlaylist]:
+        """获取并解析 playlist，同一 URL 只请求一次"""
+        with self._lock:
+            cached = self._playlists.get(url)
+            if cached is not None:
+                self._playlists.move_to_end(url)
+                self.hits += 1
+                return cached
+        # 跟随重定向后的地址作为相对路径的基准
+        response = self._get(url, headers)
+        playlist = parse_playlist(response.text, response.url or url)
+        with self._lock:
+            self.fetches += 1
+            self._playlists[url] = playlist
+            while len(self._playlists) > self.cache_size:
+                self._playlists.popitem(last=False)
+        return playlist
+
+    def resolve_media(self, url: str, headers: Optional[Dict[str, str]] = None,
+                      min_height: int = DEFAULT_MIN_HEIGHT,
+                      max_bandwidth: Optional[int] = None) -> MediaPlaylist:
+        """给主列表就按策略选清晰度再取媒体列表；给媒体列表直接返回"""
+        return self.select_media(self.load(url, headers), headers, min_height, max_bandwidth)
+
+    def select_media(self, playlist: Union[MasterPlaylist, MediaPlaylist],
+                     headers: Optional[Dict[str, str]] = None,
+                     min_height: int = DEFAULT_MIN_HEIGHT,
+                     max_bandwidth: Optional[int] = None) -> MediaPlaylist:
+        """同 resolve_media，用于已经解析好的 playlist"""
+        if isinstance(playlist, MediaPlaylist):
+            return playlist
+        variant = select_variant(playlist.variants, min_height, max_bandwidth)
+        if variant is None:
+            raise ValueError(f"主列表中没有可用的清晰度: {playlist.url}")
+        logging.info(f"🎞️ 选择清晰度: {variant.resolution[0] if variant.resolution else '?'}x{variant.height or '?'} "
+                     f"{variant.bandwidth // 1000}kbps (共 {len(playlist.variants)} 档)")
+        media = self.load(variant.uri, headers)
+        if not isinstance(media, MediaPlaylist):
+            raise ValueError(f"清晰度地址不是媒体列表: {variant.uri}")
+        return media
+
+    def get_key(self, key: HLSKey, headers: Optional[Dict[str, str]] = None) -> bytes:
+        """获取密钥，按 URI 缓存"""
+        with self._lock:
+            cached = self._keys.get(key.uri)
+        if cached is not None:
+            return cached
+        data = self._get(key.uri, headers).content
+        if len(data) != 16:
+            raise ValueError(f"AES-128 密钥长度不对 ({len(data)} 字节): {key.uri}")
+        with self._lock:
+            self._keys[key.uri] = data
+        return data
+
+    def segment_transform(self, playlist: MediaPlaylist,
+                          headers: Optional[Dict[str, str]] = None) -> Optional[Callable[[int, bytes], bytes]]:
+        """返回分片解密函数 (序号, 密文) -> 明文，给下载引擎的 transform 用；未加密返回 None"""
+        if not playlist.is_encrypted:
+            return None
+        segments = playlist.segments
+        for segment in segments:
+            if segment.key is not None and (segment.key.method != 'AES-128' or not segment.key.uri):
+                raise ValueError(f"不支持的加密方式: {segment.key.method}")
+
+        def transform(index: int, data: bytes) -> bytes:
+            segment = segments[index]
+            if segment.key is None:
+                return data
+            iv = segment.key.iv or segment.sequence.to_bytes(16, 'big')
+            return decrypt_aes128(data, self.get_key(segment.key, headers), iv)
+
+        return transform
+
+    def log_stats(self):
+        logging.info(f"🎞️ playlist缓存: 请求 {self.fetches} 次, 命中 {self.hits} 次, 密钥 {len(self._keys)} 个")
+
+
+def _to_int(value: Optional[str]) -> int:
+    try:
+        return int(float(value)) if value else 0
+    except ValueError:
+        return 0
+
+
+def _to_float(value: Optional[str]) -> float:
+    try:
+        return float(value) if value else 0.0
+    except ValueError:
+        return 0.0
+
+
+_playlist_fetcher: Optional[PlaylistFetcher] = None
+_playlist_fetcher_lock = threading.Lock()
+
+
+def get_playlist_fetcher() -> PlaylistFetcher:
+    """获取全局 playlist 获取器（同一次运行内共享缓存）"""
+    global _playlist_fetcher
+    if _playlist_fetcher is None:
+        with _playlist_fetcher_lock:
+            if _playlist_fetcher is None:
+                _playlist_fetcher = PlaylistFetcher()
+    return _playlist_fetcher
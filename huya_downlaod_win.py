@@ -19,13 +19,19 @@ import time
 import sys
 import shutil
 import threading
+import functools
 from typing import Dict, Any, Optional
+from urllib.parse import urlparse
 from pathlib import Path
 
 import mysql.connector
 from loguru import logger
 from tqdm import tqdm
 
+from task_pool import PrefetchWorkerPool
+from task_claim import TaskClaimer
+from bandwidth_scheduler import BandwidthClient
+
 
 # ———————————————— 配置区域 ————————————————
 class Config:
@@ -46,6 +52,15 @@ class Config:
     # 主机名，用于区分不同的下载节点。请务必修改为唯一的、有意义的名称！
     HOSTNAME = "da01"
 
+    # --- 工作池配置 ---
+    # 同时下载的任务数；同一主机（CDN 域名）同时下载的任务数上限
+    DOWNLOAD_WORKERS = 3
+    DOWNLOADS_PER_HOST = 2
+
+    # --- 带宽调度配置 ---
+    # 与本机其他下载器共用 bandwidth_scheduler 守护进程的总限速，数值越大分到的带宽越多
+    BANDWIDTH_PRIORITY = 1
+
     # --- 企业微信通知配置 ---
     # 是否启用企业微信通知
     WECHAT_WORK_ENABLED = False
@@ -76,6 +91,9 @@ logger.add(
     encoding="utf-8"
 )
 
+# 所有下载线程共用一份带宽额度（守护进程没启动时不限速）
+bandwidth_limiter = BandwidthClient('huya', resource='net', priority=Config.BANDWIDTH_PRIORITY, logger=logger)
+
 
 # —————————————— 企业微信通知模块 ——————————————
 
@@ -221,6 +239,15 @@ def send_status_notification(status: str):
 
 
 # —————————————— 数据库管理类 ——————————————
+def _synchronized(method):
+    """DatabaseManager 只有一个连接，多个下载线程共用时逐个执行"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class DatabaseManager:
     """管理MySQL数据库连接和操作。"""
 
@@ -229,6 +256,7 @@ class DatabaseManager:
         self.table_name = table_name
         self.conn = None
         self.cursor = None
+        self._lock = threading.RLock()
 
     def connect(self):
         """连接到MySQL数据库"""
@@ -240,49 +268,7 @@ class DatabaseManager:
             logger.error(f"数据库连接失败: {err}")
             raise
 
-    def get_interrupted_task(self, hostname: str) -> dict | None:
-        """获取本机中断的下载任务。"""
-        # 使用try...finally确保autocommit状态被重置
-        original_autocommit = self.conn.autocommit
-        try:
-            self.conn.autocommit = True  # 查询操作，使用自动提交
-            sql = f"SELECT id, url, filename FROM {self.table_name} WHERE status = 'downloading' AND hostname = %s LIMIT 1"
-            self.cursor.execute(sql, (hostname,))
-            task = self.cursor.fetchone()
-            if task:
-                return {'id': task[0], 'url': task[1], 'filename': task[2]}
-            return None
-        finally:
-            self.conn.autocommit = original_autocommit  # 恢复原始状态
-
-    def get_new_task(self, hostname: str) -> dict | None:
-        """获取新任务并标记为下载中"""
-        try:
-            self.conn.start_transaction()
-            # 添加SKIP LOCKED，跳过已被其他线程锁定的任务，避免锁等待
-            query_sql = f"SELECT id, url FROM {self.table_name} WHERE status = 'pending' LIMIT 1 FOR UPDATE SKIP LOCKED"
-            self.cursor.execute(query_sql)
-            task = self.cursor.fetchone()
-
-            if task:
-                task_id, url = task
-                update_sql = f"UPDATE {self.table_name} SET status = 'downloading', hostname = %s WHERE id = %s"
-                self.cursor.execute(update_sql, (hostname, task_id))
-                self.conn.commit()
-                logger.info(f"领取新任务 (ID: {task_id})，状态更新为 'downloading'。")
-                return {'id': task_id, 'url': url}
-            else:
-                self.conn.commit()
-                return None
-        except mysql.connector.Error as err:
-            self.conn.rollback()
-            logger.error(f"获取新任务时发生数据库错误: {err}", exc_info=True)
-            raise
-        except Exception as e:
-            self.conn.rollback()
-            logger.error(f"获取新任务时发生未知错误: {e}", exc_info=True)
-            raise
-
+    @_synchronized
     def update_task_on_success(self, task_id: int, video_title: str, filename: str):
         """下载成功：更新状态、标题和文件名"""
         try:
@@ -299,6 +285,7 @@ class DatabaseManager:
             logger.error(f"更新任务(ID: {task_id})成功状态时发生数据库错误: {err}", exc_info=True)
             raise
 
+    @_synchronized
     def update_task_on_failure(self, task_id: int):
         """下载失败：仅更新状态（删除fail_reason字段）"""
         try:
@@ -311,6 +298,7 @@ class DatabaseManager:
             logger.error(f"更新任务(ID: {task_id})失败状态时发生数据库错误: {err}", exc_info=True)
             raise
 
+    @_synchronized
     def close(self):
         """关闭数据库连接。"""
         if self.conn and self.conn.is_connected():
@@ -468,6 +456,7 @@ def download_video(url: str, filename: str, save_dir: str, resume: bool = False,
                     with open(file_path, mode) as f:
                         for chunk in resp.iter_content(chunk_size=1024 * 1024):
                             if chunk:
+                                bandwidth_limiter.throttle(len(chunk))
                                 f.write(chunk)
                                 pbar.update(len(chunk))
 
@@ -493,13 +482,15 @@ def download_video(url: str, filename: str, save_dir: str, resume: bool = False,
 
 
 # —————————————— 任务处理函数 ——————————————
-def process_task(db_manager: DatabaseManager, task: dict, resume: bool = False) -> bool:
-    """处理单个下载任务，返回是否需要继续后续下载（用于空间监测）"""
+def process_task(db_manager: DatabaseManager, task: dict, resume: bool = False,
+                 video_data: Optional[dict] = None) -> bool:
+    """处理单个下载任务，返回是否需要继续后续下载（用于空间监测）；video_data 为工作池预取的视频信息"""
     task_id = task['id']
     task_url = task['url']
     logger.info(f"\n=== 开始处理任务（ID: {task_id}）：{task_url} ===")
 
-    video_data = get_huya_video_info(task_url)
+    if video_data is None:
+        video_data = get_huya_video_info(task_url)
     if not video_data:
         db_manager.update_task_on_failure(task_id)  # 移除reason参数
         return True
@@ -564,47 +555,54 @@ if __name__ == "__main__":
         sys.exit(1)
     logger.info(f"当前运行主机（来自配置）：{hostname}")
 
-    try:
-        continue_download = True
+    def run_task(task: dict, video_data: Optional[dict]) -> bool:
         try:
-            interrupted_task = db_manager.get_interrupted_task(hostname)
-            if interrupted_task:
-                logger.warning(f"检测到本机未完成的中断任务（ID: {interrupted_task['id']}），将尝试续传。")
-                continue_download = process_task(db_manager, interrupted_task, resume=True)
-                if not continue_download:
-                    logger.critical("处理中断任务后剩余空间不足，不再领取新任务")
+            # 被领取过不止一次，说明之前有节点下过一部分，按原文件名续传
+            continue_download = process_task(db_manager, task, resume=task.get('claim_attempts', 1) > 1,
+                                             video_data=video_data)
+            if not continue_download:
+                logger.critical("处理任务后剩余空间不足，停止所有下载")
+            return continue_download
         except Exception as e:
-            task_id = interrupted_task.get('id') if interrupted_task else '未知'
-            logger.error(f"处理中断任务(ID: {task_id})时发生致命错误，跳过此任务: {e}", exc_info=True)
-            continue_download = True
-
-        while continue_download:
-            new_task = None
-            while True:
-                try:
-                    new_task = db_manager.get_new_task(hostname)
-                    break
-                except Exception as e:
-                    logger.error(f"获取新任务时发生异常，将在5秒后无限重试: {e}")
-                    time.sleep(5)
-
-            if new_task:
-                try:
-                    continue_download = process_task(db_manager, new_task, resume=False)
-                    if not continue_download:
-                        logger.critical("处理新任务后剩余空间不足，停止所有下载")
-                        break
-                except Exception as e:
-                    task_id = new_task.get('id', '未知')
-                    logger.error(f"处理任务(ID: {task_id})时发生不可恢复的错误，跳过此任务: {e}", exc_info=True)
-                    try:
-                        db_manager.update_task_on_failure(task_id)  # 移除reason参数
-                    except Exception as db_err:
-                        logger.critical(f"为失败任务(ID: {task_id})更新状态时再次发生错误，程序可能需要干预: {db_err}")
-                time.sleep(2)
-            else:
-                logger.info("\n=== 数据库中无待处理任务，程序将退出 ===")
-                break
+            task_id = task.get('id', '未知')
+            logger.error(f"处理任务(ID: {task_id})时发生不可恢复的错误，跳过此任务: {e}", exc_info=True)
+            try:
+                db_manager.update_task_on_failure(task_id)  # 移除reason参数
+            except Exception as db_err:
+                logger.critical(f"为失败任务(ID: {task_id})更新状态时再次发生错误，程序可能需要干预: {db_err}")
+            return True
+
+    def task_host(task: dict, video_data: Optional[dict]) -> str:
+        return urlparse(video_data['mp4_url']).netloc if video_data and video_data.get('mp4_url') else 'huya.com'
+
+    try:
+        # 批量领取 (SKIP LOCKED) + 租约：本机或其他节点中断的任务租约过期后自动重新领取
+        claimer = TaskClaimer(lambda: mysql.connector.connect(**Config.MYSQL_CONFIG), Config.DB_TABLE_NAME,
+                              columns=('id', 'url', 'filename'),
+                              pending_statuses=('pending',), claimed_status='downloading',
+                              owner_column='hostname', owner=hostname, failed_status='failed', logger=logger)
+        claimer.ensure_schema()
+        if claimer.expire_own_leases():
+            logger.warning("检测到本机未完成的中断任务，将尝试续传。")
+
+        # 元数据线程批量领取任务并提前获取视频信息，下载线程并行下载，任务领完后退出
+        pool = PrefetchWorkerPool(
+            claim=claimer.claim,
+            process=run_task,
+            release=claimer.release,
+            fail=claimer.fail,
+            resolve=lambda task: get_huya_video_info(task['url']),
+            host_of=task_host,
+            workers=Config.DOWNLOAD_WORKERS, per_host=Config.DOWNLOADS_PER_HOST,
+            exit_when_idle=True, logger=logger)
+        pool.run()
+        pool.log_stats()
+        claimer.log_stats()
+        claimer.close()
+        bandwidth_limiter.log_stats()
+        bandwidth_limiter.close()
+        if not pool.stop_event.is_set():
+            logger.info("\n=== 数据库中无待处理任务，程序将退出 ===")
 
     except Exception as e:
         logger.critical(f"主循环发生致命错误，程序被迫终止: {e}", exc_info=True)
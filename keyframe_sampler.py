@@ -0,0 +1,178 @@
+# _*_ coding: utf-8 _*_
+"""
+关键帧采样器 - 只解码 I 帧的快速抽帧
+
+去重签名和 ROI 预览以前用 cv2.VideoCapture + CAP_PROP_POS_FRAMES 定位，长 GOP 的
+H.264/HEVC 要从前一个关键帧一路解码到目标帧，很多封装还会退化成从头线性解码，
+一个文件要好几秒。签名和预览都不需要精确到某一帧，这里改为：
+- seek 到目标时间点之前最近的关键帧，解码器设置只输出关键帧（PyAV skip_frame=NONKEY，
+  或 ffmpeg -skip_frame nokey），每个采样点只解码一帧；
+- 解码时直接缩放到需要的尺寸，返回一个小的 NumPy 批次 (N, H, W, 3)，BGR 顺序，
+  和 cv2 读出来的帧一致；
+- 按显示矩阵（手机竖拍视频的 rotate）转正，和 ffmpeg 默认的 autorotate 一致，
+  ROI 预览里框选的坐标才能直接用于后面的 crop。
+
+优先用 PyAV（进程内，可选依赖），没装时回退到 ffmpeg 子进程。
+
+使用方式：
+    frames = sample_frames(video_path, positions=(0.1, 0.5, 0.9), size=(16, 16))
+    if frames is not None:
+        for frame in frames: ...
+"""
+
+import os
+import logging
+import subprocess
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from probe_engine import get_probe_engine
+
+try:
+    import av  # PyAV，可选依赖：pip install av
+except ImportError:
+    av = None
+
+# ==================== 配置 ====================
+DEFAULT_FFMPEG_PATH = 'ffmpeg'
+FFMPEG_TIMEOUT = 30
+
+# 默认采样位置（占时长的比例）：中间一帧
+DEFAULT_POSITIONS = (0.5,)
+
+# 采样时间点距离结尾至少留出的秒数（贴着结尾 seek 经常读不到帧）
+END_MARGIN_SECONDS = 0.5
+
+
+def _sample_times(duration: float, positions: Sequence[float]) -> List[float]:
+    """把比例位置换算成秒数，并限制在有效范围内"""
+    last = max(duration - END_MARGIN_SECONDS, 0.0)
+    return [min(max(duration * p, 0.0), last) for p in positions]
+
+
+def _display_rotation(stream, frame) -> Optional[int]:
+    """转正需要的顺时针旋转角度（0/90/180/270）；当前 PyAV 版本读不到显示矩阵时返回 None"""
+    rotation = getattr(frame, 'rotation', None)  # PyAV >= 14：帧上的显示矩阵
+    if rotation is None:
+        side_data = getattr(stream, 'side_data', None)  # 旧版 PyAV：流的 side data
+        if side_data is None:
+            return None
+        rotation = side_data.get('DISPLAYMATRIX') or 0
+    # 显示矩阵给出的是逆时针角度，换算成顺时针（和 ffmpeg autorotate 的方向一致）
+    return int(round(-float(rotation) / 90)) % 4 * 90
+
+
+def sample_frames_pyav(video_path: str, positions: Sequence[float],
+                       size: Optional[Tuple[int, int]] = None) -> Optional[np.ndarray]:
+    """用 PyAV 只解码关键帧，失败返回 None"""
+    if av is None:
+        return None
+    try:
+        with av.open(video_path, metadata_errors='ignore') as container:
+            if not container.streams.video:
+                return None
+            stream = container.streams.video[0]
+            stream.codec_context.skip_frame = 'NONKEY'
+            if container.duration:
+                duration = container.duration / av.time_base
+            elif stream.duration and stream.time_base:
+                duration = float(stream.duration * stream.time_base)
+            else:
+                return None
+
+            start = stream.start_time or 0
+            frames = []
+            for seconds in _sample_times(duration, positions):
+                container.seek(start + int(seconds / stream.time_base), stream=stream,
+                               backward=True, any_frame=False)
+                for frame in container.decode(stream):
+                    rotation = _display_rotation(stream, frame)
+                    if rotation is None:
+                        return None
+                    if size:
+                        # 转 90/270 度时宽高互换，先按转正前的方向缩放
+                        width, height = size if rotation in (0, 180) else size[::-1]
+                        frame = frame.reformat(width=width, height=height, format='bgr24')
+                    image = frame.to_ndarray(format='bgr24')
+                    if rotation:
+                        image = np.ascontiguousarray(np.rot90(image, k=-rotation // 90))
+                    frames.append(image)
+                    break
+            if len(frames) != len(positions):
+                return None
+            return np.stack(frames)
+    except Exception as e:
+        logging.debug(f"PyAV关键帧采样失败，回退ffmpeg: {os.path.basename(video_path)} - {e}")
+        return None
+
+
+def _parse_ppm(data: bytes) -> Optional[np.ndarray]:
+    """解析 ffmpeg 输出的 P6 PPM（头部 'P6'、'宽 高'、'255' 各占一行），返回 BGR 数组"""
+    parts = data.split(b'\n', 3)
+    if len(parts) != 4 or parts[0] != b'P6' or parts[2] != b'255':
+        return None
+    try:
+        width, height = (int(v) for v in parts[1].split())
+    except ValueError:
+        return None
+    frame_bytes = width * height * 3
+    if width <= 0 or height <= 0 or len(parts[3]) < frame_bytes:
+        return None
+    rgb = np.frombuffer(parts[3][:frame_bytes], dtype=np.uint8).reshape(height, width, 3)
+    return np.ascontiguousarray(rgb[:, :, ::-1])
+
+
+def sample_frames_ffmpeg(video_path: str, positions: Sequence[float],
+                         size: Optional[Tuple[int, int]] = None,
+                         ffmpeg_path: str = DEFAULT_FFMPEG_PATH,
+                         ffprobe_path: Optional[str] = None) -> Optional[np.ndarray]:
+    """用 ffmpeg -skip_frame nokey 每个采样点只解码一个关键帧，失败返回 None"""
+    duration = get_probe_engine(ffprobe_path).probe(video_path).get('duration', 0)
+    if duration <= 0:
+        return None
+
+    # 输出 PPM 而不是 rawvideo：autorotate 之后的宽高直接从头部读，不用再推算
+    scale = ['-vf', f'scale={size[0]}:{size[1]}'] if size else []
+    frames = []
+    for seconds in _sample_times(duration, positions):
+        # -noaccurate_seek：直接从 -ss 之前最近的关键帧开始输出，不再丢弃到精确时间点
+        cmd = [ffmpeg_path, '-v', 'error', '-skip_frame', 'nokey',
+               '-ss', f'{seconds:.3f}', '-noaccurate_seek', '-i', video_path,
+               '-frames:v', '1', *scale,
+               '-f', 'image2pipe', '-c:v', 'ppm', '-pix_fmt', 'rgb24', 'pipe:1']
+        try:
+            result = subprocess.run(cmd, capture_output=True, timeout=FFMPEG_TIMEOUT, stdin=subprocess.DEVNULL)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logging.debug(f"ffmpeg关键帧采样失败: {os.path.basename(video_path)} - {e}")
+            return None
+        frame = _parse_ppm(result.stdout) if result.returncode == 0 else None
+        if frame is None:
+            return None
+        frames.append(frame)
+    return np.stack(frames)
+
+
+def sample_frames(video_path: str, positions: Sequence[float] = DEFAULT_POSITIONS,
+                  size: Optional[Tuple[int, int]] = None,
+                  ffmpeg_path: Optional[str] = None,
+                  ffprobe_path: Optional[str] = None) -> Optional[np.ndarray]:
+    """
+    在指定位置各取一个关键帧
+
+    Args:
+        video_path: 视频路径
+        positions: 采样位置（占时长的比例，0~1）
+        size: 输出尺寸 (宽, 高)，None 表示原始尺寸
+        ffmpeg_path / ffprobe_path: 回退到子进程时使用的程序路径
+
+    Returns:
+        (N, H, W, 3) 的 uint8 BGR 数组；任何一个采样点失败时返回 None
+    """
+    if not positions:
+        return None
+    frames = sample_frames_pyav(video_path, positions, size)
+    if frames is None:
+        frames = sample_frames_ffmpeg(video_path, positions, size,
+                                      ffmpeg_path or DEFAULT_FFMPEG_PATH, ffprobe_path)
+    return frames
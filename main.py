@@ -8,6 +8,7 @@ from pathlib import Path
 # 需要并发运行的脚本列表。
 # 路径是相对于这个 main.py 脚本的。
 SCRIPTS_TO_RUN = [
+    "bandwidth_scheduler.py",  # 带宽调度守护进程，下载和移动脚本向它申请额度
     "sql_download_pro.py",
     "video_moving.py",
 ]
@@ -0,0 +1,186 @@
+# _*_ coding: utf-8 _*_
+"""
+MP4/MOV 文件头解析器 - 纯 Python，不启动任何子进程
+
+按 ISO-BMFF 的 box 结构直接 seek 到 moov，只读取
+    moov/mvhd、trak/mdia/mdhd、mdia/hdlr、minf/stbl/stsd、stbl/stts
+这几个很小的 box，跳过 mdat 和其余样本表。moov 放在文件末尾（未做 faststart）也一样，
+每个文件通常只需要几次小读取，NAS 上比启动一次 ffprobe 快得多。
+
+返回结构与 get_video_info 一致：
+    {'width', 'height', 'duration', 'fps', 'bitrate', 'codec', 'pixel_format'}
+解析不了（不是 MP4/MOV、分片 MP4、文件损坏等）时返回空字典 {}，调用方回退到 ffprobe。
+"""
+
+import os
+import struct
+import logging
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+# 适合用本解析器的扩展名
+MP4_EXTENSIONS = ('.mp4', '.mov', '.m4v', '.3gp', '.f4v')
+
+# 单个 stts 最多读取的字节数，超过时只用第一条记录估算帧率
+MAX_STTS_BYTES = 256 * 1024
+
+# 容器类 box：需要继续往里找子 box
+_CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+# stsd 中的编码 fourcc -> ffprobe 的 codec_name
+_CODEC_NAMES = {
+    b'avc1': 'h264', b'avc3': 'h264',
+    b'hvc1': 'hevc', b'hev1': 'hevc',
+    b'av01': 'av1', b'vp09': 'vp9', b'vp08': 'vp8',
+    b'mp4v': 'mpeg4', b'jpeg': 'mjpeg', b'mjpa': 'mjpeg',
+    b'apch': 'prores', b'apcn': 'prores', b'apcs': 'prores', b'apco': 'prores',
+    b'ap4h': 'prores', b'ap4x': 'prores',
+    b'dvh1': 'hevc', b'dvhe': 'hevc',
+}
+
+
+class _Mp4FormatError(Exception):
+    """文件结构不符合预期"""
+
+
+def _iter_boxes(f, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """遍历 [start, end) 范围内的 box，产出 (类型, 内容起始偏移, box结束偏移)"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            large = f.read(8)
+            if len(large) < 8:
+                return
+            size = struct.unpack('>Q', large)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            raise _Mp4FormatError(f"box大小异常: {box_type!r} size={size}")
+        yield box_type, offset + header_size, min(offset + size, end)
+        offset += size
+
+
+def _read_payload(f, offset: int, length: int) -> bytes:
+    f.seek(offset)
+    data = f.read(length)
+    if len(data) < length:
+        raise _Mp4FormatError("box内容被截断")
+    return data
+
+
+def _parse_time_header(data: bytes) -> Tuple[int, int]:
+    """解析 mvhd/mdhd 的 (timescale, duration)"""
+    version = data[0]
+    if version == 1:
+        timescale, duration = struct.unpack('>IQ', data[20:32])
+    else:
+        timescale, duration = struct.unpack('>II', data[12:20])
+    return timescale, duration
+
+
+def _parse_track(f, start: int, end: int) -> Dict[str, Any]:
+    """解析一个 trak，只取需要的字段"""
+    track: Dict[str, Any] = {}
+    stack = [(start, end)]
+    while stack:
+        box_start, box_end = stack.pop()
+        for box_type, payload, child_end in _iter_boxes(f, box_start, box_end):
+            if box_type in _CONTAINER_BOXES:
+                stack.append((payload, child_end))
+            elif box_type == b'mdhd':
+                track['timescale'], track['duration'] = _parse_time_header(_read_payload(f, payload, 32))
+            elif box_type == b'hdlr':
+                # version/flags(4) component_type(4) handler_type(4)
+                # 只取 mdia/hdlr；QuickTime 的 minf 下还有一个数据引用 hdlr（'dhlr'/'alis'）
+                data = _read_payload(f, payload, 12)
+                if 'handler' not in track and data[4:8] != b'dhlr':
+                    track['handler'] = data[8:12]
+            elif box_type == b'stsd':
+                # version/flags(4) entry_count(4) | size(4) format(4) reserved(6) ref_idx(2)
+                # VisualSampleEntry: pre_defined/reserved(16) width(2) height(2)
+                data = _read_payload(f, payload, 44)
+                track['fourcc'] = data[12:16]
+                track['width'], track['height'] = struct.unpack('>HH', data[40:44])
+            elif box_type == b'stts':
+                entry_count = struct.unpack('>I', _read_payload(f, payload + 4, 4))[0]
+                length = min(entry_count * 8, MAX_STTS_BYTES)
+                data = _read_payload(f, payload + 8, length) if length else b''
+                track['stts_entries'] = entry_count
+                track['stts'] = [struct.unpack('>II', data[i:i + 8]) for i in range(0, len(data) - 7, 8)]
+    return track
+
+
+def _estimate_fps(track: Dict[str, Any]) -> float:
+    """根据 stts（每个样本的时长）计算平均帧率"""
+    entries = track.get('stts') or []
+    timescale = track.get('timescale', 0)
+    if not entries or not timescale:
+        return 0.0
+    if len(entries) == track.get('stts_entries'):
+        samples = sum(count for count, _ in entries)
+        ticks = sum(count * delta for count, delta in entries)
+        return samples * timescale / ticks if ticks else 0.0
+    # 样本表过大，只用第一条记录
+    delta = entries[0][1]
+    return timescale / delta if delta else 0.0
+
+
+def read_mp4_info(video_path: str) -> Dict[str, Any]:
+    """读取 MP4/MOV 的视频信息，失败返回空字典"""
+    try:
+        file_size = os.path.getsize(video_path)
+        with open(video_path, 'rb') as f:
+            moov: Optional[Tuple[int, int]] = None
+            for box_type, payload, box_end in _iter_boxes(f, 0, file_size):
+                if box_type == b'moov':
+                    moov = (payload, box_end)
+                    break
+            if moov is None:
+                return {}
+
+            movie_timescale = movie_duration = 0
+            video_track: Optional[Dict[str, Any]] = None
+            for box_type, payload, box_end in _iter_boxes(f, *moov):
+                if box_type == b'mvhd':
+                    movie_timescale, movie_duration = _parse_time_header(_read_payload(f, payload, 32))
+                elif box_type == b'mvex':
+                    # 分片MP4：时长在各个 moof 里，交给 ffprobe
+                    return {}
+                elif box_type == b'trak' and video_track is None:
+                    track = _parse_track(f, payload, box_end)
+                    if track.get('handler') == b'vide':
+                        video_track = track
+    except (OSError, struct.error, _Mp4FormatError, IndexError) as e:
+        logging.debug(f"MP4文件头解析失败: {os.path.basename(video_path)} - {e}")
+        return {}
+
+    if not video_track or not video_track.get('width') or not video_track.get('height'):
+        return {}
+
+    duration = 0.0
+    if video_track.get('timescale'):
+        duration = video_track.get('duration', 0) / video_track['timescale']
+    if duration <= 0 and movie_timescale:
+        duration = movie_duration / movie_timescale
+    fourcc = video_track.get('fourcc', b'')
+
+    return {
+        'width': int(video_track['width']),
+        'height': int(video_track['height']),
+        'duration': float(duration),
+        'fps': float(_estimate_fps(video_track)),
+        'bitrate': int(file_size * 8 / duration) if duration > 0 else 0,
+        'codec': _CODEC_NAMES.get(fourcc, fourcc.decode('latin-1').strip() or 'unknown'),
+        'pixel_format': 'unknown',
+    }
+
+
+def is_mp4_file(video_path: str) -> bool:
+    """按扩展名判断是否适合用本解析器"""
+    return str(video_path).lower().endswith(MP4_EXTENSIONS)
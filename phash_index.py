@@ -0,0 +1,237 @@
+# _*_ coding: utf-8 _*_
+"""
+视频感知哈希索引 - 近似重复视频查找
+
+去重脚本以前只有「文件头 1MB 的 MD5 完全相同」才会进一步比较，重新编码、改过码率的
+副本头部字节完全不同，永远比不到一起。这里改为：
+- 每个视频取若干帧的感知哈希（每帧 64 位 average hash），拼成一个整数签名；
+- 签名以 (路径, 大小, 修改时间) 为键存入本地 SQLite，文件没变就不再重新抽帧；
+- 查找用 BK 树（按汉明距离组织的度量树），新加入 N 个文件只需 O(N log M) 次比较，
+  不再两两比较；
+- 输出重复簇（并查集合并），而不是一对一对的重复。
+
+使用方式：
+    index = get_phash_index()
+    sig = index.get(path)                 # 命中缓存返回整数签名，否则 None
+    index.add(path, sig, frames)
+    for other_path, distance in index.search(sig, frames, max_distance=15):
+        ...
+"""
+
+import os
+import sqlite3
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# ==================== 配置 ====================
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.video_deal')
+PHASH_INDEX_DB = os.path.join(CACHE_DIR, 'phash_index.db')
+
+# 每帧哈希的位数（imagehash 默认 8x8）
+FRAME_HASH_BITS = 64
+
+
+def signature_to_int(frame_hashes: Iterable[str]) -> int:
+    """把每帧的十六进制哈希拼成一个整数签名"""
+    value = 0
+    for frame_hash in frame_hashes:
+        value = (value << FRAME_HASH_BITS) | int(str(frame_hash), 16)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """汉明距离 BK 树：节点的子树按与该节点的距离分桶，查询时用三角不等式剪枝"""
+
+    def __init__(self):
+        # 节点结构: [签名, [路径...], {距离: 子节点}]
+        self._root: Optional[list] = None
+        self.size = 0
+
+    def add(self, key: int, item: str):
+        self.size += 1
+        if self._root is None:
+            self._root = [key, [item], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(key, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, [item], {}]
+                return
+            node = child
+
+    def search(self, key: int, max_distance: int) -> List[Tuple[str, int, int]]:
+        """返回距离不超过 max_distance 的 (路径, 签名, 距离)"""
+        results = []
+        if self._root is None:
+            return results
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(key, node[0])
+            if distance <= max_distance:
+                results.extend((item, node[0], distance) for item in node[1])
+            low, high = distance - max_distance, distance + max_distance
+            for child_distance, child in node[2].items():
+                if low <= child_distance <= high:
+                    stack.append(child)
+        return results
+
+
+class PerceptualHashIndex:
+    """持久化的视频感知哈希索引，每种帧数一棵 BK 树"""
+
+    def __init__(self, db_path: str = PHASH_INDEX_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._trees: Dict[int, BKTree] = {}
+        # 路径 -> (帧数, 签名)，用于让 BK 树里已被替换/删除的旧节点失效
+        self._current: Dict[str, Tuple[int, int]] = {}
+        # 路径 -> (大小, 修改时间)
+        self._stats: Dict[str, Tuple[int, float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS signatures (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    frames INTEGER NOT NULL,
+                    signature TEXT NOT NULL
+                )
+            ''')
+            conn.commit()
+            self._conn = conn
+            self._load(conn)
+        return self._conn
+
+    def _load(self, conn: sqlite3.Connection):
+        """启动时把全部签名装进内存 BK 树"""
+        for path, size, mtime, frames, signature in conn.execute(
+                'SELECT path, size, mtime, frames, signature FROM signatures'):
+            key = int(signature, 16)
+            self._tree(frames).add(key, path)
+            self._current[path] = (frames, key)
+            self._stats[path] = (size, mtime)
+        logging.info(f"🧬 感知哈希索引已加载 {len(self._current)} 条签名")
+
+    def _tree(self, frames: int) -> BKTree:
+        tree = self._trees.get(frames)
+        if tree is None:
+            tree = self._trees[frames] = BKTree()
+        return tree
+
+    @staticmethod
+    def _normalize(video_path: str) -> str:
+        return os.path.normcase(os.path.abspath(video_path))
+
+    def get(self, video_path: str, frames: int) -> Optional[int]:
+        """文件未变化且帧数一致时返回缓存的签名，否则 None"""
+        path = self._normalize(video_path)
+        try:
+            stat = os.stat(video_path)
+        except OSError:
+            return None
+        with self._lock:
+            self._get_conn()
+            current = self._current.get(path)
+            if current and current[0] == frames and self._stats.get(path) == (stat.st_size, stat.st_mtime):
+                self.hits += 1
+                return current[1]
+            self.misses += 1
+            return None
+
+    def add(self, video_path: str, signature: int, frames: int):
+        """写入/更新一个文件的签名"""
+        path = self._normalize(video_path)
+        try:
+            stat = os.stat(video_path)
+        except OSError:
+            return
+        with self._lock:
+            conn = self._get_conn()
+            if self._current.get(path) != (frames, signature):
+                self._tree(frames).add(signature, path)
+            self._current[path] = (frames, signature)
+            self._stats[path] = (stat.st_size, stat.st_mtime)
+            conn.execute('INSERT OR REPLACE INTO signatures (path, size, mtime, frames, signature) '
+                         'VALUES (?, ?, ?, ?, ?)', (path, stat.st_size, stat.st_mtime, frames, f'{signature:x}'))
+            conn.commit()
+
+    def remove(self, video_path: str):
+        """删除记录（BK 树中的节点惰性失效）"""
+        path = self._normalize(video_path)
+        with self._lock:
+            conn = self._get_conn()
+            self._current.pop(path, None)
+            self._stats.pop(path, None)
+            conn.execute('DELETE FROM signatures WHERE path = ?', (path,))
+            conn.commit()
+
+    def search(self, signature: int, frames: int, max_distance: int) -> List[Tuple[str, int]]:
+        """查找汉明距离不超过 max_distance 的已索引文件，返回 [(路径, 距离)]，按距离排序"""
+        with self._lock:
+            self._get_conn()
+            results = [(path, distance)
+                       for path, key, distance in self._tree(frames).search(signature, max_distance)
+                       if self._current.get(path) == (frames, key)]
+        results.sort(key=lambda r: r[1])
+        return results
+
+    def log_stats(self):
+        logging.info(f"🧬 感知哈希索引: 复用签名 {self.hits} 个, 新计算 {self.misses} 个, "
+                     f"索引总数 {len(self._current)}")
+
+
+def cluster_duplicates(pairs: Iterable[Tuple[str, str]]) -> List[List[str]]:
+    """把重复对合并成重复簇（并查集），每个簇内按路径排序"""
+    parent: Dict[str, str] = {}
+
+    def find(item: str) -> str:
+        parent.setdefault(item, item)
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    for a, b in pairs:
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[root_b] = root_a
+
+    clusters: Dict[str, List[str]] = {}
+    for item in parent:
+        clusters.setdefault(find(item), []).append(item)
+    return sorted((sorted(members) for members in clusters.values() if len(members) > 1),
+                  key=lambda members: members[0])
+
+
+_phash_index: Optional[PerceptualHashIndex] = None
+_phash_index_lock = threading.Lock()
+
+
+def get_phash_index() -> PerceptualHashIndex:
+    """获取全局索引实例"""
+    global _phash_index
+    if _phash_index is None:
+        with _phash_index_lock:
+            if _phash_index is None:
+                _phash_index = PerceptualHashIndex()
+    return _phash_index
@@ -0,0 +1,207 @@
+# _*_ coding: utf-8 _*_
+"""
+批量视频探测引擎 - 筛选/统计脚本的公共后端
+
+分辨率、时长筛选脚本以前对每个文件都启动一次 ffprobe 进程，几十万个短视频时，
+进程启动开销远大于真正读文件头的时间。这里改为：
+- 固定数量的常驻工作线程，整个运行期间复用；
+- 优先在进程内读取容器头：MP4/MOV 用纯 Python 解析 moov（见 mp4_header.py），
+  其他容器在安装了 PyAV 时用 PyAV，都不启动子进程；
+- 只有读不出来的特殊容器才回退到 ffprobe；
+- 结果写入元数据缓存（见 video_meta_cache.py），重跑同一目录零探测。
+
+返回的记录与 MC_L 的 get_video_info 结构一致：
+    {'width', 'height', 'duration', 'fps', 'codec'}，失败时为空字典 {}
+
+使用方式：
+    engine = get_probe_engine(FFPROBE_PATH)
+    for video_path, info in engine.probe_many(video_paths):
+        ...
+"""
+
+import os
+import json
+import logging
+import threading
+import subprocess
+import concurrent.futures
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from video_meta_cache import get_meta_cache
+from mp4_header import is_mp4_file, read_mp4_info
+
+try:
+    import av  # PyAV，可选依赖：pip install av
+except ImportError:
+    av = None
+
+# ==================== 配置 ====================
+DEFAULT_FFPROBE_PATH = 'ffprobe'
+DEFAULT_WORKERS = 8
+FFPROBE_TIMEOUT = 30
+
+# 缓存命名空间，所有使用本引擎的脚本共用
+CACHE_KIND = 'probe_record'
+
+
+def _parse_rate(rate: Any) -> float:
+    """把 '30000/1001' 这类帧率字符串转成浮点数"""
+    try:
+        if isinstance(rate, str) and '/' in rate:
+            num, den = rate.split('/', 1)
+            return float(num) / float(den) if float(den) != 0 else 0.0
+        return float(rate or 0)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def _is_valid_record(info: Dict[str, Any]) -> bool:
+    return bool(info) and info.get('width', 0) > 0 and info.get('height', 0) > 0
+
+
+def probe_with_pyav(video_path: str) -> Dict[str, Any]:
+    """用 PyAV 在进程内读取容器头，失败返回空字典"""
+    if av is None:
+        return {}
+    try:
+        with av.open(video_path, metadata_errors='ignore') as container:
+            if not container.streams.video:
+                return {}
+            stream = container.streams.video[0]
+            duration = 0.0
+            if container.duration:
+                duration = container.duration / av.time_base
+            elif stream.duration and stream.time_base:
+                duration = float(stream.duration * stream.time_base)
+            rate = stream.average_rate or stream.guessed_rate
+            return {
+                'width': int(stream.codec_context.width or 0),
+                'height': int(stream.codec_context.height or 0),
+                'duration': float(duration),
+                'fps': float(rate) if rate else 0.0,
+                'codec': stream.codec_context.name or 'unknown',
+            }
+    except Exception as e:
+        logging.debug(f"PyAV读取失败，回退ffprobe: {os.path.basename(video_path)} - {e}")
+        return {}
+
+
+def probe_with_ffprobe(video_path: str, ffprobe_path: str = DEFAULT_FFPROBE_PATH) -> Dict[str, Any]:
+    """ffprobe 兜底探测，失败返回空字典"""
+    try:
+        cmd = [ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
+               '-show_entries', 'stream=width,height,duration,r_frame_rate,codec_name:format=duration',
+               '-of', 'json', video_path]
+        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore',
+                                timeout=FFPROBE_TIMEOUT, stdin=subprocess.DEVNULL)
+        if result.returncode != 0 or not result.stdout.strip():
+            return {}
+        data = json.loads(result.stdout)
+        streams = data.get('streams', [])
+        if not streams:
+            return {}
+        stream = streams[0]
+        duration = float(data.get('format', {}).get('duration', 0) or 0)
+        if duration <= 0:
+            duration = float(stream.get('duration', 0) or 0)
+        return {
+            'width': int(stream.get('width', 0) or 0),
+            'height': int(stream.get('height', 0) or 0),
+            'duration': duration,
+            'fps': _parse_rate(stream.get('r_frame_rate', '0/1')),
+            'codec': stream.get('codec_name', 'unknown'),
+        }
+    except subprocess.TimeoutExpired:
+        logging.warning(f"ffprobe超时: {os.path.basename(video_path)}")
+        return {}
+    except Exception as e:
+        logging.warning(f"ffprobe探测失败: {os.path.basename(video_path)} - {e}")
+        return {}
+
+
+class ProbeEngine:
+    """常驻线程池 + 进程内读头 + ffprobe 兜底的批量探测引擎"""
+
+    def __init__(self, ffprobe_path: str = DEFAULT_FFPROBE_PATH, workers: int = DEFAULT_WORKERS):
+        self.ffprobe_path = ffprobe_path or DEFAULT_FFPROBE_PATH
+        self.workers = max(1, workers)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix='probe')
+        self._stats_lock = threading.Lock()
+        self.stats = {'mp4_header': 0, 'in_process': 0, 'ffprobe': 0, 'failed': 0}
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _probe_uncached(self, video_path: str) -> Dict[str, Any]:
+        if is_mp4_file(video_path):
+            info = read_mp4_info(video_path)
+            if _is_valid_record(info):
+                self._count('mp4_header')
+                return info
+        info = probe_with_pyav(video_path)
+        if _is_valid_record(info):
+            self._count('in_process')
+            return info
+        info = probe_with_ffprobe(video_path, self.ffprobe_path)
+        if _is_valid_record(info):
+            self._count('ffprobe')
+            return info
+        self._count('failed')
+        return {}
+
+    def probe(self, video_path: str) -> Dict[str, Any]:
+        """探测单个文件（在调用线程中执行）"""
+        return get_meta_cache().get_or_probe(
+            CACHE_KIND, str(video_path), lambda: self._probe_uncached(str(video_path)), _is_valid_record)
+
+    def probe_many(self, video_paths: Iterable[str]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        批量探测，按完成顺序产出 (路径, 信息)
+
+        同时在途的任务数限制为工作线程数的 4 倍，输入可以是边扫描边产出的生成器。
+        """
+        max_in_flight = self.workers * 4
+        pending = {}
+        for video_path in video_paths:
+            pending[self._executor.submit(self.probe, video_path)] = video_path
+            if len(pending) >= max_in_flight:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+        for future in concurrent.futures.as_completed(list(pending)):
+            yield pending.pop(future), future.result()
+
+    def probe_all(self, video_paths: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """批量探测，一次性返回 {路径: 信息}"""
+        return dict(self.probe_many(video_paths))
+
+    def log_stats(self):
+        """输出探测方式统计"""
+        logging.info(f"🔍 探测统计: MP4文件头 {self.stats['mp4_header']} 个, PyAV读头 {self.stats['in_process']} 个, "
+                     f"ffprobe兜底 {self.stats['ffprobe']} 个, 失败 {self.stats['failed']} 个")
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+_engines: Dict[str, ProbeEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_probe_engine(ffprobe_path: Optional[str] = None, workers: int = DEFAULT_WORKERS) -> ProbeEngine:
+    """获取共享的探测引擎（同一个 ffprobe 路径只创建一个线程池）"""
+    key = ffprobe_path or DEFAULT_FFPROBE_PATH
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = ProbeEngine(key, workers)
+            _engines[key] = engine
+        return engine
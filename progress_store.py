@@ -0,0 +1,370 @@
+# _*_ coding: utf-8 _*_
+"""
+视频处理进度记录：JSON 快照 + 追加日志 - 批量裁剪/切头尾/MC_L/终极处理器共用
+
+以前每次 mark_processing / mark_completed / mark_failed 都把整个 progress_data 用 indent=2
+重新序列化、写临时文件、改名，文件放在 NAS 的 PROGRESS_FOLDER 上；检查是否已完成时又要把
+completed 列表从头扫一遍。处理过 10 万个视频后，每次状态变化都要在锁里写好几 MB。这里改为：
+- 内存里按文件名建索引（已完成、处理中、失败各一个字典），按 (文件名, 大小) 或签名查询都是 O(1)；
+- 每次状态变化只往 .journal 追加一行操作记录，后台线程每隔一小段时间把攒下的操作一次写入并 fsync
+  （成组提交），进程正常退出时自动写完；
+- 日志条数超过记录数时压缩：把当前状态写回原来的 JSON 文件（格式不变，旧版脚本也能读），
+  再清空日志；快照和日志首行各带一个 generation，压缩中途断电时不会把旧日志重放两遍；
+- 原有的 video_processing_progress.json 等文件直接作为第一次的快照加载，不需要单独迁移。
+（NAS 上 SQLite 的 WAL 依赖本机共享内存，跨 SMB 不可靠，所以这里用追加日志。每台电脑各用
+各自的进度文件夹，同一个进度文件只由一个进程写。）
+
+使用方式：
+    store = ProgressStore(progress_file, defaults={'roi_settings': None, 'start_time': None})
+    if not store.is_completed(name):
+        store.mark_processing(name)
+        ...
+        store.mark_completed(name, {'name': name, 'size': size, 'output_name': out_name})
+    store.find_completed(name, size)         # 按 (文件名, 大小) 查已完成记录
+    store.set('roi_settings', roi)
+    store.close()                            # 退出前写完日志（atexit 也会调用）
+"""
+
+import os
+import json
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# ==================== 配置 ====================
+# 后台线程把攒下的操作写入日志的间隔（秒）；进程异常退出最多丢这么久的记录
+FLUSH_INTERVAL = 1.0
+# 日志条数超过 max(该值, 已完成记录数) 时压缩成快照
+COMPACT_MIN_OPS = 5000
+JOURNAL_SUFFIX = '.journal'
+# 快照里记录对应日志代数的字段
+GENERATION_KEY = '_journal_generation'
+
+
+def _record_name(record) -> Optional[str]:
+    """completed / failed 里的记录可能是字典，也可能是旧版只存了文件名的字符串"""
+    if isinstance(record, dict):
+        return record.get('name')
+    if isinstance(record, str):
+        return record
+    return None
+
+
+class ProgressStore:
+    """按文件名索引的进度记录，修改只追加日志"""
+
+    def __init__(self, json_path: str, defaults: Optional[Dict[str, Any]] = None,
+                 flush_interval: float = FLUSH_INTERVAL, logger=None):
+        self.json_path = json_path
+        self.journal_path = json_path + JOURNAL_SUFFIX
+        self.defaults = dict(defaults or {})
+        self.flush_interval = flush_interval
+        self.logger = logger or logging.getLogger('progress_store')
+
+        self._lock = threading.RLock()
+        self._completed: Dict[str, Any] = OrderedDict()
+        self._processing: Dict[str, None] = OrderedDict()
+        self._failed: Dict[str, Any] = OrderedDict()
+        self._signatures: Dict[str, Any] = {}
+        self._meta: Dict[str, Any] = {}
+        self._generation = 0
+        self._journal_ops = 0
+        self._pending: List[str] = []
+        self._closed = False
+
+        self.stats = {'ops': 0, 'flushes': 0, 'compactions': 0, 'replayed': 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(json_path)), exist_ok=True)
+        self._load()
+
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name='progress-flush', daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    # ==================== 加载 ====================
+    def _load(self):
+        snapshot = {}
+        if os.path.exists(self.json_path):
+            try:
+                with open(self.json_path, 'r', encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except Exception as e:
+                self.logger.warning(f"加载进度文件失败，按空记录处理: {e}")
+                snapshot = {}
+        self._generation = int(snapshot.get(GENERATION_KEY, 0) or 0)
+
+        for record in snapshot.get('completed', []) or []:
+            name = _record_name(record)
+            if name is not None:
+                self._completed.pop(name, None)  # 旧文件里可能有重复，以最后一条为准
+                self._completed[name] = record
+        for name in snapshot.get('processing', []) or []:
+            if isinstance(name, str):
+                self._processing[name] = None
+        for record in snapshot.get('failed', []) or []:
+            name = _record_name(record)
+            if name is not None:
+                self._failed[name] = record
+        self._signatures = dict(snapshot.get('video_signatures') or {})
+        for key, value in snapshot.items():
+            if key not in ('completed', 'processing', 'failed', 'video_signatures', GENERATION_KEY):
+                self._meta[key] = value
+        for key, value in self.defaults.items():
+            self._meta.setdefault(key, value)
+
+        self._replay_journal()
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            self._write_journal_header()
+            return
+        with open(self.journal_path, 'rb') as f:
+            data = f.read()
+        lines = data.split(b'\n')
+        # 最后一段没有换行符说明写到一半断电了，丢弃
+        complete_lines = lines[:-1]
+        try:
+            header = json.loads(complete_lines[0]) if complete_lines else {}
+        except ValueError:
+            header = {}
+        if header.get('generation') != self._generation:
+            # 压缩时快照已经写好、日志还没来得及清空，日志里的操作都已经在快照里了
+            self._write_journal_header()
+            return
+        for line in complete_lines[1:]:
+            if not line.strip():
+                continue
+            try:
+                self._apply(json.loads(line))
+            except (ValueError, KeyError, TypeError):
+                continue
+            self._journal_ops += 1
+        self.stats['replayed'] = self._journal_ops
+        if len(lines[-1]):
+            self.logger.warning("进度日志末尾有一条不完整的记录，已忽略")
+            self._compact_locked()
+
+    def _write_journal_header(self):
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'generation': self._generation}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        self._journal_ops = 0
+
+    # ==================== 操作 ====================
+    def _apply(self, op: Dict[str, Any]):
+        kind = op['op']
+        name = op.get('name')
+        if kind == 'complete':
+            self._completed.pop(name, None)
+            self._completed[name] = op['record']
+            self._processing.pop(name, None)
+            self._failed.pop(name, None)
+        elif kind == 'processing':
+            self._processing[name] = None
+        elif kind == 'unprocessing':
+            self._processing.pop(name, None)
+        elif kind == 'fail':
+            self._failed.pop(name, None)
+            self._failed[name] = op['record']
+            self._processing.pop(name, None)
+        elif kind == 'uncomplete':
+            self._completed.pop(name, None)
+        elif kind == 'unfail':
+            self._failed.pop(name, None)
+        elif kind == 'signature':
+            self._signatures[op['signature']] = op['record']
+        elif kind == 'set':
+            self._meta[op['key']] = op['value']
+        elif kind == 'append':
+            items = self._meta.get(op['key'])
+            if not isinstance(items, list):
+                items = self._meta[op['key']] = []
+            items.append(op['value'])
+            limit = op.get('limit')
+            if limit and len(items) > limit:
+                del items[:-limit]
+
+    def _log(self, op: Dict[str, Any]):
+        """应用一条操作并放进待写队列（调用方持有锁）"""
+        self._apply(op)
+        self._pending.append(json.dumps(op, ensure_ascii=False))
+        self.stats['ops'] += 1
+
+    def mark_completed(self, name: str, record: Any = None):
+        """记为已完成，同时移出处理中和失败列表；record 默认只存文件名"""
+        with self._lock:
+            self._log({'op': 'complete', 'name': name, 'record': record if record is not None else name})
+
+    def mark_processing(self, name: str):
+        with self._lock:
+            if name not in self._processing:
+                self._log({'op': 'processing', 'name': name})
+
+    def clear_processing(self, name: str) -> bool:
+        """移出处理中列表，原来不在列表里返回 False"""
+        with self._lock:
+            if name not in self._processing:
+                return False
+            self._log({'op': 'unprocessing', 'name': name})
+            return True
+
+    def mark_failed(self, name: str, record: Any, replace: bool = True):
+        """记为失败并移出处理中列表；replace=False 时已有的失败记录保持不变"""
+        with self._lock:
+            if not replace and name in self._failed:
+                self.clear_processing(name)
+                return
+            self._log({'op': 'fail', 'name': name, 'record': record})
+
+    def remove_completed(self, name: str):
+        with self._lock:
+            if name in self._completed:
+                self._log({'op': 'uncomplete', 'name': name})
+
+    def remove_failed(self, name: str):
+        with self._lock:
+            if name in self._failed:
+                self._log({'op': 'unfail', 'name': name})
+
+    def set_signature(self, signature: str, record: Any):
+        with self._lock:
+            self._log({'op': 'signature', 'name': None, 'signature': signature, 'record': record})
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._log({'op': 'set', 'key': key, 'value': value})
+
+    def append(self, key: str, value: Any, limit: Optional[int] = None):
+        """往列表类型的字段（比如 performance_history）追加一项，limit 为保留的最大条数"""
+        with self._lock:
+            self._log({'op': 'append', 'key': key, 'value': value, 'limit': limit})
+
+    # ==================== 查询 ====================
+    def is_completed(self, name: str) -> bool:
+        with self._lock:
+            return name in self._completed
+
+    def get_completed(self, name: str) -> Any:
+        with self._lock:
+            return self._completed.get(name)
+
+    def find_completed(self, name: str, size: int) -> Any:
+        """按 (文件名, 大小) 查已完成记录；旧版只有文件名的记录按文件名命中"""
+        with self._lock:
+            record = self._completed.get(name)
+        if record is None:
+            return None
+        if isinstance(record, dict) and 'size' in record and record.get('size') != size:
+            return None
+        return record
+
+    def get_signature(self, signature: str) -> Any:
+        with self._lock:
+            return self._signatures.get(signature)
+
+    def is_processing(self, name: str) -> bool:
+        with self._lock:
+            return name in self._processing
+
+    def is_failed(self, name: str) -> bool:
+        with self._lock:
+            return name in self._failed
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            return self._meta.get(key, default)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {'completed': len(self._completed), 'processing': len(self._processing),
+                    'failed': len(self._failed)}
+
+    def completed_records(self) -> List[Any]:
+        with self._lock:
+            return list(self._completed.values())
+
+    def processing_names(self) -> List[str]:
+        with self._lock:
+            return list(self._processing)
+
+    def failed_records(self) -> List[Any]:
+        with self._lock:
+            return list(self._failed.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        """导出成原来 progress_data 的格式"""
+        with self._lock:
+            data = dict(self._meta)
+            data['completed'] = list(self._completed.values())
+            data['processing'] = list(self._processing)
+            data['failed'] = list(self._failed.values())
+            if self._signatures:
+                data['video_signatures'] = dict(self._signatures)
+            return data
+
+    # ==================== 落盘 ====================
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.error(f"写入进度日志失败: {e}")
+
+    def flush(self):
+        """把攒下的操作一次写入日志；日志太长时压缩"""
+        with self._lock:
+            if not self._pending:
+                return
+            payload = ('\n'.join(self._pending) + '\n').encode('utf-8')
+            with open(self.journal_path, 'ab') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_ops += len(self._pending)
+            self._pending = []
+            self.stats['flushes'] += 1
+            if self._journal_ops > max(COMPACT_MIN_OPS, len(self._completed)):
+                self._compact_locked()
+
+    def compact(self):
+        with self._lock:
+            self._pending = []
+            self._compact_locked()
+
+    def _compact_locked(self):
+        """把当前状态写成新一代快照，再换一个只有表头的新日志"""
+        self._generation += 1
+        data = self.to_dict()
+        data[GENERATION_KEY] = self._generation
+        tmp_path = self.json_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.json_path)
+        self._write_journal_header()
+        self._pending = []
+        self.stats['compactions'] += 1
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception as e:
+            self.logger.error(f"写入进度日志失败: {e}")
+
+    def log_stats(self):
+        counts = self.counts()
+        s = self.stats
+        self.logger.info(f"📒 进度记录: 已完成 {counts['completed']}, 处理中 {counts['processing']}, "
+                         f"失败 {counts['failed']}; 本次 {s['ops']} 条操作, {s['flushes']} 次写入, "
+                         f"压缩 {s['compactions']} 次, 启动时重放 {s['replayed']} 条")
@@ -0,0 +1,279 @@
+# _*_ coding: utf-8 _*_
+"""
+关键帧对齐的切头尾（smart cut）- 只重新编码两端不完整的 GOP
+
+切头尾脚本以前为了去掉片头片尾的几十秒，把中间整段视频重新编码一遍，一小时的源文件
+要编码好几分钟；直接 -c copy 又只能从关键帧开始，切点不准。不裁剪画面时其实只需要：
+- 用 ffprobe 只读切点附近的包（-read_intervals，不解码），找到片头切点之后的第一个关键帧 K1
+  和片尾切点之前的最后一个关键帧 K2；
+- [K1, K2) 是完整的 GOP，直接流复制；
+- [切点, K1) 和 [K2, 片尾切点) 两小段按源视频的编码格式、profile、像素格式、帧率重新编码；
+- 三段都写成 MPEG-TS（码流自带 SPS/PPS），最后用 concat demuxer 无损拼接成 MP4。
+一小时的视频只编码几秒钟，其余全是顺序读写。
+
+源视频不是 H.264/HEVC、两个关键帧之间太短不值得拆分、或者任何一步失败时返回 False，
+调用方照常走整段重新编码。
+
+使用方式：
+    if not smart_cut(video_path, output_path, head_cut, duration - tail_cut,
+                     ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH):
+        ...  # 回退到原来的整段编码
+"""
+
+import os
+import json
+import shutil
+import logging
+import subprocess
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# ==================== 配置 ====================
+DEFAULT_FFMPEG_PATH = 'ffmpeg'
+DEFAULT_FFPROBE_PATH = 'ffprobe'
+# 在切点之后/之前多长范围内找关键帧（秒），应大于源视频最长的 GOP
+KEYFRAME_SEARCH_WINDOW = 30.0
+# 中间可流复制的部分短于这个时长时不值得拆分（秒）
+MIN_COPY_SECONDS = 10.0
+# 两端不足一帧的小段直接省略（秒）
+MIN_PIECE_SECONDS = 0.05
+# 时间戳按 6 位小数打印，seek 到关键帧时留一点余量，避免落到前一个关键帧
+SEEK_EPSILON = 0.001
+PROBE_TIMEOUT = 60
+# 两端小段的编码质量
+BOUNDARY_CRF = 18
+BOUNDARY_PRESET = 'medium'
+DEFAULT_AUDIO_BITRATE = '192k'
+
+# 源编码 -> (软件编码器, ffprobe profile 名称 -> 编码器 -profile:v 取值)
+_ENCODERS = {
+    'h264': ('libx264', {'high': 'high', 'main': 'main', 'baseline': 'baseline',
+                         'constrained baseline': 'baseline', 'high 10': 'high10',
+                         'high 4:2:2': 'high422', 'high 4:4:4 predictive': 'high444'}),
+    'hevc': ('libx265', {'main': 'main', 'main 10': 'main10', 'main still picture': 'mainstillpicture'}),
+}
+
+
+def probe_streams(video_path: str, ffprobe_path: str = DEFAULT_FFPROBE_PATH) -> Optional[Dict[str, Any]]:
+    """读取第一路视频和音频的编码参数"""
+    cmd = [ffprobe_path, '-v', 'error',
+           '-show_entries', 'stream=index,codec_type,codec_name,profile,level,pix_fmt,width,height,'
+                            'r_frame_rate,sample_rate,channels,bit_rate',
+           '-of', 'json', video_path]
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=PROBE_TIMEOUT)
+        if result.returncode != 0:
+            return None
+        streams = json.loads(result.stdout.decode('utf-8', errors='ignore')).get('streams', [])
+    except Exception:
+        return None
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+    if video is None:
+        return None
+    return {'video': video, 'audio': audio}
+
+
+def probe_start_time(video_path: str, ffprobe_path: str = DEFAULT_FFPROBE_PATH) -> float:
+    """容器的 start_time（秒），读不到时按 0 处理"""
+    cmd = [ffprobe_path, '-v', 'error', '-show_entries', 'format=start_time',
+           '-of', 'default=noprint_wrappers=1:nokey=1', video_path]
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=PROBE_TIMEOUT)
+        return float(result.stdout.decode('utf-8', errors='ignore').strip()) if result.returncode == 0 else 0.0
+    except (OSError, subprocess.TimeoutExpired, ValueError):
+        return 0.0
+
+
+def probe_keyframes(video_path: str, ranges: List[Tuple[float, float]],
+                    ffprobe_path: str = DEFAULT_FFPROBE_PATH) -> List[float]:
+    """
+    列出若干时间范围内的关键帧时间戳（只读包，不解码）
+
+    包的 pts_time 和 -read_intervals 都是绝对时间戳，而 ffmpeg 的输入 -ss / -t 从容器的
+    start_time 算起（MPEG-TS、部分 MP4 不从 0 开始）。这里的 ranges 和返回值都相对 start_time，
+    可以直接用于 -ss，否则重新编码的小段和流复制的中间段在接缝处会重叠或留空。
+    """
+    offset = probe_start_time(video_path, ffprobe_path)
+    intervals = ','.join(f"{max(a, 0.0) + offset:.3f}%{max(b, 0.0) + offset:.3f}" for a, b in ranges)
+    cmd = [ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
+           '-read_intervals', intervals,
+           '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', video_path]
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=PROBE_TIMEOUT)
+    except Exception:
+        return []
+    if result.returncode != 0:
+        return []
+    keyframes = set()
+    for line in result.stdout.decode('utf-8', errors='ignore').splitlines():
+        pts = None
+        is_key = False
+        for field in line.strip().split(','):
+            if field.startswith('K'):
+                is_key = True
+            else:
+                try:
+                    pts = float(field)
+                except ValueError:
+                    pass
+        if is_key and pts is not None:
+            keyframes.add(round(pts - offset, 6))
+    return sorted(keyframes)
+
+
+def find_keyframes(video_path: str, start: float, end: float,
+                   ffprobe_path: str = DEFAULT_FFPROBE_PATH,
+                   window: float = KEYFRAME_SEARCH_WINDOW) -> List[float]:
+    """列出 [start, start+window] 和 [end-window, end] 附近的关键帧时间戳"""
+    return probe_keyframes(video_path, [(start, start + window), (end - window, end + 1)], ffprobe_path)
+
+
+def plan_cut(keyframes: List[float], start: float, end: float) -> Optional[Dict[str, float]]:
+    """根据关键帧确定三段的边界；中间部分太短时返回 None"""
+    after_start = [k for k in keyframes if k >= start - SEEK_EPSILON]
+    before_end = [k for k in keyframes if k <= end + SEEK_EPSILON]
+    if not after_start or not before_end:
+        return None
+    k1, k2 = after_start[0], before_end[-1]
+    if k2 - k1 < MIN_COPY_SECONDS:
+        return None
+    return {'start': start, 'k1': k1, 'k2': k2, 'end': end}
+
+
+def _encode_args(streams: Dict[str, Any]) -> Optional[List[str]]:
+    """两端小段的视频编码参数，尽量和源视频一致，保证拼接后能连续解码"""
+    video = streams['video']
+    codec = video.get('codec_name')
+    if codec not in _ENCODERS:
+        return None
+    encoder, profiles = _ENCODERS[codec]
+    args = ['-c:v', encoder, '-preset', BOUNDARY_PRESET, '-crf', str(BOUNDARY_CRF)]
+    profile = profiles.get(str(video.get('profile', '')).lower())
+    if profile:
+        args.extend(['-profile:v', profile])
+    level = video.get('level')
+    if codec == 'h264' and isinstance(level, int) and level > 0:
+        args.extend(['-level', f"{level / 10:.1f}"])
+    if video.get('pix_fmt'):
+        args.extend(['-pix_fmt', video['pix_fmt']])
+    rate = video.get('r_frame_rate')
+    if rate and rate != '0/0':
+        args.extend(['-r', rate])
+    return args
+
+
+def _audio_args(streams: Dict[str, Any], copy_ok: bool) -> List[str]:
+    audio = streams.get('audio')
+    if audio is None:
+        return ['-an']
+    if copy_ok and audio.get('codec_name') == 'aac':
+        return ['-c:a', 'copy']
+    args = ['-c:a', 'aac', '-b:a', DEFAULT_AUDIO_BITRATE]
+    if audio.get('sample_rate'):
+        args.extend(['-ar', str(audio['sample_rate'])])
+    if audio.get('channels'):
+        args.extend(['-ac', str(audio['channels'])])
+    return args
+
+
+def _run(cmd: List[str], timeout: float, logger) -> bool:
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logger.warning(f"smart cut 子进程超时: {' '.join(cmd[:4])} ...")
+        return False
+    if result.returncode != 0:
+        tail = result.stderr.decode('utf-8', errors='ignore').strip().splitlines()[-3:]
+        logger.warning(f"smart cut 子进程失败 ({result.returncode}): {' | '.join(tail)}")
+        return False
+    return True
+
+
+def smart_cut(video_path: str, output_path: str, start: float, end: float,
+              ffmpeg_path: str = DEFAULT_FFMPEG_PATH, ffprobe_path: str = DEFAULT_FFPROBE_PATH,
+              progress: Optional[Callable[[float, str], None]] = None, logger=None) -> bool:
+    """
+    把 [start, end) 切出来写到 output_path，只重新编码两端不完整的 GOP
+
+    Args:
+        start / end: 片头切点和片尾切点（秒，相对源视频开头）
+        progress: progress(比例 0~1, 阶段说明)，每完成一段调用一次
+    Returns:
+        成功返回 True；不适合 smart cut 或失败时返回 False（不会留下输出文件），调用方回退到整段编码
+    """
+    logger = logger or logging.getLogger('smart_cut')
+    name = os.path.basename(video_path)
+
+    streams = probe_streams(video_path, ffprobe_path)
+    if streams is None:
+        logger.info(f"smart cut 跳过（无法读取流信息）: {name}")
+        return False
+    video_args = _encode_args(streams)
+    if video_args is None:
+        logger.info(f"smart cut 跳过（不支持的编码 {streams['video'].get('codec_name')}）: {name}")
+        return False
+    plan = plan_cut(find_keyframes(video_path, start, end, ffprobe_path), start, end)
+    if plan is None:
+        logger.info(f"smart cut 跳过（切点附近没有可用的关键帧）: {name}")
+        return False
+
+    k1, k2 = plan['k1'], plan['k2']
+    work_dir = output_path + '.smartcut'
+    os.makedirs(work_dir, exist_ok=True)
+    # 大文件流复制的超时按时长放宽
+    copy_timeout = max(600.0, (k2 - k1) * 0.5)
+    base = [ffmpeg_path, '-y', '-nostdin', '-hide_banner', '-loglevel', 'error']
+    maps = ['-map', '0:v:0', '-map', '0:a:0?', '-sn', '-dn', '-map_metadata', '-1']
+
+    pieces = []
+    jobs = []
+    if k1 - start > MIN_PIECE_SECONDS:
+        jobs.append(('片头边界', os.path.join(work_dir, 'head.ts'), base + [
+            '-ss', f"{start:.6f}", '-i', video_path, '-t', f"{k1 - start:.6f}", *maps,
+            *video_args, *_audio_args(streams, False), '-f', 'mpegts'], 300))
+    jobs.append(('中间流复制', os.path.join(work_dir, 'body.ts'), base + [
+        '-ss', f"{k1 + SEEK_EPSILON:.6f}", '-i', video_path, '-t', f"{k2 - k1 - SEEK_EPSILON:.6f}", *maps,
+        '-c:v', 'copy', *_audio_args(streams, True), '-f', 'mpegts'], copy_timeout))
+    if end - k2 > MIN_PIECE_SECONDS:
+        # 片尾重新编码是精确 seek，从 k2 本身开始（SEEK_EPSILON 只用于流复制时避开前一个关键帧）
+        jobs.append(('片尾边界', os.path.join(work_dir, 'tail.ts'), base + [
+            '-ss', f"{k2:.6f}", '-i', video_path, '-t', f"{end - k2:.6f}", *maps,
+            *video_args, *_audio_args(streams, False), '-f', 'mpegts'], 300))
+
+    ok = False
+    try:
+        for index, (label, piece_path, cmd, timeout) in enumerate(jobs):
+            if not _run(cmd + [piece_path], timeout, logger):
+                return False
+            pieces.append(piece_path)
+            if progress:
+                progress((index + 1) / (len(jobs) + 1), label)
+
+        list_file = os.path.join(work_dir, 'concat_list.txt')
+        with open(list_file, 'w', encoding='utf-8') as f:
+            for piece_path in pieces:
+                safe_path = piece_path.replace('\\', '/').replace("'", "'\\''")
+                f.write(f"file '{safe_path}'\n")
+        concat_cmd = base + ['-f', 'concat', '-safe', '0', '-i', list_file, '-map', '0',
+                             '-c', 'copy', '-bsf:a', 'aac_adtstoasc', '-movflags', '+faststart',
+                             '-f', 'mp4', output_path]
+        if streams.get('audio') is None:
+            concat_cmd.remove('-bsf:a')
+            concat_cmd.remove('aac_adtstoasc')
+        if not _run(concat_cmd, copy_timeout, logger):
+            return False
+        if progress:
+            progress(1.0, '拼接完成')
+
+        reencoded = (k1 - start) + (end - k2)
+        logger.info(f"✂️ smart cut 完成: {name} 流复制 {k2 - k1:.1f}s, 重新编码 {reencoded:.1f}s "
+                    f"(关键帧 {k1:.3f}s ~ {k2:.3f}s)")
+        ok = True
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if not ok and os.path.exists(output_path):
+            try:
+                os.remove(output_path)
+            except OSError:
+                pass
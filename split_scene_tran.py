@@ -28,7 +28,6 @@ import os
 import sys
 import logging
 import shutil
-import glob
 import threading
 import subprocess # For running FFmpeg
 import time
@@ -38,6 +37,7 @@ from scenedetect import SceneManager, ContentDetector, StatsManager, VideoOpenFa
 from scenedetect.backends import VideoStreamCv2
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor
+from file_index import iter_video_files
 import cv2
 
 # --- Configuration ---
@@ -273,19 +273,12 @@ def find_video_files(root_dir, extensions=('mp4', 'avi', 'mov', 'mkv')):
     """Recursively finds all video files in a directory with specified extensions."""
     video_files = []
     logger.info(f"Searching for video files with extensions {extensions} in {root_dir}...") # Use logger
-    count = 0
-    for ext in extensions:
-        # Use os.path.normpath 确保路径格式一致
-        pattern = os.path.join(os.path.normpath(root_dir), '**', f'*.{ext}')
-        logger.debug(f"Searching pattern: {pattern}") # Use logger
-        try:
-            # glob 可能对非常大的目录效率不高，但对于几百个文件通常没问题
-            files = glob.glob(pattern, recursive=True)
-            video_files.extend(files)
-            count += len(files)
-            logger.debug(f"Found {len(files)} files with extension .{ext}") # Use logger
-        except Exception as e:
-             logger.error(f"Error searching for files with pattern {pattern}: {e}") # Use logger
+    try:
+        # One pass over the persistent directory index instead of one recursive glob per extension;
+        # unchanged directories are served from the index without listing them again.
+        video_files = list(iter_video_files(os.path.normpath(root_dir), extensions))
+    except Exception as e:
+        logger.error(f"Error searching for files in {root_dir}: {e}") # Use logger
     logger.info(f"Found a total of {len(video_files)} video files.") # Use logger
     return video_files # <-- ADD THIS LINE
 
@@ -9,6 +9,12 @@ import sys
 import time
 import socket
 import shutil
+import threading
+from urllib.parse import urlparse
+
+from task_pool import PrefetchWorkerPool
+from task_claim import TaskClaimer
+from bandwidth_scheduler import BandwidthClient
 
 # ==============================================================================
 # --- 全局配置区 ---
@@ -56,6 +62,19 @@ ARIA2C_ARGS = "-c -x 16 -s 16 -k 1M --console-log-level=warn --summary-interval=
 # 【代码优化】根据您的要求，将阈值从 5GB 修改为 10GB。
 MIN_FREE_SPACE_GB = 200
 
+# 6. 工作池配置
+# ------------------------------------------------------------------------------
+# 同时下载的任务数；同一主机（CDN 域名）同时下载的任务数上限。
+# 元数据线程会一次领取一批任务，并提前解析好视频地址，下载线程拿到就直接开始下载。
+DOWNLOAD_WORKERS = 3
+DOWNLOADS_PER_HOST = 2
+
+# 7. 带宽调度配置
+# ------------------------------------------------------------------------------
+# 与本机其他下载器、video_moving.py 共用 bandwidth_scheduler 守护进程的总限速，数值越大分到的带宽越多。
+# 限速在 yt-dlp 的进度回调里进行；使用 aria2c 时回调拿不到实时字节数，不受限速控制。
+BANDWIDTH_PRIORITY = 1
+
 # ==============================================================================
 # --- 程序核心代码 ---
 # (通常无需修改以下内容)
@@ -107,17 +126,34 @@ class YtDlpLogger:
         print(f"[{timestamp}] [错误] {msg}")
 
 
+# 所有下载线程共用一份带宽额度（守护进程没启动时不限速）
+bandwidth_limiter = BandwidthClient('sql_download_pro', resource='net', priority=BANDWIDTH_PRIORITY,
+                                    logger=YtDlpLogger())
+# 每个文件上次回调时的已下载字节数，用于计算增量
+_downloaded_bytes = {}
+_downloaded_lock = threading.Lock()
+
+
 def progress_hook(d):
     """
     yt-dlp 的进度回调函数，用于在单行显示下载状态。
+    回调在下载线程里同步执行，在这里等带宽额度就相当于放慢了这个下载。
     """
     if d['status'] == 'downloading':
+        downloaded = d.get('downloaded_bytes') or 0
+        with _downloaded_lock:
+            delta = downloaded - _downloaded_bytes.get(d.get('filename'), 0)
+            _downloaded_bytes[d.get('filename')] = downloaded
+        if delta > 0:
+            bandwidth_limiter.throttle(delta)
         percent = d.get('_percent_str', 'N/A').strip()
         speed = d.get('_speed_str', 'N/A').strip()
         eta = d.get('_eta_str', 'N/A').strip()
         sys.stdout.write(f"\r\t下载中: {percent} | 速度: {speed} | 剩余时间: {eta}   ")
         sys.stdout.flush()
     elif d['status'] == 'finished':
+        with _downloaded_lock:
+            _downloaded_bytes.pop(d.get('filename'), None)
         print(f"\n\t[成功] 文件 '{os.path.basename(d['filename'])}' 下载完成。")
 
 
@@ -148,9 +184,36 @@ def check_disk_space(path, min_gb):
         return False, 0
 
 
+def set_task_status(db_config, table_name, task_id, status):
+    """
+    更新单个任务的状态，数据库异常时打印错误但不中断下载。
+    """
+    try:
+        conn = mysql.connector.connect(**db_config)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"UPDATE `{table_name}` SET status = %s WHERE id = %s;", (status, task_id))
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+    except mysql.connector.Error as err:
+        print(f"\n[数据库错误] 更新任务 {task_id} 状态为 {status} 失败: {err}")
+
+
+def task_url(task):
+    """
+    数据库里可能只存了视频 ID，补全为完整链接。
+    """
+    url_or_id = task['url']
+    if not url_or_id.startswith(('http://', 'https://')):
+        return f"https://v.douyu.com/show/{url_or_id}"
+    return url_or_id
+
+
 def download_videos_from_db(db_config, table_name, download_path, ffmpeg_location, downloader_name, machine_name):
     """
-    从 MySQL 数据库中获取 URL 并使用 yt-dlp 进行下载。
+    从 MySQL 数据库中批量领取 URL，提前解析视频地址，并使用 yt-dlp 多任务并行下载。
     """
     os.makedirs(download_path, exist_ok=True)
     print(f"下载路径已设置为: {os.path.abspath(download_path)}")
@@ -176,82 +239,87 @@ def download_videos_from_db(db_config, table_name, download_path, ffmpeg_locatio
         ydl_opts['concurrent_fragments'] = YT_DLP_CONCURRENT_FRAGMENTS
         ydl_opts['fragment_retries'] = YT_DLP_FRAGMENT_RETRIES
 
-    while True:
-        conn = None
-        cursor = None
-        task = None
+    # --- 下载前检查磁盘空间 (保留此项，防止启动时空间已不足) ---
+    has_enough_space, _ = check_disk_space(DOWNLOAD_DIRECTORY, MIN_FREE_SPACE_GB)
+    if not has_enough_space:
+        sys.exit("程序启动时磁盘空间已不足，请清理磁盘后重启。")
+    # --- 检查结束 ---
+
+    # 批量领取 (SKIP LOCKED) + 租约：中断的任务 (status = 2) 租约过期后自动重新领取
+    claimer = TaskClaimer(lambda: mysql.connector.connect(**db_config), table_name, columns=('id', 'url'),
+                          pending_statuses=(0,), claimed_status=2,
+                          owner_column='machine_name', owner=machine_name,
+                          claim_values={'downloader': downloader_name}, release_values={'downloader': None},
+                          failed_status=3, logger=YtDlpLogger())
+    try:
+        claimer.ensure_schema()
+        claimer.expire_own_leases()
+    except mysql.connector.Error as err:
+        print(f"\n[数据库错误] 初始化任务领取表结构失败: {err}")
+
+    def resolve_task(task):
+        # 元数据线程：只解析不下载，格式选择也在这里完成
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            return ydl.extract_info(task_url(task), download=False)
+
+    def task_host(task, info):
+        if info:
+            formats = info.get('requested_formats') or [info]
+            if formats[0].get('url'):
+                return urlparse(formats[0]['url']).netloc
+        return urlparse(task_url(task)).netloc
+
+    def process_task(task, info):
+        task_id = task['id']
+        url = task_url(task)
+        print(f"\n[任务ID: {task_id}] 开始下载: {url}")
 
         try:
-            # --- 下载前检查磁盘空间 (保留此项，防止启动时空间已不足) ---
-            has_enough_space, _ = check_disk_space(DOWNLOAD_DIRECTORY, MIN_FREE_SPACE_GB)
-            if not has_enough_space:
-                sys.exit("程序启动时磁盘空间已不足，请清理磁盘后重启。")
-            # --- 检查结束 ---
-
-            conn = mysql.connector.connect(**db_config)
-            cursor = conn.cursor(dictionary=True)
-
-            cursor.execute(f"START TRANSACTION;")
-            cursor.execute(f"SELECT id, url FROM `{table_name}` WHERE status = 0 LIMIT 1 FOR UPDATE;")
-            task = cursor.fetchone()
-
-            if task:
-                task_id = task['id']
-                url_or_id = task['url']
+            # YoutubeDL 实例不能跨线程共用，每个任务单独创建
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                if info:
+                    ydl.process_ie_result(info, download=True)
+                else:
+                    ydl.download([url])
 
-                cursor.execute(
-                    f"UPDATE `{table_name}` SET status = 2, downloader = %s, machine_name = %s WHERE id = %s;",
-                    (downloader_name, machine_name, task_id)
-                )
-                conn.commit()
+            # 标记任务为成功
+            set_task_status(db_config, table_name, task_id, 1)
+            print(f"\t[成功] 任务 {task_id} 已完成。")
 
-                if not url_or_id.startswith(('http://', 'https://')):
-                    url = f"https://v.douyu.com/show/{url_or_id}"
-                else:
-                    url = url_or_id
-
-                print(f"\n[任务ID: {task_id}] 开始下载: {url}")
-
-                try:
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        ydl.download([url])
-
-                    # 标记任务为成功
-                    cursor.execute(f"UPDATE `{table_name}` SET status = 1 WHERE id = %s;", (task_id,))
-                    conn.commit()
-                    print(f"\t[成功] 任务 {task_id} 已完成。")
-
-                    # --- 【代码新增】下载完成后，立即检查磁盘空间 ---
-                    has_enough_space_after, free_gb_after = check_disk_space(DOWNLOAD_DIRECTORY, MIN_FREE_SPACE_GB)
-                    if not has_enough_space_after:
-                        print(f"\n[停止] 视频下载后剩余空间 ({free_gb_after:.2f} GB) 已低于阈值 ({MIN_FREE_SPACE_GB} GB)。")
-                        sys.exit("程序因磁盘空间不足而自动停止，请清理磁盘后重启。")
-                    # --- 检查结束 ---
-
-                except DownloadError as net_err:
-                    print(f"\n\t[网络错误] 下载 {url} 时发生网络或源问题: {net_err}")
-                    cursor.execute(f"UPDATE `{table_name}` SET status = 4 WHERE id = %s;", (task_id,))
-                    conn.commit()
-                except Exception as e:
-                    print(f"\n\t[致命错误] 下载 {url} 时发生意外错误: {e}")
-                    cursor.execute(f"UPDATE `{table_name}` SET status = 3 WHERE id = %s;", (task_id,))
-                    conn.commit()
-            else:
-                print("\n没有待处理的下载任务。等待 60 秒后重试...")
-                conn.commit()
-                time.sleep(60)
-
-        except mysql.connector.Error as err:
-            print(f"\n[数据库错误] {err}")
-            if conn and conn.is_connected():
-                conn.rollback()
-            time.sleep(30)
-        finally:
-            if cursor:
-                cursor.close()
-            if conn and conn.is_connected():
-                conn.close()
+            # --- 【代码新增】下载完成后，立即检查磁盘空间 ---
+            has_enough_space_after, free_gb_after = check_disk_space(DOWNLOAD_DIRECTORY, MIN_FREE_SPACE_GB)
+            if not has_enough_space_after:
+                print(f"\n[停止] 视频下载后剩余空间 ({free_gb_after:.2f} GB) 已低于阈值 ({MIN_FREE_SPACE_GB} GB)。")
+                return False
+            # --- 检查结束 ---
 
+        except DownloadError as net_err:
+            print(f"\n\t[网络错误] 下载 {url} 时发生网络或源问题: {net_err}")
+            set_task_status(db_config, table_name, task_id, 4)
+        except Exception as e:
+            print(f"\n\t[致命错误] 下载 {url} 时发生意外错误: {e}")
+            set_task_status(db_config, table_name, task_id, 3)
+        return True
+
+    pool = PrefetchWorkerPool(
+        claim=claimer.claim,
+        process=process_task,
+        release=claimer.release,
+        fail=claimer.fail,
+        resolve=resolve_task,
+        host_of=task_host,
+        workers=DOWNLOAD_WORKERS, per_host=DOWNLOADS_PER_HOST,
+        idle_wait=60, logger=YtDlpLogger())
+    pool.run()
+    pool.log_stats()
+    claimer.log_stats()
+    claimer.close()
+    bandwidth_limiter.log_stats()
+
+    # 工作池只会因为磁盘空间不足或 Ctrl+C 停止
+    has_enough_space, _ = check_disk_space(DOWNLOAD_DIRECTORY, MIN_FREE_SPACE_GB)
+    if not has_enough_space:
+        sys.exit("程序因磁盘空间不足而自动停止，请清理磁盘后重启。")
 
 if __name__ == "__main__":
     download_videos_from_db(
@@ -0,0 +1,188 @@
+# _*_ coding: utf-8 _*_
+"""
+流式处理流水线 - 扫描、筛选、查重、编码同时进行
+
+以前的批处理脚本是「先完整扫描 → 再逐个检查分辨率 → 再过滤已完成 → 最后才开始编码」，
+几十万个文件时，GPU 要等几十分钟的扫描和探测结束才开始干活，内存里还要同时放下全部路径列表。
+这里把每一步做成一个阶段，阶段之间用有界队列连接：
+- 扫描到第一个文件，筛选线程就开始探测，第一个通过筛选的文件马上进入编码；
+- 每个阶段有自己的线程数（探测可以开多，编码按硬件并发数）；
+- 队列有上限，下游忙不过来时上游自动等待，内存占用固定。
+
+使用方式：
+    pipeline = StreamPipeline(iter_video_files(INPUT_DIR, SUPPORTED_VIDEO_FORMATS))
+    pipeline.add_stage('分辨率筛选', check_resolution, workers=8)
+    pipeline.add_stage('断点去重', check_completed, workers=1)
+    pipeline.add_stage('编码', encode_video, workers=hardware_info['max_concurrent'])
+    for result in pipeline.run():
+        ...
+
+阶段函数接收上一阶段的输出，返回 None 表示丢弃（不再往下传），否则把返回值交给下一阶段。
+阶段函数内部抛出的异常只记日志并丢弃该条目，不会中断整条流水线。
+"""
+
+import queue
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+# ==================== 配置 ====================
+DEFAULT_QUEUE_SIZE = 64
+
+# 队列等待的轮询间隔（秒），用于及时响应停止信号
+_POLL_INTERVAL = 0.5
+
+# 阶段结束标记
+_END = object()
+
+
+class _Stage:
+    """流水线中的一个阶段"""
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.processed = 0   # 产出到下游的条目数
+        self.dropped = 0     # 被阶段函数丢弃的条目数
+        self.errors = 0      # 阶段函数抛异常的条目数
+        self.lock = threading.Lock()
+        self.finished_workers = 0
+
+
+class StreamPipeline:
+    """有界队列连接的多阶段流水线"""
+
+    def __init__(self, source: Iterable[Any], queue_size: int = DEFAULT_QUEUE_SIZE,
+                 stop_event: Optional[threading.Event] = None):
+        """
+        Args:
+            source: 输入条目（通常是边扫描边产出的生成器）
+            queue_size: 每个阶段输入队列的上限
+            stop_event: 外部停止信号（如脚本的优雅关闭事件），置位后流水线尽快结束
+        """
+        self.source = source
+        self.queue_size = max(1, queue_size)
+        self.stop_event = stop_event or threading.Event()
+        self.stages: List[_Stage] = []
+        self.source_count = 0
+        self._threads: List[threading.Thread] = []
+
+    def add_stage(self, name: str, func: Callable[[Any], Any], workers: int = 1) -> 'StreamPipeline':
+        """追加一个阶段，返回自身以便链式调用"""
+        self.stages.append(_Stage(name, func, workers))
+        return self
+
+    def stop(self):
+        """请求停止：不再读取新输入，各阶段处理完手头条目后退出"""
+        self.stop_event.set()
+
+    def _put(self, q: queue.Queue, item: Any) -> bool:
+        """带停止检查的阻塞写入，停止时返回 False"""
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _put_end(self, q: queue.Queue, count: int):
+        """结束标记必须送达，否则下游线程会一直等待（停止后下游只丢弃不处理，队列很快会腾出位置）"""
+        for _ in range(count):
+            q.put(_END)
+
+    def _feed(self, out_q: queue.Queue, downstream_workers: int):
+        try:
+            for item in self.source:
+                if self.stop_event.is_set() or not self._put(out_q, item):
+                    break
+                self.source_count += 1
+        except Exception as e:
+            logging.error(f"流水线输入源异常: {e}", exc_info=True)
+        finally:
+            self._put_end(out_q, downstream_workers)
+
+    def _work(self, stage: _Stage, in_q: queue.Queue, out_q: queue.Queue, downstream_workers: int):
+        while True:
+            item = in_q.get()
+            if item is _END:
+                break
+            if self.stop_event.is_set():
+                continue
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                logging.error(f"流水线阶段[{stage.name}]处理异常: {e}", exc_info=True)
+                with stage.lock:
+                    stage.errors += 1
+                continue
+            if result is None:
+                with stage.lock:
+                    stage.dropped += 1
+                continue
+            if self._put(out_q, result):
+                with stage.lock:
+                    stage.processed += 1
+
+        # 本阶段最后一个线程退出时，通知下游结束
+        with stage.lock:
+            stage.finished_workers += 1
+            last = stage.finished_workers == stage.workers
+        if last:
+            self._put_end(out_q, downstream_workers)
+
+    def run(self) -> Iterator[Any]:
+        """启动流水线，按完成顺序产出最后一个阶段的结果"""
+        if not self.stages:
+            raise ValueError("流水线至少需要一个阶段")
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        output_q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        queues.append(output_q)
+
+        self._threads = [threading.Thread(target=self._feed, args=(queues[0], self.stages[0].workers),
+                                          name='pipeline-source', daemon=True)]
+        for index, stage in enumerate(self.stages):
+            downstream = self.stages[index + 1].workers if index + 1 < len(self.stages) else 1
+            for n in range(stage.workers):
+                self._threads.append(threading.Thread(
+                    target=self._work, args=(stage, queues[index], queues[index + 1], downstream),
+                    name=f'pipeline-{stage.name}-{n}', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+        try:
+            while True:
+                try:
+                    item = output_q.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                if item is _END:
+                    break
+                yield item
+        finally:
+            if any(thread.is_alive() for thread in self._threads):
+                # 调用方提前退出（break/异常）：停止并排空输出队列，让工作线程能退出
+                self.stop()
+                while any(thread.is_alive() for thread in self._threads):
+                    try:
+                        output_q.get(timeout=_POLL_INTERVAL)
+                    except queue.Empty:
+                        pass
+            for thread in self._threads:
+                thread.join()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """各阶段统计"""
+        return {
+            'source': self.source_count,
+            'stages': [{'name': s.name, 'workers': s.workers, 'processed': s.processed,
+                        'dropped': s.dropped, 'errors': s.errors} for s in self.stages],
+        }
+
+    def log_stats(self):
+        """输出各阶段统计"""
+        logging.info(f"🔀 流水线统计: 输入 {self.source_count} 个")
+        for s in self.stages:
+            logging.info(f"   [{s.name}] {s.workers} 线程: 通过 {s.processed}, 丢弃 {s.dropped}, 异常 {s.errors}")
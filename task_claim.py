@@ -0,0 +1,420 @@
+# _*_ coding: utf-8 _*_
+"""
+MySQL 任务表的批量领取 + 租约
+
+几个下载器各自用 `SELECT ... LIMIT 1 FOR UPDATE` 再 UPDATE 的方式领任务，二三十台机器同时轮询时
+都排队等同一行的行锁；淘宝回放下载器更是先无锁 SELECT 再 UPDATE，两台机器可能领到同一条。
+机器宕机后留下的「下载中」记录还要靠每台机器启动时查询「本机未完成的任务」才能恢复，换了机器就没人管。
+这里统一成一套领取接口：
+- MySQL 8.0 / MariaDB 10.6 以上用 `FOR UPDATE SKIP LOCKED`，被别人锁住的行直接跳过，一次领取 n 条；
+  老版本不支持时自动改用一条原子的 `UPDATE ... LIMIT n` 写入领取令牌，再按令牌查回领到的行；
+- 领取时写入租约到期时间 lease_until，后台心跳线程定期续约；
+  机器宕机或被强杀后租约过期，「下载中」的记录自动重新变为可领取，不再需要按机器名恢复；
+- claim_attempts 记录被领取的次数，大于 1 说明之前有人下过一部分，可以据此决定是否续传。
+
+任务表需要的列和索引（ensure_schema() 会自动补上）：
+    ALTER TABLE t ADD COLUMN claim_token CHAR(32) NULL,
+                  ADD COLUMN lease_until DATETIME NULL,
+                  ADD COLUMN claim_attempts INT NOT NULL DEFAULT 0,
+                  ADD INDEX idx_task_claim (<过滤列...>, status, lease_until),
+                  ADD INDEX idx_task_claim_token (claim_token);
+
+使用方式：
+    claimer = TaskClaimer(get_db_connection, 'bilibili_link', columns=('id', 'url'),
+                          pending_statuses=(0,), claimed_status=2,
+                          owner_column='computer_name', owner=hostname, logger=logger)
+    claimer.ensure_schema()
+    claimer.expire_own_leases()      # 本机重启：自己名下的「下载中」立即可以重新领取
+    tasks = claimer.claim(5)         # [{'id': .., 'url': .., 'claim_attempts': 1}, ...]
+    claimer.release(tasks[3:])       # 没开始下载的还回去
+    claimer.fail([tasks[0]])         # 下载出错：退回重试，领取次数满了标记为失败
+"""
+
+import uuid
+import socket
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+# ==================== 配置 ====================
+# 租约时长（秒），心跳每 1/3 租约续一次
+LEASE_SECONDS = 600
+# 下载出错的任务最多领取几次，之后标记为 failed_status
+MAX_ATTEMPTS = 3
+# 自动选择领取方式：先试 SKIP LOCKED，不支持时改用 UPDATE ... LIMIT
+STRATEGY_AUTO = 'auto'
+STRATEGY_SKIP_LOCKED = 'skip_locked'
+STRATEGY_UPDATE_LIMIT = 'update_limit'
+# 不支持 SKIP LOCKED 时的错误码：语法错误 / 该版本不支持
+_UNSUPPORTED_ERRNOS = (1064, 1235)
+
+# claim_values 里的值用它表示「数据库当前时间」
+CURRENT_TIMESTAMP = object()
+
+
+def _errno_of(error: Exception) -> Optional[int]:
+    """mysql.connector 的异常有 errno，pymysql 的错误码在 args[0]"""
+    errno = getattr(error, 'errno', None)
+    if errno is None and error.args and isinstance(error.args[0], int):
+        errno = error.args[0]
+    return errno
+
+
+class TaskClaimer:
+    """按批领取任务并维护租约，同时支持 mysql.connector 和 pymysql 连接"""
+
+    def __init__(self, connect: Callable[[], Any], table: str,
+                 columns: Sequence[str] = ('id', 'url'), id_column: str = 'id',
+                 status_column: str = 'status', pending_statuses: Sequence[Any] = (0,),
+                 claimed_status: Any = 2, owner_column: Optional[str] = None,
+                 owner: Optional[str] = None, filters: Optional[Dict[str, Any]] = None,
+                 claim_values: Optional[Dict[str, Any]] = None,
+                 release_values: Optional[Dict[str, Any]] = None,
+                 order_by: Optional[str] = None, lease_seconds: int = LEASE_SECONDS,
+                 legacy_statuses: Sequence[Any] = (), failed_status: Any = None,
+                 max_attempts: int = MAX_ATTEMPTS, strategy: str = STRATEGY_AUTO, logger=None):
+        """
+        Args:
+            connect: 返回一个新数据库连接的函数（返回 None 视为连接失败）
+            table: 任务表名
+            columns: 领取时返回的列
+            pending_statuses: 可领取的状态（比如 0 未下载、3 失败重试）
+            claimed_status: 领取后写入的「下载中」状态，租约过期的这个状态也可以被重新领取
+            owner_column / owner: 领取时写入机器名的列和机器名（默认本机主机名），还回时清空
+            filters: 额外的等值过滤条件，比如 {'collector': 'xxx'}，同时作为索引前缀
+            claim_values / release_values: 领取 / 还回时顺带写入的列
+            order_by: 领取顺序（列名），默认按 id_column
+            legacy_statuses: 旧版领取流程留下的中间状态（比如「排队中」），ensure_schema 时改回待下载
+            failed_status / max_attempts: fail() 时领取次数达到 max_attempts 的任务改为 failed_status，
+                                         不设置 failed_status 时一直退回待下载
+            strategy: auto / skip_locked / update_limit
+        """
+        self.connect = connect
+        self.table = table
+        self.columns = list(columns)
+        self.id_column = id_column
+        self.status_column = status_column
+        self.pending_statuses = list(pending_statuses)
+        self.claimed_status = claimed_status
+        self.owner_column = owner_column
+        self.owner = owner or socket.gethostname()
+        self.filters = dict(filters or {})
+        self.claim_values = dict(claim_values or {})
+        self.release_values = dict(release_values or {})
+        if owner_column:
+            self.claim_values.setdefault(owner_column, self.owner)
+            self.release_values.setdefault(owner_column, None)
+        self.order_by = order_by or id_column
+        self.lease_seconds = lease_seconds
+        self.legacy_statuses = list(legacy_statuses)
+        self.failed_status = failed_status
+        self.max_attempts = max(1, max_attempts)
+        self.strategy = strategy
+        self.logger = logger or logging.getLogger('task_claim')
+
+        # 本机领到、还没做完的令牌，心跳线程给它们续约
+        self._tokens = set()
+        self._tokens_lock = threading.Lock()
+        self._heartbeat = None
+        self._stop_heartbeat = threading.Event()
+        self.stats = {'claims': 0, 'claimed': 0, 'released': 0, 'failed': 0, 'renewals': 0, 'reclaimed_stale': 0}
+
+    # ==================== SQL 拼装 ====================
+    @staticmethod
+    def _q(name: str) -> str:
+        return f"`{name}`"
+
+    def _assignments(self, values: Dict[str, Any]):
+        sql, params = [], []
+        for column, value in values.items():
+            if value is CURRENT_TIMESTAMP:
+                sql.append(f"{self._q(column)} = CURRENT_TIMESTAMP")
+            else:
+                sql.append(f"{self._q(column)} = %s")
+                params.append(value)
+        return sql, params
+
+    def _claimable_where(self):
+        """可领取 = 待下载，或者「下载中」但租约已过期"""
+        status = self._q(self.status_column)
+        placeholders = ', '.join(['%s'] * len(self.pending_statuses))
+        sql = (f"({status} IN ({placeholders}) OR "
+               f"({status} = %s AND `lease_until` < NOW()))")
+        params = list(self.pending_statuses) + [self.claimed_status]
+        for column, value in self.filters.items():
+            sql += f" AND {self._q(column)} = %s"
+            params.append(value)
+        return sql, params
+
+    def _claim_set(self, token: str):
+        sql = [f"{self._q(self.status_column)} = %s", "`claim_token` = %s",
+               "`lease_until` = NOW() + INTERVAL %s SECOND", "`claim_attempts` = `claim_attempts` + 1"]
+        params = [self.claimed_status, token, self.lease_seconds]
+        extra_sql, extra_params = self._assignments(self.claim_values)
+        return ', '.join(sql + extra_sql), params + extra_params
+
+    def _select_columns(self) -> str:
+        columns = self.columns + [c for c in ('claim_attempts',) if c not in self.columns]
+        return ', '.join(self._q(c) for c in columns)
+
+    @staticmethod
+    def _rows_as_dicts(cursor) -> List[Dict[str, Any]]:
+        rows = cursor.fetchall()
+        if rows and isinstance(rows[0], dict):
+            return [dict(row) for row in rows]
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, row)) for row in rows]
+
+    def _open(self):
+        conn = self.connect()
+        if conn is None:
+            raise ConnectionError("数据库连接失败")
+        return conn
+
+    # ==================== 领取 ====================
+    def _claim_skip_locked(self, cursor, limit: int, token: str) -> List[Dict[str, Any]]:
+        where, params = self._claimable_where()
+        cursor.execute(
+            f"SELECT {self._select_columns()}, {self._q(self.status_column)} AS `_prev_status` "
+            f"FROM {self._q(self.table)} WHERE {where} ORDER BY {self._q(self.order_by)} "
+            f"LIMIT %s FOR UPDATE SKIP LOCKED", params + [limit])
+        rows = self._rows_as_dicts(cursor)
+        if not rows:
+            return []
+        ids = [row[self.id_column] for row in rows]
+        set_sql, set_params = self._claim_set(token)
+        placeholders = ', '.join(['%s'] * len(ids))
+        cursor.execute(f"UPDATE {self._q(self.table)} SET {set_sql} "
+                       f"WHERE {self._q(self.id_column)} IN ({placeholders})", set_params + ids)
+        for row in rows:
+            row['claim_attempts'] = (row.get('claim_attempts') or 0) + 1
+            if row.pop('_prev_status') == self.claimed_status:
+                self.stats['reclaimed_stale'] += 1
+        return rows
+
+    def _claim_update_limit(self, cursor, limit: int, token: str) -> List[Dict[str, Any]]:
+        where, params = self._claimable_where()
+        set_sql, set_params = self._claim_set(token)
+        cursor.execute(f"UPDATE {self._q(self.table)} SET {set_sql} WHERE {where} "
+                       f"ORDER BY {self._q(self.order_by)} LIMIT %s", set_params + params + [limit])
+        if not cursor.rowcount:
+            return []
+        cursor.execute(f"SELECT {self._select_columns()} FROM {self._q(self.table)} "
+                       f"WHERE `claim_token` = %s", (token,))
+        return self._rows_as_dicts(cursor)
+
+    def claim(self, limit: int) -> List[Dict[str, Any]]:
+        """在一个事务里领取最多 limit 条任务；数据库异常向上抛出"""
+        if limit <= 0:
+            return []
+        token = uuid.uuid4().hex
+        conn = self._open()
+        cursor = conn.cursor()
+        try:
+            if self.strategy != STRATEGY_UPDATE_LIMIT:
+                try:
+                    rows = self._claim_skip_locked(cursor, limit, token)
+                except Exception as e:
+                    if self.strategy == STRATEGY_AUTO and _errno_of(e) in _UNSUPPORTED_ERRNOS:
+                        conn.rollback()
+                        self.strategy = STRATEGY_UPDATE_LIMIT
+                        self.logger.warning("数据库不支持 SKIP LOCKED，改用 UPDATE ... LIMIT 领取任务")
+                        rows = self._claim_update_limit(cursor, limit, token)
+                    else:
+                        raise
+                else:
+                    if self.strategy == STRATEGY_AUTO:
+                        self.strategy = STRATEGY_SKIP_LOCKED
+            else:
+                rows = self._claim_update_limit(cursor, limit, token)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+        self.stats['claims'] += 1
+        if rows:
+            self.stats['claimed'] += len(rows)
+            with self._tokens_lock:
+                self._tokens.add(token)
+            self._ensure_heartbeat()
+        return rows
+
+    def release(self, tasks: Iterable[Dict[str, Any]]):
+        """把领取了但没开始下载的任务还回去（只还仍处于「下载中」的）"""
+        ids = [task[self.id_column] for task in tasks]
+        if not ids:
+            return
+        set_sql, set_params = self._assignments(self.release_values)
+        set_sql = [f"{self._q(self.status_column)} = %s", "`claim_token` = NULL", "`lease_until` = NULL",
+                   "`claim_attempts` = GREATEST(`claim_attempts` - 1, 0)"] + set_sql
+        placeholders = ', '.join(['%s'] * len(ids))
+        conn = self._open()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"UPDATE {self._q(self.table)} SET {', '.join(set_sql)} "
+                           f"WHERE {self._q(self.id_column)} IN ({placeholders}) "
+                           f"AND {self._q(self.status_column)} = %s",
+                           [self.pending_statuses[0]] + set_params + ids + [self.claimed_status])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+        self.stats['released'] += len(ids)
+        self.logger.info(f"↩️ 已还回 {len(ids)} 条未开始的任务: {ids}")
+
+    def fail(self, tasks: Iterable[Dict[str, Any]]):
+        """下载出错的任务退回待下载，领取次数照常累计（不像 release 那样扣回）；
+        领取次数达到 max_attempts 且设置了 failed_status 时直接标记为失败，不再反复领取"""
+        ids = [task[self.id_column] for task in tasks]
+        if not ids:
+            return
+        if self.failed_status is None:
+            status_sql, status_params = f"{self._q(self.status_column)} = %s", [self.pending_statuses[0]]
+        else:
+            status_sql = f"{self._q(self.status_column)} = IF(`claim_attempts` >= %s, %s, %s)"
+            status_params = [self.max_attempts, self.failed_status, self.pending_statuses[0]]
+        set_sql, set_params = self._assignments(self.release_values)
+        set_sql = [status_sql, "`claim_token` = NULL", "`lease_until` = NULL"] + set_sql
+        placeholders = ', '.join(['%s'] * len(ids))
+        conn = self._open()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"UPDATE {self._q(self.table)} SET {', '.join(set_sql)} "
+                           f"WHERE {self._q(self.id_column)} IN ({placeholders}) "
+                           f"AND {self._q(self.status_column)} = %s",
+                           status_params + set_params + ids + [self.claimed_status])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+        self.stats['failed'] += len(ids)
+        self.logger.info(f"⚠️ 已退回 {len(ids)} 条出错的任务（领取满 {self.max_attempts} 次的标记为失败）: {ids}")
+
+    def expire_own_leases(self) -> int:
+        """本机重启后让自己名下的「下载中」记录立即过期，马上可以被重新领取（续传）"""
+        if not self.owner_column:
+            return 0
+        conn = self._open()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"UPDATE {self._q(self.table)} SET `lease_until` = NOW() - INTERVAL 1 SECOND "
+                           f"WHERE {self._q(self.status_column)} = %s AND {self._q(self.owner_column)} = %s",
+                           (self.claimed_status, self.owner))
+            count = cursor.rowcount
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        if count:
+            self.logger.info(f"本机有 {count} 条未完成的任务，租约已置为过期，将重新领取")
+        return count
+
+    # ==================== 续约 ====================
+    def renew(self):
+        """给本机持有的令牌续约，并丢掉已经没有「下载中」记录的令牌"""
+        with self._tokens_lock:
+            tokens = list(self._tokens)
+        if not tokens:
+            return
+        placeholders = ', '.join(['%s'] * len(tokens))
+        conn = self._open()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"UPDATE {self._q(self.table)} SET `lease_until` = NOW() + INTERVAL %s SECOND "
+                           f"WHERE `claim_token` IN ({placeholders}) AND {self._q(self.status_column)} = %s",
+                           [self.lease_seconds] + tokens + [self.claimed_status])
+            cursor.execute(f"SELECT DISTINCT `claim_token` FROM {self._q(self.table)} "
+                           f"WHERE `claim_token` IN ({placeholders}) AND {self._q(self.status_column)} = %s",
+                           tokens + [self.claimed_status])
+            alive = {row[0] if not isinstance(row, dict) else row['claim_token'] for row in cursor.fetchall()}
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        with self._tokens_lock:
+            self._tokens.difference_update(set(tokens) - alive)
+        self.stats['renewals'] += 1
+
+    def _heartbeat_loop(self):
+        interval = max(5, self.lease_seconds // 3)
+        while not self._stop_heartbeat.wait(timeout=interval):
+            try:
+                self.renew()
+            except Exception as e:
+                self.logger.warning(f"任务租约续约失败，稍后重试: {e}")
+
+    def _ensure_heartbeat(self):
+        if self._heartbeat is None or not self._heartbeat.is_alive():
+            self._stop_heartbeat.clear()
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, name='task-lease', daemon=True)
+            self._heartbeat.start()
+
+    def close(self):
+        self._stop_heartbeat.set()
+
+    # ==================== 表结构 ====================
+    def ensure_schema(self):
+        """补齐租约相关的列和索引；刚加列时给现有的「下载中」记录补一个租约，过期后自动回收；
+        旧流程的中间状态（legacy_statuses）改回待下载，否则再也不会被领取"""
+        conn = self._open()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+                           "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (self.table,))
+            existing = {(row['COLUMN_NAME'] if isinstance(row, dict) else row[0]) for row in cursor.fetchall()}
+            added_lease = False
+            for column, definition in (('claim_token', 'CHAR(32) NULL'),
+                                       ('lease_until', 'DATETIME NULL'),
+                                       ('claim_attempts', 'INT NOT NULL DEFAULT 0')):
+                if column not in existing:
+                    cursor.execute(f"ALTER TABLE {self._q(self.table)} ADD COLUMN `{column}` {definition}")
+                    self.logger.info(f"任务表 {self.table} 已添加列 {column}")
+                    added_lease = added_lease or column == 'lease_until'
+            if added_lease:
+                cursor.execute(f"UPDATE {self._q(self.table)} SET `lease_until` = NOW() + INTERVAL %s SECOND "
+                               f"WHERE {self._q(self.status_column)} = %s",
+                               (self.lease_seconds, self.claimed_status))
+            if self.legacy_statuses:
+                set_sql, set_params = self._assignments(self.release_values)
+                set_sql = [f"{self._q(self.status_column)} = %s", "`claim_token` = NULL",
+                           "`lease_until` = NULL"] + set_sql
+                where = f"{self._q(self.status_column)} IN ({', '.join(['%s'] * len(self.legacy_statuses))})"
+                where_params = list(self.legacy_statuses)
+                for column, value in self.filters.items():
+                    where += f" AND {self._q(column)} = %s"
+                    where_params.append(value)
+                cursor.execute(f"UPDATE {self._q(self.table)} SET {', '.join(set_sql)} WHERE {where}",
+                               [self.pending_statuses[0]] + set_params + where_params)
+                if cursor.rowcount:
+                    self.logger.info(f"任务表 {self.table} 中 {cursor.rowcount} 条旧状态 "
+                                     f"{self.legacy_statuses} 的记录已改回待下载")
+
+            cursor.execute("SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS "
+                           "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (self.table,))
+            indexes = {(row['INDEX_NAME'] if isinstance(row, dict) else row[0]) for row in cursor.fetchall()}
+            claim_index = list(self.filters) + [self.status_column, 'lease_until']
+            for name, columns in (('idx_task_claim', claim_index), ('idx_task_claim_token', ['claim_token'])):
+                if name not in indexes:
+                    cursor.execute(f"ALTER TABLE {self._q(self.table)} ADD INDEX `{name}` "
+                                   f"({', '.join(self._q(c) for c in columns)})")
+                    self.logger.info(f"任务表 {self.table} 已添加索引 {name}")
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+    def log_stats(self):
+        s = self.stats
+        self.logger.info(f"🎫 任务领取统计 ({self.strategy}): 领取 {s['claims']} 次共 {s['claimed']} 条, "
+                         f"其中回收过期租约 {s['reclaimed_stale']} 条, 还回 {s['released']} 条, "
+                         f"出错退回 {s['failed']} 条, 续约 {s['renewals']} 次")
@@ -0,0 +1,295 @@
+# _*_ coding: utf-8 _*_
+"""
+数据库任务的预取式工作池
+
+几个以数据库为任务队列的下载器原来都是「领一条 → 下载 → 再领下一条」：每台机器同时只有
+一个下载在跑，领任务的数据库往返、取播放地址的 API 请求、换 Cookie 等准备工作也全部串行
+夹在两次下载之间。这里把它拆成三段：
+- 元数据线程：一次事务领取多条任务（claim），并提前解析它们的播放地址等信息（resolve），
+  放进就绪队列，下载线程拿到任务时准备工作已经做完；
+- 下载线程：固定数量的线程并行下载，同一主机（CDN 域名）同时在下的任务数有上限，
+  避免把一个源站打满，其余主机的任务可以插队先下；
+- 停止时：已领取但还没开始下载的任务通过 release 还回数据库，别的机器可以马上接手，
+  正在下载的任务会等它下完。
+
+process 返回 False（比如磁盘空间不足）时整个工作池停止领取新任务；process 抛异常时先等待
+error_wait 秒再通过 fail（没有时用 release）还回，避免同一条坏任务被马上重新领取、反复空转。
+
+使用方式：
+    pool = PrefetchWorkerPool(
+        claim=lambda n: get_new_tasks(hostname, n),       # 一个事务里领取最多 n 条
+        process=lambda task, info: download(task, info),  # info 为 resolve 的结果
+        release=lambda tasks: release_tasks(tasks),
+        fail=lambda tasks: fail_tasks(tasks),             # 出错的任务：累计次数，超过上限标记失败
+        resolve=lambda task: fetch_play_info(task),
+        host_of=lambda task, info: urlparse(info['url']).netloc,
+        workers=3, per_host=2, stop_event=stop_event, logger=logger)
+    pool.run()       # 阻塞直到 stop_event 被设置（exit_when_idle=True 时任务领完也会返回）
+    pool.log_stats()
+"""
+
+import time
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# ==================== 配置 ====================
+# 同时下载的任务数
+DEFAULT_WORKERS = 3
+# 同一主机同时下载的任务数上限
+DEFAULT_PER_HOST = 2
+# 没有任务时多久再查一次数据库（秒）
+DEFAULT_IDLE_WAIT = 30
+# 领取失败（数据库异常）后的等待时间（秒）
+CLAIM_ERROR_WAIT = 30
+# 处理任务抛异常后，还回数据库之前的等待时间（秒）
+PROCESS_ERROR_WAIT = 60
+
+
+class _ReadyTask:
+    """已领取并解析好的任务"""
+    __slots__ = ('task', 'info', 'host')
+
+    def __init__(self, task, info, host):
+        self.task = task
+        self.info = info
+        self.host = host
+
+
+class PrefetchWorkerPool:
+    """一个元数据线程 + 多个下载线程，按主机限制并发"""
+
+    def __init__(self, claim: Callable[[int], List[Any]],
+                 process: Callable[[Any, Any], Optional[bool]],
+                 release: Optional[Callable[[List[Any]], None]] = None,
+                 fail: Optional[Callable[[List[Any]], None]] = None,
+                 resolve: Optional[Callable[[Any], Any]] = None,
+                 host_of: Optional[Callable[[Any, Any], Optional[str]]] = None,
+                 workers: int = DEFAULT_WORKERS, per_host: int = DEFAULT_PER_HOST,
+                 prefetch: Optional[int] = None, initial: Iterable[Any] = (),
+                 stop_event: Optional[threading.Event] = None,
+                 idle_wait: float = DEFAULT_IDLE_WAIT, exit_when_idle: bool = False,
+                 error_wait: float = PROCESS_ERROR_WAIT, logger=None):
+        """
+        Args:
+            claim: claim(n) 在一个事务里领取最多 n 条任务并标记为本机下载中，返回任务列表
+            process: process(task, info) 下载一条任务并自行更新数据库状态；返回 False 时停止工作池
+            release: release(tasks) 把领取了但没开始下载的任务还回数据库
+            fail: fail(tasks) 把 process 抛异常的任务还回数据库（累计出错次数），不提供时用 release
+            resolve: resolve(task) 在元数据线程上提前获取播放地址等信息；抛异常时 info 为 None，
+                     由 process 自己重新获取
+            host_of: host_of(task, info) 返回下载主机，用于按主机限流；不提供时所有任务算同一主机
+            workers: 下载线程数
+            per_host: 同一主机同时下载的任务数上限
+            prefetch: 就绪队列保持的任务数，默认等于 workers
+            initial: 启动时直接放进队列的任务（比如本机上次中断的任务），不经过 claim
+            stop_event: 外部停止信号（GUI 的停止按钮），不提供时内部创建
+            idle_wait: 没有新任务时重新查询的间隔
+            exit_when_idle: 没有新任务且手上的任务都做完时 run() 直接返回
+            error_wait: process 抛异常后等待多久再还回任务
+        """
+        self.claim = claim
+        self.process = process
+        self.release = release
+        self.fail = fail
+        self.resolve = resolve
+        self.host_of = host_of
+        self.workers = max(1, workers)
+        self.per_host = max(1, per_host)
+        self.prefetch = max(1, prefetch if prefetch is not None else self.workers)
+        self.stop_event = stop_event or threading.Event()
+        self.idle_wait = idle_wait
+        self.exit_when_idle = exit_when_idle
+        self.error_wait = error_wait
+        self.logger = logger or logging.getLogger('task_pool')
+
+        self._cond = threading.Condition()
+        self._pending: List[Any] = list(initial)  # 已领取、还没解析的任务
+        self._ready: List[_ReadyTask] = []
+        self._active = 0
+        self._host_active: Dict[str, int] = defaultdict(int)
+        self._exhausted = False
+
+        self.stats = {'claimed': 0, 'resolved': 0, 'resolve_failed': 0, 'done': 0,
+                      'errors': 0, 'released': 0, 'claim_rounds': 0}
+        self._started_at = None
+
+    # ==================== 元数据线程 ====================
+    def _resolve_one(self, task) -> _ReadyTask:
+        info = None
+        if self.resolve is not None:
+            try:
+                info = self.resolve(task)
+                self.stats['resolved'] += 1
+            except Exception as e:
+                self.stats['resolve_failed'] += 1
+                self.logger.warning(f"预取任务信息失败，下载时再获取: {e}")
+        host = None
+        if self.host_of is not None:
+            try:
+                host = self.host_of(task, info)
+            except Exception:
+                host = None
+        return _ReadyTask(task, info, host or '')
+
+    def _metadata_loop(self):
+        while not self.stop_event.is_set():
+            with self._cond:
+                # 就绪队列降到一半以下再去领，一次领满，减少数据库往返
+                need = self.prefetch - len(self._ready)
+                if len(self._ready) > self.prefetch // 2 and not self._pending:
+                    self._cond.wait(timeout=1)
+                    continue
+
+            if not self._pending:
+                try:
+                    claimed = list(self.claim(need) or [])
+                except Exception as e:
+                    self.logger.error(f"领取任务失败: {e}")
+                    self.stop_event.wait(timeout=CLAIM_ERROR_WAIT)
+                    continue
+                self.stats['claim_rounds'] += 1
+                if not claimed:
+                    with self._cond:
+                        idle = not self._ready and self._active == 0
+                        if self.exit_when_idle:
+                            self._exhausted = True
+                            self._cond.notify_all()
+                    if self.exit_when_idle:
+                        return
+                    if idle:
+                        self.logger.info("数据库中无待处理任务，等待下一次检查...")
+                    self.stop_event.wait(timeout=self.idle_wait)
+                    continue
+                self.stats['claimed'] += len(claimed)
+                self.logger.info(f"📥 本次领取 {len(claimed)} 条任务")
+                with self._cond:
+                    self._pending.extend(claimed)
+
+            # 逐条解析，每条解析完马上可以开始下载
+            while not self.stop_event.is_set():
+                with self._cond:
+                    if not self._pending:
+                        break
+                    task = self._pending[0]
+                ready = self._resolve_one(task)
+                with self._cond:
+                    self._pending.pop(0)
+                    self._ready.append(ready)
+                    self._cond.notify_all()
+
+    # ==================== 下载线程 ====================
+    def _take_ready(self) -> Optional[_ReadyTask]:
+        """取第一个所在主机还有空位的任务（调用方持有锁）"""
+        for index, ready in enumerate(self._ready):
+            if self._host_active[ready.host] < self.per_host:
+                return self._ready.pop(index)
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self.stop_event.is_set():
+                        return
+                    ready = self._take_ready()
+                    if ready is not None:
+                        self._active += 1
+                        self._host_active[ready.host] += 1
+                        # 就绪队列空出位置，唤醒元数据线程补货
+                        self._cond.notify_all()
+                        break
+                    if self._exhausted and not self._ready and not self._pending:
+                        return
+                    self._cond.wait(timeout=1)
+
+            keep_going = True
+            failed = False
+            try:
+                keep_going = self.process(ready.task, ready.info) is not False
+            except Exception as e:
+                failed = True
+                self.logger.error(f"处理任务时发生未捕获的错误，{self.error_wait:.0f}秒后还回数据库: {e}")
+            finally:
+                with self._cond:
+                    self.stats['errors' if failed else 'done'] += 1
+                    self._active -= 1
+                    self._host_active[ready.host] -= 1
+                    self._cond.notify_all()
+
+            if failed:
+                # 先等一会儿再还回（租约仍由领取方续着），停止信号会提前结束等待
+                self.stop_event.wait(timeout=self.error_wait)
+                self._fail([ready.task])
+
+            if not keep_going:
+                self.logger.warning("任务处理方要求停止，工作池不再领取新任务")
+                self.stop_event.set()
+                with self._cond:
+                    self._cond.notify_all()
+
+    # ==================== 控制 ====================
+    def _release(self, tasks: List[Any]):
+        if not tasks or self.release is None:
+            return
+        try:
+            self.release(tasks)
+            with self._cond:
+                self.stats['released'] += len(tasks)
+        except Exception as e:
+            self.logger.error(f"还回 {len(tasks)} 条任务失败: {e}")
+
+    def _fail(self, tasks: List[Any]):
+        if self.fail is None:
+            self._release(tasks)
+            return
+        try:
+            self.fail(tasks)
+        except Exception as e:
+            self.logger.error(f"还回 {len(tasks)} 条出错的任务失败: {e}")
+
+    def run(self) -> Dict[str, int]:
+        """启动并阻塞到停止，返回统计"""
+        self._started_at = time.time()
+        self.logger.info(f"🧵 工作池启动: {self.workers} 个下载线程, 每个主机最多 {self.per_host} 个, "
+                         f"预取 {self.prefetch} 条")
+        meta_thread = threading.Thread(target=self._metadata_loop, name='task-meta', daemon=True)
+        meta_thread.start()
+        worker_threads = [threading.Thread(target=self._worker_loop, name=f'task-worker-{i}', daemon=True)
+                          for i in range(self.workers)]
+        for thread in worker_threads:
+            thread.start()
+        try:
+            # 带超时的 join，Windows 上 Ctrl+C 才能打断
+            for thread in worker_threads:
+                while thread.is_alive():
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            self.logger.warning("收到中断信号，等待正在下载的任务结束后退出（再按一次强制退出）")
+            self.stop()
+            for thread in worker_threads:
+                thread.join()
+
+        # 下载线程全部退出（停止信号或任务领完）后，元数据线程手上的和就绪队列里的任务都还回去
+        meta_thread.join()
+        with self._cond:
+            leftovers = self._pending + [ready.task for ready in self._ready]
+            self._pending = []
+            self._ready = []
+        if leftovers:
+            self.logger.info(f"↩️ 还回 {len(leftovers)} 条已领取但未开始的任务")
+            self._release(leftovers)
+        return self.stats
+
+    def stop(self):
+        self.stop_event.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def log_stats(self):
+        elapsed = time.time() - self._started_at if self._started_at else 0.0
+        s = self.stats
+        self.logger.info(f"🧵 工作池统计: 领取 {s['claimed']} 条 ({s['claim_rounds']} 次查询), "
+                         f"预取 {s['resolved']} 条 (失败 {s['resolve_failed']}), 完成 {s['done']} 条, "
+                         f"异常 {s['errors']} 条, 还回 {s['released']} 条, 运行 {elapsed:.0f}s")
@@ -0,0 +1,68 @@
+# _*_ coding: utf-8 _*_
+"""smart_cut.plan_cut / probe_keyframes 和 chunked_encode.plan_chunks 的切点规划测试"""
+
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chunked_encode
+import smart_cut
+from chunked_encode import MIN_CHUNK_SECONDS, plan_chunks
+from smart_cut import MIN_COPY_SECONDS, plan_cut, probe_keyframes
+
+
+def test_plan_cut_picks_first_keyframe_after_start_and_last_before_end():
+    keyframes = [0.0, 4.0, 8.0, 12.0, 96.0, 100.0, 104.0]
+    assert plan_cut(keyframes, 5.0, 101.0) == {'start': 5.0, 'k1': 8.0, 'k2': 100.0, 'end': 101.0}
+
+
+def test_plan_cut_keyframe_on_cut_point_is_used():
+    assert plan_cut([10.0, 50.0], 10.0, 50.0) == {'start': 10.0, 'k1': 10.0, 'k2': 50.0, 'end': 50.0}
+
+
+def test_plan_cut_rejects_short_copy_range():
+    assert plan_cut([0.0, 10.0, 10.0 + MIN_COPY_SECONDS - 1, 40.0], 5.0, 20.0) is None
+    assert plan_cut([], 0.0, 100.0) is None
+    assert plan_cut([50.0], 60.0, 100.0) is None
+
+
+def test_probe_keyframes_is_relative_to_container_start(monkeypatch):
+    calls = []
+
+    def fake_run(cmd, capture_output=True, timeout=None):
+        calls.append(cmd)
+        if 'format=start_time' in cmd:
+            return subprocess.CompletedProcess(cmd, 0, b'1.400000\n', b'')
+        return subprocess.CompletedProcess(cmd, 0, b'11.400000,K__\n11.440000,___\n21.400000,K_\n', b'')
+
+    monkeypatch.setattr(smart_cut.subprocess, 'run', fake_run)
+    assert probe_keyframes('in.ts', [(10.0, 40.0)], 'ffprobe') == [10.0, 20.0]
+    # -read_intervals 是绝对时间戳，请求的范围要加上 start_time
+    assert calls[1][calls[1].index('-read_intervals') + 1] == '11.400%41.400'
+
+
+def test_probe_keyframes_without_start_time(monkeypatch):
+    def fake_run(cmd, capture_output=True, timeout=None):
+        if 'format=start_time' in cmd:
+            return subprocess.CompletedProcess(cmd, 0, b'N/A\n', b'')
+        return subprocess.CompletedProcess(cmd, 0, b'3.000000,K_\n', b'')
+
+    monkeypatch.setattr(smart_cut.subprocess, 'run', fake_run)
+    assert probe_keyframes('in.mp4', [(0.0, 5.0)], 'ffprobe') == [3.0]
+
+
+def test_plan_chunks_aligns_to_next_keyframe(monkeypatch):
+    monkeypatch.setattr(chunked_encode, 'probe_keyframes',
+                        lambda path, ranges, ffprobe_path: [302.0, 605.0, 900.0])
+    assert plan_chunks('in.mp4', 0.0, 1000.0, chunk_seconds=300) == [
+        (0.0, 302.0), (302.0, 605.0), (605.0, 900.0), (900.0, 1000.0)]
+
+
+def test_plan_chunks_falls_back_to_target_and_merges_short_tail(monkeypatch):
+    # 窗口里没有关键帧时按原时间点切；离结尾不足 MIN_CHUNK_SECONDS 的分段点不要
+    monkeypatch.setattr(chunked_encode, 'probe_keyframes', lambda path, ranges, ffprobe_path: [])
+    chunks = plan_chunks('in.mp4', 10.0, 10.0 + 600 + MIN_CHUNK_SECONDS + 1, chunk_seconds=300)
+    assert chunks == [(10.0, 310.0), (310.0, 610.0), (610.0, 10.0 + 600 + MIN_CHUNK_SECONDS + 1)]
+    assert plan_chunks('in.mp4', 0.0, 200.0, chunk_seconds=300) == [(0.0, 200.0)]
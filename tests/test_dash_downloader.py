@@ -0,0 +1,112 @@
+# _*_ coding: utf-8 _*_
+"""dash_downloader 分段规划和分段续传测试（假 session 按 Range 返回数据，不联网）"""
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from dash_downloader import DashDownloader
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.status_code = 206
+        self.headers = {}
+        self._data = data
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self._data), 7):
+            yield self._data[i:i + 7]
+
+    def raise_for_status(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    """只支持 Range: bytes=a-b 的假 session，记录每次请求的头"""
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.headers = requests.Session().headers
+        self.requests = []
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        self.requests.append(dict(headers))
+        start, end = headers['Range'][len('bytes='):].split('-')
+        return FakeResponse(self.payload[int(start):int(end) + 1])
+
+
+def make_downloader(session=None):
+    return DashDownloader(session or requests.Session(), parts=4, min_part_size=10)
+
+
+def test_plan_parts_fresh_download(tmp_path):
+    tmp = str(tmp_path / 'v.tmp')
+    parts = make_downloader()._plan_parts(tmp, tmp + '.parts', 100)
+    assert parts == [[0, 24, 0], [25, 49, 0], [50, 74, 0], [75, 99, 0]]
+
+
+def test_plan_parts_small_file_single_part(tmp_path):
+    tmp = str(tmp_path / 'v.tmp')
+    assert make_downloader()._plan_parts(tmp, tmp + '.parts', 15) == [[0, 14, 0]]
+
+
+def test_plan_parts_reuses_legacy_prefix(tmp_path):
+    tmp = tmp_path / 'v.tmp'
+    tmp.write_bytes(b'x' * 40)
+    parts = make_downloader()._plan_parts(str(tmp), str(tmp) + '.parts', 100)
+    assert parts[0] == [0, 39, 40]
+    # 剩下的 60 字节照常分成 4 段
+    assert parts[1:] == [[40, 54, 0], [55, 69, 0], [70, 84, 0], [85, 99, 0]]
+
+
+def test_plan_parts_ignores_prefix_not_shorter_than_stream(tmp_path):
+    tmp = tmp_path / 'v.tmp'
+    tmp.write_bytes(b'x' * 100)
+    parts = make_downloader()._plan_parts(str(tmp), str(tmp) + '.parts', 100)
+    assert sum(part[2] for part in parts) == 0
+
+
+def test_plan_parts_resumes_or_discards_saved_state(tmp_path):
+    tmp = tmp_path / 'v.tmp'
+    tmp.write_bytes(b'\0' * 100)
+    state_path = str(tmp) + '.parts'
+    saved = [[0, 49, 20], [50, 99, 50]]
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump({'size': 100, 'parts': saved}, f)
+    assert make_downloader()._plan_parts(str(tmp), state_path, 100) == saved
+    # 文件大小变了，进度作废
+    assert sum(part[2] for part in make_downloader()._plan_parts(str(tmp), state_path, 120)) == 0
+
+
+def test_download_parts_truncates_longer_leftover(tmp_path):
+    payload = bytes(range(256)) * 4
+    final_path = str(tmp_path / 'v.video')
+    # 作废的分段进度 + 比最终文件还长的旧 .tmp
+    with open(final_path + '.tmp', 'wb') as f:
+        f.write(b'\xff' * (len(payload) + 300))
+    with open(final_path + '.tmp.parts', 'w', encoding='utf-8') as f:
+        json.dump({'size': len(payload) + 300, 'parts': []}, f)
+
+    session = FakeSession(payload)
+    downloader = DashDownloader(session, parts=4, min_part_size=100)
+    nbytes = downloader._download_parts('http://cdn/v', final_path, 'video', len(payload),
+                                        extra_headers={'Cookie': 'SESSDATA=1'})
+
+    assert nbytes == len(payload)
+    with open(final_path, 'rb') as f:
+        assert f.read() == payload
+    assert not os.path.exists(final_path + '.tmp.parts')
+    # 额外的请求头只加在本次请求上，不改共用的 session
+    assert all(h['Cookie'] == 'SESSDATA=1' for h in session.requests)
+    assert 'Cookie' not in session.headers
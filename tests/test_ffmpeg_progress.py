@@ -0,0 +1,36 @@
+# _*_ coding: utf-8 _*_
+"""ffmpeg_progress 进度解析测试"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ffmpeg_progress import parse_progress_block, with_progress_args
+
+
+def test_parse_progress_block_full():
+    info = parse_progress_block({
+        'frame': '250', 'fps': '49.87', 'bitrate': '1534.2kbits/s', 'total_size': '2097152',
+        'out_time_us': '10010000', 'out_time_ms': '10010000', 'out_time': '00:00:10.010000',
+        'speed': '2.01x', 'progress': 'continue'})
+    assert info == {'end': False, 'time': 10.01, 'frame': 250, 'fps': 49.87,
+                    'speed': 2.01, 'size': 2048, 'bitrate': 1534.2}
+
+
+def test_parse_progress_block_skips_na_and_garbage():
+    info = parse_progress_block({
+        'frame': 'N/A', 'fps': 'abc', 'bitrate': 'N/A', 'total_size': 'N/A',
+        'out_time_us': 'N/A', 'out_time_ms': '-5000', 'speed': 'N/A', 'progress': 'end'})
+    # out_time_us 为 N/A 时不回退到 out_time_ms；负数时间截到 0
+    assert info == {'end': True}
+    info = parse_progress_block({'out_time_ms': '-5000', 'speed': ' 0.5x', 'progress': 'continue'})
+    assert info == {'end': False, 'time': 0.0, 'speed': 0.5}
+
+
+def test_with_progress_args_inserts_once():
+    cmd = ['ffmpeg', '-y', '-i', 'in.mp4', 'out.mp4']
+    assert with_progress_args(cmd) == ['ffmpeg', '-progress', 'pipe:1', '-nostats', '-y', '-i', 'in.mp4', 'out.mp4']
+    already = ['ffmpeg', '-progress', 'pipe:2', '-i', 'in.mp4', 'out.mp4']
+    assert with_progress_args(already) == already
+    assert with_progress_args(already) is not already
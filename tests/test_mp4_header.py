@@ -0,0 +1,57 @@
+# _*_ coding: utf-8 _*_
+"""mp4_header 文件头解析测试（合成最小 MP4/MOV 结构）"""
+
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mp4_header import read_mp4_info
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I', 8 + len(payload)) + box_type + payload
+
+
+def hdlr(component_type: bytes, handler_type: bytes) -> bytes:
+    return box(b'hdlr', b'\0' * 4 + component_type + handler_type + b'\0' * 12 + b'\0')
+
+
+def video_trak(quicktime: bool) -> bytes:
+    mdhd = box(b'mdhd', b'\0' * 12 + struct.pack('>II', 600, 6000) + b'\0' * 4)
+    entry = struct.pack('>I', 86) + b'avc1' + b'\0' * 6 + struct.pack('>H', 1) + b'\0' * 16 + struct.pack('>HH', 1920, 1080)
+    entry += b'\0' * (86 - len(entry))
+    stsd = box(b'stsd', b'\0' * 4 + struct.pack('>I', 1) + entry)
+    stts = box(b'stts', b'\0' * 4 + struct.pack('>I', 1) + struct.pack('>II', 250, 24))
+    minf_children = box(b'stbl', stsd + stts)
+    if quicktime:
+        # QuickTime：mdia 下是 mhlr/vide，minf 下还有一个数据引用 dhlr/alis
+        media_hdlr = hdlr(b'mhlr', b'vide')
+        minf_children = hdlr(b'dhlr', b'alis') + minf_children
+    else:
+        media_hdlr = hdlr(b'\0\0\0\0', b'vide')
+    return box(b'trak', box(b'mdia', mdhd + media_hdlr + box(b'minf', minf_children)))
+
+
+def write_movie(path, quicktime: bool):
+    mvhd = box(b'mvhd', b'\0' * 12 + struct.pack('>II', 600, 6000) + b'\0' * 80)
+    ftyp = box(b'ftyp', (b'qt  ' if quicktime else b'isom') + b'\0' * 4)
+    with open(path, 'wb') as f:
+        f.write(ftyp + box(b'moov', mvhd + video_trak(quicktime)) + box(b'mdat', b'\0' * 16))
+
+
+def test_mp4_video_track(tmp_path):
+    path = tmp_path / 'sample.mp4'
+    write_movie(path, quicktime=False)
+    info = read_mp4_info(str(path))
+    assert (info['width'], info['height']) == (1920, 1080)
+    assert abs(info['duration'] - 10.0) < 1e-6
+
+
+def test_mov_data_reference_handler_ignored(tmp_path):
+    path = tmp_path / 'sample.mov'
+    write_movie(path, quicktime=True)
+    info = read_mp4_info(str(path))
+    assert (info['width'], info['height']) == (1920, 1080)
+    assert abs(info['duration'] - 10.0) < 1e-6
@@ -0,0 +1,100 @@
+# _*_ coding: utf-8 _*_
+"""phash_index（BK 树、重复簇、持久索引）和 bloom_filter 测试"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bloom_filter import BloomFilter
+from phash_index import (BKTree, PerceptualHashIndex, cluster_duplicates, hamming_distance,
+                         signature_to_int)
+
+
+def test_signature_to_int_concatenates_frame_hashes():
+    assert signature_to_int(['ff', '01']) == (0xff << 64) | 0x01
+    assert hamming_distance(0b1011, 0b0001) == 2
+
+
+def test_bk_tree_search_matches_linear_scan():
+    rng = random.Random(1)
+    keys = [rng.getrandbits(64) for _ in range(300)]
+    # 加几个近邻和完全相同的签名
+    keys += [keys[0] ^ 0b1, keys[0] ^ 0b111, keys[5]]
+    tree = BKTree()
+    for i, key in enumerate(keys):
+        tree.add(key, f'v{i}')
+    assert tree.size == len(keys)
+
+    for query in (keys[0], keys[5], rng.getrandbits(64)):
+        for max_distance in (0, 3, 20):
+            expected = sorted((f'v{i}', key, hamming_distance(query, key))
+                              for i, key in enumerate(keys) if hamming_distance(query, key) <= max_distance)
+            assert sorted(tree.search(query, max_distance)) == expected
+
+
+def test_cluster_duplicates_merges_pairs_transitively():
+    clusters = cluster_duplicates([('c', 'b'), ('b', 'a'), ('x', 'y'), ('a', 'c')])
+    assert clusters == [['a', 'b', 'c'], ['x', 'y']]
+    assert cluster_duplicates([]) == []
+
+
+def test_index_persists_and_invalidates_changed_files(tmp_path):
+    video = tmp_path / 'a.mp4'
+    other = tmp_path / 'b.mp4'
+    video.write_bytes(b'0' * 10)
+    other.write_bytes(b'1' * 10)
+    db_path = str(tmp_path / 'index.db')
+
+    index = PerceptualHashIndex(db_path)
+    index.add(str(video), 0b1111, frames=2)
+    index.add(str(other), 0b0111, frames=2)
+    assert index.get(str(video), frames=2) == 0b1111
+    assert index.get(str(video), frames=3) is None
+    found = index.search(0b1111, frames=2, max_distance=1)
+    assert [(os.path.basename(p), d) for p, d in found] == [('a.mp4', 0), ('b.mp4', 1)]
+
+    # 重新打开：从 SQLite 装回 BK 树
+    reopened = PerceptualHashIndex(db_path)
+    assert [os.path.basename(p) for p, _ in reopened.search(0b1111, 2, 0)] == ['a.mp4']
+
+    # 签名更新后旧节点失效，删除的记录不再返回
+    reopened.add(str(video), 0b0000, frames=2)
+    assert [os.path.basename(p) for p, _ in reopened.search(0b1111, 2, 0)] == []
+    reopened.remove(str(other))
+    assert reopened.search(0b0111, 2, 0) == []
+
+    # 文件大小变了，缓存的签名作废
+    video.write_bytes(b'0' * 20)
+    assert reopened.get(str(video), frames=2) is None
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, error_rate=0.01)
+    keys = [f'md5:{i:032x}' for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f'md5:{i:032x}' in bloom for i in range(1000, 11000))
+    assert false_positives < 300  # 期望约 1%，留足余量
+    assert not bloom.is_saturated
+    bloom.add('one-more')
+    assert bloom.is_saturated
+
+
+def test_bloom_filter_round_trip(tmp_path):
+    path = str(tmp_path / 'bloom.bin')
+    bloom = BloomFilter(100)
+    bloom.add('a')
+    bloom.save(path, {'last_id': 42})
+
+    loaded, meta = BloomFilter.load(path)
+    assert 'a' in loaded and 'b' not in loaded
+    assert loaded.count == 1
+    assert meta == {'last_id': 42}
+
+    with open(path, 'r+b') as f:
+        f.write(b'XXXX')
+    assert BloomFilter.load(path) is None
+    assert BloomFilter.load(str(tmp_path / 'missing.bin')) is None
@@ -0,0 +1,122 @@
+# _*_ coding: utf-8 _*_
+"""progress_store 快照 + 追加日志的重放与压缩测试"""
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import progress_store
+from progress_store import GENERATION_KEY, ProgressStore
+
+
+def open_store(path):
+    # 不让后台线程自动写入，测试里手动 flush
+    return ProgressStore(str(path), defaults={'roi_settings': None}, flush_interval=3600)
+
+
+def journal_lines(path):
+    with open(str(path) + '.journal', 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f.read().splitlines()]
+
+
+def test_journal_replay_restores_state(tmp_path):
+    path = tmp_path / 'progress.json'
+    store = open_store(path)
+    store.mark_processing('a.mp4')
+    store.mark_completed('a.mp4', {'name': 'a.mp4', 'size': 10})
+    store.mark_processing('b.mp4')
+    store.mark_failed('b.mp4', {'name': 'b.mp4', 'error': 'x'})
+    store.set('roi_settings', [1, 2, 3, 4])
+    store.append('history', 1, limit=2)
+    store.append('history', 2, limit=2)
+    store.append('history', 3, limit=2)
+    store.close()
+
+    # 只写了日志，快照文件还不存在
+    assert not path.exists()
+    assert journal_lines(path)[0] == {'generation': 0}
+
+    reopened = open_store(path)
+    assert reopened.find_completed('a.mp4', 10) == {'name': 'a.mp4', 'size': 10}
+    assert reopened.find_completed('a.mp4', 11) is None
+    assert reopened.is_failed('b.mp4') and not reopened.is_processing('b.mp4')
+    assert reopened.get('roi_settings') == [1, 2, 3, 4]
+    assert reopened.get('history') == [2, 3]
+    assert reopened.stats['replayed'] == 8
+    reopened.close()
+
+
+def test_torn_last_line_is_ignored_and_compacted(tmp_path):
+    path = tmp_path / 'progress.json'
+    store = open_store(path)
+    store.mark_completed('a.mp4')
+    store.close()
+    with open(str(path) + '.journal', 'ab') as f:
+        f.write(b'{"op": "complete", "name": "b.m')
+
+    reopened = open_store(path)
+    assert reopened.is_completed('a.mp4')
+    assert not reopened.is_completed('b.mp4')
+    # 不完整的记录触发压缩：状态写进快照，日志换成新一代的空日志
+    with open(path, 'r', encoding='utf-8') as f:
+        snapshot = json.load(f)
+    assert snapshot['completed'] == ['a.mp4']
+    assert snapshot[GENERATION_KEY] == 1
+    assert journal_lines(path) == [{'generation': 1}]
+    reopened.close()
+
+
+def test_compaction_writes_legacy_compatible_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(progress_store, 'COMPACT_MIN_OPS', 3)
+    path = tmp_path / 'progress.json'
+    store = open_store(path)
+    for i in range(4):
+        store.mark_completed(f'{i}.mp4', {'name': f'{i}.mp4', 'size': i})
+    store.mark_processing('busy.mp4')
+    store.flush()
+
+    assert store.stats['compactions'] == 1
+    with open(path, 'r', encoding='utf-8') as f:
+        snapshot = json.load(f)
+    assert [r['name'] for r in snapshot['completed']] == ['0.mp4', '1.mp4', '2.mp4', '3.mp4']
+    assert snapshot['processing'] == ['busy.mp4']
+    assert snapshot['roi_settings'] is None
+    assert journal_lines(path) == [{'generation': 1}]
+    store.close()
+
+    reopened = open_store(path)
+    assert reopened.counts() == {'completed': 4, 'processing': 1, 'failed': 0}
+    reopened.close()
+
+
+def test_stale_journal_is_not_replayed_twice(tmp_path):
+    path = tmp_path / 'progress.json'
+    store = open_store(path)
+    store.append('history', 'x')
+    store.close()
+
+    # 模拟压缩中途断电：新一代快照已写好（已包含日志里的操作），旧日志还没清空
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'completed': [], 'history': ['x'], GENERATION_KEY: 1}, f)
+
+    reopened = open_store(path)
+    assert reopened.get('history') == ['x']
+    assert reopened.stats['replayed'] == 0
+    assert journal_lines(path) == [{'generation': 1}]
+    reopened.close()
+
+
+def test_legacy_progress_file_is_loaded_as_snapshot(tmp_path):
+    path = tmp_path / 'progress.json'
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'completed': ['old.mp4', {'name': 'new.mp4', 'size': 5}, 'old.mp4'],
+                   'processing': ['p.mp4'], 'failed': [], 'start_time': 't0'}, f)
+
+    store = open_store(path)
+    assert store.find_completed('old.mp4', 123) == 'old.mp4'
+    assert store.find_completed('new.mp4', 5) == {'name': 'new.mp4', 'size': 5}
+    assert store.counts() == {'completed': 2, 'processing': 1, 'failed': 0}
+    assert store.get('start_time') == 't0'
+    store.close()
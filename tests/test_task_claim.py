@@ -0,0 +1,201 @@
+# _*_ coding: utf-8 _*_
+"""task_claim 领取 / 还回 / 租约 SQL 测试（记录 SQL 的假连接，不需要 MySQL）"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from task_claim import STRATEGY_UPDATE_LIMIT, TaskClaimer
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rowcount = 0
+        self.description = None
+        self._rows = []
+
+    def execute(self, sql, params=()):
+        sql = ' '.join(sql.split())
+        self.db.executed.append((sql, list(params)))
+        for marker, error in list(self.db.errors):
+            if marker in sql:
+                self.db.errors.remove((marker, error))
+                raise error
+        rows = self.db.results.pop(0) if sql.startswith('SELECT') and self.db.results else []
+        self._rows = rows
+        self.rowcount = len(rows) if sql.startswith('SELECT') else self.db.rowcount
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class FakeDB:
+    """connect() 每次返回一个新连接，所有连接共用执行记录和预设结果"""
+
+    def __init__(self, results=(), rowcount=1, errors=()):
+        self.executed = []
+        self.results = list(results)
+        self.rowcount = rowcount
+        self.errors = list(errors)
+        self.commits = 0
+        self.rollbacks = 0
+
+    def connect(self):
+        return self
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+
+class UnsupportedSkipLocked(Exception):
+    errno = 1064
+
+
+def make_claimer(db, **kwargs):
+    options = dict(columns=('id', 'url'), pending_statuses=(0, 3), claimed_status=2,
+                   owner_column='computer_name', owner='pc-1', lease_seconds=600)
+    options.update(kwargs)
+    return TaskClaimer(db.connect, 'tasks', **options)
+
+
+def test_claim_skip_locked_selects_pending_and_expired_leases():
+    db = FakeDB(results=[[{'id': 1, 'url': 'a', 'claim_attempts': 0, '_prev_status': 0},
+                          {'id': 2, 'url': 'b', 'claim_attempts': 1, '_prev_status': 2}]])
+    claimer = make_claimer(db)
+    try:
+        rows = claimer.claim(5)
+    finally:
+        claimer.close()
+
+    select_sql, select_params = db.executed[0]
+    assert "(`status` IN (%s, %s) OR (`status` = %s AND `lease_until` < NOW()))" in select_sql
+    assert select_sql.endswith('LIMIT %s FOR UPDATE SKIP LOCKED')
+    assert select_params == [0, 3, 2, 5]
+
+    update_sql, update_params = db.executed[1]
+    assert '`lease_until` = NOW() + INTERVAL %s SECOND' in update_sql
+    assert '`claim_attempts` = `claim_attempts` + 1' in update_sql
+    assert '`computer_name` = %s' in update_sql
+    assert update_sql.endswith('WHERE `id` IN (%s, %s)')
+    assert update_params[0] == 2 and update_params[2] == 600
+    assert update_params[-3:] == ['pc-1', 1, 2]
+
+    assert [(r['id'], r['claim_attempts']) for r in rows] == [(1, 1), (2, 2)]
+    assert all('_prev_status' not in r for r in rows)
+    assert claimer.stats['reclaimed_stale'] == 1
+    assert claimer.strategy == 'skip_locked'
+
+
+def test_claim_falls_back_to_update_limit():
+    db = FakeDB(results=[[{'id': 7, 'url': 'x', 'claim_attempts': 1}]],
+                errors=[('SKIP LOCKED', UnsupportedSkipLocked())])
+    claimer = make_claimer(db)
+    try:
+        rows = claimer.claim(3)
+    finally:
+        claimer.close()
+
+    assert claimer.strategy == STRATEGY_UPDATE_LIMIT
+    assert db.rollbacks == 1
+    update_sql, update_params = db.executed[1]
+    assert update_sql.startswith('UPDATE `tasks` SET')
+    assert update_sql.endswith('ORDER BY `id` LIMIT %s')
+    assert update_params[-1] == 3
+    token = update_params[1]
+    assert db.executed[2] == ('SELECT `id`, `url`, `claim_attempts` FROM `tasks` WHERE `claim_token` = %s', [token])
+    assert rows == [{'id': 7, 'url': 'x', 'claim_attempts': 1}]
+
+
+def test_release_returns_claimed_rows_and_refunds_attempt():
+    db = FakeDB()
+    claimer = make_claimer(db)
+    claimer.release([{'id': 1}, {'id': 2}])
+
+    sql, params = db.executed[0]
+    assert '`claim_attempts` = GREATEST(`claim_attempts` - 1, 0)' in sql
+    assert '`claim_token` = NULL' in sql and '`lease_until` = NULL' in sql
+    assert sql.endswith('WHERE `id` IN (%s, %s) AND `status` = %s')
+    # 还回第一个待下载状态，机器名清空，只动仍处于「下载中」的行
+    assert params == [0, None, 1, 2, 2]
+    assert claimer.stats['released'] == 2
+
+
+def test_fail_keeps_attempts_and_marks_failed_after_limit():
+    db = FakeDB()
+    claimer = make_claimer(db, failed_status=3, max_attempts=4)
+    claimer.fail([{'id': 9}])
+
+    sql, params = db.executed[0]
+    assert '`status` = IF(`claim_attempts` >= %s, %s, %s)' in sql
+    assert 'claim_attempts` - 1' not in sql
+    assert params == [4, 3, 0, None, 9, 2]
+
+
+def test_fail_without_failed_status_only_requeues():
+    db = FakeDB()
+    claimer = make_claimer(db)
+    claimer.fail([{'id': 9}])
+
+    sql, params = db.executed[0]
+    assert 'IF(' not in sql
+    assert params == [0, None, 9, 2]
+
+
+def test_expire_own_leases_only_touches_own_rows():
+    db = FakeDB(rowcount=3)
+    claimer = make_claimer(db)
+    assert claimer.expire_own_leases() == 3
+
+    sql, params = db.executed[0]
+    assert '`lease_until` = NOW() - INTERVAL 1 SECOND' in sql
+    assert sql.endswith('WHERE `status` = %s AND `computer_name` = %s')
+    assert params == [2, 'pc-1']
+
+
+def test_renew_extends_live_tokens_and_drops_finished_ones():
+    db = FakeDB(results=[[{'id': 1, 'url': 'a', 'claim_attempts': 0, '_prev_status': 0}]])
+    claimer = make_claimer(db)
+    try:
+        claimer.claim(1)
+        token = db.executed[1][1][1]
+        db.results.append([(token,)])
+        claimer.renew()
+        assert claimer._tokens == {token}
+
+        db.results.append([])
+        claimer.renew()
+        assert claimer._tokens == set()
+    finally:
+        claimer.close()
+
+    renew_sql, renew_params = db.executed[2]
+    assert renew_sql.endswith('WHERE `claim_token` IN (%s) AND `status` = %s')
+    assert renew_params == [600, token, 2]
+
+
+def test_ensure_schema_resets_legacy_statuses():
+    db = FakeDB(results=[[('claim_token',), ('lease_until',), ('claim_attempts',)],
+                         [('idx_task_claim',), ('idx_task_claim_token',)]])
+    claimer = make_claimer(db, legacy_statuses=(4,), filters={'collector': 'me'})
+    claimer.ensure_schema()
+
+    updates = [(sql, params) for sql, params in db.executed if sql.startswith('UPDATE')]
+    assert len(updates) == 1
+    sql, params = updates[0]
+    assert sql.endswith('WHERE `status` IN (%s) AND `collector` = %s')
+    assert params == [0, None, 4, 'me']
+    assert not any(sql.startswith('ALTER') for sql, _ in db.executed)
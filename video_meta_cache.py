@@ -0,0 +1,212 @@
+# _*_ coding: utf-8 _*_
+"""
+视频元数据持久缓存 - 多脚本共享
+
+以 (路径, 文件大小, 修改时间) 为键，把 ffprobe 的探测结果存入本地 SQLite，
+同一个视频在同一次运行里被多次探测、或者重跑已处理过的目录时，直接命中缓存，
+不再启动 ffprobe 进程。文件被替换或修改后，大小/修改时间变化，旧记录自动失效。
+
+使用方式：
+    from video_meta_cache import cached_probe, get_meta_cache
+
+    @cached_probe('mcl_video_info')
+    def get_video_info(video_path): ...
+
+    class VideoProcessor:
+        @cached_probe('uvp_video_info', path_arg=1)
+        def get_video_info(self, video_path, timeout=20): ...
+
+不同脚本返回的结构不同，用 kind 区分命名空间，互不干扰。
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import functools
+import copy
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# ==================== 配置 ====================
+# 缓存目录放在本机（不要放NAS上），所有脚本共用
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.video_deal')
+META_CACHE_DB = os.path.join(CACHE_DIR, 'video_meta_cache.db')
+
+# 进程内热缓存条数上限（一次运行内重复探测同一文件时连 SQLite 都不用查）
+MEMORY_CACHE_LIMIT = 50000
+
+
+def _file_key(video_path: str) -> Optional[Tuple[str, int, float]]:
+    """返回 (规范化路径, 大小, 修改时间)，文件不存在时返回 None"""
+    try:
+        stat = os.stat(video_path)
+    except OSError:
+        return None
+    return os.path.normcase(os.path.abspath(video_path)), stat.st_size, stat.st_mtime
+
+
+class VideoMetaCache:
+    """基于 SQLite 的视频元数据缓存，线程安全，支持多进程同时读写"""
+
+    def __init__(self, db_path: str = META_CACHE_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._memory: Dict[Tuple[str, str], Tuple[int, float, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get_conn(self) -> sqlite3.Connection:
+        """延迟建立连接；fork 出来的子进程会重新连接"""
+        if self._conn is None or self._conn_pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS video_meta (
+                    path TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (path, kind)
+                )
+            ''')
+            conn.commit()
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def get(self, kind: str, video_path: str) -> Optional[Any]:
+        """查询缓存，未命中或文件已变化时返回 None"""
+        key = _file_key(video_path)
+        if key is None:
+            return None
+        return copy.deepcopy(self._lookup(kind, key))
+
+    def _lookup(self, kind: str, key: Tuple[str, int, float]) -> Optional[Any]:
+        path, size, mtime = key
+        with self._lock:
+            cached = self._memory.get((path, kind))
+            if cached and cached[0] == size and cached[1] == mtime:
+                self.hits += 1
+                return cached[2]
+            try:
+                row = self._get_conn().execute(
+                    'SELECT size, mtime, data FROM video_meta WHERE path = ? AND kind = ?',
+                    (path, kind)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logging.warning(f"读取元数据缓存失败: {e}")
+                row = None
+            if row and row[0] == size and row[1] == mtime:
+                value = json.loads(row[2])
+                self._remember(path, kind, size, mtime, value)
+                self.hits += 1
+                return value
+            self.misses += 1
+            return None
+
+    def put(self, kind: str, video_path: str, value: Any):
+        """写入缓存（value 必须能被 JSON 序列化）"""
+        key = _file_key(video_path)
+        if key is None:
+            return
+        self._store(kind, key, value)
+
+    def _store(self, kind: str, key: Tuple[str, int, float], value: Any):
+        path, size, mtime = key
+        with self._lock:
+            self._remember(path, kind, size, mtime, value)
+            try:
+                conn = self._get_conn()
+                conn.execute(
+                    'INSERT OR REPLACE INTO video_meta (path, kind, size, mtime, data, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (path, kind, size, mtime, json.dumps(value, ensure_ascii=False), time.time())
+                )
+                conn.commit()
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                logging.warning(f"写入元数据缓存失败: {e}")
+
+    def _remember(self, path: str, kind: str, size: int, mtime: float, value: Any):
+        if len(self._memory) >= MEMORY_CACHE_LIMIT:
+            self._memory.clear()
+        self._memory[(path, kind)] = (size, mtime, value)
+
+    def get_or_probe(self, kind: str, video_path: str, probe: Callable[[], Any],
+                     is_valid: Callable[[Any], bool] = bool) -> Any:
+        """命中缓存直接返回，否则调用 probe() 探测；只有 is_valid 的结果才写入缓存"""
+        key = _file_key(video_path)
+        if key is None:
+            return probe()
+        cached = self._lookup(kind, key)
+        if cached is not None:
+            # 返回副本，避免调用方修改结果后污染缓存
+            return copy.deepcopy(cached)
+        value = probe()
+        if is_valid(value):
+            self._store(kind, key, copy.deepcopy(value))
+        return value
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取命中率统计"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+    def log_stats(self):
+        """输出命中率（一般在程序退出时调用）"""
+        stats = self.get_stats()
+        if stats['hits'] + stats['misses'] == 0:
+            return
+        message = (f"📦 元数据缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, "
+                   f"命中率 {stats['hit_rate'] * 100:.1f}%")
+        print(message)
+        logging.info(message)
+
+
+_meta_cache: Optional[VideoMetaCache] = None
+_meta_cache_lock = threading.Lock()
+
+
+def get_meta_cache() -> VideoMetaCache:
+    """获取全局缓存实例"""
+    global _meta_cache
+    if _meta_cache is None:
+        with _meta_cache_lock:
+            if _meta_cache is None:
+                _meta_cache = VideoMetaCache()
+    return _meta_cache
+
+
+def cached_probe(kind: str, path_arg: int = 0, is_valid: Callable[[Any], bool] = bool,
+                 decode: Optional[Callable[[Any], Any]] = None):
+    """
+    探测函数的缓存装饰器
+
+    Args:
+        kind: 缓存命名空间，不同返回结构的函数必须使用不同的 kind
+        path_arg: 视频路径在位置参数中的下标（实例方法传 1）
+        is_valid: 判断结果是否值得缓存，失败结果不缓存，下次会重新探测
+        decode: 从缓存取出后的转换（如 JSON 把 tuple 存成 list，可传 tuple 还原）
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            video_path = args[path_arg]
+            value = get_meta_cache().get_or_probe(
+                kind, video_path, lambda: func(*args, **kwargs), is_valid)
+            if decode is not None and value is not None:
+                value = decode(value)
+            return value
+        return wrapper
+    return decorator
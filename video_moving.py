@@ -10,6 +10,8 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 import signal
 
+from bandwidth_scheduler import BandwidthClient
+
 
 # ==============================================================================
 # 配置类 - 请根据您的环境修改此区域的所有值
@@ -41,12 +43,20 @@ class Config:
     # --- 性能配置 ---
     MAX_WORKERS: int = 4  # 并行处理文件的最大线程数，可根据CPU和磁盘性能调整
 
+    # --- 带宽调度配置 ---
+    # 跨盘复制时向 bandwidth_scheduler 守护进程申请写入额度，与本机的下载器共用限速（守护进程没启动时不限速）
+    BANDWIDTH_RESOURCE: str = 'disk'  # 目标是网络共享盘时可改为 'net'，与下载器共用同一个带宽上限
+    BANDWIDTH_PRIORITY: int = 1  # 数值越大分到的额度越多
+
 
 # ==============================================================================
 # 全局变量 - 请勿修改
 # ==============================================================================
 # 用于优雅地处理中断信号 (Ctrl+C)
 shutdown_requested = False
+# 所有移动线程共用一份额度
+bandwidth_limiter = BandwidthClient('video_moving', resource=Config.BANDWIDTH_RESOURCE,
+                                    priority=Config.BANDWIDTH_PRIORITY)
 
 
 # ==============================================================================
@@ -196,6 +206,7 @@ def move_with_progress(src: Path, dst: Path, pbar_manager):
     ) as file_pbar:
         with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
             while chunk := fsrc.read(4 * 1024 * 1024):  # 使用4MB的块大小
+                bandwidth_limiter.throttle(len(chunk))
                 fdst.write(chunk)
                 file_pbar.update(len(chunk))
 
@@ -1,8 +1,6 @@
 import os
 import shutil
 import logging
-import json
-import subprocess
 import queue
 import threading
 import time
@@ -12,6 +10,7 @@ from dataclasses import dataclass
 from collections import Counter
 from watchdog.observers import Observer
 from watchdog.events import PatternMatchingEventHandler
+from probe_engine import get_probe_engine
 
 # --- 日志设置 ---
 logging.basicConfig(
@@ -51,27 +50,17 @@ def find_ffprobe(configured_path: str) -> str | None:
 
 def check_resolution(video_path: Path, ffprobe_executable: str):
     """
-    使用 ffprobe 检查视频分辨率，返回宽度、高度以及朝向（横屏/竖屏）。
+    通过公共探测引擎检查视频分辨率，返回宽度、高度以及朝向（横屏/竖屏）。
+    优先进程内读取文件头，读不出来才回退到 ffprobe。
     """
     try:
-        command = [
-            ffprobe_executable,
-            "-v", "quiet",
-            "-print_format", "json",
-            "-show_streams",
-            str(video_path)
-        ]
-        result = subprocess.run(command, capture_output=True, text=True, check=True, encoding='utf-8')
-        metadata = json.loads(result.stdout)
-
-        video_stream = next((s for s in metadata.get("streams", []) if s.get("codec_type") == "video"), None)
-
-        if not video_stream:
-            logger.warning(f"在 '{video_path.name}' 中未找到视频流。")
+        info = get_probe_engine(ffprobe_executable).probe(str(video_path))
+        if not info:
+            logger.warning(f"无法读取 '{video_path.name}' 的视频流信息。")
             return None, None, None
 
-        width = int(video_stream.get("width", 0))
-        height = int(video_stream.get("height", 0))
+        width = int(info.get("width", 0))
+        height = int(info.get("height", 0))
 
         if width == 0 or height == 0:
             logger.warning(f"视频分辨率为零: {video_path.name}")
@@ -80,12 +69,6 @@ def check_resolution(video_path: Path, ffprobe_executable: str):
         orientation = "vertical" if width < height else "horizontal"
         return width, height, orientation
 
-    except subprocess.CalledProcessError as e:
-        logger.error(f"ffprobe 在处理 '{video_path.name}' 时出错 (返回码 {e.returncode}): {e.stderr.strip()}")
-        return None, None, None
-    except json.JSONDecodeError:
-        logger.error(f"解析 ffprobe 输出时出错: {video_path.name}")
-        return None, None, None
     except Exception as e:
         logger.error(f"读取 '{video_path.name}' 时发生未知错误: {e}")
         return None, None, None
@@ -379,6 +362,7 @@ class VideoProcessor:
         logger.info("=" * 60)
         logger.info("所有任务处理完毕，脚本已安全退出。")
         print_summary(self.stats)
+        get_probe_engine(self.ffprobe_executable).log_stats()
 
 
 @dataclass(frozen=True)
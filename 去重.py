@@ -5,11 +5,13 @@ import imagehash
 import cv2
 from PIL import Image
 from concurrent.futures import ProcessPoolExecutor
-from multiprocessing import Manager, Lock
 from tqdm import tqdm
 import logging
 import shutil
 import numpy as np
+from file_index import iter_video_files
+from phash_index import cluster_duplicates, get_phash_index, hamming_distance, signature_to_int
+from keyframe_sampler import sample_frames
 
 # --- 优化配置参数 ---
 VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv')
@@ -17,11 +19,21 @@ HASH_ALGORITHM = 'sha256'
 CHUNK_SIZE = 1024 * 1024  # 1MB
 FRAME_INTERVAL = 90
 MAX_FRAMES = 3
+# 默认签名取帧位置：开始、中间、结尾
+DEFAULT_SIGNATURE_POSITIONS = (0.0, 0.5, 1.0)
 BATCH_SIZE = 20  # 减小批次大小
 NUM_PROCESSES = max(os.cpu_count() - 1, 1)  # 保留一个核心给系统
 LOG_DIR = 'logs'
 DUPLICATE_DIR = r"E:\5\重复"
 
+# --- 感知哈希索引配置 ---
+# 启用后按多帧感知哈希找近似重复（重新编码/改码率的副本也能找到），输出重复簇
+USE_PHASH_INDEX = True
+# 签名取帧位置（占视频时长的比例，取该时间点之前最近的关键帧），避开片头片尾的黑场
+SIGNATURE_POSITIONS = (0.1, 0.3, 0.5, 0.7, 0.9)
+# 每帧允许的汉明距离（64位哈希），总阈值 = 帧数 * 该值
+PHASH_FRAME_DISTANCE = 5
+
 # --- 日志配置 ---
 LOG_DIR = 'logs'
 LOG_FILE = os.path.join(LOG_DIR, 'duplicate_video_finder.log')
@@ -67,38 +79,49 @@ def quick_hash(filepath, sample_size=1024 * 1024):
         return None
 
 
-def calculate_video_signature(filepath):
-    """优化的视频特征计算"""
-    try:
-        cap = cv2.VideoCapture(filepath)
-        if not cap.isOpened():
-            return None
+def read_frames_cv2(filepath, positions=None):
+    """用 cv2 逐个 seek 取帧（关键帧采样不可用时的回退），返回缩放到 16x16 的帧列表"""
+    cap = cv2.VideoCapture(filepath)
+    if not cap.isOpened():
+        return None
 
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        if total_frames <= 0:
-            cap.release()
-            return None
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if total_frames <= 0:
+        cap.release()
+        return None
 
-        # 只取视频的开始、中间和结尾的帧
-        frame_positions = [
-            0,
-            total_frames // 2,
-            max(0, total_frames - 1)
-        ]
+    frame_positions = [min(int(total_frames * p), total_frames - 1) for p in positions or DEFAULT_SIGNATURE_POSITIONS]
 
-        signatures = []
-        for pos in frame_positions:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, pos)
-            ret, frame = cap.read()
-            if ret:
-                # 进一步降低分辨率
-                frame = cv2.resize(frame, (16, 16))
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                img = Image.fromarray(gray)
-                hash_value = imagehash.average_hash(img)
-                signatures.append(str(hash_value))
+    frames = []
+    for pos in frame_positions:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, pos)
+        ret, frame = cap.read()
+        if ret:
+            frames.append(cv2.resize(frame, (16, 16)))
 
-        cap.release()
+    cap.release()
+    return frames
+
+
+def calculate_video_signature(filepath, positions=None):
+    """优化的视频特征计算
+
+    positions 为取帧位置（占视频时长的比例），默认取开始、中间和结尾
+    """
+    try:
+        # 只解码采样点之前最近的关键帧，解码时直接缩小到 16x16
+        frames = sample_frames(filepath, positions or DEFAULT_SIGNATURE_POSITIONS, size=(16, 16))
+        if frames is None:
+            frames = read_frames_cv2(filepath, positions)
+        if frames is None:
+            return None
+
+        signatures = []
+        for frame in frames:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            img = Image.fromarray(gray)
+            hash_value = imagehash.average_hash(img)
+            signatures.append(str(hash_value))
         return signatures
     except Exception as e:
         return None
@@ -125,9 +148,8 @@ def move_duplicate(file_to_move):
         return False
 
 
-def process_file(args):
-    """单文件处理函数"""
-    filepath, shared_dict = args
+def process_file(filepath):
+    """单文件处理函数：子进程只计算 (路径, 大小, 快速哈希)，分组比对在主进程完成"""
     try:
         # 快速检查文件是否存在
         if not os.path.exists(filepath):
@@ -141,87 +163,163 @@ def process_file(args):
         if not quick_hash_value:
             return None
 
-        # 检查是否已经处理过
-        if quick_hash_value in shared_dict:
-            existing_file = shared_dict[quick_hash_value]
+        return filepath, file_size, quick_hash_value
+    except Exception:
+        return None
 
-            # 检查文件是否仍然存在
-            if not os.path.exists(existing_file):
-                shared_dict[quick_hash_value] = filepath
-                return None
 
-            # 比较文件大小
-            existing_size = os.path.getsize(existing_file)
-            if abs(file_size - existing_size) / max(file_size, existing_size) > 0.01:
-                return None
+def compute_signature_task(filepath):
+    """子进程中计算视频特征"""
+    return filepath, calculate_video_signature(filepath)
 
-            # 计算视频特征
-            sig1 = calculate_video_signature(filepath)
-            sig2 = calculate_video_signature(existing_file)
 
-            if sig1 and sig2 and len(sig1) == len(sig2):
-                differences = sum(s1 != s2 for s1, s2 in zip(sig1, sig2))
-                if differences <= 1:  # 允许最多1帧的差异
-                    return (filepath, existing_file)
-        else:
-            shared_dict[quick_hash_value] = filepath
+def compute_phash_signature(filepath):
+    """子进程中计算整数签名，取帧不全时返回 None"""
+    signature = calculate_video_signature(filepath, SIGNATURE_POSITIONS)
+    if not signature or len(signature) != len(SIGNATURE_POSITIONS):
+        return filepath, None
+    return filepath, signature_to_int(signature)
 
-        return None
-    except Exception:
-        return None
+
+def find_duplicate_clusters(directory):
+    """按感知哈希索引查找近似重复视频，每个重复簇保留最大的文件，其余与它足够接近的移动到重复目录"""
+    index = get_phash_index()
+    frames = len(SIGNATURE_POSITIONS)
+    max_distance = frames * PHASH_FRAME_DISTANCE
+
+    all_files = list(iter_video_files(directory, VIDEO_EXTENSIONS))
+    logger.info(f"Found {len(all_files)} video files.")
+
+    # 1. 已索引且未变化的文件直接复用签名，其余文件在进程池中抽帧计算
+    signatures = {}
+    pending = []
+    for filepath in all_files:
+        signature = index.get(filepath, frames)
+        if signature is None:
+            pending.append(filepath)
+        else:
+            signatures[filepath] = signature
+
+    with ProcessPoolExecutor(max_workers=NUM_PROCESSES) as executor:
+        with tqdm(total=len(pending), desc="Computing signatures") as pbar:
+            for filepath, signature in executor.map(compute_phash_signature, pending, chunksize=BATCH_SIZE):
+                if signature is not None:
+                    signatures[filepath] = signature
+                    index.add(filepath, signature, frames)
+                pbar.update(1)
+
+    # 2. BK 树查询近邻，合并成重复簇（同一索引里其他目录的文件也会被找到）
+    pairs = []
+    for filepath in tqdm(all_files, desc="Searching index"):
+        signature = signatures.get(filepath)
+        if signature is None:
+            continue
+        own_path = os.path.normcase(os.path.abspath(filepath))
+        for other_path, distance in index.search(signature, frames, max_distance):
+            if other_path == own_path:
+                continue
+            if not os.path.exists(other_path):
+                index.remove(other_path)
+                continue
+            pairs.append((own_path, other_path))
+
+    clusters = cluster_duplicates(pairs)
+    index.log_stats()
+    logger.info(f"Duplicate clusters found: {len(clusters)}")
+
+    # 3. 每个簇保留最大的文件（通常画质最好），只移动扫描目录内的其余文件。
+    # 簇是单链接合并的（A~B、B~C 会把 A、C 并到一起），所以移动前还要确认
+    # 该文件和保留的文件本身的距离也在阈值内，否则只记录不移动
+    scan_root = os.path.normcase(os.path.abspath(directory)).rstrip(os.sep) + os.sep
+    cluster_signatures = {os.path.normcase(os.path.abspath(p)): s for p, s in signatures.items()}
+    moved_count = 0
+    for cluster in clusters:
+        keeper = max(cluster, key=lambda p: (os.path.getsize(p) if os.path.exists(p) else -1, p))
+        keeper_signature = cluster_signatures.get(keeper)
+        if keeper_signature is None:
+            keeper_signature = index.get(keeper, frames)
+        logger.info(f"Cluster ({len(cluster)} files), keep: {keeper}")
+        for filepath in cluster:
+            logger.info(f"    {filepath}")
+            if filepath == keeper or not filepath.startswith(scan_root):
+                continue
+            signature = cluster_signatures.get(filepath)
+            if keeper_signature is None or signature is None or \
+                    hamming_distance(signature, keeper_signature) > max_distance:
+                logger.info(f"    Kept (too far from {os.path.basename(keeper)}): {filepath}")
+                continue
+            if move_duplicate(filepath):
+                index.remove(filepath)
+                moved_count += 1
+
+    logger.info(f"Total files processed: {len(all_files)}")
+    logger.info(f"Duplicates found and moved: {moved_count}")
+    return clusters
 
 
 def find_duplicate_videos(directory):
-    """优化的主函数"""
-    # 使用Manager来共享数据
-    with Manager() as manager:
-        shared_dict = manager.dict()
-
-        # 收集所有视频文件
-        all_files = []
-        for root, _, files in os.walk(directory):
-            for filename in files:
-                if filename.lower().endswith(VIDEO_EXTENSIONS):
-                    filepath = os.path.join(root, filename)
-                    all_files.append(filepath)
-
-        logger.info(f"Found {len(all_files)} video files.")
-
-        # 创建进程池
-        with ProcessPoolExecutor(max_workers=NUM_PROCESSES) as executor:
-            # 准备任务参数
-            tasks = [(f, shared_dict) for f in all_files]
-
-            # 使用tqdm显示进度
-            duplicates = []
-            with tqdm(total=len(all_files), desc="Processing videos") as pbar:
-                # 分批提交任务
-                for i in range(0, len(tasks), BATCH_SIZE):
-                    batch = tasks[i:i + BATCH_SIZE]
-                    futures = [executor.submit(process_file, args) for args in batch]
-
-                    # 处理每个批次的结果
-                    for future in futures:
-                        try:
-                            result = future.result()
-                            if result:
-                                duplicates.append(result)
-                            pbar.update(1)
-                        except Exception as e:
-                            logger.error(f"Error processing file: {e}")
-                            pbar.update(1)
-
-        # 移动重复文件
-        moved_count = 0
-        for filepath, existing_filepath in duplicates:
-            try:
-                if move_duplicate(existing_filepath):
-                    moved_count += 1
-            except Exception as e:
-                logger.error(f"Error moving file {existing_filepath}: {e}")
-
-        logger.info(f"Total files processed: {len(all_files)}")
-        logger.info(f"Duplicates found and moved: {moved_count}")
+    """优化的主函数
+
+    子进程只算哈希和特征并返回，主进程用普通字典分组，没有 Manager 代理的进程间往返，
+    也不存在两个子进程同时「先查后写」同一个哈希的竞争。
+    """
+    # 收集所有视频文件
+    all_files = list(iter_video_files(directory, VIDEO_EXTENSIONS))
+
+    logger.info(f"Found {len(all_files)} video files.")
+
+    # 快速哈希 -> (首个文件, 大小)
+    first_seen = {}
+    candidates = []
+
+    # 创建进程池
+    with ProcessPoolExecutor(max_workers=NUM_PROCESSES) as executor:
+        # 1. 并行计算快速哈希，主进程按扫描顺序分组
+        with tqdm(total=len(all_files), desc="Processing videos") as pbar:
+            for result in executor.map(process_file, all_files, chunksize=BATCH_SIZE):
+                pbar.update(1)
+                if not result:
+                    continue
+                filepath, file_size, quick_hash_value = result
+                existing = first_seen.get(quick_hash_value)
+                if existing is None:
+                    first_seen[quick_hash_value] = (filepath, file_size)
+                    continue
+
+                # 比较文件大小
+                existing_file, existing_size = existing
+                if abs(file_size - existing_size) / max(file_size, existing_size, 1) > 0.01:
+                    continue
+                candidates.append((filepath, existing_file))
+
+        # 2. 只给候选对里的文件计算视频特征，每个文件只算一次
+        candidate_files = sorted({path for pair in candidates for path in pair})
+        signatures = {}
+        with tqdm(total=len(candidate_files), desc="Computing signatures") as pbar:
+            for filepath, signature in executor.map(compute_signature_task, candidate_files, chunksize=BATCH_SIZE):
+                signatures[filepath] = signature
+                pbar.update(1)
+
+    duplicates = []
+    for filepath, existing_file in candidates:
+        sig1 = signatures.get(filepath)
+        sig2 = signatures.get(existing_file)
+        if sig1 and sig2 and len(sig1) == len(sig2):
+            differences = sum(s1 != s2 for s1, s2 in zip(sig1, sig2))
+            if differences <= 1:  # 允许最多1帧的差异
+                duplicates.append((filepath, existing_file))
+
+    # 移动重复文件
+    moved_count = 0
+    for filepath, existing_filepath in duplicates:
+        try:
+            if os.path.exists(existing_filepath) and move_duplicate(existing_filepath):
+                moved_count += 1
+        except Exception as e:
+            logger.error(f"Error moving file {existing_filepath}: {e}")
+
+    logger.info(f"Total files processed: {len(all_files)}")
+    logger.info(f"Duplicates found and moved: {moved_count}")
 
 
 if __name__ == "__main__":
@@ -230,5 +328,8 @@ if __name__ == "__main__":
     if not os.path.exists(DUPLICATE_DIR):
         os.makedirs(DUPLICATE_DIR)
 
-    find_duplicate_videos(directory_to_search)
+    if USE_PHASH_INDEX:
+        find_duplicate_clusters(directory_to_search)
+    else:
+        find_duplicate_videos(directory_to_search)
     logger.info("Finished processing all videos.")
\ No newline at end of file
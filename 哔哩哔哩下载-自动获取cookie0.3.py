@@ -13,7 +13,6 @@ import json
 import os
 import sys
 import time
-import subprocess
 from datetime import datetime
 from loguru import logger
 import threading
@@ -22,6 +21,7 @@ import socket
 import platform
 import random
 from typing import Dict, Any, Optional, List
+from urllib.parse import urlparse
 # from concurrent.futures import ThreadPoolExecutor, as_completed # 已移除
 
 # --- 新增数据库依赖 ---
@@ -32,9 +32,26 @@ from mysql.connector import errorcode
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext
 
+# --- 下载引擎 ---
+from dash_downloader import DashDownloader
+from task_pool import PrefetchWorkerPool
+from task_claim import TaskClaimer
+from bandwidth_scheduler import BandwidthClient
+
 # --- 配置文件 ---
 CONFIG_FILE = "config.json"
 
+# 大文件分几段并行下载（音频和视频本身也同时下载）
+DOWNLOAD_PARTS = 4
+# 边下边合并：ffmpeg 直接读音视频流写成品，不落地中间文件（不分段、不支持续传）
+MERGE_WHILE_DOWNLOADING = False
+# 工作池：同时下载的任务数、同一 CDN 主机同时下载的任务数、一次预取（领取并解析播放地址）的任务数
+DOWNLOAD_WORKERS = 2
+DOWNLOADS_PER_HOST = 2
+PREFETCH_TASKS = 2
+# 与本机其他下载器共用 bandwidth_scheduler 守护进程的总限速，数值越大分到的带宽越多
+BANDWIDTH_PRIORITY = 1
+
 # ==============================================================================
 # 0. 数据库配置与连接模块 (修改：添加全局表名和collector变量)
 # ==============================================================================
@@ -132,55 +149,6 @@ def initialize_database():
             conn.close()
 
 
-def get_task_to_resume(computer_name: str) -> Optional[Dict[str, Any]]:
-    """查找本机之前未完成的任务，增加collector条件"""
-    conn = get_db_connection()
-    if not conn: return None
-    task = None
-    try:
-        cursor = conn.cursor(dictionary=True)
-        # 修改：使用全局表名变量，增加collector条件
-        query = f"SELECT id, url, primary_category, secondary_category FROM {TABLE_NAME} WHERE status = 2 AND computer_name = %s AND collector = %s LIMIT 1"
-        cursor.execute(query, (computer_name, COLLECTOR))
-        task = cursor.fetchone()
-    except Exception as e:
-        logger.error(f"查询待恢复任务失败: {e}")
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
-    return task
-
-
-def get_new_task(computer_name: str) -> Optional[Dict[str, Any]]:
-    """原子性地获取一个新任务并标记为正在下载，增加collector条件"""
-    conn = get_db_connection()
-    if not conn: return None
-    task = None
-    try:
-        cursor = conn.cursor(dictionary=True)
-        conn.start_transaction()
-        # 修改：使用全局表名变量，增加collector条件
-        query = f"SELECT id, url, primary_category, secondary_category FROM {TABLE_NAME} WHERE status = 0 AND collector = %s LIMIT 1 FOR UPDATE"
-        cursor.execute(query, (COLLECTOR,))
-        row = cursor.fetchone()
-        if row:
-            task_id = row['id']
-            # 修改：使用全局表名变量
-            update_query = f"UPDATE {TABLE_NAME} SET status = 2, computer_name = %s WHERE id = %s"
-            cursor.execute(update_query, (computer_name, task_id))
-            task = row
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"获取新任务失败: {e}")
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
-    return task
-
-
 def update_task_status(task_id: int, status: int, title: Optional[str] = None):
     """更新任务状态"""
     conn = get_db_connection()
@@ -468,6 +436,10 @@ class DownloaderApp:
 # ==============================================================================
 BASE_SAVE_DIR, FFMPEG_PATH = '', ''
 session = requests.Session()
+# 多个任务同时分段下载，连接池要容纳 任务数 × 音视频 × 分段数 个连接
+session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=DOWNLOAD_WORKERS * 2 * DOWNLOAD_PARTS + 4))
+bandwidth_limiter = BandwidthClient('bilibili', resource='net', priority=BANDWIDTH_PRIORITY, logger=logger)
+dash_downloader = DashDownloader(session, parts=DOWNLOAD_PARTS, limiter=bandwidth_limiter, logger=logger)
 
 def get_random_cookie_from_dir(dir_path: str) -> Optional[str]:
     """从指定文件夹中随机选择一个.txt文件并读取其Cookie内容"""
@@ -507,14 +479,16 @@ def get_cookie_from_file(file_path: str) -> Optional[str]:
         return None
 
 
-def get_playinfo_from_api(bvid: str, page_number: int = 1) -> Optional[Dict[str, Any]]:
+def get_playinfo_from_api(bvid: str, page_number: int = 1, cookie: Optional[str] = None) -> Optional[Dict[str, Any]]:
     """
     通过BVID和分P号获取信息，并自动选择最高画质。
+    cookie 只用于本次请求，不写进共用的 session。
     """
     view_api_url = "https://api.bilibili.com/x/web-interface/view"
     params = {'bvid': bvid}
+    headers = {'Cookie': cookie} if cookie else None
     try:
-        response = session.get(view_api_url, params=params, timeout=20)
+        response = session.get(view_api_url, params=params, headers=headers, timeout=20)
         response.raise_for_status()
         data = response.json()
 
@@ -553,7 +527,7 @@ def get_playinfo_from_api(bvid: str, page_number: int = 1) -> Optional[Dict[str,
 
         play_api_url = "https://api.bilibili.com/x/player/playurl"
         play_params = {'bvid': bvid, 'cid': cid, 'fnval': 4048}
-        play_response = session.get(play_api_url, params=play_params, timeout=20)
+        play_response = session.get(play_api_url, params=play_params, headers=headers, timeout=20)
         play_response.raise_for_status()
         play_data = play_response.json()
 
@@ -581,7 +555,9 @@ def get_playinfo_from_api(bvid: str, page_number: int = 1) -> Optional[Dict[str,
             'videoUrl': best_video_stream['baseUrl'],
             'audioUrl': best_audio_stream['baseUrl'],
             'width': best_video_stream.get('width', 0),
-            'height': best_video_stream.get('height', 0)
+            'height': best_video_stream.get('height', 0),
+            'videoCodecs': best_video_stream.get('codecs'),
+            'audioCodecs': best_audio_stream.get('codecs')
         }
 
     except requests.exceptions.RequestException as e:
@@ -592,90 +568,54 @@ def get_playinfo_from_api(bvid: str, page_number: int = 1) -> Optional[Dict[str,
         return None
 
 
-def saveMedia_single_thread(base_download_dir: str, fileName: str, url: str, desc: str) -> Optional[str]:
+def saveMedia_parallel(base_download_dir: str, fileName: str, audio_url: str, video_url: str,
+                       cookie: Optional[str] = None):
     """
-    使用单线程流式下载媒体文件，支持断点续传并显示进度条。(修改：接收base_download_dir参数)
+    同时下载音频和视频，大文件按 Range 分段多连接下载，断点续传按段记录（见 dash_downloader.py）。
+    返回 (音频路径, 视频路径)，失败的为 None
     """
     os.makedirs(name=base_download_dir, exist_ok=True)
-    final_file_path = os.path.join(base_download_dir, f"{fileName}.{desc}")
-    temp_file_path = final_file_path + ".tmp"
+    audio_path, video_path = dash_downloader.download_many([
+        (audio_url, os.path.join(base_download_dir, f"{fileName}.audio"), 'audio'),
+        (video_url, os.path.join(base_download_dir, f"{fileName}.video"), 'video'),
+    ], headers={'Cookie': cookie} if cookie else None)
+    return audio_path, video_path
+
+
+def AvMerge(mp3Path: str, mp4Path: str, savePath: str, video_codecs: Optional[str] = None,
+            audio_codecs: Optional[str] = None) -> bool:
+    """合并音视频：编码兼容时 -c copy 直接复制，否则音频转 AAC（见 dash_downloader.py）"""
+    if not dash_downloader.merge(FFMPEG_PATH, mp4Path, mp3Path, savePath, video_codecs, audio_codecs):
+        logger.error(f"FFmpeg合并失败: {os.path.basename(savePath)}")
+        return False
+    os.remove(mp3Path)
+    os.remove(mp4Path)
+    return True
 
-    if os.path.exists(final_file_path):
-        logger.info(f"{desc} 最终文件已存在，跳过下载。")
-        return final_file_path
 
-    try:
-        downloaded_size = 0
-        if os.path.exists(temp_file_path):
-            downloaded_size = os.path.getsize(temp_file_path)
-
-        headers = session.headers.copy()
-        if downloaded_size > 0:
-            headers['Range'] = f'bytes={downloaded_size}-'
-            logger.info(f"发现未完成的 {desc} 文件，从 {downloaded_size / 1024 / 1024:.2f} MB 处继续下载。")
-
-        with session.get(url, headers=headers, stream=True, timeout=(30, 3600)) as r:
-            if r.status_code not in [200, 206]:
-                r.raise_for_status()
-
-            total_size_str = r.headers.get('Content-Range', r.headers.get('content-length'))
-            total_size = 0
-            if total_size_str:
-                if '/' in total_size_str:
-                    total_size = int(total_size_str.split('/')[-1])
-                else:
-                    total_size = downloaded_size + int(total_size_str)
-            else:
-                total_size = downloaded_size
-
-            with tqdm(total=total_size, initial=downloaded_size, desc=desc, unit='B', unit_scale=True,
-                      unit_divisor=1024, leave=False) as pbar:
-                with open(temp_file_path, 'ab') as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            pbar.update(len(chunk))
-
-        os.rename(temp_file_path, final_file_path)
-        logger.success(f"{desc}: 文件下载完成 -> {os.path.basename(final_file_path)}")
-        return final_file_path
-
-    except requests.exceptions.HTTPError as http_err:
-        logger.error(f"HTTP错误导致 {desc} 下载失败: {http_err}. 请检查Cookie是否已过期或不正确。")
-        return None
-    except Exception as e:
-        logger.error(f"{desc} 下载过程中发生错误: {e}")
+def parse_video_url(url: str) -> Optional[tuple]:
+    """从链接中提取 (BVID, 分P号)，提取不到 BVID 时返回 None"""
+    bvid_match = re.search(r'BV([a-zA-Z0-9]{10})', url)
+    if not bvid_match:
         return None
+    page_match = re.search(r'[?&]p=(\d+)', url)
+    return bvid_match.group(0), int(page_match.group(1)) if page_match else 1
 
 
-def AvMerge(mp3Path: str, mp4Path: str, savePath: str) -> bool:
-    """合并音视频 (无改动)"""
-    try:
-        command = [FFMPEG_PATH, '-y', '-i', mp4Path, '-i', mp3Path, '-c:v', 'copy', '-c:a', 'aac', '-strict',
-                   'experimental', savePath]
-        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL);
-        logger.success(f"合并成功: {os.path.basename(savePath)}");
-        os.remove(mp3Path);
-        os.remove(mp4Path);
-        return True
-    except Exception as e:
-        logger.error(f"FFmpeg合并失败: {e}");
-        return False
-
-
-def processVideoUrl(url: str, primary_category: Optional[str], secondary_category: Optional[str]) -> Dict[str, Any]:
+def processVideoUrl(url: str, primary_category: Optional[str], secondary_category: Optional[str],
+                    prefetched_info: Optional[Dict[str, Any]] = None,
+                    cookie: Optional[str] = None) -> Dict[str, Any]:
     """
-    处理单个视频链接，调用单线程下载函数。(修改：接收分类参数)
+    处理单个视频链接，音频和视频并行下载。(修改：接收分类参数)
+    prefetched_info 为工作池提前取好的播放信息，第一次尝试直接使用，重试时重新获取。
+    cookie 为这个任务自己的 Cookie，所有请求都带上它（并发的任务各用各的）。
     """
     MAX_RETRIES = 5
 
-    bvid_match = re.search(r'BV([a-zA-Z0-9]{10})', url)
-    if not bvid_match:
+    parsed = parse_video_url(url)
+    if not parsed:
         return {'success': False, 'title': None, 'error_msg': f"无法从URL中提取BVID: {url}", 'reason': 'parse_failed'}
-    bvid = bvid_match.group(0)
-
-    page_match = re.search(r'[?&]p=(\d+)', url)
-    page_number = int(page_match.group(1)) if page_match else 1
+    bvid, page_number = parsed
 
     logger.info(f"识别到 BVID: {bvid}, 分P: {page_number}")
 
@@ -690,7 +630,10 @@ def processVideoUrl(url: str, primary_category: Optional[str], secondary_categor
 
     for attempt in range(1, MAX_RETRIES + 1):
         try:
-            videoInfo = get_playinfo_from_api(bvid, page_number)
+            if attempt == 1 and prefetched_info:
+                videoInfo = prefetched_info
+            else:
+                videoInfo = get_playinfo_from_api(bvid, page_number, cookie)
             if not videoInfo:
                 raise Exception("通过API获取视频信息失败。")
 
@@ -709,13 +652,21 @@ def processVideoUrl(url: str, primary_category: Optional[str], secondary_categor
                 return {'success': True, 'title': safe_title, 'reason': 'already_exists'}
 
             # 修改：传递分类目录路径
-            mp3_path = saveMedia_single_thread(category_dir, safe_title, videoInfo['audioUrl'], 'audio')
+            if MERGE_WHILE_DOWNLOADING:
+                if not dash_downloader.download_and_merge(FFMPEG_PATH, videoInfo['videoUrl'], videoInfo['audioUrl'],
+                                                          final_output, videoInfo.get('videoCodecs'),
+                                                          videoInfo.get('audioCodecs'),
+                                                          headers={'Cookie': cookie} if cookie else None):
+                    raise Exception("边下边合并失败。请检查Cookie是否已过期或不正确。")
+                return {'success': True, 'title': safe_title, 'reason': 'downloaded'}
+
+            # 音频和视频同时下载
+            mp3_path, mp4_path = saveMedia_parallel(category_dir, safe_title, videoInfo['audioUrl'], videoInfo['videoUrl'],
+                                                    cookie)
             if not mp3_path: raise Exception("下载音频文件失败。请检查Cookie是否已过期或不正确。")
-
-            mp4_path = saveMedia_single_thread(category_dir, safe_title, videoInfo['videoUrl'], 'video')
             if not mp4_path: raise Exception("下载视频文件失败。请检查Cookie是否已过期或不正确。")
 
-            if not AvMerge(mp3_path, mp4_path, final_output):
+            if not AvMerge(mp3_path, mp4_path, final_output, videoInfo.get('videoCodecs'), videoInfo.get('audioCodecs')):
                 raise Exception("合并音视频文件失败")
 
             return {'success': True, 'title': safe_title, 'reason': 'downloaded'}
@@ -754,67 +705,83 @@ def main_downloader_loop(config, stop_event):
     logger.info(f"当前收集者: {COLLECTOR}")
     initialize_database()
 
-    while not stop_event.is_set():
-        task = None
-        try:
-            task = get_task_to_resume(COMPUTER_NAME)
-            if task:
-                logger.info(f"发现本机未完成的任务，继续处理: {task['url']}")
-            else:
-                task = get_new_task(COMPUTER_NAME)
-
-            if task:
-                # 在处理每个任务前，都从文件重新加载Cookie
-                fresh_cookie = get_random_cookie_from_dir(cookie_dir)
-                if not fresh_cookie:
-                    logger.error(f"无法从目录 '{cookie_dir}' 中获取有效Cookie，本次任务将跳过，稍后重试。")
-                    # 不重置任务状态，等待下个循环自动重试
-                    stop_event.wait(timeout=30)
-                    continue  # 跳过本次循环
-
-                session.headers['Cookie'] = fresh_cookie
-                logger.info("已从文件动态更新Cookie。")
-
-                task_id, url = task['id'], task['url']
-                # 修改：获取分类信息
-                primary_category = task.get('primary_category')
-                secondary_category = task.get('secondary_category')
-
-                logger.info(f"开始处理任务 (ID: {task_id}): {url}")
-                logger.info(
-                    f"分类信息 - 主分类: {primary_category or '未分类'}, 子分类: {secondary_category or '未分类'}")
-
-                # 修改：传递分类信息
-                result = processVideoUrl(url, primary_category, secondary_category)
-
-                # 根据 processVideoUrl 返回的结果更新任务状态
-                if result.get('success'):
-                    # 成功下载或文件已存在，都标记为已下载
-                    update_task_status(task_id, 1, result['title'])
-                    logger.success(f"任务 (ID: {task_id}) 处理成功: {result['title']}")
-                else:
-                    # 处理失败的情况
-                    if result.get('reason') == 'low_resolution':
-                        # 如果是分辨率低，根据要求将状态重置为4
-                        update_task_status(task_id, 4)
-                        logger.warning(f"任务 (ID: {task_id}) 因分辨率过低已跳过，状态已重置为4 (分辨率不足，跳过下载)。")
-                    else:
-                        # 其他所有失败情况，标记为失败状态3
-                        update_task_status(task_id, 3)
-                        logger.error(f"任务 (ID: {task_id}) 处理失败，已标记为失败状态: {url}。")
-            else:
-                logger.info("数据库中无待处理链接，等待下一次检查...")
-                stop_event.wait(timeout=30)
+    # 批量领取 (SKIP LOCKED) + 租约：本机或其他机器中断的任务租约过期后自动重新领取
+    claimer = TaskClaimer(get_db_connection, TABLE_NAME,
+                          columns=('id', 'url', 'primary_category', 'secondary_category'),
+                          pending_statuses=(0,), claimed_status=2,
+                          owner_column='computer_name', owner=COMPUTER_NAME,
+                          filters={'collector': COLLECTOR}, failed_status=3, logger=logger)
+    try:
+        claimer.ensure_schema()
+        claimer.expire_own_leases()
+    except Exception as e:
+        logger.error(f"初始化任务领取表结构失败: {e}")
 
-            if not task:
-                time.sleep(1)
+    def resolve_task(task):
+        # 元数据线程上为每个任务单独读一份 Cookie 并提前取好播放地址，下载线程拿到任务就能直接开始。
+        # Cookie 跟着任务走，不写进共用的 session，并发下载和重试时不会串用别的任务的 Cookie
+        cookie = get_random_cookie_from_dir(cookie_dir)
+        if not cookie:
+            return {'cookie': None, 'video_info': None}
+        parsed = parse_video_url(task['url'])
+        return {'cookie': cookie, 'video_info': get_playinfo_from_api(*parsed, cookie=cookie) if parsed else None}
+
+    def task_host(task, resolved):
+        video_info = resolved and resolved.get('video_info')
+        return urlparse(video_info['videoUrl']).netloc if video_info else 'api.bilibili.com'
+
+    def process_task(task, resolved):
+        task_id, url = task['id'], task['url']
+        resolved = resolved or {}
+        cookie = resolved.get('cookie') or get_random_cookie_from_dir(cookie_dir)
+        if not cookie:
+            # 不改任务状态：稍等后还回数据库，Cookie 补上后再重新领取
+            logger.error(f"无法从目录 '{cookie_dir}' 中获取有效Cookie，任务 (ID: {task_id}) 稍后重试。")
+            stop_event.wait(timeout=30)
+            claimer.release([task])
+            return True
 
-        except Exception as e:
-            logger.error(f"监控循环发生未知错误: {e}", exc_info=True)
-            if task and 'id' in task:
-                logger.warning(f"将任务 {task['id']} 状态重置为0")
-                update_task_status(task['id'], 0)
-            stop_event.wait(timeout=60)
+        # 修改：获取分类信息
+        primary_category = task.get('primary_category')
+        secondary_category = task.get('secondary_category')
+
+        logger.info(f"开始处理任务 (ID: {task_id}): {url}")
+        logger.info(
+            f"分类信息 - 主分类: {primary_category or '未分类'}, 子分类: {secondary_category or '未分类'}")
+
+        # 修改：传递分类信息
+        result = processVideoUrl(url, primary_category, secondary_category, resolved.get('video_info'), cookie)
+
+        # 根据 processVideoUrl 返回的结果更新任务状态
+        if result.get('success'):
+            # 成功下载或文件已存在，都标记为已下载
+            update_task_status(task_id, 1, result['title'])
+            logger.success(f"任务 (ID: {task_id}) 处理成功: {result['title']}")
+        else:
+            # 处理失败的情况
+            if result.get('reason') == 'low_resolution':
+                # 如果是分辨率低，根据要求将状态重置为4
+                update_task_status(task_id, 4)
+                logger.warning(f"任务 (ID: {task_id}) 因分辨率过低已跳过，状态已重置为4 (分辨率不足，跳过下载)。")
+            else:
+                # 其他所有失败情况，标记为失败状态3
+                update_task_status(task_id, 3)
+                logger.error(f"任务 (ID: {task_id}) 处理失败，已标记为失败状态: {url}。")
+
+    pool = PrefetchWorkerPool(
+        claim=claimer.claim,
+        process=process_task,
+        release=claimer.release,
+        fail=claimer.fail,
+        resolve=resolve_task,
+        host_of=task_host,
+        workers=DOWNLOAD_WORKERS, per_host=DOWNLOADS_PER_HOST, prefetch=PREFETCH_TASKS,
+        stop_event=stop_event, idle_wait=30, logger=logger)
+    pool.run()
+    pool.log_stats()
+    claimer.log_stats()
+    claimer.close()
+    bandwidth_limiter.log_stats()
 
     if wechat_work_notifier_instance and wechat_work_notifier_instance.enabled:
         wechat_work_notifier_instance.send_message_async("下载监控任务已停止。")
@@ -852,23 +819,6 @@ def save_config(config_data):
 
 
 if __name__ == '__main__':
-    try:
-        from tqdm import tqdm
-    except ImportError:
-        root = tk.Tk();
-        root.withdraw();
-        messagebox.showerror("依赖缺失", "错误：tqdm 库未安装。\n请在命令行运行 'pip install tqdm' 进行安装。");
-        sys.exit(1)
-
-    try:
-        import mysql.connector
-    except ImportError:
-        root = tk.Tk();
-        root.withdraw();
-        messagebox.showerror("依赖缺失",
-                             "错误：mysql-connector-python 库未安装。\n请在命令行运行 'pip install mysql-connector-python' 进行安装。");
-        sys.exit(1)
-
     root = tk.Tk();
     app = DownloaderApp(root);
     root.mainloop()
\ No newline at end of file
@@ -2,12 +2,10 @@
 
 import logging
 import os
-import subprocess
-import json
 from datetime import datetime
-import concurrent.futures
 from queue import Queue
 from tqdm import tqdm
+from probe_engine import get_probe_engine
 
 # 日志配置
 log_dir = "./logs"
@@ -32,29 +30,15 @@ if not logger.handlers:
     stream_handler.setFormatter(log_format)
     logger.addHandler(stream_handler)
 
-def get_video_info(video_path, ffprobe_path, retry=2):
-    """使用 ffprobe 获取视频的分辨率和时长，失败自动重试"""
+def get_video_info(video_path, ffprobe_path, retry=2, info=None):
+    """通过探测引擎获取视频的分辨率和时长，失败自动重试"""
     for attempt in range(retry):
         try:
-            command = [
-                ffprobe_path, '-v', 'error',
-                '-show_entries', 'format=duration',
-                '-show_entries', 'stream=width,height',
-                '-of', 'json', video_path
-            ]
-            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8')
-            info = json.loads(result.stdout)
-            width, height = 0, 0
-            if 'streams' in info:
-                for stream in info['streams']:
-                    if 'width' in stream and 'height' in stream:
-                        width = stream.get('width', 0)
-                        height = stream.get('height', 0)
-                        break
-            duration = 0
-            if 'format' in info and 'duration' in info['format']:
-                duration = float(info['format']['duration'])
-            return width, height, duration
+            if info is None or attempt > 0:
+                info = get_probe_engine(ffprobe_path).probe(video_path)
+            if not info:
+                raise ValueError("无法读取视频信息")
+            return info.get('width', 0), info.get('height', 0), info.get('duration', 0)
         except Exception as e:
             if attempt == retry - 1:
                 logger.error(f"获取视频信息时出错: {e} ({video_path})")
@@ -106,9 +90,9 @@ def process_videos_in_directory(directory, ffprobe_path, max_workers=8):
     result_queue = Queue()
     logger.info(f"共发现 {len(video_paths)} 个视频文件，开始处理...")
 
-    def safe_process(video_path, ffprobe_path, result_queue):
+    def safe_process(video_path, ffprobe_path, result_queue, info=None):
         try:
-            width, height, duration = get_video_info(video_path, ffprobe_path)
+            width, height, duration = get_video_info(video_path, ffprobe_path, info=info)
             if width is not None and height is not None and duration is not None:
                 short_edge = min(width, height)
                 if short_edge >= 1080 and duration >= 5:
@@ -123,13 +107,11 @@ def process_videos_in_directory(directory, ffprobe_path, max_workers=8):
             logger.error(f"处理视频时出错: {e} ({video_path})")
             failed_files.append(video_path)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
-            executor.submit(safe_process, video_path, ffprobe_path, result_queue)
-            for video_path in video_paths
-        ]
-        for _ in tqdm(concurrent.futures.as_completed(futures), total=len(futures), desc='处理进度'):
-            pass
+    # 探测引擎的常驻线程批量读取视频信息，结果在主线程汇总
+    engine = get_probe_engine(ffprobe_path, workers=max_workers)
+    for video_path, info in tqdm(engine.probe_many(video_paths), total=len(video_paths), desc='处理进度'):
+        safe_process(video_path, ffprobe_path, result_queue, info)
+    engine.log_stats()
 
     while not result_queue.empty():
         size, duration = result_queue.get()
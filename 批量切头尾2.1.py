@@ -39,6 +39,17 @@ import multiprocessing
 import math
 import gc
 import weakref
+import atexit
+from video_meta_cache import cached_probe, get_meta_cache
+from mp4_header import is_mp4_file, read_mp4_info
+from file_index import iter_video_files
+from stream_pipeline import StreamPipeline
+from progress_store import ProgressStore
+from smart_cut import smart_cut
+from ffmpeg_progress import run_ffmpeg
+
+# 程序退出时输出元数据缓存命中率
+atexit.register(get_meta_cache().log_stats)
 
 # ==================== 编码配置 ====================
 # 设置环境变量确保UTF-8编码
@@ -67,6 +78,9 @@ PROGRESS_FOLDER = r"Z:\personal_folder\L\去片头片尾处理完数据"
 # --- 切头尾时间配置 ---
 head_cut_time = 90  # 片头时间（秒）
 tail_cut_time = 90  # 片尾时间（秒）
+# 关键帧对齐切割：中间完整的 GOP 直接流复制，只重新编码两端不完整的 GOP；
+# 源视频不是 H.264/HEVC 或切割失败时自动回退到整段重新编码
+ENABLE_SMART_CUT = True
 
 # --- 支持的视频格式 ---
 SUPPORTED_VIDEO_FORMATS = ['.mp4', '.mov', '.avi', '.mkv', '.wmv', '.flv', '.webm', '.ts', '.m4v', '.3gp', '.f4v']
@@ -96,6 +110,14 @@ MIN_RESOLUTION_WIDTH = 1920
 # 跳过的视频移动到的目录 (设为空字符串则不移动，只跳过)
 SKIP_VIDEOS_MOVE_DIR = r"Z:\personal_folder\L\测试\跳过的低分辨率视频"
 
+# --- 流式处理配置 ---
+# 启用后扫描、分辨率检查、断点过滤、编码同时进行，扫描到第一个合格视频就开始编码
+ENABLE_STREAMING_PIPELINE = True
+# 分辨率检查线程数
+PIPELINE_PROBE_WORKERS = 8
+# 阶段之间的队列长度（下游忙时上游自动等待）
+PIPELINE_QUEUE_SIZE = 64
+
 # ===================== END: 用户配置区域 =====================
 
 # ==================== START: 新增功能函数 (基于批量裁剪2.0) ====================
@@ -437,6 +459,7 @@ def get_software_optimized_options() -> Dict:
             'threads': '0'
         }
 
+@cached_probe('duration_seconds', is_valid=lambda duration: duration > 0)
 def get_media_duration_seconds(video_path: str) -> float:
     """
     获取媒体文件的时长（秒）- 增强版本，多重备用方案和详细日志
@@ -461,6 +484,13 @@ def get_media_duration_seconds(video_path: str) -> float:
         logging.error(f"无法获取文件大小: {video_name} -> {e}")
         return 0.0
     
+    # 方法0: MP4/MOV 直接解析文件头 (不启动ffprobe)
+    if is_mp4_file(video_path):
+        duration = read_mp4_info(video_path).get('duration', 0.0)
+        if duration > 0:
+            logging.debug(f"✅ 文件头解析获取时长: {duration:.1f}s - {video_name}")
+            return duration
+    
     max_retries = 3
     retry_delay = 1.0
     
@@ -676,6 +706,7 @@ def diagnose_video_file(video_path: str) -> Dict:
     
     return diagnosis
 
+@cached_probe('resolution', is_valid=lambda res: bool(res) and res[0] > 0 and res[1] > 0, decode=tuple)
 def get_video_resolution(video_path: str) -> Optional[Tuple[int, int]]:
     """
     获取视频文件的分辨率 (宽度, 高度) - 增强版本，参考批量裁剪2.0.py的多重重试机制
@@ -697,6 +728,13 @@ def get_video_resolution(video_path: str) -> Optional[Tuple[int, int]]:
     
     logging.debug(f"开始获取视频分辨率: {video_name}")
     
+    # 方法0: MP4/MOV 直接解析文件头 (不启动ffprobe)
+    if is_mp4_file(video_path):
+        info = read_mp4_info(video_path)
+        if info:
+            logging.debug(f"✅ 文件头解析获取分辨率: {info['width']}x{info['height']} - {video_name}")
+            return (info['width'], info['height'])
+    
     for attempt in range(max_retries):
         try:
             # 方法1: 使用 CSV 格式输出 (最快最可靠)
@@ -1152,7 +1190,7 @@ class ProgressManager:
         # 自动创建进度记录文件夹
         self.ensure_progress_folder()
         
-        self.progress_data = self.load_progress()
+        self.store = self.load_progress()
         
         # 为单个视频进度文件创建子文件夹
         self.individual_progress_folder = os.path.join(self.progress_folder, 'individual')
@@ -1181,49 +1219,25 @@ class ProgressManager:
             print(f"✅ 进度记录文件夹已存在: {progress_folder}")
     
     def load_progress(self):
-        """加载进度数据"""
-        try:
-            if os.path.exists(self.progress_file):
-                with open(self.progress_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    logging.info(f"加载进度记录: {len(data.get('completed', []))} 个已完成, {len(data.get('processing', []))} 个处理中")
-                    logging.info(f"进度文件路径: {self.progress_file}")
-                    # 显示前几个已完成文件作为示例
-                    completed_files = data.get('completed', [])
-                    if completed_files:
-                        logging.info(f"已完成文件示例: {completed_files[:3]}")
-                    return data
-        except Exception as e:
-            logging.warning(f"加载进度文件失败: {e}")
-        return {'completed': [], 'processing': [], 'failed': [], 'start_time': None, 'performance_history': []}
+        """加载进度数据（JSON 快照 + 追加日志，按文件名建索引）"""
+        store = ProgressStore(self.progress_file,
+                              defaults={'start_time': None, 'performance_history': []},
+                              logger=logging.getLogger())
+        counts = store.counts()
+        logging.info(f"加载进度记录: {counts['completed']} 个已完成, {counts['processing']} 个处理中")
+        logging.info(f"进度文件路径: {self.progress_file}")
+        # 显示前几个已完成文件作为示例
+        completed_files = store.completed_records()[:3]
+        if completed_files:
+            logging.info(f"已完成文件示例: {completed_files}")
+        return store
     
     def save_progress(self):
-        """保存进度数据"""
-        # 使用线程锁防止并发写入
-        max_retries = 3
-        retry_delay = 0.5
-        
-        for attempt in range(max_retries):
-            try:
-                # 先保存到临时文件
-                with open(self.temp_file, 'w', encoding='utf-8') as f:
-                    json.dump(self.progress_data, f, ensure_ascii=False, indent=2)
-                
-                # 然后移动到正式文件
-                if os.path.exists(self.progress_file):
-                    os.remove(self.progress_file)
-                os.rename(self.temp_file, self.progress_file)
-                return  # 成功保存，退出重试循环
-            except (OSError, PermissionError) as e:
-                if attempt < max_retries - 1:
-                    logging.warning(f"保存进度文件重试 {attempt + 1}/{max_retries}: {e}")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # 指数退避
-                else:
-                    logging.error(f"保存进度文件失败 (已重试 {max_retries} 次): {e}")
-            except Exception as e:
-                logging.error(f"保存进度文件失败: {e}")
-                break  # 非文件系统错误，不重试
+        """把还没写入的进度日志立即写盘（平时由后台线程每秒成组写入）"""
+        try:
+            self.store.flush()
+        except Exception as e:
+            logging.error(f"保存进度文件失败: {e}")
     
     def get_file_signature(self, file_path):
         """获取文件的唯一标识（基于文件大小、修改时间和文件名）"""
@@ -1249,24 +1263,19 @@ class ProgressManager:
         if not video_signature:
             return False, None
         
-        # 检查进度记录中是否有相同签名的文件
-        for completed_record in self.progress_data.get('completed', []):
-            if isinstance(completed_record, dict):
-                # 新格式：包含文件签名的记录
-                if (completed_record.get('name') == video_signature['name'] and
-                    completed_record.get('size') == video_signature['size']):
-                    # 检查输出目录中是否存在对应的输出文件
-                    output_name = completed_record.get('output_name', video_signature['name'])
-                    output_path = os.path.join(output_dir, output_name)
-                    if os.path.exists(output_path) and os.path.getsize(output_path) > 1024:
-                        return True, completed_record
-            else:
-                # 旧格式：只有文件名的记录
-                if completed_record == video_signature['name']:
-                    # 检查输出目录中是否存在该文件
-                    output_path = os.path.join(output_dir, completed_record)
-                    if os.path.exists(output_path) and os.path.getsize(output_path) > 1024:
-                        return True, completed_record
+        # 按 (文件名, 大小) 直接查已完成记录
+        completed_record = self.store.find_completed(video_signature['name'], video_signature['size'])
+        if completed_record is None:
+            return False, None
+        if isinstance(completed_record, dict):
+            # 新格式：包含文件签名的记录，检查输出目录中是否存在对应的输出文件
+            output_name = completed_record.get('output_name', video_signature['name'])
+        else:
+            # 旧格式：只有文件名的记录
+            output_name = completed_record
+        output_path = os.path.join(output_dir, output_name)
+        if os.path.exists(output_path) and os.path.getsize(output_path) > 1024:
+            return True, completed_record
         
         return False, None
     
@@ -1280,16 +1289,19 @@ class ProgressManager:
         
         # 回退到文件名检查
         video_name = os.path.basename(video_path)
-        return video_name in self.progress_data.get('completed', [])
+        return self.store.get_completed(video_name) == video_name
     
     def mark_completed(self, video_path, output_path=None, processing_time=0.0):
         """标记视频为已完成（记录文件签名）"""
+        video_name = os.path.basename(video_path)
         video_signature = self.get_file_signature(video_path)
         if not video_signature:
             logging.warning(f"无法获取文件签名，使用文件名记录: {video_path}")
-            video_name = os.path.basename(video_path)
-            if video_name not in self.progress_data['completed']:
-                self.progress_data['completed'].append(video_name)
+            if not self.store.is_completed(video_name):
+                self.store.mark_completed(video_name)
+            else:
+                self.store.clear_processing(video_name)
+                self.store.remove_failed(video_name)
         else:
             # 记录完整的文件信息
             completed_record = {
@@ -1303,42 +1315,20 @@ class ProgressManager:
                 'processing_time': processing_time
             }
             
-            # 移除旧的记录（如果存在）
-            self.progress_data['completed'] = [
-                record for record in self.progress_data['completed'] 
-                if not (isinstance(record, dict) and record.get('name') == video_signature['name'])
-            ]
-            self.progress_data['completed'] = [
-                record for record in self.progress_data['completed'] 
-                if record != video_signature['name']
-            ]
-            
-            # 添加新记录
-            self.progress_data['completed'].append(completed_record)
+            # 替换同名旧记录，同时从处理中和失败列表中移除
+            self.store.mark_completed(video_signature['name'], completed_record)
             
             # 记录性能数据
             if processing_time > 0:
-                self.progress_data['performance_history'].append({
+                self.store.append('performance_history', {
                     'file': video_signature['name'],
                     'time': processing_time,
                     'timestamp': datetime.now().isoformat()
                 })
-        
-        # 从处理中移除
-        video_name = os.path.basename(video_path)
-        if video_name in self.progress_data['processing']:
-            self.progress_data['processing'].remove(video_name)
-        # 从失败列表中移除
-        self.progress_data['failed'] = [f for f in self.progress_data['failed'] if f.get('name') != video_name]
-        
-        self.save_progress()
     
     def mark_processing(self, video_path):
         """标记视频为处理中"""
-        video_name = os.path.basename(video_path)
-        if video_name not in self.progress_data['processing']:
-            self.progress_data['processing'].append(video_name)
-        self.save_progress()
+        self.store.mark_processing(os.path.basename(video_path))
     
     def mark_failed(self, video_path, error_msg=""):
         """标记视频为失败"""
@@ -1346,41 +1336,37 @@ class ProgressManager:
         # 清理错误消息
         clean_error = error_msg[:200] if error_msg else "处理失败"
         
-        # 检查是否已经在失败列表中
-        failed_names = [f['name'] for f in self.progress_data['failed'] if isinstance(f, dict)]
-        if video_name not in failed_names:
-            self.progress_data['failed'].append({
-                'name': video_name,
-                'error': clean_error,
-                'time': datetime.now().isoformat()
-            })
-        # 从处理中移除
-        if video_name in self.progress_data['processing']:
-            self.progress_data['processing'].remove(video_name)
-        self.save_progress()
+        # 已经在失败列表中的保留第一次的错误信息，同时从处理中移除
+        self.store.mark_failed(video_name, {
+            'name': video_name,
+            'error': clean_error,
+            'time': datetime.now().isoformat()
+        }, replace=False)
     
     def is_processing(self, video_path):
         """检查视频是否正在处理中"""
-        video_name = os.path.basename(video_path)
-        return video_name in self.progress_data['processing']
+        return self.store.is_processing(os.path.basename(video_path))
     
     def get_completed_count(self):
         """获取已完成数量"""
-        return len(self.progress_data['completed'])
+        return self.store.counts()['completed']
     
     def get_processing_count(self):
         """获取处理中数量"""
-        return len(self.progress_data['processing'])
+        return self.store.counts()['processing']
     
     def get_failed_count(self):
         """获取失败数量"""
-        return len(self.progress_data['failed'])
+        return self.store.counts()['failed']
+    
+    def get_failed_records(self):
+        """获取失败记录列表（按失败时间先后）"""
+        return self.store.failed_records()
     
     def set_start_time(self):
         """设置开始时间"""
-        if not self.progress_data.get('start_time'):
-            self.progress_data['start_time'] = datetime.now().isoformat()
-            self.save_progress()
+        if not self.store.get('start_time'):
+            self.store.set('start_time', datetime.now().isoformat())
     
     def print_summary(self):
         """打印进度摘要"""
@@ -1391,16 +1377,15 @@ class ProgressManager:
         
         if failed > 0:
             logging.info("失败的文件:")
-            for fail_info in self.progress_data['failed']:
+            for fail_info in self.store.failed_records():
                 if isinstance(fail_info, dict):
                     logging.info(f"  - {fail_info['name']}: {fail_info['error']}")
     
     def cleanup_invalid_records(self, output_dir):
         """清理无效的记录（输出文件不存在的记录）"""
         cleaned_count = 0
-        valid_completed = []
         
-        for record in self.progress_data.get('completed', []):
+        for record in self.store.completed_records():
             if isinstance(record, dict):
                 # 新格式记录
                 output_name = record.get('output_name', record.get('name'))
@@ -1411,28 +1396,22 @@ class ProgressManager:
                     os.path.join(output_dir, output_name),
                 ]
                 
-                found = False
-                for output_path in possible_paths:
-                    if os.path.exists(output_path) and os.path.getsize(output_path) > 1024:
-                        valid_completed.append(record)
-                        found = True
-                        break
+                found = any(os.path.exists(output_path) and os.path.getsize(output_path) > 1024
+                            for output_path in possible_paths)
                 
                 if not found:
+                    self.store.remove_completed(record.get('name'))
                     cleaned_count += 1
                     logging.info(f"清理无效记录: {record.get('name')} (输出文件不存在)")
             else:
                 # 旧格式记录
                 base_name = os.path.splitext(record)[0]
                 output_path = os.path.join(output_dir, f"{base_name}_no_head_tail.mp4")
-                if os.path.exists(output_path) and os.path.getsize(output_path) > 1024:
-                    valid_completed.append(record)
-                else:
+                if not (os.path.exists(output_path) and os.path.getsize(output_path) > 1024):
+                    self.store.remove_completed(record)
                     cleaned_count += 1
                     logging.info(f"清理无效记录: {record} (输出文件不存在)")
         
-        self.progress_data['completed'] = valid_completed
-        
         if cleaned_count > 0:
             self.save_progress()
             logging.info(f"清理完成，移除了 {cleaned_count} 个无效记录")
@@ -1865,7 +1844,7 @@ def update_final_progress(pbar, video_path, stage_name="最终处理"):
 
 def run_ffmpeg_process(cmd, expected_duration, pbar, video_path):
     """
-    执行FFmpeg进程并监控进度 - 优化版本
+    执行FFmpeg进程并通过 -progress 通道监控进度，stderr 只保留最后几行用于错误信息
     
     Args:
         cmd: FFmpeg命令列表
@@ -1874,82 +1853,44 @@ def run_ffmpeg_process(cmd, expected_duration, pbar, video_path):
         video_path: 视频路径(用于日志)
     """
     video_name = os.path.basename(video_path)
-    process = None
+    last_progress = 0
+    
+    def on_progress(progress_info):
+        nonlocal last_progress
+        current_time = progress_info.get('time')
+        if current_time is None or expected_duration <= 0:
+            return
+        progress = min(95, (current_time / expected_duration) * 95)  # 最多到95%
+        if progress > last_progress:
+            pbar.n = progress
+            pbar.set_postfix_str(f"🎬 处理中... {progress:.1f}%")
+            pbar.refresh()
+            last_progress = progress
     
     try:
-        # 启动FFmpeg进程
-        process = subprocess.Popen(
+        pbar.set_postfix_str("🎬 处理中...")
+        # 长视频允许更长时间没有进度（例如长时间 seek）
+        if expected_duration > 7200:
+            max_no_progress_time = 1200
+        elif expected_duration > 3600:
+            max_no_progress_time = 600
+        else:
+            max_no_progress_time = 300
+        runner = run_ffmpeg(
             cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            encoding='utf-8',
+            on_progress=on_progress,
+            stall_timeout=max_no_progress_time,
             creationflags=subprocess.CREATE_NO_WINDOW if platform.system() == "Windows" else 0
         )
         
-        # 监控进度
-        progress_pattern = re.compile(r'time=(\d+):(\d+):(\d+)\.(\d+)')
-        last_progress = 0
-        
-        pbar.set_postfix_str("🎬 处理中...")
-        
-        while True:
-            output = process.stderr.readline()
-            if output == '' and process.poll() is not None:
-                break
-            
-            if output:
-                # 解析进度
-                match = progress_pattern.search(output)
-                if match:
-                    hours = int(match.group(1))
-                    minutes = int(match.group(2))
-                    seconds = int(match.group(3))
-                    current_time = hours * 3600 + minutes * 60 + seconds
-                    
-                    if expected_duration > 0:
-                        progress = min(95, (current_time / expected_duration) * 95)  # 最多到95%
-                        if progress > last_progress:
-                            pbar.n = progress
-                            pbar.set_postfix_str(f"🎬 处理中... {progress:.1f}%")
-                            pbar.refresh()
-                            last_progress = progress
-        
-        # 等待进程完成
-        return_code = process.wait()
-        
-        if return_code != 0:
-            stderr_output = process.stderr.read() if process.stderr else ""
-            raise RuntimeError(f"FFmpeg处理失败 (退出码: {return_code}): {stderr_output}")
+        if runner.returncode != 0:
+            raise RuntimeError(f"FFmpeg处理失败 (退出码: {runner.returncode}): {runner.error_text(10)}")
             
     except Exception as e:
         logging.error(f"FFmpeg进程执行失败: {video_name} -> {e}")
         raise
         
     finally:
-        # 确保进程被正确终止和清理
-        if process:
-            try:
-                if process.poll() is None:  # 进程仍在运行
-                    process.terminate()
-                    try:
-                        process.wait(timeout=5)  # 等待5秒
-                    except subprocess.TimeoutExpired:
-                        process.kill()  # 强制杀死
-                        process.wait()
-                
-                # 关闭文件描述符
-                if process.stdout:
-                    process.stdout.close()
-                if process.stderr:
-                    process.stderr.close()
-                    
-            except Exception as cleanup_error:
-                logging.warning(f"FFmpeg进程清理失败: {cleanup_error}")
-            
-            finally:
-                process = None  # 释放引用
-                
         # 主动垃圾回收
         gc.collect()
 
@@ -2098,17 +2039,28 @@ def process_video(video_path, output_video_path, hardware_info, video_idx=0, tot
         if progress_manager:
             progress_manager.mark_processing(video_path)
         
-        # 构建FFmpeg命令
-        cmd = build_ffmpeg_command(video_path, output_video_path, hardware_info)
-        
-        # 记录命令信息
         logging.info(f"开始处理视频 [{video_idx+1}/{total_videos}]: {video_name}")
         logging.info(f"原始时长: {duration:.1f}s, 有效时长: {effective_duration:.1f}s")
-        logging.info(f"使用编码器: {hardware_info.get('encoder', 'unknown')}")
-        logging.debug(f"FFmpeg命令: {' '.join(cmd)}")
         
-        # 执行FFmpeg处理
-        run_ffmpeg_process(cmd, effective_duration, pbar, video_path)
+        def smart_cut_progress(fraction, stage):
+            target = 10 + fraction * 85
+            if target > pbar.n:
+                pbar.update(target - pbar.n)
+            pbar.set_postfix_str(f"✂️ {stage}")
+        
+        # 优先关键帧对齐切割，不适用时整段重新编码
+        if not (ENABLE_SMART_CUT and smart_cut(video_path, output_video_path, head_cut_time, duration - tail_cut_time,
+                                               ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH,
+                                               progress=smart_cut_progress)):
+            # 构建FFmpeg命令
+            cmd = build_ffmpeg_command(video_path, output_video_path, hardware_info)
+            
+            # 记录命令信息
+            logging.info(f"使用编码器: {hardware_info.get('encoder', 'unknown')}")
+            logging.debug(f"FFmpeg命令: {' '.join(cmd)}")
+            
+            # 执行FFmpeg处理
+            run_ffmpeg_process(cmd, effective_duration, pbar, video_path)
         
         # 更新最终进度
         update_final_progress(pbar, video_path, "切头尾处理")
@@ -2524,6 +2476,129 @@ def process_video_batch(video_list, hardware_info, max_workers=None):
         'processing_time': total_processing_time
     }
 
+def process_video_stream(hardware_info, max_workers=None):
+    """
+    流式批量处理 - 扫描、分辨率检查、断点过滤、编码同时进行
+    
+    与 process_video_batch 的区别：不需要先拿到完整的视频列表，
+    扫描到的视频立即进入分辨率检查，合格的立即进入编码。
+    
+    Args:
+        hardware_info: 硬件信息字典
+        max_workers: 编码并发数
+    
+    Returns:
+        dict: 处理结果统计（比 process_video_batch 多 low_res_skipped/skipped_videos）
+    """
+    if max_workers is None:
+        max_workers = hardware_info.get('max_concurrent', 2)
+    
+    counter_lock = threading.Lock()
+    next_index = [0]
+    skipped_videos = []
+    completed_count = [0]
+    
+    def check_resolution(video_path):
+        """阶段1：低分辨率检查（跳过的视频先记下，流水线结束后再统一移动）"""
+        should_skip, resolution, skip_reason = should_skip_low_resolution_video(video_path)
+        if should_skip:
+            with counter_lock:
+                skipped_videos.append({'path': video_path, 'resolution': resolution, 'reason': skip_reason})
+            return None
+        return video_path
+    
+    def check_progress(video_path):
+        """阶段2：断点过滤，已完成/处理中的视频不再编码"""
+        if progress_manager and (progress_manager.is_completed(video_path, output_root)
+                                 or progress_manager.is_processing(video_path)):
+            with counter_lock:
+                completed_count[0] += 1
+            return None
+        with counter_lock:
+            video_idx = next_index[0]
+            next_index[0] += 1
+        base_name = os.path.splitext(os.path.basename(video_path))[0]
+        output_path = os.path.join(output_root, f"{base_name}_no_head_tail.mp4")
+        return video_path, output_path, video_idx
+    
+    def encode(video_info):
+        """阶段3：切头尾编码"""
+        video_path, output_path, video_idx = video_info
+        try:
+            success, processing_time, error_msg = process_video(
+                video_path, output_path, hardware_info, video_idx, next_index[0]
+            )
+        except Exception as e:
+            logging.error(f"💥 处理视频时发生未预期异常: {os.path.basename(video_path)} -> {e}", exc_info=True)
+            if progress_manager:
+                progress_manager.mark_failed(video_path, f"未预期异常: {str(e)}")
+            success, processing_time, error_msg = False, 0, str(e)
+        return video_path, success, processing_time, error_msg
+    
+    if progress_manager:
+        progress_manager.set_start_time()
+    
+    pipeline = StreamPipeline(iter_video_files(root_path, SUPPORTED_VIDEO_FORMATS), queue_size=PIPELINE_QUEUE_SIZE)
+    pipeline.add_stage('分辨率检查', check_resolution, workers=PIPELINE_PROBE_WORKERS)
+    pipeline.add_stage('断点过滤', check_progress, workers=1)
+    pipeline.add_stage('编码', encode, workers=max_workers)
+    logging.info(f"🔀 流式处理启动: 分辨率检查 {PIPELINE_PROBE_WORKERS} 线程, 编码 {max_workers} 线程")
+    
+    success_count = 0
+    failed_count = 0
+    skipped_count = 0
+    total_processing_time = 0
+    batch_start_time = time.time()
+    
+    # 总数未知，进度条只显示已完成数量
+    main_pbar = tqdm(desc="总体进度", position=0, leave=True, unit='个', ncols=120)
+    try:
+        for video_path, success, processing_time, error_msg in pipeline.run():
+            video_name = os.path.basename(video_path)
+            if success:
+                success_count += 1
+                logging.info(f"✅ 处理成功: {video_name} (耗时: {processing_time:.1f}s)")
+            elif error_msg and "智能跳过" in error_msg:
+                skipped_count += 1
+                logging.info(f"⏭️ 智能跳过: {video_name} -> {error_msg}")
+            else:
+                failed_count += 1
+                logging.error(f"❌ 处理失败: {video_name} -> {error_msg}")
+            total_processing_time += processing_time
+            main_pbar.update(1)
+            main_pbar.set_postfix({
+                '成功': success_count,
+                '失败': failed_count,
+                '跳过': skipped_count,
+                '已扫描': pipeline.source_count
+            })
+            if (success_count + failed_count + skipped_count) % 20 == 0:
+                gc.collect()
+    except KeyboardInterrupt:
+        logging.info("流式处理被用户中断")
+        main_pbar.set_postfix_str("❌ 用户中断")
+        pipeline.stop()
+    finally:
+        main_pbar.close()
+    
+    batch_time = time.time() - batch_start_time
+    pipeline.log_stats()
+    logging.info(f"🎯 流式处理完成: 扫描{pipeline.source_count}, 低分辨率跳过{len(skipped_videos)}, "
+                 f"已完成跳过{completed_count[0]}, 成功{success_count}, 失败{failed_count}, 跳过{skipped_count}")
+    if progress_manager:
+        progress_manager.print_summary()
+    
+    return {
+        'success': success_count,
+        'failed': failed_count,
+        'skipped': skipped_count + completed_count[0],
+        'total_time': batch_time,
+        'processing_time': total_processing_time,
+        'scanned': pipeline.source_count,
+        'low_res_skipped': len(skipped_videos),
+        'skipped_videos': skipped_videos
+    }
+
 # ==================== 主程序入口 (基于批量裁剪2.0架构) ====================
 
 def setup_logging():
@@ -2580,6 +2655,32 @@ def main():
         print(f"✅ 进度管理器初始化完成")
         print()
         
+        # 流式处理：扫描、检查、编码同时进行
+        if ENABLE_STREAMING_PIPELINE:
+            cleaned = progress_manager.cleanup_invalid_records(output_root)
+            if cleaned > 0:
+                print(f"🧹 清理了 {cleaned} 个无效记录")
+            print("🔀 流式处理: 边扫描边检查边编码...")
+            results = process_video_stream(hardware_info, max_workers=hardware_info.get('max_concurrent', 2))
+            
+            # 流水线结束后再移动跳过的低分辨率视频（移动目录可能就在扫描目录里）
+            moved_count = 0
+            if results['skipped_videos'] and SKIP_VIDEOS_MOVE_DIR and SKIP_VIDEOS_MOVE_DIR.strip():
+                for skipped_info in results['skipped_videos']:
+                    if move_skipped_video(skipped_info['path'], skipped_info['reason']):
+                        moved_count += 1
+            
+            print(f"\n📊 最终统计报告:")
+            print(f"   - 总扫描文件: {results['scanned']} 个")
+            print(f"   - 跳过低分辨率: {results['low_res_skipped']} 个（已移动 {moved_count} 个）")
+            print(f"   - 成功处理: {results['success']} 个")
+            print(f"   - 处理失败: {results['failed']} 个")
+            print(f"   - 已完成/断点续传跳过: {results['skipped']} 个")
+            print(f"   - 总耗时: {results['total_time']:.1f}秒")
+            print(f"   - 输出目录: {output_root}")
+            print("✅ 程序执行完成！")
+            return
+        
         # 4. 扫描视频文件
         print("📁 正在扫描视频文件...")
         video_files = []
@@ -2834,7 +2935,7 @@ def main():
         # 失败文件报告
         if results['failed'] > 0:
             print("❌ 失败文件详情:")
-            failed_files = progress_manager.progress_data.get('failed', [])
+            failed_files = progress_manager.get_failed_records()
             for fail_info in failed_files[-10:]:  # 显示最近10个失败
                 if isinstance(fail_info, dict):
                     print(f"   - {fail_info['name']}: {fail_info['error'][:50]}...")
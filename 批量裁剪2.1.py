@@ -39,6 +39,22 @@ MIN_RESOLUTION_WIDTH = 1920
 # 跳过的视频移动到的目录 (设为空字符串则不移动，只跳过)
 SKIP_VIDEOS_MOVE_DIR = r"Z:\a项目\航拍特写\李建楠\测试\1\跳过的低分辨率视频"
 
+# --- 流式处理配置 ---
+# 启用后分辨率检查、断点过滤、编码同时进行，第一个合格视频检查完就开始编码
+ENABLE_STREAMING_PIPELINE = True
+# 分辨率检查线程数
+PIPELINE_PROBE_WORKERS = 8
+# 阶段之间的队列长度（下游忙时上游自动等待）
+PIPELINE_QUEUE_SIZE = 64
+
+# --- 分段编码配置 ---
+# 视频按关键帧对齐的固定时长分段编码，最后无损拼接；分段清单写在输出文件旁（<输出>.chunks.json），
+# 中断后任何一台电脑重新处理时都只编码还没完成的分段
+# 每段目标时长（秒），实际分段点对齐到之后最近的关键帧
+CHUNK_SECONDS = 300
+# 硬件编码器时分段放到共享线程池并行编码（软件编码单任务已占满CPU，按顺序编码）
+ENABLE_CHUNKED_ENCODE = True
+
 # --- 支持的视频格式 ---
 # 支持的视频文件扩展名
 SUPPORTED_VIDEO_FORMATS = ['.mp4', '.mov', '.avi', '.mkv', '.wmv', '.flv', '.webm', '.ts', '.m4v', '.3gp', '.f4v']
@@ -92,7 +108,6 @@ version_ok = check_opencv_version()
 print(f"📦 使用OpenCV版本: {cv2.__version__}")
 # ==================== 版本检查完成 ====================
 import subprocess
-import glob
 import concurrent.futures
 import logging
 import re
@@ -134,8 +149,18 @@ import hashlib
 import uuid
 import socket
 import multiprocessing
-from typing import List, Tuple, Dict, Optional
+from typing import List, Tuple, Dict
 import math
+import atexit
+from video_meta_cache import cached_probe, get_meta_cache
+from mp4_header import is_mp4_file, read_mp4_info
+from file_index import iter_video_files
+from stream_pipeline import StreamPipeline
+from progress_store import ProgressStore
+from chunked_encode import ChunkedEncoder, plan_chunks
+
+# 程序退出时输出元数据缓存命中率
+atexit.register(get_meta_cache().log_stats)
 
 # 以下为系统配置，通常不需要修改
 # 注意：进度文件路径现在会动态生成，基于电脑唯一标识
@@ -187,19 +212,8 @@ def find_video_files(directory: str) -> List[str]:
     video_files = []
     
     try:
-        for format_ext in SUPPORTED_VIDEO_FORMATS:
-            pattern = os.path.join(directory, f'*{format_ext}')
-            files = glob.glob(pattern, recursive=False)
-            video_files.extend(files)
-            
-            # 也搜索大写扩展名
-            pattern_upper = os.path.join(directory, f'*{format_ext.upper()}')
-            files_upper = glob.glob(pattern_upper, recursive=False)
-            video_files.extend(files_upper)
-        
-        # 去重并排序
-        video_files = list(set(video_files))
-        video_files.sort()
+        # 增量目录索引：目录没有变化时直接从索引读取，不再逐个扩展名 glob
+        video_files = sorted(iter_video_files(directory, SUPPORTED_VIDEO_FORMATS, recursive=False))
         
         logging.info(f"在目录 {directory} 中找到 {len(video_files)} 个支持的视频文件")
         
@@ -486,11 +500,18 @@ def get_media_duration_seconds(video_path: str) -> float:
         logging.warning(f"获取视频时长失败 {video_path}: {e}")
         return 0.0
 
+@cached_probe('resolution', is_valid=lambda res: bool(res) and res[0] > 0 and res[1] > 0, decode=tuple)
 def get_video_resolution(video_path: str) -> Tuple[int, int]:
     """获取视频分辨率 (宽度, 高度) - 增强版本，支持多种重试机制"""
     max_retries = 3
     retry_delay = 1.0
     
+    # 方法0: MP4/MOV 直接解析文件头 (不启动ffprobe)
+    if is_mp4_file(video_path):
+        info = read_mp4_info(video_path)
+        if info:
+            return info['width'], info['height']
+    
     for attempt in range(max_retries):
         try:
             # 方法1: 使用 CSV 格式输出 (原方法，但增强解析)
@@ -906,41 +927,6 @@ def calculate_optimal_bitrate(source_info: Dict, target_resolution: Tuple[int, i
         logging.warning(f"码率计算失败，使用默认值: {e}")
         return VIDEO_BITRATE, MAX_BITRATE, BUFFER_SIZE
 
-def create_enhanced_progress_checkpoint(video_path: str, current_time: float, total_duration: float, segment_info: Dict = None) -> Dict:
-    """创建增强的进度检查点，支持段级别续传"""
-    checkpoint = {
-        'video_path': video_path,
-        'current_time': current_time,
-        'total_duration': total_duration,
-        'progress_percent': (current_time / total_duration * 100) if total_duration > 0 else 0,
-        'timestamp': datetime.now().isoformat(),
-        'computer_id': get_computer_unique_id(),  # 添加电脑唯一标识
-        'segment_info': segment_info or {}
-    }
-    return checkpoint
-
-def save_progress_checkpoint(checkpoint: Dict, checkpoint_file: str):
-    """保存进度检查点到文件"""
-    try:
-        with open(checkpoint_file, 'w', encoding='utf-8') as f:
-            json.dump(checkpoint, f, ensure_ascii=False, indent=2)
-            # 减少频繁的检查点保存日志
-            pass
-    except Exception as e:
-        logging.warning(f"保存检查点失败: {e}")
-
-def load_progress_checkpoint(checkpoint_file: str) -> Optional[Dict]:
-    """从文件加载进度检查点"""
-    try:
-        if os.path.exists(checkpoint_file):
-            with open(checkpoint_file, 'r', encoding='utf-8') as f:
-                checkpoint = json.load(f)
-            # 减少频繁的检查点加载日志
-            return checkpoint
-    except Exception as e:
-        logging.warning(f"加载检查点失败: {e}")
-    return None
-
 # ===================== END: 新增功能函数 =====================
 
 # 配置验证函数
@@ -1031,7 +1017,7 @@ class ProgressManager:
         # 自动创建进度记录文件夹
         self.ensure_progress_folder()
         
-        self.progress_data = self.load_progress()
+        self.store = self.load_progress()
         
         # 为单个视频进度文件创建子文件夹
         self.individual_progress_folder = os.path.join(self.progress_folder, 'individual')
@@ -1060,51 +1046,25 @@ class ProgressManager:
             print(f"✅ 进度记录文件夹已存在: {progress_folder}")
     
     def load_progress(self):
-        """加载进度数据"""
-        try:
-            if os.path.exists(self.progress_file):
-                with open(self.progress_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    logging.info(f"加载进度记录: {len(data.get('completed', []))} 个已完成, {len(data.get('processing', []))} 个处理中")
-                    logging.info(f"进度文件路径: {self.progress_file}")
-                    # 显示前几个已完成文件作为示例
-                    completed_files = data.get('completed', [])
-                    if completed_files:
-                        logging.info(f"已完成文件示例: {completed_files[:3]}")
-                    return data
-        except Exception as e:
-            logging.warning(f"加载进度文件失败: {e}")
-        return {'completed': [], 'processing': [], 'failed': [], 'start_time': None, 'roi_settings': None}
+        """加载进度数据（JSON 快照 + 追加日志，按文件名建索引）"""
+        store = ProgressStore(self.progress_file,
+                              defaults={'start_time': None, 'roi_settings': None},
+                              logger=logging.getLogger())
+        counts = store.counts()
+        logging.info(f"加载进度记录: {counts['completed']} 个已完成, {counts['processing']} 个处理中")
+        logging.info(f"进度文件路径: {self.progress_file}")
+        # 显示前几个已完成文件作为示例
+        completed_files = store.completed_records()[:3]
+        if completed_files:
+            logging.info(f"已完成文件示例: {completed_files}")
+        return store
     
     def save_progress(self):
-        """保存进度数据"""
-        # 使用线程锁防止并发写入
-        with progress_save_lock:
-            import time
-            max_retries = 3
-            retry_delay = 0.5
-            
-            for attempt in range(max_retries):
-                try:
-                    # 先保存到临时文件
-                    with open(self.temp_file, 'w', encoding='utf-8') as f:
-                        json.dump(self.progress_data, f, ensure_ascii=False, indent=2)
-                    
-                    # 然后移动到正式文件
-                    if os.path.exists(self.progress_file):
-                        os.remove(self.progress_file)
-                    os.rename(self.temp_file, self.progress_file)
-                    return  # 成功保存，退出重试循环
-                except (OSError, PermissionError) as e:
-                    if attempt < max_retries - 1:
-                        logging.warning(f"保存进度文件重试 {attempt + 1}/{max_retries}: {e}")
-                        time.sleep(retry_delay)
-                        retry_delay *= 2  # 指数退避
-                    else:
-                        logging.error(f"保存进度文件失败 (已重试 {max_retries} 次): {e}")
-                except Exception as e:
-                    logging.error(f"保存进度文件失败: {e}")
-                    break  # 非文件系统错误，不重试
+        """把还没写入的进度日志立即写盘（平时由后台线程每秒成组写入）"""
+        try:
+            self.store.flush()
+        except Exception as e:
+            logging.error(f"保存进度文件失败: {e}")
     
     def get_file_signature(self, file_path):
         """获取文件的唯一标识（基于文件大小、修改时间和文件名）"""
@@ -1149,52 +1109,48 @@ class ProgressManager:
         if not video_signature:
             return False, None
         
-        # 检查进度记录中是否有相同签名的文件
-        for completed_record in self.progress_data.get('completed', []):
-            if isinstance(completed_record, dict):
-                # 新格式：包含文件签名的记录
-                if (completed_record.get('name') == video_signature['name'] and
-                    completed_record.get('size') == video_signature['size']):
-                    # 检查输出目录中是否存在对应的输出文件
-                    output_name = completed_record.get('output_name', video_signature['name'])
-                    output_path = os.path.join(output_dir, output_name)
-                    if os.path.exists(output_path) and os.path.getsize(output_path) > 1024:
-                        return True, completed_record
-            else:
-                # 旧格式：只有文件名的记录
-                if completed_record == video_signature['name']:
-                    # 检查输出目录中是否存在该文件
-                    output_path = os.path.join(output_dir, completed_record)
-                    if os.path.exists(output_path) and os.path.getsize(output_path) > 1024:
-                        return True, completed_record
+        # 按 (文件名, 大小) 直接查已完成记录
+        completed_record = self.store.find_completed(video_signature['name'], video_signature['size'])
+        if completed_record is None:
+            return False, None
+        if isinstance(completed_record, dict):
+            # 新格式：包含文件签名的记录，检查输出目录中是否存在对应的输出文件
+            output_name = completed_record.get('output_name', video_signature['name'])
+        else:
+            # 旧格式：只有文件名的记录
+            output_name = completed_record
+        output_path = os.path.join(output_dir, output_name)
+        if os.path.exists(output_path) and os.path.getsize(output_path) > 1024:
+            return True, completed_record
         
         return False, None
     
     def is_file_completed_by_name(self, video_path):
         """基于文件名检查是否已完成（向后兼容）"""
         video_name = os.path.basename(video_path)
-        return video_name in self.progress_data.get('completed', [])
+        return self.store.get_completed(video_name) == video_name
     
     def is_completed(self, video_path, output_dir=None):
         """检查视频是否已完成（优先使用内容检查）"""
-        with progress_save_lock:  # 添加锁保护，防止并发读写冲突
-            if output_dir:
-                # 使用内容检查（推荐）
-                completed, record = self.is_file_completed_by_content(video_path, output_dir)
-                if completed:
-                    return True
-            
-            # 回退到文件名检查
-            return self.is_file_completed_by_name(video_path)
+        if output_dir:
+            # 使用内容检查（推荐）
+            completed, record = self.is_file_completed_by_content(video_path, output_dir)
+            if completed:
+                return True
+        
+        # 回退到文件名检查
+        return self.is_file_completed_by_name(video_path)
     
     def mark_completed(self, video_path, output_path):
         """标记视频为已完成（记录文件签名）"""
+        video_name = os.path.basename(video_path)
         video_signature = self.get_file_signature(video_path)
         if not video_signature:
             logging.warning(f"无法获取文件签名，使用文件名记录: {video_path}")
-            video_name = os.path.basename(video_path)
-            if video_name not in self.progress_data['completed']:
-                self.progress_data['completed'].append(video_name)
+            if not self.store.is_completed(video_name):
+                self.store.mark_completed(video_name)
+            else:
+                self.store.clear_processing(video_name)
         else:
             # 记录完整的文件信息
             completed_record = {
@@ -1207,36 +1163,16 @@ class ProgressManager:
                 'completed_time': datetime.now().isoformat()
             }
             
-            # 移除旧的记录（如果存在）
-            self.progress_data['completed'] = [
-                record for record in self.progress_data['completed'] 
-                if not (isinstance(record, dict) and record.get('name') == video_signature['name'])
-            ]
-            self.progress_data['completed'] = [
-                record for record in self.progress_data['completed'] 
-                if record != video_signature['name']
-            ]
-            
-            # 添加新记录
-            self.progress_data['completed'].append(completed_record)
-        
-        # 从处理中移除
-        video_name = os.path.basename(video_path)
-        if video_name in self.progress_data['processing']:
-            self.progress_data['processing'].remove(video_name)
-        # 从失败列表中移除
-        if video_name in self.progress_data['failed']:
-            self.progress_data['failed'].remove(video_name)
-        
-        self.save_progress()
+            # 替换同名旧记录，同时从处理中和失败列表中移除
+            self.store.mark_completed(video_signature['name'], completed_record)
     
     def mark_processing(self, video_path):
         """标记视频为处理中"""
-        with progress_save_lock:  # 添加锁保护，防止并发冲突
-            video_name = os.path.basename(video_path)
-            if video_name not in self.progress_data['processing']:
-                self.progress_data['processing'].append(video_name)
-            self.save_progress()
+        self.store.mark_processing(os.path.basename(video_path))
+    
+    def unmark_processing(self, video_path):
+        """从处理中列表移除，原来不在列表中返回 False"""
+        return self.store.clear_processing(os.path.basename(video_path))
     
     def atomic_check_and_mark_processing(self, video_path, output_dir):
         """原子性检查是否已完成并标记为处理中，防止重复处理"""
@@ -1318,45 +1254,36 @@ class ProgressManager:
     
     def mark_failed(self, video_path, error_msg=""):
         """标记视频为失败"""
-        with progress_save_lock:  # 原子性操作，防止并发冲突
-            video_name = os.path.basename(video_path)
-            # 清理错误消息
-            clean_error = self.clean_error_message(error_msg)
-            
-            # 检查是否已经在失败列表中
-            failed_names = [f.get('name') if isinstance(f, dict) else f for f in self.progress_data['failed']]
-            if video_name not in failed_names:
-                self.progress_data['failed'].append({
-                    'name': video_name,
-                    'error': clean_error,
-                    'time': datetime.now().isoformat()
-                })
-            # 从处理中移除
-            if video_name in self.progress_data['processing']:
-                self.progress_data['processing'].remove(video_name)
-            self.save_progress()
+        video_name = os.path.basename(video_path)
+        # 清理错误消息
+        clean_error = self.clean_error_message(error_msg)
+        
+        # 已经在失败列表中的保留第一次的错误信息，同时从处理中移除
+        self.store.mark_failed(video_name, {
+            'name': video_name,
+            'error': clean_error,
+            'time': datetime.now().isoformat()
+        }, replace=False)
     
     def is_processing(self, video_path):
         """检查视频是否正在处理中"""
-        with progress_save_lock:  # 添加锁保护，防止并发读写冲突
-            video_name = os.path.basename(video_path)
-            return video_name in self.progress_data['processing']
+        return self.store.is_processing(os.path.basename(video_path))
     
     def get_completed_count(self):
         """获取已完成数量"""
-        return len(self.progress_data['completed'])
+        return self.store.counts()['completed']
     
     def get_processing_count(self):
         """获取处理中数量"""
-        return len(self.progress_data['processing'])
+        return self.store.counts()['processing']
     
     def get_failed_count(self):
         """获取失败数量"""
-        return len(self.progress_data['failed'])
+        return self.store.counts()['failed']
     
     def set_roi_settings(self, roi_settings):
         """保存ROI设置"""
-        self.progress_data['roi_settings'] = roi_settings
+        self.store.set('roi_settings', roi_settings)
         self.save_progress()
     
     def get_individual_progress_file(self, video_path):
@@ -1413,13 +1340,12 @@ class ProgressManager:
     
     def get_roi_settings(self):
         """获取ROI设置"""
-        return self.progress_data.get('roi_settings')
+        return self.store.get('roi_settings')
     
     def set_start_time(self):
         """设置开始时间"""
-        if not self.progress_data.get('start_time'):
-            self.progress_data['start_time'] = datetime.now().isoformat()
-            self.save_progress()
+        if not self.store.get('start_time'):
+            self.store.set('start_time', datetime.now().isoformat())
     
     def print_summary(self):
         """打印进度摘要"""
@@ -1430,47 +1356,38 @@ class ProgressManager:
         
         if failed > 0:
             logging.info("失败的文件:")
-            for fail_info in self.progress_data['failed']:
+            for fail_info in self.store.failed_records():
                 logging.info(f"  - {fail_info['name']}: {fail_info['error']}")
     
     def cleanup_invalid_records(self, output_dir):
         """清理无效的记录（输出文件不存在的记录）"""
         cleaned_count = 0
-        valid_completed = []
         
-        for record in self.progress_data.get('completed', []):
+        for record in self.store.completed_records():
             if isinstance(record, dict):
                 # 新格式记录
                 output_name = record.get('output_name', record.get('name'))
                 output_path = os.path.join(output_dir, output_name)
-                if os.path.exists(output_path) and os.path.getsize(output_path) > 1024:
-                    valid_completed.append(record)
-                else:
+                if not (os.path.exists(output_path) and os.path.getsize(output_path) > 1024):
+                    self.store.remove_completed(record.get('name'))
                     cleaned_count += 1
                     logging.info(f"清理无效记录: {record.get('name')} (输出文件不存在)")
             else:
                 # 旧格式记录
                 output_path = os.path.join(output_dir, record)
-                if os.path.exists(output_path) and os.path.getsize(output_path) > 1024:
-                    valid_completed.append(record)
-                else:
+                if not (os.path.exists(output_path) and os.path.getsize(output_path) > 1024):
+                    self.store.remove_completed(record)
                     cleaned_count += 1
                     logging.info(f"清理无效记录: {record} (输出文件不存在)")
         
-        self.progress_data['completed'] = valid_completed
-        
         # 清理失败记录
-        valid_failed = []
-        for fail_info in self.progress_data.get('failed', []):
+        for fail_info in self.store.failed_records():
             output_path = os.path.join(output_dir, fail_info['name'])
-            if os.path.exists(output_path) and os.path.getsize(output_path) > 1024:
-                valid_failed.append(fail_info)
-            else:
+            if not (os.path.exists(output_path) and os.path.getsize(output_path) > 1024):
+                self.store.remove_failed(fail_info['name'])
                 cleaned_count += 1
                 logging.info(f"清理无效失败记录: {fail_info['name']} (输出文件不存在)")
         
-        self.progress_data['failed'] = valid_failed
-        
         if cleaned_count > 0:
             self.save_progress()
             logging.info(f"清理完成，移除了 {cleaned_count} 个无效记录")
@@ -1894,22 +1811,7 @@ def detect_hardware():
         return hw_info
 
 
-def parse_progress(line):
-    info = {}
-    patterns = {'frame': r'frame=\s*(\d+)', 'fps': r'fps=\s*([\d\.]+)', 'time': r'time=\s*(\d+):(\d+):([\d\.]+)',
-                'speed': r'speed=\s*([\d\.]+)x', 'size': r'size=\s*(\d+)kB'}
-    for key, pattern in patterns.items():
-        match = re.search(pattern, line)
-        if match:
-            if key == 'time':
-                info[key] = float(match.group(1)) * 3600 + float(match.group(2)) * 60 + float(match.group(3))
-            elif key in ['fps', 'speed']:
-                info[key] = float(match.group(1))
-            else:
-                info[key] = int(match.group(1))
-    return info
-
-
+@cached_probe('duration_seconds', is_valid=lambda duration: duration > 0)
 def get_media_duration_seconds(media_path):
     """使用 ffprobe 获取媒体时长（秒）。失败返回 0.0"""
     try:
@@ -1946,7 +1848,8 @@ def concat_mp4_files(file_list, output_path):
     """使用 concat demuxer 无损拼接多个 mp4 片段。file_list 为绝对路径列表。"""
     concat_dir = os.path.dirname(output_path)
     os.makedirs(concat_dir, exist_ok=True)
-    list_file = os.path.join(concat_dir, 'concat_list.txt')
+    # 每个输出用独立的列表文件，避免并行任务互相覆盖
+    list_file = os.path.join(concat_dir, f"{os.path.basename(output_path)}.concat_list.txt")
     with open(list_file, 'w', encoding='utf-8') as f:
         for p in file_list:
             safe_path = p.replace('\\', '/').replace("'", "'\\''")
@@ -1960,12 +1863,18 @@ def concat_mp4_files(file_list, output_path):
     except Exception:
         pass
 
-def build_ffmpeg_command(input_file, output_file, filter_complex, hw_info, seek_seconds=0, source_quality_info=None, target_resolution=(1920, 1080)):
-    """构建FFmpeg命令 - 采用1.0版本的稳定策略"""
+def build_ffmpeg_command(input_file, output_file, filter_complex, hw_info, seek_seconds=0, source_quality_info=None, target_resolution=(1920, 1080),
+                         duration_seconds=0):
+    """构建FFmpeg命令 - 采用1.0版本的稳定策略
+
+    duration_seconds > 0 时只处理从 seek_seconds 开始的这一段（分段编码用）
+    """
     cmd = [FFMPEG_PATH, '-y', '-nostdin']
     
     if seek_seconds > 0: 
         cmd.extend(['-ss', str(seek_seconds)])
+    if duration_seconds > 0:
+        cmd.extend(['-t', f'{duration_seconds:.6f}'])
     
     cmd.extend(['-i', input_file, '-vf', filter_complex, '-c:v', hw_info['encoder']])
     
@@ -2021,120 +1930,6 @@ def build_ffmpeg_command(input_file, output_file, filter_complex, hw_info, seek_
     return cmd
 
 
-def run_ffmpeg_process(cmd, duration, pbar, initial_time_offset: float = 0.0, video_path: str = None):
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
-                               encoding='utf-8', errors='ignore', bufsize=1)
-    last_percentage, last_update_time, stalled_time = 0, time.time(), 0
-    no_progress_count = 0
-    last_progress_time = 0
-    
-    # 对于长视频，调整超时参数
-    is_long_video = duration > 3600  # 超过1小时算长视频
-    max_stall_time = 300 if is_long_video else 120  # 长视频5分钟，短视频2分钟
-    max_no_progress_time = 600 if is_long_video else 300  # 长视频10分钟，短视频5分钟
-    
-    # 添加进度监控变量
-    last_progress_percentage = 0
-    progress_stuck_time = 0
-    progress_check_interval = 30  # 每30秒检查一次进度是否卡住
-    last_progress_check = time.time()
-    
-    logging.info(f"视频时长: {duration:.1f}秒, 长视频模式: {is_long_video}, 最大卡死时间: {max_stall_time}秒, 最大无进度时间: {max_no_progress_time}秒, 续传偏移: {initial_time_offset:.1f}s")
-    
-    while process.poll() is None:
-        line = process.stderr.readline()
-        if line:
-            progress_info = parse_progress(line)
-            if 'time' in progress_info:
-                last_update_time = time.time()
-                no_progress_count = 0  # 重置无进度计数
-                
-                # 采用1.0版本的稳定进度计算策略
-                current_time = initial_time_offset + progress_info['time']
-                if current_time > duration:
-                    current_time = duration
-                
-                # 采用1.0版本的进度计算：限制到95%，然后由update_final_progress处理
-                if current_time >= duration * 0.95:  # 如果已经处理了95%以上
-                    percentage = 95
-                else:
-                    percentage = min(95, 10 + current_time * 85 / duration)  # 10%-95%范围
-                
-                # 简化进度检查（采用1.0版本策略）
-                # 移除复杂的进度卡住检查，使用更简单的逻辑
-                
-                if percentage > last_percentage:
-                    pbar.update(percentage - last_percentage)
-                    last_percentage = percentage
-                    last_progress_time = current_time
-                    
-                    # 更新单视频进度
-                    if video_path:
-                        progress_manager.update_individual_progress(
-                            video_path, 'processing', percentage, 
-                            f"处理中 {percentage:.1f}% ({current_time:.1f}s/{duration:.1f}s)"
-                        )
-                    
-                    # 采用1.0版本的简化显示
-                    postfix = {'FPS': f"{progress_info.get('fps', 0):.1f}",
-                               '速度': f"{progress_info.get('speed', 0):.1f}x",
-                               '大小': f"{progress_info.get('size', 0) / 1024:.1f}MB",
-                               '时间': f"{current_time:.1f}s/{duration:.1f}s",
-                               '进度': f"{current_time/duration*100:.1f}%"}
-                    pbar.set_postfix(postfix)
-                    
-                    # 简化日志输出
-                    if int(percentage) % 20 == 0 and int(percentage) != int(last_percentage):
-                        logging.info(f"处理进度: {percentage:.1f}% - FPS: {progress_info.get('fps', 0):.1f}, 速度: {progress_info.get('speed', 0):.1f}x, 时间: {current_time:.1f}s/{duration:.1f}s")
-                
-                # 改进卡死检测，对长视频更宽容
-                speed = progress_info.get('speed', 1.0)
-                if speed < 0.01:  # 速度极慢
-                    stalled_time += 1
-                elif speed < 0.1 and is_long_video:  # 长视频允许更慢的速度
-                    stalled_time += 0.5
-                else:
-                    stalled_time = 0
-                
-                if stalled_time > max_stall_time:
-                    process.terminate()
-                    raise Exception(f"处理速度过慢，可能已卡死 (速度: {speed}x, 卡死时间: {stalled_time}s)")
-        else:
-            no_progress_count += 1
-            # 对于长视频，大幅增加超时时间
-            if time.time() - last_update_time > max_no_progress_time:
-                process.terminate()
-                raise Exception(f"处理超时，{max_no_progress_time}秒内无任何进度更新")
-        
-        time.sleep(1 if is_long_video else 0.5)  # 长视频减少检查频率
-    
-    # 检查返回码
-    if process.returncode != 0:
-        # 只读取剩余的stderr内容，并过滤掉进度信息
-        remaining_stderr = process.stderr.read()
-        error_lines = []
-        for line in remaining_stderr.split('\n'):
-            # 过滤掉进度行和一些常见的非错误信息
-            if (line.strip() and 
-                not line.startswith('frame=') and 
-                not line.startswith('size=') and
-                not line.startswith('time=') and
-                not line.startswith('bitrate=') and
-                not line.startswith('speed=') and
-                'fps=' not in line and
-                not line.strip().startswith('Last message repeated')):
-                error_lines.append(line.strip())
-        
-        # 只保留最后10行真正的错误信息
-        filtered_errors = error_lines[-10:] if error_lines else ["无具体错误信息"]
-        error_msg = '\n'.join(filtered_errors)
-        raise Exception(f"ffmpeg处理失败 (代码 {process.returncode}): {error_msg}")
-    
-    # 采用1.0版本的策略：确保进度条到达95%（由update_final_progress处理95-100%）
-    if last_percentage < 95:
-        pbar.update(95 - last_percentage)
-
-
 def update_final_progress(pbar, video_path, stage_name="最终处理"):
     """更新最终进度 - 采用1.0版本的简化策略"""
     # 采用1.0版本的简单做法：直接跳到100%
@@ -2145,6 +1940,62 @@ def update_final_progress(pbar, video_path, stage_name="最终处理"):
             progress_manager.update_individual_progress(video_path, 'completed', 100, f"{stage_name}完成")
 
 
+# 分段编码共享线程池：所有视频的分段都提交到这里，批量末尾只剩一个长视频时也能占满编码器
+_chunk_executor = None
+_chunk_executor_lock = threading.Lock()
+
+
+def get_chunk_executor(hardware_info):
+    """获取分段编码共享线程池（首次调用时按编码并行数创建）"""
+    global _chunk_executor
+    with _chunk_executor_lock:
+        if _chunk_executor is None:
+            _chunk_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=get_parallel_workers(hardware_info), thread_name_prefix='chunk')
+        return _chunk_executor
+
+
+def run_fragmented_encode(video_path, output_video_path, filter_complex, hardware_info, duration, pbar,
+                          source_quality_info=None, target_resolution=(1920, 1080)):
+    """按关键帧对齐的固定时长分段编码一个视频
+
+    已完成的分段记录在输出文件旁的清单里（不含电脑标识），中断后任何电脑都跳过已完成的分段，
+    全部完成后无损拼接。硬件编码器时分段在共享线程池里并行编码，软件编码按顺序编码。
+    """
+    chunks = plan_chunks(video_path, 0.0, duration, CHUNK_SECONDS, FFPROBE_PATH)
+
+    def build_command(start, length, chunk_output):
+        return build_ffmpeg_command(video_path, chunk_output, filter_complex, hardware_info,
+                                    seek_seconds=start, source_quality_info=source_quality_info,
+                                    target_resolution=target_resolution, duration_seconds=length)
+
+    last_percentage = pbar.n
+
+    def on_progress(done_seconds, total_seconds):
+        nonlocal last_percentage
+        percentage = min(95, 10 + done_seconds * 85 / total_seconds)
+        if percentage <= last_percentage:
+            return
+        pbar.update(percentage - last_percentage)
+        pbar.set_postfix_str(f"分段编码 {done_seconds:.0f}s/{total_seconds:.0f}s")
+        # 分段内进度每 0.5 秒一次，单视频进度只在整数百分比变化时更新
+        if int(percentage) != int(last_percentage):
+            progress_manager.update_individual_progress(
+                video_path, 'processing', percentage, f"分段编码 {percentage:.1f}% ({done_seconds:.1f}s/{total_seconds:.1f}s)")
+        last_percentage = percentage
+
+    parallel = ENABLE_CHUNKED_ENCODE and hardware_info['encoder_type'] != 'software'
+    # 只按“多久没有任何进度”判断卡死，不限制单段总时长（慢速 CPU 回退编码也能跑完）
+    max_no_progress_time = 600 if duration > 3600 else 300
+    signature = {'encoder': hardware_info['encoder'], 'encoder_type': hardware_info['encoder_type'],
+                 'filter': filter_complex, 'resolution': list(target_resolution)}
+    encoder = ChunkedEncoder(video_path, output_video_path, chunks, build_command, concat_mp4_files,
+                             executor=get_chunk_executor(hardware_info) if parallel else None, workers=1,
+                             stall_timeout=max_no_progress_time, signature=signature, logger=logging.getLogger())
+    pbar.set_postfix_str(f"分段编码 ({len(chunks)}段)...")
+    encoder.run(progress=on_progress)
+
+
 def process_video(video_path, output_video_path, roi, hardware_info, video_idx=0, total_videos=1,
                   target_resolution=(1920, 1080)):
     filename = os.path.basename(video_path)
@@ -2213,11 +2064,6 @@ def process_video(video_path, output_video_path, roi, hardware_info, video_idx=0
         except Exception as e:
             logging.warning(f"获取视频尺寸失败: {e}，使用原始ROI")
         
-        # 创建视频专用的检查点文件
-        checkpoint_dir = os.path.join(os.path.dirname(progress_manager.progress_file), 'checkpoints')
-        os.makedirs(checkpoint_dir, exist_ok=True)
-        checkpoint_file = os.path.join(checkpoint_dir, f"{hashlib.md5(video_path.encode()).hexdigest()}.json")
-        
         try:
             # 分析视频质量
             pbar.set_postfix_str("分析视频质量...")
@@ -2274,54 +2120,13 @@ def process_video(video_path, output_video_path, roi, hardware_info, video_idx=0
             
             logging.info(f"开始处理视频: {filename}, 时长: {duration:.1f}s, 质量: {source_quality_info.get('bitrate_mbps', 0):.1f}Mbps")
 
-            # 增强断点续传：检查检查点和输出文件
-            checkpoint = load_progress_checkpoint(checkpoint_file)
+            # 输出文件已完整时直接标记完成
             existing_duration = 0
-            output_file_exists = os.path.exists(output_video_path)
-            
-            if output_file_exists:
+            if os.path.exists(output_video_path):
                 existing_duration = get_media_duration_seconds(output_video_path)
-                # 如果输出文件存在但时长为0，说明文件损坏，删除重新开始
-                if existing_duration == 0.0 and os.path.getsize(output_video_path) > 0:
-                    logging.warning(f"检测到损坏的输出文件 (大小:{os.path.getsize(output_video_path)} bytes, 时长:0s)，删除重新开始")
-                    try:
-                        os.remove(output_video_path)
-                        output_file_exists = False
-                        existing_duration = 0
-                        logging.info("已删除损坏的输出文件")
-                    except Exception as e:
-                        logging.error(f"删除损坏文件失败: {e}")
-            
-            logging.info(f"断点续传检查: 检查点文件={os.path.exists(checkpoint_file)}, "
-                        f"输出文件存在={output_file_exists}, "
-                        f"输出文件时长={existing_duration:.1f}s, 源文件时长={duration:.1f}s")
-            
-            # 额外的调试信息
-            if checkpoint:
-                logging.info(f"检查点详情: 时间={checkpoint.get('current_time', 0):.1f}s, "
-                            f"电脑ID匹配={checkpoint.get('computer_id') == get_computer_unique_id()}")
-            
-            resume_from = 0
-            
-            # 优先使用检查点信息
-            if checkpoint and checkpoint.get('computer_id') == get_computer_unique_id():
-                checkpoint_time = checkpoint.get('current_time', 0)
-                logging.info(f"发现检查点: 时间={checkpoint_time:.1f}s")
-                
-                if checkpoint_time > 10:  # 检查点时间合理
-                    resume_from = checkpoint_time
-                    logging.info(f"✅ 使用检查点续传: 从 {resume_from:.1f}s 继续")
-                
-            # 如果没有有效检查点，检查输出文件
-            elif output_file_exists and existing_duration > 10 and existing_duration < duration * 0.99:
-                resume_from = existing_duration
-                logging.info(f"✅ 使用输出文件续传: 从 {resume_from:.1f}s 继续")
-                
-            # 判断是否需要续传
-            if resume_from > 10:
-                logging.info(f"🔄 断点续传模式: 从 {resume_from:.1f}s 继续处理")
-            elif output_file_exists and existing_duration >= duration * 0.99:
+            if existing_duration >= duration * 0.99:
                 logging.info(f"✅ 输出文件已完整 ({existing_duration:.1f}s >= {duration * 0.99:.1f}s)，跳过处理")
+                ChunkedEncoder.remove_chunks(output_video_path)
                 # 标记为已完成并跳过
                 progress_manager.mark_completed(video_path, output_video_path)
                 pbar.set_postfix_str("已完成✓")
@@ -2332,75 +2137,11 @@ def process_video(video_path, output_video_path, roi, hardware_info, video_idx=0
                 release_progress_bar_position(current_position)
                 pbar.close()
                 return True
-            else:
-                logging.info("🆕 全新处理: 没有发现可续传的文件")
-        
-            if resume_from > 10:  # 只有超过10秒才值得续传
-                progress_percent = (resume_from / duration) * 100
-                logging.info(f"🔄 断点续传: {filename} - 已完成 {resume_from:.1f}s / {duration:.1f}s ({progress_percent:.1f}%)")
-                pbar.set_postfix_str(f"续传中 ({progress_percent:.1f}%)")
-                
-                # 保存续传检查点
-                resume_checkpoint = create_enhanced_progress_checkpoint(video_path, resume_from, duration)
-                save_progress_checkpoint(resume_checkpoint, checkpoint_file)
-                
-                # 更新进度条显示续传进度（但不超过90%，为后续处理留空间）
-                initial_progress = min(progress_percent, 90)
-                pbar.update(initial_progress)
-                
-                # 将已有部分暂存为 part1
-                part1_path = output_video_path + ".part1.mp4"
-                try:
-                    if os.path.exists(output_video_path):
-                        shutil.move(output_video_path, part1_path)
-                except Exception as e:
-                    logging.warning(f"移动输出文件失败: {e}")
-                    part1_path = None
-                
-                # 从 resume_from 续传生成 part2
-                part2_path = output_video_path + ".part2.mp4"
-                cmd = build_ffmpeg_command(video_path, part2_path, filter_complex, hardware_info, 
-                                         seek_seconds=int(resume_from), source_quality_info=source_quality_info, 
-                                         target_resolution=target_resolution)
-                logging.info(f"执行命令(增强续传): {' '.join(cmd)}")
-                remaining_duration = duration - resume_from
-                logging.info(f"续传剩余时长: {remaining_duration:.1f}s")
-                run_ffmpeg_process(cmd, remaining_duration, pbar, initial_time_offset=resume_from, video_path=video_path)
-                
-                # 更新最终阶段进度 (95-100%)
-                update_final_progress(pbar, video_path, "续传处理")
-                
-                # 拼接 part1 + part2 为最终文件
-                try:
-                    concat_inputs = []
-                    if part1_path and os.path.exists(part1_path):
-                        concat_inputs.append(part1_path)
-                    if os.path.exists(part2_path):
-                        concat_inputs.append(part2_path)
-                    if concat_inputs:
-                        tmp_output = output_video_path + ".tmp.mp4"
-                        concat_mp4_files(concat_inputs, tmp_output)
-                        shutil.move(tmp_output, output_video_path)
-                        for p in concat_inputs:
-                            try:
-                                os.remove(p)
-                            except Exception:
-                                pass
-                except Exception as ce:
-                    logging.error(f"拼接续传片段失败: {ce}")
-            else:
-                # 完整处理
-                pbar.set_postfix_str("尝试优化编码...")
-                cmd = build_ffmpeg_command(video_path, output_video_path, filter_complex, hardware_info, 
-                                         source_quality_info=source_quality_info, target_resolution=target_resolution)
-                logging.info(f"执行命令(全新处理): {' '.join(cmd)}")
-                
-                # 定期保存检查点
-                def save_checkpoint_during_processing(current_time):
-                    checkpoint = create_enhanced_progress_checkpoint(video_path, current_time, duration)
-                    save_progress_checkpoint(checkpoint, checkpoint_file)
-                
-                run_ffmpeg_process(cmd, duration, pbar, video_path=video_path)
+            
+            # 按段编码：已完成的分段记录在输出文件旁的清单里，中断后任何一台电脑都从未完成的分段继续
+            pbar.set_postfix_str("尝试优化编码...")
+            run_fragmented_encode(video_path, output_video_path, filter_complex, hardware_info, duration, pbar,
+                                  source_quality_info=source_quality_info, target_resolution=target_resolution)
             
             # 更新最终阶段进度 (95-100%)
             update_final_progress(pbar, video_path, "主要处理")
@@ -2409,13 +2150,6 @@ def process_video(video_path, output_video_path, roi, hardware_info, video_idx=0
             if not os.path.exists(output_video_path) or os.path.getsize(output_video_path) < 1024:
                 raise Exception(f"输出文件无效或太小: {output_video_path}")
             
-            # 清理检查点文件
-            try:
-                if os.path.exists(checkpoint_file):
-                    os.remove(checkpoint_file)
-            except Exception:
-                pass
-            
             # 标记为已完成
             progress_manager.mark_completed(video_path, output_video_path)
             
@@ -2457,10 +2191,9 @@ def process_video(video_path, output_video_path, roi, hardware_info, video_idx=0
                         "buffer_size": "1024"
                     }
                     
-                    cmd = build_ffmpeg_command(video_path, output_video_path, filter_complex, fallback_hw_info,
-                                             source_quality_info=source_quality_info, target_resolution=target_resolution)
-                    logging.info(f"执行命令 (NVENC兼容模式): {' '.join(cmd)}")
-                    run_ffmpeg_process(cmd, duration, pbar, video_path=video_path)
+                    logging.info("按段编码 (NVENC兼容模式)")
+                    run_fragmented_encode(video_path, output_video_path, filter_complex, fallback_hw_info, duration, pbar,
+                                          source_quality_info=source_quality_info, target_resolution=target_resolution)
                     
                     # 更新最终阶段进度 (95-100%)
                     update_final_progress(pbar, video_path, "NVENC兼容处理")
@@ -2469,13 +2202,6 @@ def process_video(video_path, output_video_path, roi, hardware_info, video_idx=0
                     if not os.path.exists(output_video_path) or os.path.getsize(output_video_path) < 1024:
                         raise Exception(f"NVENC兼容模式输出文件无效或太小: {output_video_path}")
                     
-                    # 清理检查点文件
-                    try:
-                        if os.path.exists(checkpoint_file):
-                            os.remove(checkpoint_file)
-                    except Exception:
-                        pass
-                    
                     # 标记为已完成
                     progress_manager.mark_completed(video_path, output_video_path)
                     
@@ -2509,49 +2235,10 @@ def process_video(video_path, output_video_path, roi, hardware_info, video_idx=0
                     "buffer_size": "1024"
                 }
             
-                # CPU 方案同样支持增强续传
-                existing_duration = get_media_duration_seconds(output_video_path)
-                if existing_duration > 10 and existing_duration < duration * 0.99:
-                    part1_path = output_video_path + ".part1.mp4"
-                    try:
-                        if os.path.exists(output_video_path):
-                            shutil.move(output_video_path, part1_path)
-                    except Exception as e:
-                        logging.warning(f"CPU续传移动文件失败: {e}")
-                        part1_path = None
-                    
-                    part2_path = output_video_path + ".part2.mp4"
-                    cmd = build_ffmpeg_command(video_path, part2_path, filter_complex, cpu_hw_info, 
-                                             seek_seconds=int(existing_duration), source_quality_info=source_quality_info,
-                                             target_resolution=target_resolution)
-                    logging.info(f"执行命令 (CPU增强续传): {' '.join(cmd)}")
-                    run_ffmpeg_process(cmd, duration, pbar, initial_time_offset=existing_duration, video_path=video_path)
-                    
-                    # 更新最终阶段进度 (95-100%)
-                    update_final_progress(pbar, video_path, "CPU续传处理")
-                    
-                    try:
-                        concat_inputs = []
-                        if part1_path and os.path.exists(part1_path):
-                            concat_inputs.append(part1_path)
-                        if os.path.exists(part2_path):
-                            concat_inputs.append(part2_path)
-                        if concat_inputs:
-                            tmp_output = output_video_path + ".tmp.mp4"
-                            concat_mp4_files(concat_inputs, tmp_output)
-                            shutil.move(tmp_output, output_video_path)
-                            for p in concat_inputs:
-                                try:
-                                    os.remove(p)
-                                except Exception:
-                                    pass
-                    except Exception as ce:
-                        logging.error(f"CPU拼接续传片段失败: {ce}")
-                else:
-                    cmd = build_ffmpeg_command(video_path, output_video_path, filter_complex, cpu_hw_info,
-                                             source_quality_info=source_quality_info, target_resolution=target_resolution)
-                    logging.info(f"执行命令 (CPU完整处理): {' '.join(cmd)}")
-                    run_ffmpeg_process(cmd, duration, pbar, video_path=video_path)
+                # CPU 方案同样按段编码，编码参数变了，之前的分段不会混用
+                logging.info("按段编码 (CPU)")
+                run_fragmented_encode(video_path, output_video_path, filter_complex, cpu_hw_info, duration, pbar,
+                                      source_quality_info=source_quality_info, target_resolution=target_resolution)
             
                 # 更新最终阶段进度 (95-100%)
                 update_final_progress(pbar, video_path, "CPU完整处理")
@@ -2560,13 +2247,6 @@ def process_video(video_path, output_video_path, roi, hardware_info, video_idx=0
                 if not os.path.exists(output_video_path) or os.path.getsize(output_video_path) < 1024:
                     raise Exception(f"CPU编码输出文件无效或太小: {output_video_path}")
                 
-                # 清理检查点文件
-                try:
-                    if os.path.exists(checkpoint_file):
-                        os.remove(checkpoint_file)
-                except Exception:
-                    pass
-                
                 # 标记为已完成
                 progress_manager.mark_completed(video_path, output_video_path)
                 
@@ -2599,9 +2279,7 @@ def process_video(video_path, output_video_path, roi, hardware_info, video_idx=0
         
         # 从处理中移除（无论是否已经在失败列表中）
         video_name = os.path.basename(video_path)
-        if video_name in progress_manager.progress_data['processing']:
-            progress_manager.progress_data['processing'].remove(video_name)
-            progress_manager.save_progress()
+        if progress_manager.unmark_processing(video_path):
             logging.info(f"已从处理中列表移除: {video_name}")
         
         # 标记为失败
@@ -2622,9 +2300,7 @@ def process_video(video_path, output_video_path, roi, hardware_info, video_idx=0
         
         # 从处理中移除
         video_name = os.path.basename(video_path)
-        if video_name in progress_manager.progress_data['processing']:
-            progress_manager.progress_data['processing'].remove(video_name)
-            progress_manager.save_progress()
+        if progress_manager.unmark_processing(video_path):
             logging.info(f"已从处理中列表移除: {video_name}")
         
         # 更新单视频进度为中断
@@ -2641,6 +2317,23 @@ def process_video(video_path, output_video_path, roi, hardware_info, video_idx=0
         release_file_processing_lock(video_path, file_lock)
 
 
+def get_parallel_workers(hardware_info):
+    """根据硬件检测结果确定编码并行数"""
+    max_workers = hardware_info.get("max_parallel", 4)
+    if hardware_info["encoder_type"] != "software":
+        # 硬件编码器：减少并行数以避免GPU资源争抢
+        max_workers = min(max_workers, 6)
+    else:
+        # 软件编码器：可以使用更多并行，但要考虑I9性能
+        cpu_cores = hardware_info.get("cpu_cores", 8)
+        if hardware_info.get('is_i9', False):
+            # i9处理器优化：使用更多并行数
+            max_workers = min(max_workers, min(cpu_cores - 2, 16))
+        else:
+            max_workers = min(max_workers, cpu_cores // 2)
+    return max(1, max_workers)
+
+
 def process_videos_in_parallel(video_paths, output_paths, roi, hardware_info, target_resolution):
     if output_paths: os.makedirs(os.path.dirname(output_paths[0]), exist_ok=True)
     
@@ -2678,18 +2371,7 @@ def process_videos_in_parallel(video_paths, output_paths, roi, hardware_info, ta
             })
 
     # 使用新的硬件检测结果确定并行数
-    max_workers = hardware_info.get("max_parallel", 4)
-    if hardware_info["encoder_type"] != "software":
-        # 硬件编码器：减少并行数以避免GPU资源争抢
-        max_workers = min(max_workers, 6)
-    else:
-        # 软件编码器：可以使用更多并行，但要考虑I9性能
-        cpu_cores = hardware_info.get("cpu_cores", 8)
-        if hardware_info.get('is_i9', False):
-            # i9处理器优化：使用更多并行数
-            max_workers = min(max_workers, min(cpu_cores - 2, 16))
-        else:
-            max_workers = min(max_workers, cpu_cores // 2)
+    max_workers = get_parallel_workers(hardware_info)
     
     logging.info(f"硬件类型: {hardware_info['encoder_type']}, 并行数: {max_workers}")
     if hardware_info.get('is_i9', False):
@@ -2735,6 +2417,106 @@ def process_videos_in_parallel(video_paths, output_paths, roi, hardware_info, ta
     return success_count, failed_count
 
 
+def process_videos_streaming(video_paths, roi, hardware_info, target_resolution):
+    """流式处理：分辨率检查、断点过滤、编码同时进行
+
+    不再等全部视频检查完才开始编码，第一个合格的视频检查完就进入编码阶段。
+    断点过滤只做进度记录检查和精确同名输出检查，前缀变体匹配仍走批量模式。
+
+    Returns:
+        (成功数, 失败数, 已完成跳过数, 跳过的低分辨率视频列表)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    max_workers = get_parallel_workers(hardware_info)
+    counter_lock = threading.Lock()
+    skipped_videos = []
+    completed_count = 0
+    next_index = 0
+
+    def check_resolution(video_path):
+        should_skip, (width, height) = should_skip_low_resolution_video(video_path)
+        if should_skip:
+            with counter_lock:
+                skipped_videos.append({'path': video_path, 'name': os.path.basename(video_path),
+                                       'resolution': f"{width}x{height}"})
+            logging.info(f"跳过低分辨率视频: {os.path.basename(video_path)} ({width}x{height})")
+            return None
+        return video_path
+
+    def check_progress(video_path):
+        nonlocal completed_count, next_index
+        video_name = os.path.basename(video_path)
+        output_path = os.path.join(output_dir, video_name)
+        if not progress_manager.is_processing(video_path):
+            done = progress_manager.is_completed(video_path, output_dir)
+            if not done and os.path.exists(output_path) and os.path.getsize(output_path) > 1024 \
+                    and get_media_duration_seconds(output_path) > 0:
+                # 输出文件存在且可读，同步到进度记录
+                progress_manager.mark_completed(video_path, output_path)
+                logging.info(f"自动同步: {video_name}")
+                done = True
+            if done:
+                with counter_lock:
+                    completed_count += 1
+                return None
+        with counter_lock:
+            video_idx = next_index
+            next_index += 1
+        return video_path, output_path, video_idx
+
+    # 软件编码仍放进进程池（CPU密集型），编码阶段的线程只负责提交并等待结果
+    process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) \
+        if hardware_info["encoder_type"] == "software" else None
+
+    def encode(video_info):
+        video_path, output_path, video_idx = video_info
+        args = (video_path, output_path, roi, hardware_info, video_idx, len(video_paths), target_resolution)
+        try:
+            if process_pool is not None:
+                result = process_pool.submit(process_video, *args).result()
+            else:
+                result = process_video(*args)
+        except Exception as e:
+            logging.error(f"任务异常: {os.path.basename(video_path)} - {e}")
+            result = False
+        return video_path, bool(result)
+
+    pipeline = StreamPipeline(video_paths, queue_size=PIPELINE_QUEUE_SIZE)
+    pipeline.add_stage('分辨率检查', check_resolution, workers=PIPELINE_PROBE_WORKERS)
+    pipeline.add_stage('断点过滤', check_progress, workers=1)
+    pipeline.add_stage('编码', encode, workers=max_workers)
+    logging.info(f"🔀 流式处理启动: 硬件类型 {hardware_info['encoder_type']}, "
+                 f"分辨率检查 {PIPELINE_PROBE_WORKERS} 线程, 编码并行数 {max_workers}")
+
+    success_count = 0
+    failed_count = 0
+    total_pbar = tqdm(total=len(video_paths), desc="📁 总文件进度", position=0, leave=True,
+                      bar_format='{l_bar}{bar:30}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]')
+    try:
+        for video_path, success in pipeline.run():
+            if success:
+                success_count += 1
+            else:
+                failed_count += 1
+            # 跳过/已完成的视频也计入总进度
+            total_pbar.n = success_count + failed_count + completed_count + len(skipped_videos)
+            total_pbar.set_postfix({'成功': success_count, '失败': failed_count, '已完成': completed_count})
+    except KeyboardInterrupt:
+        logging.info("流式处理被用户中断")
+        pipeline.stop()
+    finally:
+        total_pbar.n = success_count + failed_count + completed_count + len(skipped_videos)
+        total_pbar.close()
+        if process_pool is not None:
+            process_pool.shutdown(wait=True)
+
+    cleanup_file_processing_locks()
+    pipeline.log_stats()
+    logging.info(f"📊 流式处理完成: 成功 {success_count} 个, 失败 {failed_count} 个, "
+                 f"已完成 {completed_count} 个, 低分辨率跳过 {len(skipped_videos)} 个")
+    return success_count, failed_count, completed_count, skipped_videos
+
+
 def test_resolution_detection(video_path: str = None):
     """测试视频分辨率检测功能"""
     if not video_path:
@@ -3082,7 +2864,39 @@ if __name__ == '__main__':
     
     print(f"✅ ROI选择完成，最终ROI参数: {final_roi}")
     print(f"🔍 现在开始检测视频分辨率并筛选待处理文件...")
-    
+
+    # 流式处理：分辨率检查、断点过滤、编码同时进行
+    if ENABLE_STREAMING_PIPELINE:
+        progress_manager.set_start_time()
+        hardware_info = detect_advanced_hardware()
+        success_count, failed_count, completed_count, skipped_videos = process_videos_streaming(
+            video_paths, final_roi, hardware_info, TARGET_RESOLUTION)
+        progress_manager.print_summary()
+
+        # 流水线结束后再统一移动跳过的低分辨率视频
+        moved_count = 0
+        if skipped_videos and SKIP_VIDEOS_MOVE_DIR and SKIP_VIDEOS_MOVE_DIR.strip():
+            for skipped_info in skipped_videos:
+                if move_skipped_video(skipped_info['path'], "低分辨率"):
+                    moved_count += 1
+
+        try:
+            if os.path.exists(temp_dir):
+                shutil.rmtree(temp_dir)
+                logging.info("临时文件已清理")
+        except Exception as e:
+            logging.warning(f"清理临时文件失败: {e}")
+
+        elapsed_time = time.time() - start_time
+        print(f"\n📈 最终统计汇总:")
+        print(f"   总视频数量: {len(video_paths)}")
+        print(f"   本次成功: {success_count}, 失败: {failed_count}")
+        print(f"   已完成跳过: {completed_count}")
+        print(f"   跳过低分辨率: {len(skipped_videos)} (已移动 {moved_count})")
+        print(f"   处理耗时: {elapsed_time:.2f}秒")
+        logging.info(f'处理完成！总耗时: {elapsed_time:.2f}秒')
+        exit(0)
+
     # 预检查视频完成状态，现在进行分辨率检测和筛选
     logging.info("预检查视频处理状态...")
     filtered_video_paths = []
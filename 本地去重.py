@@ -12,12 +12,15 @@ WeChat Official Account: 码间拾遗（Code Snippets）
 Power by macOS on Mac mini m4(2024)
 """
 import os
-import hashlib
 import shutil
 import logging
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from file_index import iter_video_files
+from bloom_filter import BloomFilter
+from file_hasher import ParallelHasher
+
 from dbutils.pooled_db import PooledDB  # 使用小写开头的 pooled_db
 from tqdm import tqdm
 import pymysql  # 使用 pymysql 连接 MySQL
@@ -53,6 +56,18 @@ POOL_CONFIG = {
 
 DB_TABLE = "videos"
 
+# --- 批量查重配置 ---
+# 批量模式：每 DB_BATCH_SIZE 个文件只做一次 md5 IN / name IN 查询，新记录用 executemany 一次插入
+BATCH_MODE = True
+DB_BATCH_SIZE = 500
+# 本地布隆过滤器：挡掉绝大多数「肯定不存在」的查询，只有可能存在的文件才查 MySQL
+BLOOM_CAPACITY = 20_000_000
+BLOOM_ERROR_RATE = 0.01
+BLOOM_FILE = os.path.join(os.path.expanduser('~'), '.video_deal',
+                          f"md5_bloom_{DB_CONFIG['host']}_{DB_CONFIG['database']}_{DB_TABLE}.bin")
+# 增量同步时向前多取的分钟数（其他电脑插入的记录 created_at 早于提交时间）
+BLOOM_SYNC_MARGIN_MINUTES = 10
+
 
 # --- 日志配置 ---
 # 创建一个 logger
@@ -83,19 +98,20 @@ pool = None
 
 # --- 函数定义 ---
 
+# MD5 计算线程池（大块读取 + (路径, 大小, 修改时间) 缓存，见 file_hasher.py）
+hasher = None
+
+
+def get_hasher():
+    global hasher
+    if hasher is None:
+        hasher = ParallelHasher(workers=NUM_THREADS)
+    return hasher
+
+
 def calculate_md5(filepath):
-    hasher = hashlib.md5()
-    try:
-        with open(filepath, 'rb') as file:
-            while True:
-                chunk = file.read(4096)
-                if not chunk:
-                    break
-                hasher.update(chunk)
-    except OSError as e:
-        logger.error(f"Error reading file {filepath}: {e}")
-        return None
-    return hasher.hexdigest()
+    """计算文件 MD5，文件没变时直接取缓存"""
+    return get_hasher().hash_file(filepath)
 
 def database_connect():
     """创建数据库连接池"""
@@ -190,16 +206,174 @@ def process_video_file(filepath):
 
 
 
+def load_known_filter():
+    """加载本地布隆过滤器（不存在或已饱和时重新构建）"""
+    loaded = BloomFilter.load(BLOOM_FILE)
+    if loaded and not loaded[0].is_saturated:
+        bloom, meta = loaded
+        logger.info(f"Loaded bloom filter: {bloom.count} keys, synced until {meta.get('synced_until')}")
+        return bloom, meta
+    if loaded:
+        logger.warning("Bloom filter saturated, rebuilding from database.")
+    return BloomFilter(BLOOM_CAPACITY, BLOOM_ERROR_RATE), {}
+
+
+def sync_known_filter(bloom, meta):
+    """从数据库增量同步已有记录到布隆过滤器（按 created_at）"""
+    since = meta.get('synced_until')
+    conn = get_connection()
+    added = 0
+    try:
+        # 流式游标，首次全量同步时不会把整张表读进内存
+        with conn.cursor(pymysql.cursors.SSCursor) as cursor:
+            if since:
+                cursor.execute(f"SELECT name, md5, created_at FROM {DB_TABLE} "
+                               f"WHERE created_at >= DATE_SUB(%s, INTERVAL {BLOOM_SYNC_MARGIN_MINUTES} MINUTE)",
+                               (since,))
+            else:
+                cursor.execute(f"SELECT name, md5, created_at FROM {DB_TABLE}")
+            latest = since
+            for name, md5, created_at in cursor:
+                if name:
+                    bloom.add(f"name:{name}")
+                if md5:
+                    bloom.add(f"md5:{md5}")
+                if created_at and (latest is None or str(created_at) > latest):
+                    latest = str(created_at)
+                added += 1
+            meta['synced_until'] = latest
+    finally:
+        conn.close()
+    logger.debug(f"Bloom filter synced {added} rows from database.")
+
+
+def find_existing_in_database(cursor, filenames, md5s):
+    """两条 IN 查询分别走 md5 和 name 的索引，返回 (已存在的md5集合, 已存在的文件名集合)"""
+    existing_md5s = set()
+    existing_names = set()
+    if md5s:
+        placeholders = ', '.join(['%s'] * len(md5s))
+        cursor.execute(f"SELECT md5 FROM {DB_TABLE} WHERE md5 IN ({placeholders})", list(md5s))
+        existing_md5s = {row['md5'] for row in cursor.fetchall()}
+    if filenames:
+        placeholders = ', '.join(['%s'] * len(filenames))
+        cursor.execute(f"SELECT name FROM {DB_TABLE} WHERE name IN ({placeholders})", list(filenames))
+        existing_names = {row['name'] for row in cursor.fetchall()}
+    return existing_md5s, existing_names
+
+
+def insert_batch_into_database(conn, cursor, rows):
+    """executemany 批量插入 [(文件名, md5)]，遇到主键冲突时退回逐条插入"""
+    if not rows:
+        return 0
+    sql = f"INSERT INTO {DB_TABLE} (name, link, created_at, md5, keywords, datal_id, save_path) VALUES (%s, %s, NOW(), %s, %s, %s, %s)"
+    try:
+        cursor.executemany(sql, [(filename, '', md5, '', 83, filename) for filename, md5 in rows])
+        return len(rows)
+    except IntegrityError:
+        logger.warning("Batch insert hit a duplicate key, falling back to row-by-row insert.")
+        conn.rollback()
+        return sum(1 for filename, md5 in rows if insert_into_database(cursor, filename, md5))
+
+
+def process_video_chunk(items, bloom):
+    """批量处理一批已算好 md5 的文件 [(路径, 文件名, md5)]，返回新插入的数量"""
+    # 布隆过滤器说不存在的，肯定不在数据库里，不用查
+    maybe_known = [(filename, md5) for _, filename, md5 in items
+                   if f"md5:{md5}" in bloom or f"name:{filename}" in bloom]
+
+    max_retries = 3
+    for attempt in range(max_retries):
+        conn = get_connection()
+        try:
+            with conn.cursor() as cursor:
+                existing_md5s, existing_names = find_existing_in_database(
+                    cursor, {f for f, _ in maybe_known}, {m for _, m in maybe_known})
+
+                # 同一批里重复的 md5/文件名：第一个当新文件插入，后面的按已存在处理
+                seen_md5s = set()
+                seen_names = set()
+                to_insert = []
+                for filepath, filename, md5 in items:
+                    target_filepath = os.path.join(TARGET_DIR, filename)
+                    if (md5 in existing_md5s or filename in existing_names
+                            or md5 in seen_md5s or filename in seen_names):
+                        try:
+                            shutil.move(filepath, target_filepath)
+                            logger.info(f"Moved: {filepath} -> {target_filepath}")
+                            logger.info(f"Skipped (already exists): {filename}")
+                        except OSError as e:
+                            logger.error(f"Error moving file {filepath}: {e}")
+                        continue
+                    if os.path.exists(target_filepath):
+                        logger.warning(f"Target file already exists (MD5 collision?): {target_filepath}")
+                        continue
+                    seen_md5s.add(md5)
+                    seen_names.add(filename)
+                    to_insert.append((filename, md5))
+
+                inserted = insert_batch_into_database(conn, cursor, to_insert)
+            conn.commit()
+            for filename, md5 in to_insert:
+                bloom.add(f"name:{filename}")
+                bloom.add(f"md5:{md5}")
+            logger.info(f"Batch done: {len(items)} files, {len(maybe_known)} queried, "
+                        f"{len(items) - len(to_insert)} duplicates, {inserted} inserted")
+            return inserted
+
+        except (InternalError, OperationalError) as e:
+            logger.warning(f"Database error (attempt {attempt + 1}/{max_retries}): {e}")
+            if attempt < max_retries - 1:
+                time.sleep(2 ** attempt)  # 指数退避 (等待 1, 2, 4 秒...)
+                continue
+            logger.error(f"Max retries reached. Giving up on batch of {len(items)} files.")
+            return 0
+        except Exception as e:
+            logger.exception(f"An unexpected error: {e}")
+            return 0
+        finally:
+            conn.close()  # 将连接返回到连接池
+
+    return 0
+
+
+def run_batch_mode(video_files):
+    """批量模式：线程池算 md5，每攒够 DB_BATCH_SIZE 个文件批量查重/插入一次"""
+    bloom, meta = load_known_filter()
+    sync_known_filter(bloom, meta)
+    bloom.save(BLOOM_FILE, meta)
+
+    processed_count = 0
+    chunk = []
+
+    def flush():
+        nonlocal processed_count, chunk
+        if not chunk:
+            return
+        # 每批开始前增量同步，尽量拿到其他电脑刚插入的记录
+        sync_known_filter(bloom, meta)
+        processed_count += process_video_chunk(chunk, bloom)
+        chunk = []
+
+    try:
+        with tqdm(total=len(video_files), desc="Processing", unit="file") as pbar:
+            for filepath, md5 in get_hasher().hash_many(video_files):
+                pbar.update(1)
+                if md5 is None:
+                    continue
+                chunk.append((filepath, os.path.basename(filepath), md5))
+                if len(chunk) >= DB_BATCH_SIZE:
+                    flush()
+            flush()
+    finally:
+        bloom.save(BLOOM_FILE, meta)
+
+    return processed_count
+
+
 def traverse_directory(directory):
-    """递归遍历目录，返回所有视频文件路径"""
-    video_files = []
-    for item in os.listdir(directory):
-        item_path = os.path.join(directory, item)
-        if os.path.isfile(item_path) and item.lower().endswith(VIDEO_EXTENSIONS):
-            video_files.append(item_path)
-        elif os.path.isdir(item_path):
-            video_files.extend(traverse_directory(item_path))
-    return video_files
+    """递归遍历目录，返回所有视频文件路径（增量目录索引，未变化的目录不再重新列举）"""
+    return list(iter_video_files(directory, VIDEO_EXTENSIONS))
 
 
 # --- 主程序 ---
@@ -212,6 +386,12 @@ def main():
     num_files = len(video_files)
     logger.info(f"Found {num_files} video files to process.")
 
+    if BATCH_MODE:
+        processed_count = run_batch_mode(video_files)
+        logger.info(f"Processed {processed_count} of {num_files} files.")
+        get_hasher().log_stats(logger)
+        return
+
     processed_count = 0
 
     with ThreadPoolExecutor(max_workers=NUM_THREADS) as executor, \
@@ -231,6 +411,7 @@ def main():
                 pbar.update(1)  # 即使出错，也要更新进度条
 
     logger.info(f"Processed {processed_count} of {num_files} files.")
+    get_hasher().log_stats(logger)
 
 
 if __name__ == "__main__":
@@ -1,28 +1,27 @@
-import cv2
 import os
 import shutil
 import concurrent.futures
+from probe_engine import get_probe_engine
 
 
-def is_1920x1080_and_50fps(video_path):
-    # 打开视频文件
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"无法打开视频文件: {video_path}")
+def is_1920x1080_and_50fps(info):
+    # 视频信息由探测引擎批量读取（文件头），不再逐个打开视频
+    if not info:
         return False
 
-    # 读取视频的分辨率和帧率
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    cap.release()  # 释放视频资源
+    width = info.get('width', 0)
+    height = info.get('height', 0)
+    fps = info.get('fps', 0)
 
     # return width == 1920 and height == 1080 and fps >= 25
     return min(height,width) >=1080
 
 
-def process_video(video_path, input_directory, output_directory):
-    if is_1920x1080_and_50fps(video_path):
+def process_video(video_path, info, input_directory, output_directory):
+    if not info:
+        print(f"无法打开视频文件: {video_path}")
+        return None
+    if is_1920x1080_and_50fps(info):
         # 计算目标路径，保持原文件夹结构
         relative_path = os.path.relpath(os.path.dirname(video_path), input_directory)
         target_dir = os.path.join(output_directory, relative_path)
@@ -51,9 +50,11 @@ def find_and_move_1920x1080_videos(input_directory, output_directory, max_worker
                 video_path = os.path.join(root, file)
                 video_paths.append(video_path)
 
-    # 使用多线程处理视频文件
+    # 探测引擎批量读取视频信息，多线程移动文件
+    engine = get_probe_engine(workers=max_workers)
     with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(process_video, video_path, input_directory, output_directory) for video_path in video_paths]
+        futures = [executor.submit(process_video, video_path, info, input_directory, output_directory)
+                   for video_path, info in engine.probe_many(video_paths)]
         for future in concurrent.futures.as_completed(futures):
             result = future.result()
             if result:
@@ -1,39 +1,21 @@
 import os
 import shutil
-import subprocess
-import re
-import json
+from probe_engine import get_probe_engine
 
-def get_video_info(video_path):
-    """使用 ffprobe 获取视频的分辨率和时长"""
-    ffprobe_path=r"D:\ffmpeg-7.0.2-essentials_build\bin\ffprobe.exe"
-    try:
-        command = [
-            ffprobe_path, '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-show_entries', 'stream=width,height',
-            '-of', 'json', video_path
-        ]
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        info = json.loads(result.stdout)
-
-        # 提取分辨率
-        width, height = 0, 0
-        if 'streams' in info:
-            for stream in info['streams']:
-                if 'width' in stream and 'height' in stream:
-                    width = stream.get('width', 0)
-                    height = stream.get('height', 0)
+ffprobe_path=r"D:\ffmpeg-7.0.2-essentials_build\bin\ffprobe.exe"
 
-        # 提取时长
-        duration = 0
-        if 'format' in info:
-            duration = float(info['format'].get('duration', 0))
-
-        return width, height,duration
+def get_video_info(video_path, info=None):
+    """获取视频的分辨率和时长（探测引擎优先读文件头，必要时才调用 ffprobe），读取失败返回 None"""
+    try:
+        if info is None:
+            info = get_probe_engine(ffprobe_path).probe(video_path)
+        if not info:
+            print(f"获取视频信息时出错: {video_path}")
+            return None
+        return info.get('width', 0), info.get('height', 0), info.get('duration', 0)
     except Exception as e:
         print(f"获取视频信息时出错: {e}")
-        return None, None
+        return None
 
 def copy_high_res_videos(filepath, outputfile):
     try:
@@ -48,16 +30,22 @@ def copy_high_res_videos(filepath, outputfile):
             if not os.path.exists(output_subfolder):
                 os.makedirs(output_subfolder)
 
-            for file in files:
-                if file.lower().endswith(('.mp4', '.avi', '.mkv', '.mov', '.flv', '.wmv', '.webm','.ts','.m2ts')):
-                    video_path = os.path.join(root, file)
-                    print(f"当前处理视频:{video_path}")
-                    width, height,duration = get_video_info(video_path)
-                    if min(width,height)< 1080 or duration < 10 :
-                        # 构建outputfile中对应文件的完整路径
-                        output_video_path = os.path.join(output_subfolder, file)
-                        shutil.move(video_path, output_video_path)
-                        print(f"\033[31mMoved {video_path} to {output_video_path}\033[0m")
+            video_paths = [os.path.join(root, file) for file in files
+                           if file.lower().endswith(('.mp4', '.avi', '.mkv', '.mov', '.flv', '.wmv', '.webm','.ts','.m2ts'))]
+            # 整个文件夹的视频交给探测引擎批量读取
+            for video_path, info in get_probe_engine(ffprobe_path).probe_many(video_paths):
+                file = os.path.basename(video_path)
+                print(f"当前处理视频:{video_path}")
+                video_info = get_video_info(video_path, info)
+                if video_info is None:
+                    # 读不出信息的（损坏/不完整的文件）跳过，不当成低分辨率移走
+                    continue
+                width, height,duration = video_info
+                if min(width,height)< 1080 or duration < 10 :
+                    # 构建outputfile中对应文件的完整路径
+                    output_video_path = os.path.join(output_subfolder, file)
+                    shutil.move(video_path, output_video_path)
+                    print(f"\033[31mMoved {video_path} to {output_video_path}\033[0m")
     except Exception as e:
         print(str(e))
 
@@ -65,6 +65,8 @@ TABLE_NAME = "Video_Editing"          # 固定表名
 # --- 性能配置 ---
 MAX_PARALLEL_WORKERS = 6              # 最大并行数
 MAX_FILTER_WORKERS = 8                # 最大过滤并行数（防死锁优化）
+ENABLE_STREAMING_PIPELINE = True      # 流式处理：过滤与编码同时进行，不等全部过滤完
+PIPELINE_QUEUE_SIZE = 64              # 流式处理阶段间队列长度
 QUALITY_MODE = 'highest'              # 质量模式: 'highest' | 'high' | 'balanced' | 'fast'
 AUTO_BITRATE = True                   # 自动码率调整
 VIDEO_BITRATE = "10M"                 # 固定码率(AUTO_BITRATE=False时使用)
@@ -165,7 +167,6 @@ import uuid
 import psutil
 import pickle
 import glob
-import re
 import signal
 import traceback
 import queue
@@ -177,6 +178,15 @@ from dataclasses import dataclass, field
 from contextlib import contextmanager
 import numpy as np
 import enum
+import atexit
+from video_meta_cache import cached_probe, get_meta_cache
+from keyframe_sampler import sample_frames
+from stream_pipeline import StreamPipeline
+from progress_store import ProgressStore
+from ffmpeg_progress import run_ffmpeg
+
+# 程序退出时输出元数据缓存命中率
+atexit.register(get_meta_cache().log_stats)
 
 # ==================== 日志配置 ====================
 def setup_logging():
@@ -1524,7 +1534,12 @@ class ROISelector:
     def extract_preview_frame(self, video_path: str) -> Optional[np.ndarray]:
         """提取预览帧"""
         try:
-            # 获取视频时长
+            # 只解码中间位置之前最近的一个关键帧，不再 ffprobe + ffmpeg 写临时图片
+            frames = sample_frames(video_path, (0.5,), ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
+            if frames is not None:
+                return frames[0]
+            
+            # 关键帧采样失败时回退：获取视频时长
             probe_cmd = [FFPROBE_PATH, '-v', 'error', '-show_entries', 'format=duration',
                         '-of', 'default=noprint_wrappers=1:nokey=1', video_path]
             result = subprocess.run(probe_cmd, capture_output=True, text=True, timeout=10, encoding='utf-8', errors='ignore')
@@ -1846,56 +1861,33 @@ class ProgressManager:
         self.computer_name = computer_name
         self.db_manager = db_manager
         self.progress_file = Path(PROGRESS_FOLDER) / f"progress_{computer_name}.json"
-        self.progress_data = self._load_progress()
         
         # 确保进度文件夹存在
         self.progress_file.parent.mkdir(exist_ok=True)
+        self.store = self._load_progress()
     
-    def _load_progress(self) -> Dict[str, Any]:
-        """加载进度数据"""
-        if self.progress_file.exists():
-            try:
-                with open(self.progress_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                logger.info(f"加载进度记录: {len(data.get('completed', []))} 个已完成")
-                return data
-            except Exception as e:
-                logger.warning(f"加载进度文件失败: {e}")
-        
-        return {
-            'completed': [],
-            'processing': [],
-            'failed': [],
-            'roi_settings': None,
-            'start_time': None
-        }
+    def _load_progress(self) -> ProgressStore:
+        """加载进度数据（JSON 快照 + 追加日志，按文件名建索引）"""
+        store = ProgressStore(str(self.progress_file),
+                              defaults={'roi_settings': None, 'start_time': None},
+                              logger=logger)
+        logger.info(f"加载进度记录: {store.counts()['completed']} 个已完成")
+        return store
     
     def save_progress(self):
-        """保存进度数据"""
+        """把还没写入的进度日志立即写盘（平时由后台线程每秒成组写入）"""
         try:
-            with open(self.progress_file, 'w', encoding='utf-8') as f:
-                json.dump(self.progress_data, f, ensure_ascii=False, indent=2)
+            self.store.flush()
         except Exception as e:
             logger.error(f"保存进度文件失败: {e}")
     
     def is_completed(self, video_path: str) -> bool:
         """检查视频是否已完成"""
-        video_name = os.path.basename(video_path)
-        
-        # 检查本地进度记录
-        for record in self.progress_data['completed']:
-            if isinstance(record, dict):
-                if record.get('name') == video_name:
-                    return True
-            elif record == video_name:
-                return True
-        
-        return False
+        return self.store.is_completed(os.path.basename(video_path))
     
     def is_processing(self, video_path: str) -> bool:
         """检查视频是否正在处理中"""
-        video_name = os.path.basename(video_path)
-        return video_name in self.progress_data['processing']
+        return self.store.is_processing(os.path.basename(video_path))
     
     def atomic_check_and_mark_processing(self, video_path: str, output_dir: str = None) -> Tuple[bool, str]:
         """原子性检查并标记为处理中，防止重复处理
@@ -1976,59 +1968,43 @@ class ProgressManager:
             'computer': self.computer_name
         }
         
-        self.progress_data['completed'].append(record)
-        
-        # 从处理中移除
-        self.progress_data['processing'] = [
-            p for p in self.progress_data['processing'] if p != video_name
-        ]
-        
-        self.save_progress()
+        # 替换同名旧记录，同时从处理中和失败列表移除
+        self.store.mark_completed(video_name, record)
         logger.info(f"标记完成: {video_name}")
     
     def mark_processing(self, video_path: str):
         """标记为处理中"""
-        video_name = os.path.basename(video_path)
-        if video_name not in self.progress_data['processing']:
-            self.progress_data['processing'].append(video_name)
-            self.save_progress()
+        self.store.mark_processing(os.path.basename(video_path))
+    
+    def unmark_processing(self, video_path: str) -> bool:
+        """从处理中列表移除，原来不在列表中返回 False"""
+        return self.store.clear_processing(os.path.basename(video_path))
     
     def mark_failed(self, video_path: str, error_msg: str = ""):
-        """标记为失败"""
+        """标记为失败（同一视频只保留最近一次的错误），同时从处理中移除"""
         video_name = os.path.basename(video_path)
         
-        self.progress_data['failed'].append({
+        self.store.mark_failed(video_name, {
             'name': video_name,
             'error': error_msg,
             'time': datetime.now().isoformat()
         })
-        
-        # 从处理中移除
-        self.progress_data['processing'] = [
-            p for p in self.progress_data['processing'] if p != video_name
-        ]
-        
-        self.save_progress()
         logger.error(f"标记失败: {video_name} - {error_msg}")
     
     def get_statistics(self) -> Dict[str, int]:
         """获取统计信息"""
-        return {
-            'completed': len(self.progress_data['completed']),
-            'processing': len(self.progress_data['processing']),
-            'failed': len(self.progress_data['failed'])
-        }
+        return self.store.counts()
     
     def set_roi_settings(self, roi: Tuple[int, int, int, int, int, int]):
         """保存ROI设置（包含基准分辨率）"""
-        self.progress_data['roi_settings'] = roi
+        self.store.set('roi_settings', roi)
         self.save_progress()
         x, y, w, h, base_width, base_height = roi
         logger.info(f"保存ROI设置: 区域({x}, {y}, {w}, {h}), 基准分辨率{base_width}x{base_height}")
     
     def get_roi_settings(self) -> Optional[Tuple[int, int, int, int, int, int]]:
         """获取ROI设置（包含基准分辨率）"""
-        saved_roi = self.progress_data.get('roi_settings')
+        saved_roi = self.store.get('roi_settings')
         if saved_roi and len(saved_roi) == 6:
             return saved_roi
         elif saved_roi and len(saved_roi) == 4:
@@ -2120,8 +2096,9 @@ class VideoProcessor:
         
         return hash_sha256.hexdigest()
     
+    @cached_probe('uvp_video_info', path_arg=1, is_valid=lambda info: bool(info) and 'error' not in info)
     def get_video_info(self, video_path: str, timeout: int = 20) -> Dict[str, Any]:
-        """获取视频信息（防死锁优化版）"""
+        """获取视频信息（防死锁优化版，成功结果持久缓存）"""
         try:
             # 🚨 快速检查文件可读性
             if not os.path.exists(video_path):
@@ -2327,67 +2304,38 @@ class VideoProcessor:
     
     def run_ffmpeg_with_progress(self, cmd: List[str], expected_duration: float, 
                                 video_name: str) -> bool:
-        """运行FFmpeg并显示进度"""
+        """运行FFmpeg并显示进度（-progress 通道，stderr 只用于错误信息）"""
         try:
-            process = subprocess.Popen(
-                cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                universal_newlines=True, encoding='utf-8', bufsize=1
-            )
-            
             with tqdm(total=100, desc=f"处理: {video_name[:30]}", 
                      unit='%', leave=False) as pbar:
                 
                 last_progress = 0
                 
-                while process.poll() is None:
-                    line = process.stderr.readline()
-                    if line:
-                        progress_info = self._parse_ffmpeg_progress(line)
-                        if 'time' in progress_info:
-                            current_time = progress_info['time']
-                            progress = min(95, (current_time / expected_duration) * 100)
-                            
-                            if progress > last_progress:
-                                pbar.update(progress - last_progress)
-                                last_progress = progress
+                def on_progress(progress_info: Dict[str, Any]):
+                    nonlocal last_progress
+                    if 'time' in progress_info and expected_duration > 0:
+                        progress = min(95, (progress_info['time'] / expected_duration) * 100)
+                        if progress > last_progress:
+                            pbar.update(progress - last_progress)
+                            last_progress = progress
+                
+                runner = run_ffmpeg(cmd, on_progress=on_progress)
                 
                 # 完成最后5%
                 if last_progress < 100:
                     pbar.update(100 - last_progress)
             
-            if process.returncode == 0:
+            if runner.returncode == 0:
                 logger.info(f"FFmpeg处理成功: {video_name}")
                 return True
             else:
-                stderr_output = process.stderr.read()
-                logger.error(f"FFmpeg处理失败: {video_name} - {stderr_output}")
+                logger.error(f"FFmpeg处理失败: {video_name} - {runner.error_text(20)}")
                 return False
                 
         except Exception as e:
             logger.error(f"运行FFmpeg异常: {e}")
             return False
     
-    def _parse_ffmpeg_progress(self, line: str) -> Dict[str, float]:
-        """解析FFmpeg进度输出"""
-        info = {}
-        patterns = {
-            'frame': r'frame=\s*(\d+)',
-            'fps': r'fps=\s*([\d\.]+)',
-            'time': r'time=\s*(\d+):(\d+):([\d\.]+)',
-            'speed': r'speed=\s*([\d\.]+)x'
-        }
-        
-        for key, pattern in patterns.items():
-            match = re.search(pattern, line)
-            if match:
-                if key == 'time':
-                    hours, minutes, seconds = match.groups()
-                    info[key] = float(hours) * 3600 + float(minutes) * 60 + float(seconds)
-                else:
-                    info[key] = float(match.group(1))
-        
-        return info
-    
     def process_video_crop(self, input_path: str, output_path: str, 
                           base_roi: Tuple[int, int, int, int, int, int], 
                           roi_selector: 'ROISelector' = None) -> bool:
@@ -3187,10 +3135,7 @@ class UnifiedVideoProcessor:
             if not self.task_manager.claim_video_task(video_path):
                 logger.info(f"🔒 视频已被其他电脑处理: {video_name}")
                 # 移除本地处理中标记，因为其他电脑在处理
-                self.progress_manager.progress_data['processing'] = [
-                    p for p in self.progress_manager.progress_data['processing'] if p != video_name
-                ]
-                self.progress_manager.save_progress()
+                self.progress_manager.unmark_processing(video_path)
                 return False  # 被其他电脑锁定，跳过
             
             base_name = os.path.splitext(video_name)[0]
@@ -3501,6 +3446,86 @@ class UnifiedVideoProcessor:
         self._log_batch_completion(total_processed, success_count, failed_count, 
                                  skipped_count, batch_duration)
     
+    def process_stream(self, video_files: List[str], roi: Optional[Tuple[int, int, int, int]] = None):
+        """流式处理视频：过滤（已完成/低分辨率/数据库查重）与编码同时进行
+        
+        第一个通过过滤的视频立即开始编码，不再等全部视频过滤完；
+        阶段间是有界队列，编码跟不上时过滤自动放慢。
+        """
+        if not video_files:
+            logger.info("没有需要处理的视频文件")
+            return
+        
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        if ENABLE_DISTRIBUTED_PROCESSING:
+            self.task_manager.cleanup_expired_locks()
+        
+        total_videos = len(video_files)
+        filter_workers = max(1, min(MAX_FILTER_WORKERS, self.hardware_info['max_parallel'] // 2))
+        encode_workers = max(1, min(self.hardware_info['max_parallel'], 32))
+        preload_lock = threading.Lock()
+        preloaded = [0]
+        
+        def filter_stage(video_path: str) -> Optional[str]:
+            if self._filter_single_video_safe(video_path) != "keep":
+                return None
+            # 通过过滤的前几个视频提前开始预加载到本地缓存
+            if self.cache_manager:
+                with preload_lock:
+                    preload = preloaded[0] < PRELOAD_COUNT
+                    preloaded[0] += 1
+                if preload:
+                    self.cache_manager.start_async_download(video_path, priority=-preloaded[0])
+            return video_path
+        
+        def encode_stage(video_path: str):
+            try:
+                return video_path, self.process_video_file(video_path, roi)
+            except Exception as e:
+                logger.error(f"❌ 任务异常: {os.path.basename(video_path)} - {e}")
+                return video_path, None
+        
+        pipeline = StreamPipeline(video_files, queue_size=PIPELINE_QUEUE_SIZE, stop_event=self.shutdown_event)
+        pipeline.add_stage('过滤', filter_stage, workers=filter_workers)
+        pipeline.add_stage('编码', encode_stage, workers=encode_workers)
+        logger.info(f"🔀 流式处理 {total_videos} 个视频: 过滤 {filter_workers} 线程, 编码 {encode_workers} 线程")
+        
+        batch_start_time = time.time()
+        success_count = 0
+        failed_count = 0
+        skipped_count = 0
+        processed_count = 0
+        
+        # 总数未知（过滤掉多少要跑完才知道），进度条只显示已处理数量
+        with tqdm(desc="🎬 处理进度", unit="video") as pbar:
+            for video_path, result in pipeline.run():
+                if result is True:
+                    success_count += 1
+                elif result is False:
+                    # False 可能表示被其他电脑处理或跳过
+                    skipped_count += 1
+                else:
+                    failed_count += 1
+                processed_count += 1
+                
+                pbar.update(1)
+                pbar.set_postfix({
+                    '✅成功': success_count,
+                    '❌失败': failed_count,
+                    '⏭️跳过': skipped_count,
+                    '🔍已过滤': pipeline.stages[0].processed + pipeline.stages[0].dropped,
+                    '🧠内存': f"{self.memory_monitor.get_memory_stats().get('current_memory_mb', 0):.0f}MB"
+                })
+                
+                if processed_count % 50 == 0:
+                    self._health_check_during_batch(processed_count, total_videos)
+                if processed_count % MEMORY_CLEANUP_INTERVAL == 0:
+                    self.memory_monitor.cleanup_memory()
+        
+        pipeline.log_stats()
+        self._log_batch_completion(processed_count, success_count, failed_count,
+                                   skipped_count, time.time() - batch_start_time)
+    
     def _process_large_batch(self, video_files: List[str], roi: Optional[Tuple[int, int, int, int]] = None):
         """处理大规模数据集（分批处理）"""
         total_videos = len(video_files)
@@ -3638,19 +3663,24 @@ class UnifiedVideoProcessor:
             # 设置ROI（如果需要）
             roi = self.setup_roi_for_crop_mode(video_files)
             
-            # 过滤视频文件
-            print("🔧 过滤视频文件...")
-            filtered_files = self.filter_videos(video_files)
-            
-            if not filtered_files:
-                print("✅ 所有视频都已处理完成！")
-                return
-            
-            print(f"📋 待处理视频: {len(filtered_files)} 个")
-            
-            # 开始批量处理
-            print("🎬 开始批量处理...")
-            self.process_batch(filtered_files, roi)
+            if ENABLE_STREAMING_PIPELINE:
+                # 流式处理：过滤和编码同时进行
+                print("🎬 开始流式处理（边过滤边编码）...")
+                self.process_stream(video_files, roi)
+            else:
+                # 过滤视频文件
+                print("🔧 过滤视频文件...")
+                filtered_files = self.filter_videos(video_files)
+                
+                if not filtered_files:
+                    print("✅ 所有视频都已处理完成！")
+                    return
+                
+                print(f"📋 待处理视频: {len(filtered_files)} 个")
+                
+                # 开始批量处理
+                print("🎬 开始批量处理...")
+                self.process_batch(filtered_files, roi)
             
             # 显示最终统计
             stats = self.progress_manager.get_statistics()
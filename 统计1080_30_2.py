@@ -1,10 +1,9 @@
 import logging
 import os
-import subprocess
-import json
 from dataclasses import fields
 from logging.handlers import RotatingFileHandler
 from datetime import datetime
+from probe_engine import get_probe_engine
 
 # 日志配置
 log_dir = "./logs"
@@ -31,36 +30,15 @@ stream_handler.setFormatter(log_format)
 logger.addHandler(stream_handler)
 
 
-def get_video_info(video_path, ffprobe_path):
-    """使用 ffprobe 获取视频的分辨率和时长"""
+def get_video_info(video_path, ffprobe_path, info=None):
+    """通过探测引擎获取视频的分辨率和时长（优先读文件头，必要时才调用 ffprobe）"""
     try:
-        command = [
-            ffprobe_path, '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-show_entries', 'stream=width,height',
-            '-of', 'json', video_path
-        ]
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        info = json.loads(result.stdout)
-
-        # 提取分辨率
-        width, height = 0, 0
-        if 'streams' in info:
-            for stream in info['streams']:
-                if 'width' in stream and 'height' in stream:
-                    width = stream.get('width', 0)
-                    height = stream.get('height', 0)
-                    break  # 只取第一个有效的流
-
-        # 提取时长
-        duration = 0
-        if 'format' in info and 'duration' in info['format']:
-            duration = float(info['format']['duration'])
-
-        return width, height, duration
-    except FileNotFoundError:
-        logger.error(f"错误: ffprobe 可执行文件未找到在: {ffprobe_path}")
-        return None, None, None
+        if info is None:
+            info = get_probe_engine(ffprobe_path).probe(video_path)
+        if not info:
+            logger.error(f"获取视频信息时出错: {video_path}")
+            return None, None, None
+        return info.get('width', 0), info.get('height', 0), info.get('duration', 0)
     except Exception as e:
         logger.error(f"获取视频信息时出错: {e}")
         return None, None, None
@@ -81,22 +59,28 @@ def process_videos_in_directory(directory, ffprobe_path):
     total_size = 0
     total_duration = 0
 
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.startswith('._') or file == '.DS_Store':
-                continue
-            elif file.lower().endswith(('.mp4', '.avi', '.mkv', '.mov', '.flv', '.wmv', '.webm')):
-                video_path = os.path.join(root, file)
-                width, height, duration = get_video_info(video_path, ffprobe_path)
-                if width is not None and height is not None and duration is not None:
-                    short_edge = min(width, height)
-                    if short_edge >= 720 and duration >= 0:
-                        size = get_file_size(video_path)
-                        total_count += 1
-                        total_size += size
-                        total_duration += duration
-                        logger.info(
-                            f"视频: {video_path}，分辨率: {width}x{height}，时长: {duration:.2f}秒，大小: {size / (1024 * 1024):.2f} MB")
+    def iter_video_paths():
+        for root, _, files in os.walk(directory):
+            for file in files:
+                if file.startswith('._') or file == '.DS_Store':
+                    continue
+                elif file.lower().endswith(('.mp4', '.avi', '.mkv', '.mov', '.flv', '.wmv', '.webm')):
+                    yield os.path.join(root, file)
+
+    # 边扫描边交给探测引擎批量读取
+    engine = get_probe_engine(ffprobe_path)
+    for video_path, info in engine.probe_many(iter_video_paths()):
+        width, height, duration = get_video_info(video_path, ffprobe_path, info)
+        if width is not None and height is not None and duration is not None:
+            short_edge = min(width, height)
+            if short_edge >= 720 and duration >= 0:
+                size = get_file_size(video_path)
+                total_count += 1
+                total_size += size
+                total_duration += duration
+                logger.info(
+                    f"视频: {video_path}，分辨率: {width}x{height}，时长: {duration:.2f}秒，大小: {size / (1024 * 1024):.2f} MB")
+    engine.log_stats()
 
     logger.info(f"\n符合条件的视频总数: {total_count}")
     logger.info(f"符合条件的视频总大小: {total_size / (1024 * 1024 * 1024):.2f} GB")
@@ -175,6 +175,7 @@ from dataclasses import dataclass, field
 from contextlib import contextmanager
 import numpy as np
 import enum
+from keyframe_sampler import sample_frames
 
 # ==================== 日志配置 ====================
 def setup_logging():
@@ -1347,7 +1348,12 @@ class ROISelector:
     def extract_preview_frame(self, video_path: str) -> Optional[np.ndarray]:
         """提取预览帧"""
         try:
-            # 获取视频时长
+            # 只解码中间位置之前最近的一个关键帧，不再 ffprobe + ffmpeg 写临时图片
+            frames = sample_frames(video_path, (0.5,), ffmpeg_path=FFMPEG_PATH, ffprobe_path=FFPROBE_PATH)
+            if frames is not None:
+                return frames[0]
+            
+            # 关键帧采样失败时回退：获取视频时长
             probe_cmd = [FFPROBE_PATH, '-v', 'error', '-show_entries', 'format=duration',
                         '-of', 'default=noprint_wrappers=1:nokey=1', video_path]
             result = subprocess.run(probe_cmd, capture_output=True, text=True, timeout=10, encoding='utf-8', errors='ignore')